@@ -9,12 +9,24 @@ Now with integrated Clinical Alert generation from AI findings.
 import asyncio
 import traceback
 import httpx
-from datetime import datetime, timezone
-from typing import Dict, Any, Optional
+import socket
+import tempfile
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional
 import os
 import logging
 from dotenv import load_dotenv
 from async_file_downloader import file_downloader
+from ai_batch_backend import (
+    BATCH_STATE_FAILED,
+    BATCH_STATE_RUNNING,
+    BATCH_STATE_SUCCEEDED,
+    create_batch_backend,
+    write_jsonl
+)
+from ai_queue_scheduler import LANE_BACKGROUND, LANE_INTERACTIVE, FairQueueScheduler
+from ai_retry_policy import plan_retry
 
 # Import alert service for critical findings
 from alert_service import ClinicalAlertService, get_alert_service
@@ -35,12 +47,31 @@ class AIAnalysisProcessor:
         self.delay_between_analyses = 2  # 2 second delay between each analysis
         self.file_downloader = file_downloader  # Use global async downloader
         
+        # Fair scheduling: round-robin across doctors, interactive lane ahead of background
+        self.scheduler = FairQueueScheduler(
+            background_reserved_slots=int(os.getenv("AI_QUEUE_BACKGROUND_RESERVED_SLOTS", "1"))
+        )
+        self.scheduler_per_doctor = 3  # Candidate rows fetched per doctor and priority
+        
         # Initialize alert service for critical findings detection
         self.alert_service: Optional[ClinicalAlertService] = None
         
+        # Batch lane: queue items with lane='batch' are accumulated into batch
+        # prediction jobs instead of competing with interactive analyses
+        self.batch_lane_enabled = os.getenv("AI_BATCH_LANE_ENABLED", "false").lower() == "true"
+        self.batch_interval = int(os.getenv("AI_BATCH_INTERVAL_SECONDS", "300"))
+        self.batch_min_items = int(os.getenv("AI_BATCH_MIN_ITEMS", "20"))
+        self.batch_max_items = int(os.getenv("AI_BATCH_MAX_ITEMS", "200"))
+        self.batch_max_wait_seconds = int(os.getenv("AI_BATCH_MAX_WAIT_SECONDS", "1800"))
+        self.batch_prepare_concurrency = 5
+        self.batch_backend = None
+        self.batch_task: Optional[asyncio.Task] = None
+        self.batch_stats = {"jobs_submitted": 0, "jobs_completed": 0, "jobs_failed": 0, "items_completed": 0, "items_failed": 0}
+        
         logger.info("🔄 AI Analysis Processor initialized")
         logger.info(f"   Max concurrent: {self.max_concurrent}")
         logger.info(f"   Delay between analyses: {self.delay_between_analyses}s")
+        logger.info(f"   Batch lane: {'enabled' if self.batch_lane_enabled else 'disabled'}")
     
     def _init_alert_service(self):
         """Initialize the alert service lazily (needs supabase client)"""
@@ -52,6 +83,11 @@ class AIAnalysisProcessor:
         self.is_running = True
         print("🚀 Starting AI Analysis background processor...")
         
+        if self.batch_lane_enabled and self.batch_task is None:
+            self.batch_backend = create_batch_backend(self.ai_service)
+            self.batch_task = asyncio.create_task(self.run_batch_lane())
+            print(f"📦 Batch lane started ({self.batch_backend.name} backend, every {self.batch_interval}s)")
+        
         while self.is_running:
             try:
                 await self.process_pending_analyses()
@@ -64,6 +100,9 @@ class AIAnalysisProcessor:
     def stop_processing(self):
         """Stop the background processing"""
         self.is_running = False
+        if self.batch_task:
+            self.batch_task.cancel()
+            self.batch_task = None
         print("⏹️  AI Analysis processor stopped")
     
     async def process_pending_analyses(self):
@@ -82,8 +121,10 @@ class AIAnalysisProcessor:
             print(f"📋 Found {len(queue_items)} pending AI analyses to process")
             
             # Process analyses concurrently using asyncio.gather
+            # Items in this dispatch share visit / patient / doctor fetches
             print(f"🚀 Processing {len(queue_items)} analyses concurrently...")
-            tasks = [self.process_single_analysis(item) for item in queue_items]
+            context_window: Dict[Any, asyncio.Future] = {}
+            tasks = [self.process_single_analysis(item, context_window) for item in queue_items]
             
             # Use return_exceptions=True to ensure all tasks complete even if one fails
             results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -101,63 +142,70 @@ class AIAnalysisProcessor:
             print(f"Traceback: {traceback.format_exc()}")
     
     async def get_all_pending_analyses(self, limit: int = 10) -> list:
-        """Get pending analyses from the queue"""
+        """Get the next pending analyses to dispatch, chosen by the fair scheduler"""
         try:
-            # Use a direct query to get pending analyses
-            # This is a simplified version - in production you might want to batch by doctor
-            response = await self.db.supabase.table("ai_analysis_queue") \
-                    .select("*") \
-                    .eq("status", "pending") \
-                    .order("priority", desc=True) \
-                    .order("queued_at") \
-                    .limit(limit) \
-                    .execute()
+            # With the batch lane running, batch items are left for run_batch_lane;
+            # otherwise they are served here as background work
+            lanes = ["interactive"] if self.batch_lane_enabled else ["interactive", "batch"]
+            candidates = await self.db.get_ai_queue_candidates(
+                lanes,
+                per_doctor=max(self.scheduler_per_doctor, limit)
+            )
             
-            return response.data if response.data else []
+            lane_depths = None
+            if candidates["lane_depths"] is not None:
+                lane_depths = {
+                    LANE_INTERACTIVE: candidates["lane_depths"].get("interactive", 0),
+                    LANE_BACKGROUND: candidates["lane_depths"].get("batch", 0) if not self.batch_lane_enabled else 0
+                }
+            
+            return self.scheduler.plan(candidates["items"], limit, lane_depths)
             
         except Exception as e:
             print(f"❌ Error getting pending analyses: {e}")
             return []
     
-    async def process_single_analysis(self, queue_item: Dict[str, Any]):
+    async def process_single_analysis(
+        self,
+        queue_item: Dict[str, Any],
+        context_window: Optional[Dict[Any, asyncio.Future]] = None
+    ):
         """Process a single AI analysis from the queue"""
         queue_id = queue_item["id"]
         report_id = queue_item["report_id"]
-        visit_id = queue_item["visit_id"]
-        patient_id = queue_item["patient_id"]
-        doctor_firebase_uid = queue_item["doctor_firebase_uid"]
         
         try:
             print(f"🔍 Processing AI analysis for report {report_id}")
             
-            # Update status to processing
-            await self.db.update_ai_analysis_queue_status(queue_id, "processing")
+            # Update status to processing while the existing-analysis check,
+            # report / visit / patient / doctor and the file download run concurrently
+            _, context = await asyncio.gather(
+                self.db.update_ai_analysis_queue_status(queue_id, "processing"),
+                self._load_analysis_context(queue_item, context_window)
+            )
             
             # Check if analysis already exists (avoid duplicate processing)
-            existing_analysis = await self.db.get_ai_analysis_by_report_id(report_id, doctor_firebase_uid)
-            if existing_analysis:
+            if context["existing_analysis"]:
                 print(f"⚠️  Analysis already exists for report {report_id}, marking as completed")
                 await self.db.update_ai_analysis_queue_status(queue_id, "completed")
                 return
             
-            # Get report, visit, patient, and doctor data
-            report = await self.db.get_report_by_id(report_id, doctor_firebase_uid)
-            visit = await self.db.get_visit_by_id(visit_id, doctor_firebase_uid) 
-            patient = await self.db.get_patient_by_id(patient_id, doctor_firebase_uid)
-            doctor = await self.db.get_doctor_by_firebase_uid(doctor_firebase_uid)
+            report = context["report"]
+            visit = context["visit"]
+            patient = context["patient"]
+            doctor = context["doctor"]
             
             if not all([report, visit, patient, doctor]):
                 error_msg = "Missing required data (report, visit, patient, or doctor)"
                 print(f"❌ {error_msg} for queue item {queue_id}")
-                await self.db.update_ai_analysis_queue_status(queue_id, "failed", error_msg)
+                await self._handle_failed_attempt(queue_item, error_msg)
                 return
             
-            # Download the file for analysis
-            file_content = await self.download_report_file(report["file_url"])
+            file_content = context["file_content"]
             if not file_content:
                 error_msg = "Failed to download report file"
                 print(f"❌ {error_msg} for report {report_id}")
-                await self.db.update_ai_analysis_queue_status(queue_id, "failed", error_msg)
+                await self._handle_failed_attempt(queue_item, error_msg)
                 return
             
             # Perform AI analysis
@@ -174,101 +222,231 @@ class AIAnalysisProcessor:
             # Calculate processing time
             processing_time = (datetime.now() - start_time).total_seconds() * 1000
             
-            if analysis_result["success"]:
-                # Get structured data (either from JSON mode or parsed)
-                structured_analysis = analysis_result["analysis"].get("structured_analysis", {})
-                structured_data = analysis_result["analysis"].get("structured_data", structured_analysis)
-                
-                # Store analysis results with enhanced visit-contextual fields
-                analysis_data = {
-                    "report_id": report_id,
-                    "visit_id": visit_id,
-                    "patient_id": patient_id,
-                    "doctor_firebase_uid": doctor_firebase_uid,
-                    "analysis_type": "document_analysis",
-                    "model_used": analysis_result["model_used"],
-                    "confidence_score": analysis_result["analysis"].get("confidence_score", 0.7),
-                    "raw_analysis": analysis_result["analysis"].get("raw_analysis", ""),
-                    # NEW: Store structured JSON data directly
-                    "structured_data": structured_data if structured_data else None,
-                    # Enhanced visit-contextual fields (for backward compatibility)
-                    "clinical_correlation": structured_analysis.get("clinical_correlation"),
-                    "detailed_findings": structured_analysis.get("detailed_findings") or structured_analysis.get("findings"),
-                    "critical_findings": structured_analysis.get("critical_findings"),
-                    "treatment_evaluation": structured_analysis.get("treatment_evaluation"),
-                    # Original fields (keeping for backward compatibility)
-                    "document_summary": structured_analysis.get("document_summary"),
-                    "clinical_significance": structured_analysis.get("clinical_significance"),
-                    "correlation_with_patient": structured_analysis.get("correlation_with_patient"),
-                    "actionable_insights": structured_analysis.get("actionable_insights"),
-                    "patient_communication": structured_analysis.get("patient_communication"),
-                    "clinical_notes": structured_analysis.get("clinical_notes"),
-                    "key_findings": analysis_result["analysis"].get("key_findings", []),
-                    "analysis_success": True,
-                    "analysis_error": None,
-                    "processing_time_ms": int(processing_time),
-                    "analyzed_at": analysis_result["processed_at"],
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                created_analysis = await self.db.create_ai_analysis(analysis_data)
-                if created_analysis:
-                    logger.info(f"✅ AI analysis completed for report {report_id} (Queue ID: {queue_id})")
-                    logger.info(f"   Processing time: {processing_time:.0f}ms")
-                    logger.info(f"   Confidence: {analysis_result['analysis']['confidence_score']:.2f}")
-                    logger.info(f"   Parsing method: {analysis_result['analysis'].get('parsing_method', 'unknown')}")
-                    
-                    # GENERATE CLINICAL ALERTS from critical findings
-                    try:
-                        self._init_alert_service()
-                        if self.alert_service and structured_data:
-                            alerts_created = await self.alert_service.process_analysis_for_alerts(
-                                analysis_id=str(created_analysis.get("id")),
-                                analysis_data=structured_data,
-                                patient_id=str(patient_id),
-                                doctor_firebase_uid=doctor_firebase_uid,
-                                visit_id=str(visit_id)
-                            )
-                            if alerts_created:
-                                logger.info(f"   🚨 Created {len(alerts_created)} clinical alerts")
-                    except Exception as alert_error:
-                        logger.warning(f"   ⚠️ Alert generation failed (non-critical): {alert_error}")
-                    
-                    await self.db.update_ai_analysis_queue_status(queue_id, "completed")
-                else:
-                    error_msg = "Failed to save analysis results to database"
-                    print(f"❌ {error_msg} for report {report_id}")
-                    await self.db.update_ai_analysis_queue_status(queue_id, "failed", error_msg)
-            else:
-                # Analysis failed
-                error_msg = analysis_result["error"]
-                print(f"❌ AI analysis failed for report {report_id}: {error_msg}")
-                
-                # Store failed analysis
-                analysis_data = {
-                    "report_id": report_id,
-                    "visit_id": visit_id,
-                    "patient_id": patient_id,
-                    "doctor_firebase_uid": doctor_firebase_uid,
-                    "analysis_type": "document_analysis",
-                    "model_used": "gemini-2.0-flash-exp",
-                    "confidence_score": 0.0,
-                    "raw_analysis": "",
-                    "analysis_success": False,
-                    "analysis_error": error_msg,
-                    "processing_time_ms": int(processing_time),
-                    "analyzed_at": datetime.now(timezone.utc).isoformat(),
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                await self.db.create_ai_analysis(analysis_data)
-                await self.db.update_ai_analysis_queue_status(queue_id, "failed", error_msg)
+            await self._store_analysis_result(queue_item, analysis_result, processing_time)
                 
         except Exception as e:
             error_msg = f"Processing error: {str(e)}"
             print(f"❌ Error processing analysis for queue item {queue_id}: {e}")
             print(f"Traceback: {traceback.format_exc()}")
-            await self.db.update_ai_analysis_queue_status(queue_id, "failed", error_msg)
+            await self._handle_failed_attempt(queue_item, error_msg)
+    
+    def _shared_fetch(
+        self,
+        context_window: Optional[Dict[Any, asyncio.Future]],
+        key: Any,
+        fetch
+    ) -> asyncio.Future:
+        """Start a fetch, or join the one already running for the same key in this dispatch window"""
+        if context_window is None:
+            return asyncio.ensure_future(fetch())
+        task = context_window.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            context_window[key] = task
+        return task
+    
+    async def _load_analysis_context(
+        self,
+        queue_item: Dict[str, Any],
+        context_window: Optional[Dict[Any, asyncio.Future]] = None
+    ) -> Dict[str, Any]:
+        """
+        Fetch everything an analysis needs in one round of concurrent calls.
+        
+        Visit, patient and doctor fetches are shared by queue items in the same
+        dispatch window. The file download starts as soon as the report row is
+        known and is dropped if an analysis already exists or context is missing.
+        """
+        report_id = queue_item["report_id"]
+        visit_id = queue_item["visit_id"]
+        patient_id = queue_item["patient_id"]
+        doctor_firebase_uid = queue_item["doctor_firebase_uid"]
+        
+        existing_task = asyncio.ensure_future(self.db.get_ai_analysis_by_report_id(report_id, doctor_firebase_uid))
+        report_task = asyncio.ensure_future(self.db.get_report_by_id(report_id, doctor_firebase_uid))
+        visit_task = self._shared_fetch(
+            context_window, ("visit", visit_id, doctor_firebase_uid),
+            lambda: self.db.get_visit_by_id(visit_id, doctor_firebase_uid)
+        )
+        patient_task = self._shared_fetch(
+            context_window, ("patient", patient_id, doctor_firebase_uid),
+            lambda: self.db.get_patient_by_id(patient_id, doctor_firebase_uid)
+        )
+        doctor_task = self._shared_fetch(
+            context_window, ("doctor", doctor_firebase_uid),
+            lambda: self.db.get_doctor_by_firebase_uid(doctor_firebase_uid)
+        )
+        
+        report = await report_task
+        download_task = asyncio.ensure_future(self.download_report_file(report["file_url"])) if report else None
+        
+        context = {
+            "existing_analysis": await existing_task,
+            "report": report,
+            "visit": None,
+            "patient": None,
+            "doctor": None,
+            "file_content": None
+        }
+        if context["existing_analysis"]:
+            if download_task:
+                download_task.cancel()
+            return context
+        
+        context["visit"], context["patient"], context["doctor"] = await asyncio.gather(
+            visit_task, patient_task, doctor_task
+        )
+        if all([report, context["visit"], context["patient"], context["doctor"]]):
+            context["file_content"] = await download_task
+        elif download_task:
+            download_task.cancel()
+        
+        return context
+    
+    async def _store_analysis_result(
+        self,
+        queue_item: Dict[str, Any],
+        analysis_result: Dict[str, Any],
+        processing_time: float
+    ):
+        """Persist an analysis result (interactive or batch lane), raise alerts and close the queue item"""
+        queue_id = queue_item["id"]
+        report_id = queue_item["report_id"]
+        visit_id = queue_item["visit_id"]
+        patient_id = queue_item["patient_id"]
+        doctor_firebase_uid = queue_item["doctor_firebase_uid"]
+        
+        if analysis_result["success"]:
+            # Get structured data (either from JSON mode or parsed)
+            structured_analysis = analysis_result["analysis"].get("structured_analysis", {})
+            structured_data = analysis_result["analysis"].get("structured_data", structured_analysis)
+            
+            # Store analysis results with enhanced visit-contextual fields
+            analysis_data = {
+                "report_id": report_id,
+                "visit_id": visit_id,
+                "patient_id": patient_id,
+                "doctor_firebase_uid": doctor_firebase_uid,
+                "analysis_type": "document_analysis",
+                "model_used": analysis_result["model_used"],
+                "confidence_score": analysis_result["analysis"].get("confidence_score", 0.7),
+                "raw_analysis": analysis_result["analysis"].get("raw_analysis", ""),
+                # NEW: Store structured JSON data directly
+                "structured_data": structured_data if structured_data else None,
+                # Enhanced visit-contextual fields (for backward compatibility)
+                "clinical_correlation": structured_analysis.get("clinical_correlation"),
+                "detailed_findings": structured_analysis.get("detailed_findings") or structured_analysis.get("findings"),
+                "critical_findings": structured_analysis.get("critical_findings"),
+                "treatment_evaluation": structured_analysis.get("treatment_evaluation"),
+                # Original fields (keeping for backward compatibility)
+                "document_summary": structured_analysis.get("document_summary"),
+                "clinical_significance": structured_analysis.get("clinical_significance"),
+                "correlation_with_patient": structured_analysis.get("correlation_with_patient"),
+                "actionable_insights": structured_analysis.get("actionable_insights"),
+                "patient_communication": structured_analysis.get("patient_communication"),
+                "clinical_notes": structured_analysis.get("clinical_notes"),
+                "key_findings": analysis_result["analysis"].get("key_findings", []),
+                "analysis_success": True,
+                "analysis_error": None,
+                "processing_time_ms": int(processing_time),
+                "input_token_count": analysis_result["analysis"].get("token_usage", {}).get("prompt_tokens"),
+                "output_token_count": analysis_result["analysis"].get("token_usage", {}).get("output_tokens"),
+                "document_input_mode": analysis_result["analysis"].get("input_mode"),
+                "analyzed_at": analysis_result["processed_at"],
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }
+            
+            created_analysis = await self.db.create_ai_analysis(analysis_data)
+            if created_analysis:
+                logger.info(f"✅ AI analysis completed for report {report_id} (Queue ID: {queue_id})")
+                logger.info(f"   Processing time: {processing_time:.0f}ms")
+                logger.info(f"   Confidence: {analysis_result['analysis']['confidence_score']:.2f}")
+                logger.info(f"   Parsing method: {analysis_result['analysis'].get('parsing_method', 'unknown')}")
+                token_usage = analysis_result['analysis'].get('token_usage') or {}
+                logger.info(f"   Input: {analysis_result['analysis'].get('input_mode', 'unknown')}, tokens in/out: {token_usage.get('prompt_tokens')}/{token_usage.get('output_tokens')}")
+                
+                # GENERATE CLINICAL ALERTS from critical findings
+                try:
+                    self._init_alert_service()
+                    if self.alert_service and structured_data:
+                        alerts_created = await self.alert_service.process_analysis_for_alerts(
+                            analysis_id=str(created_analysis.get("id")),
+                            analysis_data=structured_data,
+                            patient_id=str(patient_id),
+                            doctor_firebase_uid=doctor_firebase_uid,
+                            visit_id=str(visit_id)
+                        )
+                        if alerts_created:
+                            logger.info(f"   🚨 Created {len(alerts_created)} clinical alerts")
+                except Exception as alert_error:
+                    logger.warning(f"   ⚠️ Alert generation failed (non-critical): {alert_error}")
+                
+                await self.db.update_ai_analysis_queue_status(queue_id, "completed")
+            else:
+                error_msg = "Failed to save analysis results to database"
+                print(f"❌ {error_msg} for report {report_id}")
+                await self._handle_failed_attempt(queue_item, error_msg)
+        else:
+            # Analysis failed
+            error_msg = analysis_result["error"]
+            print(f"❌ AI analysis failed for report {report_id}: {error_msg}")
+            await self._handle_failed_attempt(queue_item, error_msg, processing_time=processing_time)
+    
+    async def _handle_failed_attempt(
+        self,
+        queue_item: Dict[str, Any],
+        error_msg: str,
+        processing_time: Optional[float] = None
+    ):
+        """
+        Retry a failed queue item with backoff, or close it as failed / dead_letter.
+        
+        A failed analysis record is only stored once the item is closed and the
+        model actually ran (processing_time given), so retries don't leave
+        failed rows behind for the report.
+        """
+        queue_id = queue_item["id"]
+        attempts = (queue_item.get("attempts") or 0) + 1
+        max_retries = queue_item.get("max_retries")
+        max_attempts = (3 if max_retries is None else max_retries) + 1
+        
+        plan = plan_retry(error_msg, attempts, max_attempts)
+        
+        if plan["action"] == "retry":
+            next_attempt_at = plan["next_attempt_at"].isoformat()
+            print(f"🔁 Retrying queue item {queue_id} ({plan['error_class']}, attempt {attempts}/{max_attempts}) at {next_attempt_at}")
+            await self.db.record_failed_ai_analysis_attempt(
+                queue_id, "pending", attempts, plan["error_class"], error_msg, next_attempt_at
+            )
+            return
+        
+        status = "dead_letter" if plan["action"] == "dead_letter" else "failed"
+        if status == "dead_letter":
+            print(f"☠️ Queue item {queue_id} moved to dead letter after {attempts} attempts ({plan['error_class']})")
+        
+        if processing_time is not None:
+            # Store failed analysis
+            analysis_data = {
+                "report_id": queue_item["report_id"],
+                "visit_id": queue_item["visit_id"],
+                "patient_id": queue_item["patient_id"],
+                "doctor_firebase_uid": queue_item["doctor_firebase_uid"],
+                "analysis_type": "document_analysis",
+                "model_used": "gemini-2.0-flash-exp",
+                "confidence_score": 0.0,
+                "raw_analysis": "",
+                "analysis_success": False,
+                "analysis_error": error_msg,
+                "processing_time_ms": int(processing_time),
+                "analyzed_at": datetime.now(timezone.utc).isoformat(),
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }
+            
+            await self.db.create_ai_analysis(analysis_data)
+        
+        await self.db.record_failed_ai_analysis_attempt(
+            queue_id, status, attempts, plan["error_class"], error_msg
+        )
     
     async def download_report_file(self, file_url: str) -> Optional[bytes]:
         """Download a report file from the given URL using async non-blocking download"""
@@ -290,37 +468,215 @@ class AIAnalysisProcessor:
             print(f"❌ Error downloading file: {e}")
             return None
     
-    async def get_processing_stats(self) -> Dict[str, Any]:
-        """Get statistics about the processing queue"""
+    # =========================================================================
+    # BATCH LANE
+    # =========================================================================
+    
+    async def run_batch_lane(self):
+        """Poll running batch jobs and submit new ones on a slow cadence"""
+        while self.is_running:
+            try:
+                await self.poll_batch_jobs()
+                await self.submit_batch_job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Error in batch lane: {e}")
+                print(f"Traceback: {traceback.format_exc()}")
+            await asyncio.sleep(self.batch_interval)
+    
+    async def submit_batch_job(self) -> Optional[str]:
+        """Accumulate pending batch-lane items into a JSONL job and submit it"""
+        items = await self.db.get_pending_ai_analyses_for_lane("batch", limit=self.batch_max_items)
+        if not items:
+            return None
+        
+        oldest_queued = min(datetime.fromisoformat(item["queued_at"].replace("Z", "+00:00")) for item in items)
+        waited_seconds = (datetime.now(timezone.utc) - oldest_queued).total_seconds()
+        if len(items) < self.batch_min_items and waited_seconds < self.batch_max_wait_seconds:
+            return None  # Keep accumulating
+        
+        # Claim the items before preparing them so no other worker picks them up
+        claim_id = f"claim:{uuid.uuid4().hex[:12]}"
+        claimed = await self.db.claim_ai_analyses_for_batch(
+            [item["id"] for item in items], claim_id, self.batch_backend.owner_id
+        )
+        if not claimed:
+            return None
+        
+        semaphore = asyncio.Semaphore(self.batch_prepare_concurrency)
+        context_window: Dict[Any, asyncio.Future] = {}
+        
+        async def prepare(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    return await self._build_batch_line(item, context_window)
+                except Exception as e:
+                    print(f"❌ Error preparing batch item {item['id']}: {e}")
+                    await self._handle_failed_attempt(item, f"Processing error: {str(e)}")
+                    return None
+        
+        prepared = await asyncio.gather(*[prepare(item) for item in claimed])
+        lines = [line for line in prepared if line]
+        included_ids = [item["id"] for item, line in zip(claimed, prepared) if line]
+        
+        if not lines:
+            return None
+        
+        jsonl_path = write_jsonl(
+            os.path.join(tempfile.gettempdir(), f"ai_batch_{claim_id.split(':')[1]}.jsonl"),
+            lines
+        )
         try:
-            # Get queue statistics
-            response = await self.db.supabase.table("ai_analysis_queue") \
-                    .select("status") \
-                    .execute()
+            job_id = await self.batch_backend.submit(jsonl_path, display_name=f"document-analysis-{claim_id.split(':')[1]}")
+        except Exception as e:
+            print(f"❌ Batch submission failed, releasing {len(included_ids)} items: {e}")
+            await self.db.release_ai_analyses_from_batch(included_ids)
+            return None
+        
+        await self.db.set_ai_analysis_batch_job(included_ids, job_id, claim_id)
+        self.batch_stats["jobs_submitted"] += 1
+        print(f"📦 Submitted batch job {job_id} with {len(included_ids)} analyses")
+        return job_id
+    
+    async def _build_batch_line(
+        self,
+        item: Dict[str, Any],
+        context_window: Optional[Dict[Any, asyncio.Future]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Fetch context and the report file for a queue item and build its JSONL line"""
+        queue_id = item["id"]
+        doctor_firebase_uid = item["doctor_firebase_uid"]
+        
+        context = await self._load_analysis_context(item, context_window)
+        if context["existing_analysis"]:
+            await self.db.update_ai_analysis_queue_status(queue_id, "completed")
+            return None
+        
+        report = context["report"]
+        visit = context["visit"]
+        patient = context["patient"]
+        doctor = context["doctor"]
+        if not all([report, visit, patient, doctor]):
+            await self._handle_failed_attempt(item, "Missing required data (report, visit, patient, or doctor)")
+            return None
+        
+        file_content = context["file_content"]
+        if not file_content:
+            await self._handle_failed_attempt(item, "Failed to download report file")
+            return None
+        
+        line = await self.ai_service.build_document_batch_request(
+            key=str(queue_id),
+            file_content=file_content,
+            file_name=report["file_name"],
+            file_type=report["file_type"],
+            patient_context=patient,
+            visit_context=visit,
+            doctor_context=doctor
+        )
+        if not line:
+            await self._handle_failed_attempt(item, "Unable to process document format")
+        return line
+    
+    async def poll_batch_jobs(self):
+        """
+        Check submitted jobs and fan finished results back into the analysis tables.
+        Only jobs claimed through this worker's backend (batch_owner) are polled; jobs of
+        a backend that is gone are reset by cleanup_stale_processing_items.
+        """
+        owner_id = self.batch_backend.owner_id
+        batched_items = await self.db.get_batched_ai_analyses(owner_id)
+        jobs: Dict[str, List[Dict[str, Any]]] = {}
+        for item in batched_items:
+            jobs.setdefault(item["batch_job_id"], []).append(item)
+        
+        for job_id, job_items in jobs.items():
+            item_ids = [item["id"] for item in job_items]
             
-            queue_items = response.data if response.data else []
+            if job_id.startswith("claim:"):
+                # Claimed but never submitted (worker died while preparing)
+                started = min(datetime.fromisoformat(item["started_at"].replace("Z", "+00:00")) for item in job_items)
+                if datetime.now(timezone.utc) - started > timedelta(seconds=max(self.batch_interval * 2, 1800)):
+                    print(f"⚠️ Releasing {len(item_ids)} items from abandoned batch claim {job_id}")
+                    await self.db.release_ai_analyses_from_batch(item_ids)
+                continue
             
-            stats = {
-                "total_queued": len(queue_items),
-                "pending": len([item for item in queue_items if item["status"] == "pending"]),
-                "processing": len([item for item in queue_items if item["status"] == "processing"]),
-                "completed": len([item for item in queue_items if item["status"] == "completed"]),
-                "failed": len([item for item in queue_items if item["status"] == "failed"]),
-                "processor_running": self.is_running
-            }
+            state = await self.batch_backend.get_state(job_id)
+            if state == BATCH_STATE_RUNNING:
+                continue
             
-            return stats
+            if state not in (BATCH_STATE_SUCCEEDED, BATCH_STATE_FAILED):
+                # Not readable right now; the job is left alone rather than resubmitted
+                print(f"⚠️ Batch job {job_id} state unknown, checking again next cycle")
+                continue
             
-        except Exception as e:
-            print(f"❌ Error getting processing stats: {e}")
-            return {
-                "total_queued": 0,
-                "pending": 0,
-                "processing": 0,
-                "completed": 0,
-                "failed": 0,
-                "processor_running": self.is_running
-            }
+            # A shared owner (Vertex AI) is polled by every worker: one takes the finished job
+            job_items = await self.db.take_ai_analysis_batch_job(
+                job_id, owner_id, f"{owner_id}@{socket.gethostname()}:{os.getpid()}"
+            )
+            if not job_items:
+                continue
+            item_ids = [item["id"] for item in job_items]
+            
+            if state == BATCH_STATE_FAILED:
+                print(f"❌ Batch job {job_id} failed ({len(item_ids)} analyses)")
+                self.batch_stats["jobs_failed"] += 1
+                self.batch_stats["items_failed"] += len(item_ids)
+                for item in job_items:
+                    await self._handle_failed_attempt(item, f"Batch job {job_id} failed")
+                continue
+            
+            results = await self.batch_backend.fetch_results(job_id)
+            results_by_key = {result["key"]: result for result in results if result.get("key")}
+            
+            for item in job_items:
+                result = results_by_key.get(str(item["id"]))
+                if not result:
+                    self.batch_stats["items_failed"] += 1
+                    await self._handle_failed_attempt(item, "Missing from batch output")
+                    continue
+                
+                analysis_result = self.ai_service.parse_document_batch_result(result)
+                started = datetime.fromisoformat(item["started_at"].replace("Z", "+00:00"))
+                processing_time = (datetime.now(timezone.utc) - started).total_seconds() * 1000
+                try:
+                    await self._store_analysis_result(item, analysis_result, processing_time)
+                    self.batch_stats["items_completed" if analysis_result["success"] else "items_failed"] += 1
+                except Exception as e:
+                    print(f"❌ Error storing batch result for queue item {item['id']}: {e}")
+                    await self._handle_failed_attempt(item, f"Processing error: {str(e)}")
+            
+            self.batch_stats["jobs_completed"] += 1
+            print(f"✅ Batch job {job_id} completed ({len(job_items)} analyses)")
+    
+    def get_batch_lane_status(self) -> Dict[str, Any]:
+        """Configuration and counters for the batch lane"""
+        return {
+            "enabled": self.batch_lane_enabled,
+            "backend": self.batch_backend.name if self.batch_backend else None,
+            "interval_seconds": self.batch_interval,
+            "min_items": self.batch_min_items,
+            "max_items": self.batch_max_items,
+            "max_wait_seconds": self.batch_max_wait_seconds,
+            **self.batch_stats
+        }
+    
+    async def get_processing_stats(self) -> Dict[str, Any]:
+        """Get statistics about the processing queue"""
+        # Single aggregated (and briefly cached) query instead of reading every queue row
+        queue_stats = await self.db.get_queue_stats()
+        
+        return {
+            "total_queued": queue_stats["total"],
+            "pending": queue_stats["pending"],
+            "processing": queue_stats["processing"],
+            "completed": queue_stats["completed"],
+            "failed": queue_stats["failed"],
+            "dead_letter": queue_stats["dead_letter"],
+            "oldest_pending_age_seconds": queue_stats["oldest_pending_age_seconds"],
+            "processor_running": self.is_running
+        }
 
 async def run_background_processor():
     """Standalone function to run the background processor"""
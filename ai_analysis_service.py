@@ -7,6 +7,7 @@ from typing import Dict, Any, Optional, List
 from datetime import datetime, timezone
 import magic
 import PyPDF2
+import fitz  # PyMuPDF for page subsetting / rasterizing scanned PDFs
 from PIL import Image
 import io
 import base64
@@ -25,8 +26,350 @@ from ai_schemas import (
     CONSOLIDATED_ANALYSIS_SCHEMA
 )
 
+from prompt_budget import PromptBudget, truncate_to_tokens
+from gemini_context_cache import ContextCacheManager, is_cache_miss_error
+from fake_gemini_client import FakeGeminiClient
+from ai_batch_backend import content_part_to_rest, to_rest_schema
+
 logger = logging.getLogger(__name__)
 
+# Terms that raise the rank of a visit/report when the history prompt is over budget
+HISTORY_RELEVANCE_KEYWORDS = (
+    "abnormal", "critical", "urgent", "severe", "elevated", "positive", "malignan",
+    "tumor", "mass", "chronic", "worsen", "emergency", "admitted", "allergic", "reaction"
+)
+
+DOCUMENT_ANALYSIS_INSTRUCTIONS = """
+You are an advanced AI medical assistant helping a doctor analyze a medical document within the context of a specific patient visit. This analysis should be DIRECTLY RELEVANT to the doctor's clinical observations and treatment decisions.
+
+Each request gives the patient information, the current visit context (and linked visit history for follow-ups), followed by the document itself.
+
+**ANALYSIS INSTRUCTIONS:**
+
+Your analysis MUST be contextual and personalized. This is not a standalone report analysis - it's an analysis to help the doctor validate their clinical decisions and adjust treatment if needed.
+
+Please provide analysis in this ENHANCED format:
+
+**1. DOCUMENT IDENTIFICATION & SUMMARY:**
+- Type of medical document (CBC, LFT, X-Ray, CT scan, etc.)
+- Date of test/report (if available)
+- Key parameters measured and their values
+- Overall quality of the document
+
+**2. CLINICAL CORRELATION WITH VISIT:**
+⚠️ **MOST IMPORTANT SECTION** - This should be the most detailed part.
+- **Direct Relevance to Chief Complaint:** How do the report findings specifically relate to the chief complaint?
+- **Validation of Clinical Examination:** Do the report findings support or contradict the doctor's clinical examination findings?
+- **Support for Working Diagnosis:** How do these results confirm, refute, or modify the doctor's working diagnosis?
+- **Explanation of Symptoms:** Which findings in this report could explain the patient's presenting symptoms?
+- **Appropriateness of Test:** Was this the right test to order given the presentation? Are the results what you'd expect?
+
+**3. DETAILED FINDINGS ANALYSIS:**
+For each significant parameter/finding:
+- **Value found** vs **Normal reference range**
+- **Clinical significance** in general medical context
+- **Specific relevance** to this patient's age, gender, and medical history
+- **Severity assessment** (normal, borderline, mildly abnormal, significantly abnormal, critical)
+- **Trends** if previous values are mentioned in medical history
+
+**4. CRITICAL & URGENT FINDINGS:**
+🚨 Flag any values that require:
+- Immediate medical attention
+- Urgent follow-up within 24-48 hours
+- Careful monitoring
+- Medication adjustments
+
+**5. TREATMENT PLAN EVALUATION:**
+Given the current treatment plan and medications prescribed in the visit context:
+- Are the test results consistent with continuing this treatment?
+- Do findings suggest need for treatment modification?
+- Are there any contraindications revealed by this report?
+- Should any medications be adjusted based on these findings?
+
+**6. CONTINUITY OF CARE ANALYSIS (IF FOLLOW-UP VISIT):**
+⚠️ If this is a follow-up visit with linked visit history:
+- **Treatment Response:** How do current findings compare to previous visit? Is the patient improving?
+- **Diagnosis Validation:** Do current results confirm or change the previous diagnosis?
+- **Medication Effectiveness:** Are the previously prescribed medications working?
+- **Test Correlation:** If this test was ordered in a previous visit, what do results indicate?
+- **Disease Progression:** Any signs of progression or regression of the condition?
+- **Previous vs Current:** Direct comparison of any overlapping parameters from past reports
+
+**7. ACTIONABLE NEXT STEPS:**
+Based on BOTH the report findings AND the visit context (including previous visits):
+- Immediate actions for the treating doctor to consider
+- Follow-up tests recommended (with justification)
+- Specialist referrals if indicated
+- Patient lifestyle modifications
+- Monitoring schedule recommendations
+- Treatment modifications based on previous visit outcomes
+
+**8. PATIENT COMMUNICATION GUIDANCE:**
+- How should the treating doctor explain these results to the patient?
+- Key points to emphasize during patient consultation
+- Reassurance points if results are normal/mild
+- Concerns to discuss if results are abnormal
+- Simple, non-technical explanation of findings
+- Progress explanation if this is a follow-up
+
+**9. CLINICAL DOCUMENTATION NOTES:**
+- Important observations to add to medical records
+- Trends to monitor in future visits
+- Red flags for future reference
+- Quality/limitations of this test
+
+**CRITICAL ANALYSIS PRINCIPLES:**
+✓ Always connect findings back to the chief complaint and symptoms
+✓ Consider the doctor's working diagnosis in your interpretation
+✓ Think about "why did the doctor order this test?" and answer that question
+✓ Be specific about clinical implications, not just lab values
+✓ Prioritize findings that impact immediate patient management
+✓ Consider the complete clinical picture, not isolated lab values
+✓ Flag discrepancies between clinical findings and lab results
+✓ Provide decision support, not just data interpretation
+✓ **If follow-up visit: ALWAYS compare with previous visit findings and treatments**
+✓ **Track treatment effectiveness across linked visits**
+
+This analysis should help the treating doctor provide better care for the patient by connecting the diagnostic data with the clinical presentation and treatment plan.
+"""
+
+HANDWRITTEN_ANALYSIS_INSTRUCTIONS = """
+You are an advanced AI medical assistant with specialized training in reading and interpreting handwritten medical documents. You are helping a doctor by analyzing a handwritten prescription/visit notes for their patient.
+
+**IMPORTANT CONTEXT:**
+This is a HANDWRITTEN prescription pad that the doctor has filled out during the patient consultation. The doctor chose to write on the prescription pad instead of typing details into the system. Your task is to:
+1. EXTRACT all handwritten content from the prescription
+2. INTERPRET the medical content correctly
+3. PROVIDE clinical analysis of the documented information
+
+Each request gives the patient information and visit context from the system, followed by the handwritten document.
+
+**ANALYSIS INSTRUCTIONS:**
+
+Please provide a comprehensive analysis in this format:
+
+**1. HANDWRITING EXTRACTION:**
+📝 Extract ALL readable text from the handwritten prescription:
+- Header information (date, patient name if written)
+- Chief complaint / reason for visit
+- History of present illness
+- Clinical examination findings
+- Diagnosis (Rx/Dx)
+- Treatment plan
+- Medications prescribed (with dosage, frequency, duration)
+- Special instructions
+- Follow-up notes
+- Any drawings, diagrams, or annotations
+
+**2. MEDICATION ANALYSIS:**
+💊 For each medication identified:
+- Drug name (generic and brand if mentioned)
+- Dosage
+- Route of administration
+- Frequency
+- Duration
+- Food/timing instructions
+- Any warnings or precautions written
+
+**3. CLINICAL INTERPRETATION:**
+🏥 Based on the handwritten notes:
+- What condition(s) is the doctor treating?
+- Is the diagnosis clear from the handwriting?
+- Are the medications appropriate for the apparent diagnosis?
+- Any potential drug interactions to note?
+- Appropriateness for the patient's age and medical history
+
+**4. ALLERGY & SAFETY CHECK:**
+⚠️ Cross-reference with the patient's known allergies:
+- Any prescribed medications that might conflict with allergies?
+- Any contraindications based on the patient's medical history?
+- Any safety concerns?
+
+**5. PATIENT INSTRUCTIONS SUMMARY:**
+📋 Clear summary for the patient:
+- Diagnosis in simple terms
+- Medication schedule in easy-to-understand format
+- Lifestyle or dietary instructions
+- Warning signs to watch for
+- When to return for follow-up
+
+**6. CLINICAL DOCUMENTATION:**
+📁 Structured data extracted for medical records:
+- Diagnosis (ICD codes if determinable)
+- Procedures performed (if any)
+- Medications prescribed (structured format)
+- Follow-up plan
+
+**7. HANDWRITING QUALITY NOTES:**
+✍️ Assessment of document:
+- Overall legibility score (1-10)
+- Any sections that were difficult to read
+- Any ambiguous medications or dosages that need verification
+- Recommendations for clarification if needed
+
+**8. VISIT SUMMARY:**
+📊 Comprehensive summary of this visit based on the handwritten prescription:
+- Primary diagnosis
+- Secondary findings
+- Treatment approach
+- Prognosis indicators
+- Critical follow-up requirements
+
+**CRITICAL GUIDELINES:**
+✓ If handwriting is unclear, indicate uncertainty with [?] or [unclear]
+✓ For medications, if unsure of exact spelling, provide best interpretation with alternatives
+✓ Flag any potentially dangerous prescriptions or dosages
+✓ Consider patient's age and medical history in analysis
+✓ Note if the handwriting suggests any urgency or severity
+✓ Preserve doctor's original intent while clarifying for records
+
+This analysis will help ensure accurate medical records and patient safety by properly interpreting the doctor's handwritten prescription.
+"""
+
+RISK_SCORE_INSTRUCTIONS = """
+Analyze the patient's complete medical data given in each request and calculate comprehensive risk scores.
+
+**RISK ASSESSMENT INSTRUCTIONS:**
+
+Based on all available data, calculate the following risk scores (0-100, where 100 is highest risk):
+
+1. **Overall Health Risk Score**: Combined assessment of all risk factors
+2. **Cardiovascular Risk**: Based on BP, lipids, age, lifestyle factors
+3. **Diabetes Risk**: Based on glucose levels, BMI, family history
+4. **Kidney Risk**: Based on creatinine, eGFR, urinalysis findings
+5. **Liver Risk**: Based on LFTs, lifestyle factors
+
+Also identify:
+- **Risk Factors**: Conditions or findings that increase health risk
+- **Protective Factors**: Positive health indicators
+- **Recommendations**: Actionable steps to reduce risk
+
+Use established medical risk frameworks (Framingham, ASCVD, etc.) as reference.
+Consider patient's age, gender, and medical history in all assessments.
+"""
+
+CASE_ANALYSIS_INSTRUCTIONS = """
+You are an experienced medical professional analyzing a complete case/episode of care.
+Analyze the treatment progress and provide comprehensive insights.
+
+Each request gives the case information, patient information, visit history, photo
+documentation (with any photos attached) and the requested analysis type.
+
+Please provide a comprehensive analysis including:
+
+1. **Case Overview**: Summary of the entire case journey
+2. **Treatment Effectiveness**: How effective has the treatment been?
+3. **Progress Assessment**: Overall progress from first to latest visit
+4. **Visual Progress** (if photos provided): Compare before/after photos
+5. **Red Flags**: Any concerns or warning signs
+6. **Recommendations**: Next steps and follow-up recommendations
+7. **Patient-Friendly Summary**: Simple explanation for the patient
+
+Be thorough but concise. Focus on actionable insights.
+"""
+
+COMPREHENSIVE_HISTORY_INSTRUCTIONS = """
+## ANALYSIS INSTRUCTIONS
+
+**YOUR MISSION: Analyze ALL the above data to provide insights that would be impossible to see by looking at individual pieces. Think like a detective connecting clues across time.**
+
+Please provide an extremely thorough analysis covering:
+
+## 1. COMPREHENSIVE MEDICAL SUMMARY
+- Create a complete narrative of this patient's health journey
+- Summarize the key medical events and their significance
+- What is the overall "story" of this patient's health?
+
+## 2. MEDICAL TRAJECTORY & TRENDS
+- How has the patient's health changed over time?
+- Are they getting better, worse, or stable?
+- What trends do you see in vitals, symptoms, or conditions?
+- Graph-like description of health trajectory (improving/declining/stable periods)
+
+## 3. CHRONIC CONDITIONS & RECURRING ISSUES
+- Identify any chronic or recurring conditions
+- Which symptoms keep appearing?
+- Are there seasonal or cyclical patterns?
+- What conditions require ongoing management?
+
+## 4. PATTERN DETECTION (CRITICAL!)
+**Look for patterns that might be missed:**
+- Are there correlations between symptoms and timing?
+- Do certain medications seem to trigger new symptoms?
+- Are there environmental or lifestyle factors triggering issues?
+- What clusters of symptoms appear together?
+- Are there warning signs that appeared before major health events?
+
+## 5. MISSED OPPORTUNITIES & CONCERNS
+**This is crucial - what might have been overlooked?**
+- Are there test results that should have prompted action?
+- Were there symptoms that might indicate something more serious?
+- Are there recommended tests that were never done?
+- Are there medication interactions to be concerned about?
+- What diagnoses might have been missed?
+
+## 6. TREATMENT EFFECTIVENESS REVIEW
+- Which treatments have worked well?
+- Which treatments haven't shown improvement?
+- Are there alternative treatments to consider?
+- Is the patient responding to current medication regimens?
+- Medication compliance patterns (if detectable)
+
+## 7. RISK FACTOR IDENTIFICATION
+- Current health risks
+- Emerging risks based on trends
+- Lifestyle factors affecting health
+- Age-appropriate health concerns
+- Genetic/hereditary risk indicators
+
+## 8. SIGNIFICANT FINDINGS SUMMARY
+- List the most important findings across ALL data
+- What would you definitely want to discuss with the patient?
+- What requires immediate attention?
+
+## 9. ACTIONABLE RECOMMENDATIONS
+**Specific, prioritized recommendations:**
+- Immediate actions (within 1 week)
+- Short-term actions (within 1 month)
+- Long-term health management strategies
+- Preventive care recommendations
+- Lifestyle modification suggestions
+- Screening tests to consider
+
+## 10. PATIENT COMMUNICATION GUIDE
+- How to explain the overall health status to the patient
+- Key points to emphasize in patient consultation
+- Areas where patient education is needed
+- Motivational approaches for lifestyle changes
+
+## 11. FOLLOW-UP & MONITORING PLAN
+- Recommended monitoring schedule
+- Tests that should be repeated and when
+- Specialist referrals if indicated
+- Red flags to watch for
+
+## 12. DATA CORRELATION INSIGHTS
+**Connect the dots between different pieces of data:**
+- How do lab results relate to symptoms?
+- Do physical exam findings match test results?
+- Are there inconsistencies that need clarification?
+- How do different visits relate to each other?
+
+## CRITICAL PRINCIPLES
+
+- Think holistically - every piece of data might connect to another
+- Look for what's NOT there as much as what IS there
+- Consider time relationships between events
+- Flag anything that seems unusual or worth investigating
+- Be specific and actionable in recommendations
+- Consider the patient's age, gender, and overall context
+- If something doesn't make sense, mention it as a concern
+- Prioritize findings by clinical importance
+- Think about quality of life, not just medical metrics
+
+This comprehensive analysis will help {doctor_name} provide the best possible care for {patient_name}, especially if they're returning after a gap or if this is a complex case requiring a holistic view.
+"""
+
 class AIAnalysisService:
     def __init__(self):
         """Initialize the AI Analysis Service with Gemini 3 Pro via Vertex AI"""
@@ -34,26 +377,34 @@ class AIAnalysisService:
         self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
         self.location = os.getenv("GOOGLE_CLOUD_LOCATION", "global")
         
-        if not self.project_id:
-            raise ValueError("GOOGLE_CLOUD_PROJECT environment variable is required")
-        
-        # Set environment variables for Gen AI SDK to use Vertex AI
-        os.environ["GOOGLE_CLOUD_PROJECT"] = self.project_id
-        os.environ["GOOGLE_CLOUD_LOCATION"] = self.location
-        os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "True"
-        
-        # Set up Google Cloud credentials from environment variable
-        credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-        if not credentials_path:
-            raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable is required")
+        # Offline mode: local fake model instead of Vertex AI (no credentials needed)
+        self.use_fake_model = os.getenv("GEMINI_FAKE_MODEL", "false").lower() == "true"
         
-        if not os.path.exists(credentials_path):
-            raise FileNotFoundError(f"GCP credentials file not found: {credentials_path}")
-        
-        print(f"Using GCP credentials from: {credentials_path}")
-        
-        # Initialize the Gen AI client for Vertex AI
-        self.client = genai.Client()
+        if self.use_fake_model:
+            self.project_id = self.project_id or "local-fake"
+            print("⚠️ GEMINI_FAKE_MODEL enabled - using the local fake Gemini client")
+            self.client = FakeGeminiClient()
+        else:
+            if not self.project_id:
+                raise ValueError("GOOGLE_CLOUD_PROJECT environment variable is required")
+            
+            # Set environment variables for Gen AI SDK to use Vertex AI
+            os.environ["GOOGLE_CLOUD_PROJECT"] = self.project_id
+            os.environ["GOOGLE_CLOUD_LOCATION"] = self.location
+            os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "True"
+            
+            # Set up Google Cloud credentials from environment variable
+            credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+            if not credentials_path:
+                raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable is required")
+            
+            if not os.path.exists(credentials_path):
+                raise FileNotFoundError(f"GCP credentials file not found: {credentials_path}")
+            
+            print(f"Using GCP credentials from: {credentials_path}")
+            
+            # Initialize the Gen AI client for Vertex AI
+            self.client = genai.Client()
         
         # Model name for Gemini 3 Pro Preview
         self.model_name = "gemini-3-pro-preview"
@@ -61,9 +412,81 @@ class AIAnalysisService:
         # Create thread pool for sync operations
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
         
+        # Global Gemini budget: every model call acquires this semaphore, so fan-out
+        # inside one request cannot exceed the process-wide concurrency limit
+        self.max_concurrent_model_calls = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS", "8"))
+        self.model_call_semaphore = asyncio.Semaphore(self.max_concurrent_model_calls)
+        
+        # Per-request limit for analyze_multiple_documents fan-out
+        self.multi_document_concurrency = int(os.getenv("GEMINI_MULTI_DOCUMENT_CONCURRENCY", "4"))
+        
+        # PDF pages with little extractable text (scans, vector-drawn charts) or mostly covered
+        # by an image are sent to Gemini natively instead of as text.
+        # native: subset PDF with only those pages; raster: JPEG per page at the given DPI
+        self.scanned_pdf_mode = os.getenv("SCANNED_PDF_MODE", "native").lower()
+        self.scanned_pdf_max_pages = int(os.getenv("SCANNED_PDF_MAX_PAGES", "10"))
+        self.scanned_pdf_raster_dpi = int(os.getenv("SCANNED_PDF_RASTER_DPI", "150"))
+        self.scanned_pdf_min_text_chars = int(os.getenv("SCANNED_PDF_MIN_TEXT_CHARS", "100"))
+        
+        # Token budget for the comprehensive history prompt (estimated, ~4 chars/token)
+        self.history_prompt_token_budget = int(os.getenv("HISTORY_PROMPT_TOKEN_BUDGET", "30000"))
+        
+        # Explicit context caching for static instruction prefixes
+        self.context_cache = ContextCacheManager(
+            self.client,
+            self.executor,
+            ttl_seconds=int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600")),
+            refresh_margin_seconds=int(os.getenv("GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", "300")),
+            min_tokens=int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024")),
+            enabled=os.getenv("GEMINI_CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+        )
+        
         print(f"AI Analysis Service initialized with Gemini 3 Pro via Vertex AI")
         print(f"Project: {self.project_id}, Location: {self.location}")
     
+    async def _run_model_call(self, generate_fn):
+        """Run a blocking Gemini SDK call on the executor under the global model-call budget"""
+        async with self.model_call_semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, generate_fn)
+    
+    async def _generate_with_static_prefix(
+        self,
+        prefix_key: str,
+        static_prefix: str,
+        contents: Any,
+        **config_kwargs
+    ):
+        """
+        Generate with a static instruction prefix and a dynamic suffix (contents).
+        
+        The prefix is served from an explicit context cache when available, otherwise
+        it is sent inline as system_instruction (still a stable prefix for implicit caching).
+        """
+        cache_name = await self.context_cache.get_cache_name(prefix_key, self.model_name, static_prefix)
+        
+        def generate(use_cache: bool):
+            if use_cache:
+                config = types.GenerateContentConfig(cached_content=cache_name, **config_kwargs)
+            else:
+                config = types.GenerateContentConfig(system_instruction=static_prefix, **config_kwargs)
+            return self.client.models.generate_content(
+                model=self.model_name,
+                contents=contents,
+                config=config
+            )
+        
+        if cache_name:
+            try:
+                return await self._run_model_call(lambda: generate(True))
+            except Exception as e:
+                if not is_cache_miss_error(e):
+                    raise
+                print(f"⚠️ Context cache for {prefix_key} expired upstream, retrying inline")
+                self.context_cache.invalidate(prefix_key, self.model_name)
+        
+        return await self._run_model_call(lambda: generate(False))
+    
     async def analyze_document(
         self, 
         file_content: bytes, 
@@ -197,35 +620,107 @@ class AIAnalysisService:
             return None
     
     async def _prepare_pdf(self, file_content: bytes) -> Dict[str, Any]:
-        """Prepare PDF for AI analysis"""
+        """
+        Prepare PDF for AI analysis.
+        
+        Text-layer pages are extracted as text. Pages whose content is visual (scans,
+        including ones with a short typed header, and pages with no extractable text)
+        are sent to Gemini as a native PDF part containing only those pages, or as
+        rasterized JPEGs when SCANNED_PDF_MODE=raster.
+        """
         try:
-            # Extract text from PDF
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-            text_content = ""
-            
-            for page in pdf_reader.pages:
-                text_content += page.extract_text() + "\n"
+            loop = asyncio.get_event_loop()
+            page_texts, scanned_pages = await loop.run_in_executor(
+                self.executor, self._split_pdf_pages, file_content
+            )
+            text_content = "\n".join(text for text in page_texts if text).strip()
             
-            # If text extraction is successful, use text
-            if text_content.strip():
+            # If every page has a usable text layer, use text
+            if not scanned_pages:
                 return {
                     "type": "text",
-                    "content": text_content.strip()
+                    "content": text_content
+                }
+            
+            selected_pages = scanned_pages[:self.scanned_pdf_max_pages]
+            if len(scanned_pages) > len(selected_pages):
+                print(f"⚠️ PDF has {len(scanned_pages)} pages without usable text, sending first {len(selected_pages)}")
+            
+            if self.scanned_pdf_mode == "raster":
+                images = await loop.run_in_executor(
+                    self.executor, self._rasterize_pdf_pages, file_content, selected_pages
+                )
+                document_data = {
+                    "type": "images",
+                    "content": images,
+                    "mime_type": "image/jpeg"
                 }
             else:
-                # If no text, try to convert first page to image
-                # Note: This would require additional libraries like pdf2image
-                # For now, return the raw content and let Gemini handle it
-                return {
+                subset = await loop.run_in_executor(
+                    self.executor, self._subset_pdf_pages, file_content, selected_pages
+                )
+                document_data = {
                     "type": "pdf",
-                    "content": file_content[:1024000],  # Limit size
+                    "content": subset,
                     "mime_type": "application/pdf"
                 }
+            
+            document_data.update({
+                # Text from the pages that do have a text layer (mixed documents)
+                "text_content": text_content or None,
+                "page_count": len(page_texts),
+                "pages_sent": [page + 1 for page in selected_pages]
+            })
+            return document_data
                 
         except Exception as e:
             print(f"Error preparing PDF: {e}")
             return None
     
+    def _split_pdf_pages(self, file_content: bytes):
+        """Return (per-page text, indices of pages to send visually) for a PDF"""
+        page_texts = []
+        scanned_pages = []
+        with fitz.open(stream=file_content, filetype="pdf") as pdf:
+            for index, page in enumerate(pdf):
+                text = page.get_text().strip()
+                page_texts.append(text)
+                # Little text means the content is in images or vector drawings; a page mostly
+                # covered by an image is a scan even if it carries a typed header
+                if len(text) < self.scanned_pdf_min_text_chars or self._image_coverage(page) >= 0.5:
+                    scanned_pages.append(index)
+        return page_texts, scanned_pages
+    
+    @staticmethod
+    def _image_coverage(page) -> float:
+        """Fraction of the page area covered by embedded images (overlaps counted twice)"""
+        page_area = abs(page.rect)
+        if not page_area:
+            return 0.0
+        covered = 0.0
+        for info in page.get_image_info():
+            covered += abs(fitz.Rect(info["bbox"]) & page.rect)
+        return min(1.0, covered / page_area)
+    
+    def _subset_pdf_pages(self, file_content: bytes, pages: List[int]) -> bytes:
+        """Build a new PDF containing only the given pages"""
+        with fitz.open(stream=file_content, filetype="pdf") as source, fitz.open() as subset:
+            for page in pages:
+                subset.insert_pdf(source, from_page=page, to_page=page)
+            return subset.tobytes(garbage=3, deflate=True)
+    
+    def _rasterize_pdf_pages(self, file_content: bytes, pages: List[int]) -> List[bytes]:
+        """Render the given pages to JPEG at the configured DPI"""
+        images = []
+        with fitz.open(stream=file_content, filetype="pdf") as pdf:
+            for page in pages:
+                pixmap = pdf[page].get_pixmap(dpi=self.scanned_pdf_raster_dpi, colorspace=fitz.csRGB, alpha=False)
+                image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+                output = io.BytesIO()
+                image.save(output, format='JPEG', quality=85)
+                images.append(output.getvalue())
+        return images
+    
     async def _prepare_text(self, file_content: bytes) -> Dict[str, Any]:
         """Prepare text file for AI analysis"""
         try:
@@ -429,8 +924,10 @@ IMPORTANT: Use this history to provide continuity of care analysis.
 
 """
         
+        # Static instructions live in DOCUMENT_ANALYSIS_INSTRUCTIONS (cached prefix);
+        # this is the per-request suffix
         prompt = f"""
-You are an advanced AI medical assistant helping {doctor_name} ({specialization}) analyze a medical document within the context of a specific patient visit. This analysis should be DIRECTLY RELEVANT to the doctor's clinical observations and treatment decisions.
+**TREATING DOCTOR:** {doctor_name} ({specialization})
 
 **PATIENT INFORMATION:**
 - Name: {patient_name}
@@ -457,94 +954,7 @@ You are an advanced AI medical assistant helping {doctor_name} ({specialization}
 
 **DOCUMENT TO ANALYZE:**
 - File Name: {file_name}
-
-**ANALYSIS INSTRUCTIONS:**
-
-Your analysis MUST be contextual and personalized. This is not a standalone report analysis - it's an analysis to help the doctor validate their clinical decisions and adjust treatment if needed.
 {self._get_prior_treatment_instruction(prior_history_section)}
-Please provide analysis in this ENHANCED format:
-
-**1. DOCUMENT IDENTIFICATION & SUMMARY:**
-- Type of medical document (CBC, LFT, X-Ray, CT scan, etc.)
-- Date of test/report (if available)
-- Key parameters measured and their values
-- Overall quality of the document
-
-**2. CLINICAL CORRELATION WITH VISIT:**
-⚠️ **MOST IMPORTANT SECTION** - This should be the most detailed part.
-- **Direct Relevance to Chief Complaint:** How do the report findings specifically relate to "{chief_complaint}"?
-- **Validation of Clinical Examination:** Do the report findings support or contradict Dr. {doctor_name}'s examination findings of: "{clinical_examination}"?
-- **Support for Working Diagnosis:** How do these results confirm, refute, or modify the diagnosis of "{diagnosis}"?
-- **Explanation of Symptoms:** Which findings in this report could explain the patient's symptoms: "{symptoms}"?
-- **Appropriateness of Test:** Was this the right test to order given the presentation? Are the results what you'd expect?
-
-**3. DETAILED FINDINGS ANALYSIS:**
-For each significant parameter/finding:
-- **Value found** vs **Normal reference range**
-- **Clinical significance** in general medical context
-- **Specific relevance** to this patient's age ({patient_age}), gender ({patient_gender}), and medical history
-- **Severity assessment** (normal, borderline, mildly abnormal, significantly abnormal, critical)
-- **Trends** if previous values are mentioned in medical history
-
-**4. CRITICAL & URGENT FINDINGS:**
-🚨 Flag any values that require:
-- Immediate medical attention
-- Urgent follow-up within 24-48 hours
-- Careful monitoring
-- Medication adjustments
-
-**5. TREATMENT PLAN EVALUATION:**
-Given the current treatment plan: "{treatment_plan}" and medications: "{medications}"
-- Are the test results consistent with continuing this treatment?
-- Do findings suggest need for treatment modification?
-- Are there any contraindications revealed by this report?
-- Should any medications be adjusted based on these findings?
-
-**6. CONTINUITY OF CARE ANALYSIS (IF FOLLOW-UP VISIT):**
-⚠️ If this is a follow-up visit with linked visit history:
-- **Treatment Response:** How do current findings compare to previous visit? Is the patient improving?
-- **Diagnosis Validation:** Do current results confirm or change the previous diagnosis?
-- **Medication Effectiveness:** Are the previously prescribed medications working?
-- **Test Correlation:** If this test was ordered in a previous visit, what do results indicate?
-- **Disease Progression:** Any signs of progression or regression of the condition?
-- **Previous vs Current:** Direct comparison of any overlapping parameters from past reports
-
-**7. ACTIONABLE NEXT STEPS:**
-Based on BOTH the report findings AND the visit context (including previous visits):
-- Immediate actions for Dr. {doctor_name} to consider
-- Follow-up tests recommended (with justification)
-- Specialist referrals if indicated
-- Patient lifestyle modifications
-- Monitoring schedule recommendations
-- Treatment modifications based on previous visit outcomes
-
-**8. PATIENT COMMUNICATION GUIDANCE:**
-- How should Dr. {doctor_name} explain these results to {patient_name}?
-- Key points to emphasize during patient consultation
-- Reassurance points if results are normal/mild
-- Concerns to discuss if results are abnormal
-- Simple, non-technical explanation of findings
-- Progress explanation if this is a follow-up
-
-**9. CLINICAL DOCUMENTATION NOTES:**
-- Important observations to add to medical records
-- Trends to monitor in future visits
-- Red flags for future reference
-- Quality/limitations of this test
-
-**CRITICAL ANALYSIS PRINCIPLES:**
-✓ Always connect findings back to the chief complaint and symptoms
-✓ Consider the doctor's working diagnosis in your interpretation
-✓ Think about "why did the doctor order this test?" and answer that question
-✓ Be specific about clinical implications, not just lab values
-✓ Prioritize findings that impact immediate patient management
-✓ Consider the complete clinical picture, not isolated lab values
-✓ Flag discrepancies between clinical findings and lab results
-✓ Provide decision support, not just data interpretation
-✓ **If follow-up visit: ALWAYS compare with previous visit findings and treatments**
-✓ **Track treatment effectiveness across linked visits**
-
-This analysis should help Dr. {doctor_name} provide better care for {patient_name} by connecting the diagnostic data with the clinical presentation and treatment plan.
 """
         
         return prompt
@@ -647,115 +1057,51 @@ This analysis should help Dr. {doctor_name} provide better care for {patient_nam
         prompt: str, 
         document_data: Dict[str, Any],
         max_retries: int = 3,
-        use_json_mode: bool = True
+        use_json_mode: bool = True,
+        static_prefix: str = DOCUMENT_ANALYSIS_INSTRUCTIONS,
+        prefix_key: str = "document_analysis"
     ) -> Dict[str, Any]:
         """
         Perform the actual AI analysis using Gemini 3 Pro with retry logic for rate limits.
         
         Now uses JSON structured output mode for reliable parsing.
         Falls back to text mode only if JSON parsing fails.
+        The static instructions are sent as a (context-cached) prefix; prompt is the dynamic suffix.
         """
         
         for attempt in range(max_retries):
             try:
-                loop = asyncio.get_event_loop()
-                
                 # Prepare content for Gemini 3 Pro using Gen AI SDK
-                content_parts = []
-                
-                if document_data["type"] == "text":
-                    content_parts = [prompt, document_data["content"]]
-                elif document_data["type"] == "image":
-                    # Create image part using types.Part for Gemini 3
-                    image_part = types.Part.from_bytes(
-                        data=document_data["content"],
-                        mime_type=document_data["mime_type"]
-                    )
-                    content_parts = [prompt, image_part]
-                else:
-                    # For PDF or other types, include as text if possible
-                    content_parts = [prompt, f"Document content: {document_data.get('content', 'Unable to extract content')}"]
+                content_parts = self._build_document_content_parts(prompt, document_data)
                 
                 # Generate response using Gemini 3 Pro via Vertex AI
                 # Using LOW thinking level for faster responses in document analysis
                 # Now with JSON structured output for reliable parsing
-                def generate_sync():
-                    if use_json_mode:
-                        # Use JSON mode with structured schema
-                        return self.client.models.generate_content(
-                            model=self.model_name,
-                            contents=content_parts,
-                            config=types.GenerateContentConfig(
-                                thinking_config=types.ThinkingConfig(
-                                    thinking_level=types.ThinkingLevel.LOW
-                                ),
-                                response_mime_type="application/json",
-                                response_schema=DOCUMENT_ANALYSIS_SCHEMA
-                            )
-                        )
-                    else:
-                        # Fallback to text mode
-                        return self.client.models.generate_content(
-                            model=self.model_name,
-                            contents=content_parts,
-                            config=types.GenerateContentConfig(
-                                thinking_config=types.ThinkingConfig(
-                                    thinking_level=types.ThinkingLevel.LOW
-                                )
-                            )
-                        )
+                config_kwargs = {
+                    "thinking_config": types.ThinkingConfig(
+                        thinking_level=types.ThinkingLevel.LOW
+                    )
+                }
+                if use_json_mode:
+                    # Use JSON mode with structured schema
+                    config_kwargs["response_mime_type"] = "application/json"
+                    config_kwargs["response_schema"] = DOCUMENT_ANALYSIS_SCHEMA
                 
-                response = await loop.run_in_executor(
-                    self.executor,
-                    generate_sync
+                response = await self._generate_with_static_prefix(
+                    prefix_key, static_prefix, content_parts, **config_kwargs
                 )
                 
+                token_usage = self._extract_token_usage(response)
+                if document_data["type"] in ("pdf", "images"):
+                    print(
+                        f"📄 Scanned PDF sent as {document_data['type']}: pages {document_data.get('pages_sent')} "
+                        f"of {document_data.get('page_count')}, prompt tokens: {token_usage.get('prompt_tokens')}"
+                    )
+                
                 if response and response.text:
-                    analysis_text = response.text
-                    
-                    if use_json_mode:
-                        # Parse JSON response directly
-                        try:
-                            structured_analysis = json.loads(analysis_text)
-                            
-                            # Calculate confidence from structured data
-                            confidence_score = self._calculate_confidence_from_structured(structured_analysis)
-                            
-                            # Extract key findings from structured data
-                            key_findings = self._extract_key_findings_from_structured(structured_analysis)
-                            
-                            return {
-                                "raw_analysis": analysis_text,
-                                "structured_analysis": structured_analysis,
-                                "confidence_score": confidence_score,
-                                "analysis_length": len(analysis_text),
-                                "key_findings": key_findings,
-                                "structured_data": structured_analysis,  # New field for direct storage
-                                "parsing_method": "json_mode"
-                            }
-                        except json.JSONDecodeError as je:
-                            logger.warning(f"JSON parsing failed, falling back to text parsing: {je}")
-                            # Fall back to text parsing
-                            parsed_analysis = self._parse_analysis_response(analysis_text)
-                            return {
-                                "raw_analysis": analysis_text,
-                                "structured_analysis": parsed_analysis,
-                                "confidence_score": self._calculate_confidence(analysis_text),
-                                "analysis_length": len(analysis_text),
-                                "key_findings": self._extract_key_findings(parsed_analysis),
-                                "parsing_method": "text_fallback"
-                            }
-                    else:
-                        # Legacy text parsing mode
-                        parsed_analysis = self._parse_analysis_response(analysis_text)
-                        return {
-                            "raw_analysis": analysis_text,
-                            "structured_analysis": parsed_analysis,
-                            "confidence_score": self._calculate_confidence(analysis_text),
-                            "analysis_length": len(analysis_text),
-                            "key_findings": self._extract_key_findings(parsed_analysis),
-                            "parsing_method": "text_mode"
-                        }
+                    return self._build_document_analysis_result(
+                        response.text, token_usage, document_data["type"], use_json_mode
+                    )
                 else:
                     return {
                         "error": "No response from AI model",
@@ -806,6 +1152,162 @@ This analysis should help Dr. {doctor_name} provide better care for {patient_nam
             "key_findings": []
         }
     
+    async def build_document_batch_request(
+        self,
+        key: str,
+        file_content: bytes,
+        file_name: str,
+        file_type: str,
+        patient_context: Dict[str, Any],
+        visit_context: Dict[str, Any],
+        doctor_context: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Build one batch-prediction JSONL line for a document analysis.
+        
+        Same prompt, document parts, instructions and schema as analyze_document; the
+        queue key travels in request labels so results can be matched back.
+        """
+        document_data = await self._prepare_document(file_content, file_name, file_type)
+        if not document_data:
+            return None
+        
+        prompt = self._create_analysis_prompt(
+            patient_context,
+            visit_context,
+            doctor_context,
+            file_name
+        )
+        content_parts = self._build_document_content_parts(prompt, document_data)
+        
+        return {
+            "request": {
+                "contents": [{"role": "user", "parts": [content_part_to_rest(p) for p in content_parts]}],
+                "system_instruction": {"parts": [{"text": DOCUMENT_ANALYSIS_INSTRUCTIONS}]},
+                "generation_config": {
+                    "response_mime_type": "application/json",
+                    "response_schema": to_rest_schema(DOCUMENT_ANALYSIS_SCHEMA),
+                    "thinking_config": {"thinking_level": "LOW"}
+                },
+                "labels": {"queue_id": key, "input_mode": document_data["type"]}
+            }
+        }
+    
+    def parse_document_batch_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a parsed batch result line into the analyze_document return shape"""
+        if result.get("error") or not result.get("text"):
+            return {
+                "success": False,
+                "error": result.get("error") or "No response from AI model",
+                "analysis": None
+            }
+        
+        return {
+            "success": True,
+            "analysis": self._build_document_analysis_result(
+                result["text"], result.get("usage") or {}, result.get("input_mode") or "text"
+            ),
+            "processed_at": datetime.now(timezone.utc).isoformat(),
+            "model_used": self.model_name
+        }
+    
+    def _build_document_content_parts(self, prompt: str, document_data: Dict[str, Any]) -> List[Any]:
+        """Content parts (prompt + document) for a document analysis request"""
+        content_parts = []
+        
+        if document_data["type"] == "text":
+            content_parts = [prompt, document_data["content"]]
+        elif document_data["type"] == "image":
+            # Create image part using types.Part for Gemini 3
+            image_part = types.Part.from_bytes(
+                data=document_data["content"],
+                mime_type=document_data["mime_type"]
+            )
+            content_parts = [prompt, image_part]
+        elif document_data["type"] in ("pdf", "images"):
+            # Scanned PDF: send the pages natively, plus any text-layer pages as text
+            content_parts = [prompt]
+            if document_data.get("text_content"):
+                content_parts.append(f"Text extracted from the document's other pages:\n{document_data['text_content']}")
+            page_blobs = document_data["content"] if document_data["type"] == "images" else [document_data["content"]]
+            for blob in page_blobs:
+                content_parts.append(types.Part.from_bytes(
+                    data=blob,
+                    mime_type=document_data["mime_type"]
+                ))
+        else:
+            # Other types, include as text if possible
+            content_parts = [prompt, f"Document content: {document_data.get('content', 'Unable to extract content')}"]
+        return content_parts
+    
+    def _build_document_analysis_result(
+        self,
+        analysis_text: str,
+        token_usage: Dict[str, Optional[int]],
+        input_mode: str,
+        use_json_mode: bool = True
+    ) -> Dict[str, Any]:
+        """Turn a model response into the analysis dict stored for a document"""
+        if use_json_mode:
+            # Parse JSON response directly
+            try:
+                structured_analysis = json.loads(analysis_text)
+                
+                # Calculate confidence from structured data
+                confidence_score = self._calculate_confidence_from_structured(structured_analysis)
+                
+                # Extract key findings from structured data
+                key_findings = self._extract_key_findings_from_structured(structured_analysis)
+                
+                return {
+                    "raw_analysis": analysis_text,
+                    "structured_analysis": structured_analysis,
+                    "confidence_score": confidence_score,
+                    "analysis_length": len(analysis_text),
+                    "key_findings": key_findings,
+                    "structured_data": structured_analysis,  # New field for direct storage
+                    "parsing_method": "json_mode",
+                    "token_usage": token_usage,
+                    "input_mode": input_mode
+                }
+            except json.JSONDecodeError as je:
+                logger.warning(f"JSON parsing failed, falling back to text parsing: {je}")
+                # Fall back to text parsing
+                parsed_analysis = self._parse_analysis_response(analysis_text)
+                return {
+                    "raw_analysis": analysis_text,
+                    "structured_analysis": parsed_analysis,
+                    "confidence_score": self._calculate_confidence(analysis_text),
+                    "analysis_length": len(analysis_text),
+                    "key_findings": self._extract_key_findings(parsed_analysis),
+                    "parsing_method": "text_fallback",
+                    "token_usage": token_usage,
+                    "input_mode": input_mode
+                }
+        else:
+            # Legacy text parsing mode
+            parsed_analysis = self._parse_analysis_response(analysis_text)
+            return {
+                "raw_analysis": analysis_text,
+                "structured_analysis": parsed_analysis,
+                "confidence_score": self._calculate_confidence(analysis_text),
+                "analysis_length": len(analysis_text),
+                "key_findings": self._extract_key_findings(parsed_analysis),
+                "parsing_method": "text_mode",
+                "token_usage": token_usage,
+                "input_mode": input_mode
+            }
+    
+    def _extract_token_usage(self, response) -> Dict[str, Optional[int]]:
+        """Token counts reported by Gemini for a response (None when unavailable)"""
+        usage = getattr(response, "usage_metadata", None)
+        return {
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+            "cached_tokens": getattr(usage, "cached_content_token_count", None),
+            "output_tokens": getattr(usage, "candidates_token_count", None),
+            "total_tokens": getattr(usage, "total_token_count", None)
+        }
+    
     def _calculate_confidence_from_structured(self, structured_data: Dict[str, Any]) -> float:
         """Calculate confidence score from structured JSON response"""
         try:
@@ -1037,35 +1539,64 @@ This analysis should help Dr. {doctor_name} provide better care for {patient_nam
         documents: List[Dict[str, Any]],
         patient_context: Dict[str, Any],
         visit_context: Dict[str, Any],
-        doctor_context: Dict[str, Any]
+        doctor_context: Dict[str, Any],
+        max_concurrency: Optional[int] = None
     ) -> Dict[str, Any]:
-        """Analyze multiple documents and provide a consolidated analysis"""
+        """
+        Analyze multiple documents and provide a consolidated analysis.
+        
+        Per-document analyses run concurrently (bounded by max_concurrency and the
+        global model-call budget). A failing document does not stop the others; its
+        failure is reported to the consolidation step like any other result.
+        Wall time approaches the slowest single document plus consolidation.
+        """
+        individual_analyses: List[Optional[Dict[str, Any]]] = [None] * len(documents)
+        document_summaries: List[str] = [""] * len(documents)
         try:
-            individual_analyses = []
-            
-            # Analyze each document
-            for doc in documents:
-                analysis = await self.analyze_document(
-                    doc["content"],
-                    doc["file_name"],
-                    doc["file_type"],
-                    patient_context,
-                    visit_context,
-                    doctor_context
-                )
-                individual_analyses.append({
-                    "file_name": doc["file_name"],
-                    "analysis": analysis
-                })
+            limit = max(1, max_concurrency or self.multi_document_concurrency)
+            fan_out_semaphore = asyncio.Semaphore(limit)
+            
+            async def analyze_one(index: int, doc: Dict[str, Any]):
+                async with fan_out_semaphore:
+                    try:
+                        analysis = await self.analyze_document(
+                            doc["content"],
+                            doc["file_name"],
+                            doc["file_type"],
+                            patient_context,
+                            visit_context,
+                            doctor_context
+                        )
+                    except Exception as doc_error:
+                        analysis = {"success": False, "error": str(doc_error), "analysis": None}
+                return index, {"file_name": doc["file_name"], "analysis": analysis}
+            
+            # Fan out and fold each result into the consolidation input as it completes
+            tasks = [asyncio.create_task(analyze_one(i, doc)) for i, doc in enumerate(documents)]
+            completed = 0
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                individual_analyses[index] = result
+                document_summaries[index] = self._summarize_document_analysis(index + 1, result)
+                completed += 1
+                status_label = "ok" if result["analysis"].get("success") else "failed"
+                print(f"📄 Document {completed}/{len(documents)} analyzed ({result['file_name']}: {status_label})")
+            
+            if not any(a["analysis"].get("success") for a in individual_analyses):
+                return {
+                    "success": False,
+                    "error": "All document analyses failed",
+                    "individual_analyses": individual_analyses,
+                    "consolidated_analysis": None
+                }
             
             # Create consolidated analysis
             consolidated_prompt = self._create_consolidated_prompt(
-                individual_analyses, patient_context, visit_context, doctor_context
+                individual_analyses, patient_context, visit_context, doctor_context,
+                document_summaries=document_summaries
             )
             
             # Generate consolidated insights using Gemini 3 Pro with JSON mode
-            loop = asyncio.get_event_loop()
-            
             def generate_consolidated():
                 return self.client.models.generate_content(
                     model=self.model_name,
@@ -1079,16 +1610,14 @@ This analysis should help Dr. {doctor_name} provide better care for {patient_nam
                     )
                 )
             
-            response = await loop.run_in_executor(
-                self.executor,
-                generate_consolidated
-            )
+            response = await self._run_model_call(generate_consolidated)
             
             return {
                 "success": True,
                 "individual_analyses": individual_analyses,
                 "consolidated_analysis": response.text if response and response.text else "Unable to generate consolidated analysis",
                 "total_documents": len(documents),
+                "failed_documents": sum(1 for a in individual_analyses if not a["analysis"].get("success")),
                 "processed_at": datetime.now(timezone.utc).isoformat()
             }
             
@@ -1097,31 +1626,41 @@ This analysis should help Dr. {doctor_name} provide better care for {patient_nam
             return {
                 "success": False,
                 "error": str(e),
-                "individual_analyses": individual_analyses if 'individual_analyses' in locals() else [],
+                "individual_analyses": [a for a in individual_analyses if a is not None],
                 "consolidated_analysis": None
             }
     
+    def _summarize_document_analysis(self, position: int, analysis: Dict[str, Any]) -> str:
+        """Render one document's result for the consolidated prompt"""
+        summary = f"\n**Document {position}: {analysis['file_name']}**\n"
+        if analysis['analysis']['success']:
+            # Access the raw_analysis from the analysis result
+            raw_analysis = analysis['analysis']['analysis']['raw_analysis']
+            summary += raw_analysis[:500] + "...\n"
+        else:
+            summary += f"Analysis failed: {analysis['analysis']['error']}\n"
+        return summary
+    
     def _create_consolidated_prompt(
         self,
         analyses: List[Dict[str, Any]],
         patient_context: Dict[str, Any],
         visit_context: Dict[str, Any],
-        doctor_context: Dict[str, Any]
+        doctor_context: Dict[str, Any],
+        document_summaries: Optional[List[str]] = None
     ) -> str:
         """Create prompt for consolidated analysis of multiple documents"""
         
         patient_name = f"{patient_context.get('first_name', '')} {patient_context.get('last_name', '')}"
         doctor_name = f"Dr. {doctor_context.get('first_name', '')} {doctor_context.get('last_name', '')}"
         
-        analyses_summary = ""
-        for i, analysis in enumerate(analyses, 1):
-            analyses_summary += f"\n**Document {i}: {analysis['file_name']}**\n"
-            if analysis['analysis']['success']:
-                # Access the raw_analysis from the analysis result
-                raw_analysis = analysis['analysis']['analysis']['raw_analysis']
-                analyses_summary += raw_analysis[:500] + "...\n"
-            else:
-                analyses_summary += f"Analysis failed: {analysis['analysis']['error']}\n"
+        # Summaries may already have been rendered as each document finished
+        if document_summaries is None:
+            document_summaries = [
+                self._summarize_document_analysis(i, analysis)
+                for i, analysis in enumerate(analyses, 1)
+            ]
+        analyses_summary = "".join(document_summaries)
         
         prompt = f"""
 You are helping {doctor_name} create a consolidated analysis of multiple medical documents for patient {patient_name}.
@@ -1204,8 +1743,6 @@ Focus on creating a cohesive medical narrative that helps Dr. {doctor_name} make
             
             # Perform analysis using Gemini 3 Pro with HIGH thinking for complex reasoning
             # Now using JSON mode for structured output
-            loop = asyncio.get_event_loop()
-            
             def generate_comprehensive():
                 return self.client.models.generate_content(
                     model=self.model_name,
@@ -1219,404 +1756,273 @@ Focus on creating a cohesive medical narrative that helps Dr. {doctor_name} make
                     )
                 )
             
-            response = await loop.run_in_executor(
-                self.executor,
-                generate_comprehensive
-            )
+            response = await self._run_model_call(generate_comprehensive)
             
             if response and response.text:
                 analysis_text = response.text
                 
-                # Try to parse as JSON for structured data
-                try:
-                    structured_analysis = json.loads(analysis_text)
-                    return {
-                        "success": True,
-                        "comprehensive_analysis": analysis_text,
-                        "structured_data": structured_analysis,
-                        "confidence_score": 0.85,
-                        "processed_at": datetime.now(timezone.utc).isoformat(),
-                        "parsing_method": "json_mode"
-                    }
-                except json.JSONDecodeError:
-                    # Fall back to raw text
-                    return {
-                        "success": True,
-                        "comprehensive_analysis": analysis_text,
-                        "confidence_score": 0.80,
-                        "processed_at": datetime.now(timezone.utc).isoformat(),
-                        "parsing_method": "text_fallback"
-                    }
-            else:
-                return {
-                    "success": False,
-                    "error": "No response from AI model"
-                }
-            
-        except Exception as e:
-            logger.error(f"Error in comprehensive history analysis: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    def _create_comprehensive_history_prompt(
-        self,
-        patient_context: Dict[str, Any],
-        visits: List[Dict[str, Any]],
-        reports: List[Dict[str, Any]],
-        existing_analyses: List[Dict[str, Any]],
-        doctor_context: Dict[str, Any],
-        analysis_period_months: Optional[int] = None,
-        handwritten_notes: Optional[List[Dict[str, Any]]] = None
-    ) -> str:
-        """Create a comprehensive prompt for patient history analysis with ALL available data"""
-        
-        patient_name = f"{patient_context.get('first_name', '')} {patient_context.get('last_name', '')}"
-        doctor_name = f"Dr. {doctor_context.get('first_name', '')} {doctor_context.get('last_name', '')}"
-        doctor_specialization = doctor_context.get('specialization', 'General Practice')
-        
-        # Calculate patient age
-        patient_age = "Unknown"
-        if patient_context.get('date_of_birth'):
-            try:
-                dob = datetime.strptime(patient_context['date_of_birth'], '%Y-%m-%d')
-                age = (datetime.now() - dob).days // 365
-                patient_age = f"{age} years old"
-            except:
-                pass
-        
-        # Format time period
-        period_text = ""
-        if analysis_period_months:
-            period_text = f" over the last {analysis_period_months} months"
-        else:
-            period_text = " across their complete medical history"
-        
-        # Prepare DETAILED visits summary with ALL information
-        visits_summary = ""
-        if visits:
-            visits_summary = f"\n\n═══════════════════════════════════════════════════════════════\n**📋 COMPLETE MEDICAL VISITS ({len(visits)} total)**\n═══════════════════════════════════════════════════════════════\n"
-            for i, visit in enumerate(visits, 1):
-                visit_date = visit.get('visit_date', 'Unknown date')
-                visit_type = visit.get('visit_type', 'General')
-                chief_complaint = visit.get('chief_complaint', 'Not specified')
-                symptoms = visit.get('symptoms', 'Not documented')
-                diagnosis = visit.get('diagnosis', 'Not specified')
-                treatment = visit.get('treatment_plan', 'Not specified')
-                medications = visit.get('medications', 'None prescribed')
-                clinical_exam = visit.get('clinical_examination', 'Not documented')
-                tests_recommended = visit.get('tests_recommended', 'None')
-                follow_up = visit.get('follow_up_date', 'Not scheduled')
-                notes = visit.get('notes', '')
-                
-                # Extract vitals with all measurements
-                vitals_text = "Not recorded"
-                vitals = visit.get('vitals', {})
-                if vitals:
-                    vitals_parts = []
-                    if vitals.get('temperature'):
-                        vitals_parts.append(f"Temp: {vitals['temperature']}°C")
-                    if vitals.get('blood_pressure_systolic') and vitals.get('blood_pressure_diastolic'):
-                        vitals_parts.append(f"BP: {vitals['blood_pressure_systolic']}/{vitals['blood_pressure_diastolic']} mmHg")
-                    if vitals.get('heart_rate'):
-                        vitals_parts.append(f"HR: {vitals['heart_rate']} bpm")
-                    if vitals.get('pulse_rate'):
-                        vitals_parts.append(f"Pulse: {vitals['pulse_rate']} bpm")
-                    if vitals.get('respiratory_rate'):
-                        vitals_parts.append(f"RR: {vitals['respiratory_rate']}/min")
-                    if vitals.get('oxygen_saturation'):
-                        vitals_parts.append(f"SpO2: {vitals['oxygen_saturation']}%")
-                    if vitals.get('weight'):
-                        vitals_parts.append(f"Weight: {vitals['weight']} kg")
-                    if vitals.get('height'):
-                        vitals_parts.append(f"Height: {vitals['height']} cm")
-                    if vitals.get('bmi'):
-                        vitals_parts.append(f"BMI: {vitals['bmi']}")
-                    if vitals_parts:
-                        vitals_text = " | ".join(vitals_parts)
-                
-                visits_summary += f"""
-┌─────────────────────────────────────────────────────────────────
-│ 📅 VISIT #{i}: {visit_date} ({visit_type})
-├─────────────────────────────────────────────────────────────────
-│ 🔴 Chief Complaint: {chief_complaint}
-│ 📝 Symptoms: {symptoms}
-│ 🩺 Vitals: {vitals_text}
-│ 🔍 Clinical Examination: {clinical_exam}
-│ ✅ Diagnosis: {diagnosis}
-│ 💊 Medications Prescribed: {medications}
-│ 📋 Treatment Plan: {treatment}
-│ 🧪 Tests Recommended: {tests_recommended}
-│ 📆 Follow-up Date: {follow_up}
-│ 📝 Additional Notes: {notes if notes else 'None'}
-└─────────────────────────────────────────────────────────────────
-"""
-        
-        # Prepare DETAILED reports summary with content
-        reports_summary = ""
-        if reports:
-            reports_summary = f"\n\n═══════════════════════════════════════════════════════════════\n**🔬 MEDICAL REPORTS & LAB TESTS ({len(reports)} total)**\n═══════════════════════════════════════════════════════════════\n"
-            for i, report in enumerate(reports, 1):
-                file_name = report.get('file_name', 'Unknown file')
-                test_type = report.get('test_type', 'General Report')
-                uploaded_date = report.get('uploaded_at', 'Unknown date')
-                visit_id = report.get('visit_id', 'N/A')
-                
-                # Extract text content from the report if available
-                content_preview = ""
-                if report.get('content'):
-                    try:
-                        # Try to decode content
-                        raw_content = report['content']
-                        if isinstance(raw_content, bytes):
-                            # For PDFs, extract text using PyPDF2
-                            import io
-                            try:
-                                import PyPDF2
-                                pdf_reader = PyPDF2.PdfReader(io.BytesIO(raw_content))
-                                text_content = ""
-                                for page in pdf_reader.pages[:3]:  # First 3 pages
-                                    text_content += page.extract_text() + "\n"
-                                if text_content.strip():
-                                    content_preview = text_content[:2000]  # Limit to 2000 chars
-                            except:
-                                pass
-                        elif isinstance(raw_content, str):
-                            content_preview = raw_content[:2000]
-                    except:
-                        pass
-                
-                reports_summary += f"""
-┌─────────────────────────────────────────────────────────────────
-│ 📄 REPORT #{i}: {file_name}
-├─────────────────────────────────────────────────────────────────
-│ 🏷️ Test Type: {test_type}
-│ 📅 Uploaded: {uploaded_date}
-│ 🔗 Associated Visit ID: {visit_id}
-"""
-                if content_preview:
-                    reports_summary += f"""│ 📊 REPORT CONTENT/FINDINGS:
-│ {content_preview[:1500]}{'...' if len(content_preview) > 1500 else ''}
-"""
-                reports_summary += "└─────────────────────────────────────────────────────────────────\n"
-        
-        # Prepare handwritten notes summary
-        handwritten_summary = ""
-        if handwritten_notes:
-            handwritten_summary = f"\n\n═══════════════════════════════════════════════════════════════\n**✍️ HANDWRITTEN NOTES & PRESCRIPTIONS ({len(handwritten_notes)} total)**\n═══════════════════════════════════════════════════════════════\n"
-            for i, note in enumerate(handwritten_notes, 1):
-                file_name = note.get('file_name', 'Handwritten Note')
-                created_at = note.get('created_at', 'Unknown date')
-                visit_id = note.get('visit_id', 'N/A')
-                
-                # Extract text from handwritten note PDF
-                content_preview = ""
-                if note.get('content'):
-                    try:
-                        raw_content = note['content']
-                        if isinstance(raw_content, bytes):
-                            import io
-                            try:
-                                import PyPDF2
-                                pdf_reader = PyPDF2.PdfReader(io.BytesIO(raw_content))
-                                text_content = ""
-                                for page in pdf_reader.pages[:2]:
-                                    text_content += page.extract_text() + "\n"
-                                if text_content.strip():
-                                    content_preview = text_content[:1500]
-                            except:
-                                pass
-                    except:
-                        pass
-                
-                handwritten_summary += f"""
-┌─────────────────────────────────────────────────────────────────
-│ ✍️ HANDWRITTEN NOTE #{i}: {file_name}
-├─────────────────────────────────────────────────────────────────
-│ 📅 Created: {created_at}
-│ 🔗 Associated Visit ID: {visit_id}
-"""
-                if content_preview:
-                    handwritten_summary += f"""│ 📝 EXTRACTED CONTENT:
-│ {content_preview}
-"""
-                handwritten_summary += "└─────────────────────────────────────────────────────────────────\n"
-        
-        # Prepare existing analyses summary
-        analyses_summary = ""
-        if existing_analyses:
-            analyses_summary = f"\n\n═══════════════════════════════════════════════════════════════\n**🤖 PREVIOUS AI ANALYSES ({len(existing_analyses)} total)**\n═══════════════════════════════════════════════════════════════\n"
-            for i, analysis in enumerate(existing_analyses[:5], 1):
-                analyzed_date = analysis.get('analyzed_at', 'Unknown date')
-                document_summary = analysis.get('document_summary', 'Not available')
-                clinical_significance = analysis.get('clinical_significance', 'Not available')
-                key_findings = analysis.get('key_findings', [])
-                actionable_insights = analysis.get('actionable_insights', 'Not available')
-                
-                analyses_summary += f"""
-┌─────────────────────────────────────────────────────────────────
-│ 🤖 AI ANALYSIS #{i}: {analyzed_date}
-├─────────────────────────────────────────────────────────────────
-│ 📋 Document Summary: {str(document_summary)[:500]}...
-│ 🎯 Clinical Significance: {str(clinical_significance)[:500]}...
-│ 🔑 Key Findings: {', '.join(key_findings[:5]) if key_findings else 'None identified'}
-│ 💡 Actionable Insights: {str(actionable_insights)[:300]}...
-└─────────────────────────────────────────────────────────────────
-"""
-        
-        # Build the comprehensive mega-prompt
-        prompt = f"""
-╔═══════════════════════════════════════════════════════════════════════════════╗
-║                    🏥 COMPREHENSIVE PATIENT HISTORY ANALYSIS                   ║
-║                         DEEP MEDICAL PATTERN DETECTION                         ║
-╚═══════════════════════════════════════════════════════════════════════════════╝
-
-You are an advanced AI medical assistant with expertise in pattern recognition, clinical correlation, and comprehensive medical history analysis. You are helping {doctor_name} ({doctor_specialization}) analyze the COMPLETE medical history of {patient_name} ({patient_age}){period_text}.
-
-Your task is to find patterns, correlations, missed opportunities, and provide insights that a human might overlook by reviewing ALL the data together.
-
-═══════════════════════════════════════════════════════════════
-**👤 PATIENT DEMOGRAPHICS**
-═══════════════════════════════════════════════════════════════
-┌─────────────────────────────────────────────────────────────────
-│ 📛 Name: {patient_name}
-│ 🎂 Age: {patient_age}
-│ 👤 Gender: {patient_context.get('gender', 'Not specified')}
-│ 🩸 Blood Group: {patient_context.get('blood_group', 'Not specified')}
-│ ⚠️ Known Allergies: {patient_context.get('allergies', 'None reported')}
-│ 🏥 Medical History: {patient_context.get('medical_history', 'None provided')}
-│ 📞 Emergency Contact: {patient_context.get('emergency_contact_name', 'Not provided')}
-│ 📧 Email: {patient_context.get('email', 'Not provided')}
-│ 📱 Phone: {patient_context.get('phone', 'Not provided')}
-└─────────────────────────────────────────────────────────────────
-{self._format_prior_medical_history_for_prompt(patient_context)}
-{visits_summary}
-{reports_summary}
-{handwritten_summary}
-{analyses_summary}
-
-═══════════════════════════════════════════════════════════════════════════════
-                    🎯 COMPREHENSIVE ANALYSIS INSTRUCTIONS
-═══════════════════════════════════════════════════════════════════════════════
-
-**YOUR MISSION: Analyze ALL the above data to provide insights that would be impossible to see by looking at individual pieces. Think like a detective connecting clues across time.**
-
-Please provide an extremely thorough analysis covering:
-
-## 1. 🏥 COMPREHENSIVE MEDICAL SUMMARY
-- Create a complete narrative of this patient's health journey
-- Summarize the key medical events and their significance
-- What is the overall "story" of this patient's health?
-
-## 2. 📈 MEDICAL TRAJECTORY & TRENDS
-- How has the patient's health changed over time?
-- Are they getting better, worse, or stable?
-- What trends do you see in vitals, symptoms, or conditions?
-- Graph-like description of health trajectory (improving/declining/stable periods)
-
-## 3. 🔄 CHRONIC CONDITIONS & RECURRING ISSUES
-- Identify any chronic or recurring conditions
-- Which symptoms keep appearing?
-- Are there seasonal or cyclical patterns?
-- What conditions require ongoing management?
-
-## 4. 🔍 PATTERN DETECTION (CRITICAL!)
-**Look for patterns that might be missed:**
-- Are there correlations between symptoms and timing?
-- Do certain medications seem to trigger new symptoms?
-- Are there environmental or lifestyle factors triggering issues?
-- What clusters of symptoms appear together?
-- Are there warning signs that appeared before major health events?
-
-## 5. ⚠️ MISSED OPPORTUNITIES & CONCERNS
-**This is crucial - what might have been overlooked?**
-- Are there test results that should have prompted action?
-- Were there symptoms that might indicate something more serious?
-- Are there recommended tests that were never done?
-- Are there medication interactions to be concerned about?
-- What diagnoses might have been missed?
-
-## 6. 💊 TREATMENT EFFECTIVENESS REVIEW
-- Which treatments have worked well?
-- Which treatments haven't shown improvement?
-- Are there alternative treatments to consider?
-- Is the patient responding to current medication regimens?
-- Medication compliance patterns (if detectable)
-
-## 7. 🚨 RISK FACTOR IDENTIFICATION
-- Current health risks
-- Emerging risks based on trends
-- Lifestyle factors affecting health
-- Age-appropriate health concerns
-- Genetic/hereditary risk indicators
-
-## 8. 📊 SIGNIFICANT FINDINGS SUMMARY
-- List the most important findings across ALL data
-- What would you definitely want to discuss with the patient?
-- What requires immediate attention?
-
-## 9. ✨ ACTIONABLE RECOMMENDATIONS
-**Specific, prioritized recommendations:**
-- Immediate actions (within 1 week)
-- Short-term actions (within 1 month)
-- Long-term health management strategies
-- Preventive care recommendations
-- Lifestyle modification suggestions
-- Screening tests to consider
-
-## 10. 💬 PATIENT COMMUNICATION GUIDE
-- How to explain the overall health status to the patient
-- Key points to emphasize in patient consultation
-- Areas where patient education is needed
-- Motivational approaches for lifestyle changes
-
-## 11. 📅 FOLLOW-UP & MONITORING PLAN
-- Recommended monitoring schedule
-- Tests that should be repeated and when
-- Specialist referrals if indicated
-- Red flags to watch for
-
-## 12. 🔗 DATA CORRELATION INSIGHTS
-**Connect the dots between different pieces of data:**
-- How do lab results relate to symptoms?
-- Do physical exam findings match test results?
-- Are there inconsistencies that need clarification?
-- How do different visits relate to each other?
-
-═══════════════════════════════════════════════════════════════════════════════
-                            ⚡ CRITICAL PRINCIPLES
-═══════════════════════════════════════════════════════════════════════════════
-
-✓ Think holistically - every piece of data might connect to another
-✓ Look for what's NOT there as much as what IS there
-✓ Consider time relationships between events
-✓ Flag anything that seems unusual or worth investigating
-✓ Be specific and actionable in recommendations
-✓ Consider the patient's age, gender, and overall context
-✓ If something doesn't make sense, mention it as a concern
-✓ Prioritize findings by clinical importance
-✓ Think about quality of life, not just medical metrics
-
-This comprehensive analysis will help {doctor_name} provide the best possible care for {patient_name}, especially if they're returning after a gap or if this is a complex case requiring a holistic view.
+                # Try to parse as JSON for structured data
+                try:
+                    structured_analysis = json.loads(analysis_text)
+                    return {
+                        "success": True,
+                        "comprehensive_analysis": analysis_text,
+                        "structured_data": structured_analysis,
+                        "confidence_score": 0.85,
+                        "processed_at": datetime.now(timezone.utc).isoformat(),
+                        "parsing_method": "json_mode"
+                    }
+                except json.JSONDecodeError:
+                    # Fall back to raw text
+                    return {
+                        "success": True,
+                        "comprehensive_analysis": analysis_text,
+                        "confidence_score": 0.80,
+                        "processed_at": datetime.now(timezone.utc).isoformat(),
+                        "parsing_method": "text_fallback"
+                    }
+            else:
+                return {
+                    "success": False,
+                    "error": "No response from AI model"
+                }
+            
+        except Exception as e:
+            logger.error(f"Error in comprehensive history analysis: {e}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    def _create_comprehensive_history_prompt(
+        self,
+        patient_context: Dict[str, Any],
+        visits: List[Dict[str, Any]],
+        reports: List[Dict[str, Any]],
+        existing_analyses: List[Dict[str, Any]],
+        doctor_context: Dict[str, Any],
+        analysis_period_months: Optional[int] = None,
+        handwritten_notes: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """
+        Create the comprehensive history prompt within HISTORY_PROMPT_TOKEN_BUDGET.
+        
+        Demographics and instructions are always included. Visits, reports, notes and
+        previous analyses are ranked by recency and clinical relevance; lower-ranked
+        items are reduced to one-line summaries or elided when the budget runs out.
+        """
+        
+        patient_name = f"{patient_context.get('first_name', '')} {patient_context.get('last_name', '')}"
+        doctor_name = f"Dr. {doctor_context.get('first_name', '')} {doctor_context.get('last_name', '')}"
+        doctor_specialization = doctor_context.get('specialization', 'General Practice')
+        
+        # Calculate patient age
+        patient_age = "Unknown"
+        if patient_context.get('date_of_birth'):
+            try:
+                dob = datetime.strptime(patient_context['date_of_birth'], '%Y-%m-%d')
+                age = (datetime.now() - dob).days // 365
+                patient_age = f"{age} years old"
+            except:
+                pass
+        
+        # Format time period
+        period_text = ""
+        if analysis_period_months:
+            period_text = f" over the last {analysis_period_months} months"
+        else:
+            period_text = " across their complete medical history"
+        
+        handwritten_notes = handwritten_notes or []
+        budget = PromptBudget(self.history_prompt_token_budget)
+        
+        demographics_text = f"""# COMPREHENSIVE PATIENT HISTORY ANALYSIS
 
-═══════════════════════════════════════════════════════════════════════════════
-                         📝 FORMAT YOUR RESPONSE
-═══════════════════════════════════════════════════════════════════════════════
+You are an advanced AI medical assistant with expertise in pattern recognition, clinical correlation, and comprehensive medical history analysis. You are helping {doctor_name} ({doctor_specialization}) analyze the COMPLETE medical history of {patient_name} ({patient_age}){period_text}.
 
-Use clear markdown formatting with:
-- **Bold** for important points
-- Bullet points for lists
-- Clear section headers
-- Numbered items for prioritized recommendations
-- ⚠️ for warnings/concerns
-- ✅ for positive findings
-- 🔍 for insights that require further investigation
+Your task is to find patterns, correlations, missed opportunities, and provide insights that a human might overlook by reviewing ALL the data together.
 
+## PATIENT DEMOGRAPHICS
+Name: {patient_name} | Age: {patient_age} | Gender: {patient_context.get('gender', 'Not specified')} | Blood Group: {patient_context.get('blood_group', 'Not specified')}
+Known Allergies: {patient_context.get('allergies', 'None reported')}
+Medical History: {patient_context.get('medical_history', 'None provided')}
+{self._format_prior_medical_history_for_prompt(patient_context)}
 """
+        budget.add_fixed("demographics", demographics_text)
+        
+        # Visits: newest and most clinically loaded first
+        visit_recency = self._recency_scores(visits, 'visit_date')
+        for i, visit in enumerate(visits, 1):
+            visit_text = self._render_history_visit(i, visit)
+            priority = visit_recency[i - 1] + self._clinical_relevance(visit_text)
+            if visit.get('diagnosis'):
+                priority += 0.2
+            if visit.get('medications'):
+                priority += 0.1
+            budget.add_block("visits", visit_text, priority, self._summarize_history_visit(i, visit))
+        
+        report_recency = self._recency_scores(reports, 'uploaded_at')
+        for i, report in enumerate(reports, 1):
+            content_preview = self._extract_document_text_preview(report.get('content'), max_pages=3, max_chars=1500)
+            header = (
+                f"Report #{i}: {report.get('file_name', 'Unknown file')} | Type: {report.get('test_type', 'General Report')} | "
+                f"Uploaded: {report.get('uploaded_at', 'Unknown date')} | Visit ID: {report.get('visit_id', 'N/A')}"
+            )
+            report_text = f"- {header}\n  Findings: {content_preview}\n" if content_preview else f"- {header}\n"
+            priority = report_recency[i - 1] + self._clinical_relevance(content_preview) + (0.2 if content_preview else 0.0)
+            budget.add_block("reports", report_text, priority, f"- {header} (content omitted)\n")
+        
+        note_recency = self._recency_scores(handwritten_notes, 'created_at')
+        for i, note in enumerate(handwritten_notes, 1):
+            content_preview = self._extract_document_text_preview(note.get('content'), max_pages=2, max_chars=1500)
+            header = (
+                f"Handwritten note #{i}: {note.get('file_name', 'Handwritten Note')} | "
+                f"Created: {note.get('created_at', 'Unknown date')} | Visit ID: {note.get('visit_id', 'N/A')}"
+            )
+            note_text = f"- {header}\n  Extracted content: {content_preview}\n" if content_preview else f"- {header}\n"
+            priority = note_recency[i - 1] + self._clinical_relevance(content_preview)
+            budget.add_block("handwritten_notes", note_text, priority, f"- {header} (content omitted)\n")
+        
+        recent_analyses = existing_analyses[:5]
+        analysis_recency = self._recency_scores(recent_analyses, 'analyzed_at')
+        for i, analysis in enumerate(recent_analyses, 1):
+            key_findings = analysis.get('key_findings') or []
+            findings_text = ', '.join(key_findings[:5]) if key_findings else 'None identified'
+            analysis_text = (
+                f"- AI analysis #{i} ({analysis.get('analyzed_at', 'Unknown date')})\n"
+                f"  Summary: {truncate_to_tokens(str(analysis.get('document_summary', 'Not available')), 125)}\n"
+                f"  Clinical significance: {truncate_to_tokens(str(analysis.get('clinical_significance', 'Not available')), 125)}\n"
+                f"  Key findings: {findings_text}\n"
+                f"  Actionable insights: {truncate_to_tokens(str(analysis.get('actionable_insights', 'Not available')), 75)}\n"
+            )
+            summary_text = f"- AI analysis #{i} ({analysis.get('analyzed_at', 'Unknown date')}): key findings: {findings_text}\n"
+            # Previous analyses are derived data, so they rank below primary records
+            budget.add_block("ai_analyses", analysis_text, analysis_recency[i - 1] * 0.5, summary_text)
         
-        return prompt
+        instructions_text = COMPREHENSIVE_HISTORY_INSTRUCTIONS.format(
+            doctor_name=doctor_name,
+            patient_name=patient_name
+        )
+        budget.add_fixed("instructions", instructions_text)
+        
+        selected, stats = budget.select()
+        print(f"🧮 Comprehensive history prompt {PromptBudget.format_stats(stats, budget.max_tokens)}")
+        
+        section_headers = [
+            ("visits", f"MEDICAL VISITS ({len(visits)} total)"),
+            ("reports", f"MEDICAL REPORTS & LAB TESTS ({len(reports)} total)"),
+            ("handwritten_notes", f"HANDWRITTEN NOTES & PRESCRIPTIONS ({len(handwritten_notes)} total)"),
+            ("ai_analyses", f"PREVIOUS AI ANALYSES ({len(existing_analyses)} total, up to 5 most recent shown)"),
+        ]
+        sections = [demographics_text]
+        for section, title in section_headers:
+            section_stats = stats.get(section)
+            if not section_stats:
+                continue
+            body = "".join(selected.get(section, []))
+            if section_stats["summarized"] or section_stats["elided"]:
+                body += (
+                    f"({section_stats['summarized']} lower-priority item(s) summarized, "
+                    f"{section_stats['elided']} omitted to fit the prompt budget)\n"
+                )
+            sections.append(f"\n## {title}\n{body}")
+        sections.append(instructions_text)
+        
+        return "".join(sections)
+    
+    def _recency_scores(self, items: List[Dict[str, Any]], date_field: str) -> List[float]:
+        """Score items 1.0 (newest) down to ~0 (oldest) by an ISO date field"""
+        if not items:
+            return []
+        order = sorted(range(len(items)), key=lambda i: str(items[i].get(date_field) or ""), reverse=True)
+        scores = [0.0] * len(items)
+        for rank, index in enumerate(order):
+            scores[index] = 1.0 - rank / len(items)
+        return scores
+    
+    def _clinical_relevance(self, text: Optional[str]) -> float:
+        """Boost for text mentioning high-signal clinical terms (0.0 - 0.5)"""
+        if not text:
+            return 0.0
+        lowered = text.lower()
+        hits = sum(1 for keyword in HISTORY_RELEVANCE_KEYWORDS if keyword in lowered)
+        return min(hits * 0.1, 0.5)
+    
+    def _format_vitals_compact(self, vitals: Optional[Dict[str, Any]]) -> str:
+        """Single-line vitals (only the recorded measurements)"""
+        if not vitals:
+            return ""
+        parts = []
+        if vitals.get('temperature'):
+            parts.append(f"Temp {vitals['temperature']}°C")
+        if vitals.get('blood_pressure_systolic') and vitals.get('blood_pressure_diastolic'):
+            parts.append(f"BP {vitals['blood_pressure_systolic']}/{vitals['blood_pressure_diastolic']}")
+        if vitals.get('heart_rate'):
+            parts.append(f"HR {vitals['heart_rate']}")
+        if vitals.get('pulse_rate'):
+            parts.append(f"Pulse {vitals['pulse_rate']}")
+        if vitals.get('respiratory_rate'):
+            parts.append(f"RR {vitals['respiratory_rate']}")
+        if vitals.get('oxygen_saturation'):
+            parts.append(f"SpO2 {vitals['oxygen_saturation']}%")
+        if vitals.get('weight'):
+            parts.append(f"Wt {vitals['weight']}kg")
+        if vitals.get('height'):
+            parts.append(f"Ht {vitals['height']}cm")
+        if vitals.get('bmi'):
+            parts.append(f"BMI {vitals['bmi']}")
+        return ", ".join(parts)
+    
+    def _render_history_visit(self, index: int, visit: Dict[str, Any]) -> str:
+        """Full visit entry with only the documented fields"""
+        fields = [
+            ("Chief complaint", visit.get('chief_complaint')),
+            ("Symptoms", visit.get('symptoms')),
+            ("Vitals", self._format_vitals_compact(visit.get('vitals'))),
+            ("Examination", visit.get('clinical_examination')),
+            ("Diagnosis", visit.get('diagnosis')),
+            ("Medications", visit.get('medications')),
+            ("Treatment plan", visit.get('treatment_plan')),
+            ("Tests recommended", visit.get('tests_recommended')),
+            ("Follow-up", visit.get('follow_up_date')),
+            ("Notes", visit.get('notes')),
+        ]
+        lines = [f"- Visit #{index}: {visit.get('visit_date', 'Unknown date')} ({visit.get('visit_type', 'General')})"]
+        lines.extend(f"  {label}: {value}" for label, value in fields if value)
+        return "\n".join(lines) + "\n"
+    
+    def _summarize_history_visit(self, index: int, visit: Dict[str, Any]) -> str:
+        """One-line visit summary used when the full entry does not fit"""
+        summary = f"- Visit #{index}: {visit.get('visit_date', 'Unknown date')}"
+        if visit.get('diagnosis'):
+            summary += f" | Dx: {str(visit['diagnosis'])[:120]}"
+        elif visit.get('chief_complaint'):
+            summary += f" | CC: {str(visit['chief_complaint'])[:120]}"
+        if visit.get('medications'):
+            summary += f" | Rx: {str(visit['medications'])[:120]}"
+        return summary + "\n"
+    
+    def _extract_document_text_preview(self, raw_content: Any, max_pages: int, max_chars: int) -> str:
+        """Text preview of a report/note (PDF bytes or plain text), empty if none"""
+        if not raw_content:
+            return ""
+        try:
+            if isinstance(raw_content, str):
+                text_content = raw_content
+            elif isinstance(raw_content, bytes):
+                pdf_reader = PyPDF2.PdfReader(io.BytesIO(raw_content))
+                text_content = "\n".join(
+                    page.extract_text() or "" for page in pdf_reader.pages[:max_pages]
+                )
+            else:
+                return ""
+        except Exception:
+            return ""
+        text_content = " ".join(text_content.split())
+        if len(text_content) > max_chars:
+            return text_content[:max_chars] + "..."
+        return text_content
     
     def _parse_comprehensive_analysis(self, analysis_text: str) -> Dict[str, Any]:
         """Parse the comprehensive analysis text into structured components"""
@@ -1881,14 +2287,10 @@ This patient has been seen before for related concerns. Use this history for con
 
 """
         
+        # Static instructions live in HANDWRITTEN_ANALYSIS_INSTRUCTIONS (cached prefix);
+        # this is the per-request suffix
         prompt = f"""
-You are an advanced AI medical assistant with specialized training in reading and interpreting handwritten medical documents. You are helping {doctor_name} ({specialization}) by analyzing a handwritten prescription/visit notes for their patient.
-
-**IMPORTANT CONTEXT:**
-This is a HANDWRITTEN prescription pad that the doctor has filled out during the patient consultation. The doctor chose to write on the prescription pad instead of typing details into the system. Your task is to:
-1. EXTRACT all handwritten content from the prescription
-2. INTERPRET the medical content correctly
-3. PROVIDE clinical analysis of the documented information
+**TREATING DOCTOR:** {doctor_name} ({specialization})
 
 **PATIENT INFORMATION (from system):**
 - Name: {patient_name}
@@ -1908,87 +2310,6 @@ This is a HANDWRITTEN prescription pad that the doctor has filled out during the
 **DOCUMENT TO ANALYZE:**
 - File Name: {file_name}
 - Document Type: Handwritten Prescription/Visit Notes
-
-**ANALYSIS INSTRUCTIONS:**
-
-Please provide a comprehensive analysis in this format:
-
-**1. HANDWRITING EXTRACTION:**
-📝 Extract ALL readable text from the handwritten prescription:
-- Header information (date, patient name if written)
-- Chief complaint / reason for visit
-- History of present illness
-- Clinical examination findings
-- Diagnosis (Rx/Dx)
-- Treatment plan
-- Medications prescribed (with dosage, frequency, duration)
-- Special instructions
-- Follow-up notes
-- Any drawings, diagrams, or annotations
-
-**2. MEDICATION ANALYSIS:**
-💊 For each medication identified:
-- Drug name (generic and brand if mentioned)
-- Dosage
-- Route of administration
-- Frequency
-- Duration
-- Food/timing instructions
-- Any warnings or precautions written
-
-**3. CLINICAL INTERPRETATION:**
-🏥 Based on the handwritten notes:
-- What condition(s) is the doctor treating?
-- Is the diagnosis clear from the handwriting?
-- Are the medications appropriate for the apparent diagnosis?
-- Any potential drug interactions to note?
-- Appropriateness for patient's age ({patient_age}) and medical history
-
-**4. ALLERGY & SAFETY CHECK:**
-⚠️ Cross-reference with patient's known allergies ({allergies}):
-- Any prescribed medications that might conflict with allergies?
-- Any contraindications based on medical history ({medical_history})?
-- Any safety concerns?
-
-**5. PATIENT INSTRUCTIONS SUMMARY:**
-📋 Clear summary for the patient:
-- Diagnosis in simple terms
-- Medication schedule in easy-to-understand format
-- Lifestyle or dietary instructions
-- Warning signs to watch for
-- When to return for follow-up
-
-**6. CLINICAL DOCUMENTATION:**
-📁 Structured data extracted for medical records:
-- Diagnosis (ICD codes if determinable)
-- Procedures performed (if any)
-- Medications prescribed (structured format)
-- Follow-up plan
-
-**7. HANDWRITING QUALITY NOTES:**
-✍️ Assessment of document:
-- Overall legibility score (1-10)
-- Any sections that were difficult to read
-- Any ambiguous medications or dosages that need verification
-- Recommendations for clarification if needed
-
-**8. VISIT SUMMARY:**
-📊 Comprehensive summary of this visit based on the handwritten prescription:
-- Primary diagnosis
-- Secondary findings
-- Treatment approach
-- Prognosis indicators
-- Critical follow-up requirements
-
-**CRITICAL GUIDELINES:**
-✓ If handwriting is unclear, indicate uncertainty with [?] or [unclear]
-✓ For medications, if unsure of exact spelling, provide best interpretation with alternatives
-✓ Flag any potentially dangerous prescriptions or dosages
-✓ Consider patient's age and medical history in analysis
-✓ Note if the handwriting suggests any urgency or severity
-✓ Preserve doctor's original intent while clarifying for records
-
-This analysis will help ensure accurate medical records and patient safety by properly interpreting Dr. {doctor_name}'s handwritten prescription for {patient_name}.
 """
         
         return prompt
@@ -2008,8 +2329,6 @@ This analysis will help ensure accurate medical records and patient safety by pr
         
         for attempt in range(max_retries):
             try:
-                loop = asyncio.get_event_loop()
-                
                 # For handwritten PDFs, we send the PDF directly to Gemini 3 Pro
                 # which has excellent multimodal capabilities for reading handwriting
                 pdf_part = types.Part.from_bytes(
@@ -2022,33 +2341,17 @@ This analysis will help ensure accurate medical records and patient safety by pr
                 # Use HIGH thinking level for handwritten analysis 
                 # as it requires more reasoning to interpret handwriting
                 # Now with JSON structured output for reliable parsing
-                def generate_sync():
-                    if use_json_mode:
-                        return self.client.models.generate_content(
-                            model=self.model_name,
-                            contents=content_parts,
-                            config=types.GenerateContentConfig(
-                                thinking_config=types.ThinkingConfig(
-                                    thinking_level=types.ThinkingLevel.HIGH
-                                ),
-                                response_mime_type="application/json",
-                                response_schema=HANDWRITTEN_ANALYSIS_SCHEMA
-                            )
-                        )
-                    else:
-                        return self.client.models.generate_content(
-                            model=self.model_name,
-                            contents=content_parts,
-                            config=types.GenerateContentConfig(
-                                thinking_config=types.ThinkingConfig(
-                                    thinking_level=types.ThinkingLevel.HIGH
-                                )
-                            )
-                        )
+                config_kwargs = {
+                    "thinking_config": types.ThinkingConfig(
+                        thinking_level=types.ThinkingLevel.HIGH
+                    )
+                }
+                if use_json_mode:
+                    config_kwargs["response_mime_type"] = "application/json"
+                    config_kwargs["response_schema"] = HANDWRITTEN_ANALYSIS_SCHEMA
                 
-                response = await loop.run_in_executor(
-                    self.executor,
-                    generate_sync
+                response = await self._generate_with_static_prefix(
+                    "handwritten_analysis", HANDWRITTEN_ANALYSIS_INSTRUCTIONS, content_parts, **config_kwargs
                 )
                 
                 if response and response.text:
@@ -2341,8 +2644,6 @@ This analysis will help ensure accurate medical records and patient safety by pr
             )
             
             # Generate using Gemini with JSON mode
-            loop = asyncio.get_event_loop()
-            
             def generate_soap():
                 return self.client.models.generate_content(
                     model=self.model_name,
@@ -2356,7 +2657,7 @@ This analysis will help ensure accurate medical records and patient safety by pr
                     )
                 )
             
-            response = await loop.run_in_executor(self.executor, generate_soap)
+            response = await self._run_model_call(generate_soap)
             
             if response and response.text:
                 try:
@@ -2580,22 +2881,16 @@ The note should be suitable for medical records and insurance documentation.
                 patient_context, visits, analyses, doctor_context
             )
             
-            loop = asyncio.get_event_loop()
-            
-            def generate_risk():
-                return self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        thinking_config=types.ThinkingConfig(
-                            thinking_level=types.ThinkingLevel.HIGH
-                        ),
-                        response_mime_type="application/json",
-                        response_schema=RISK_SCORE_SCHEMA
-                    )
-                )
-            
-            response = await loop.run_in_executor(self.executor, generate_risk)
+            response = await self._generate_with_static_prefix(
+                "risk_score",
+                RISK_SCORE_INSTRUCTIONS,
+                prompt,
+                thinking_config=types.ThinkingConfig(
+                    thinking_level=types.ThinkingLevel.HIGH
+                ),
+                response_mime_type="application/json",
+                response_schema=RISK_SCORE_SCHEMA
+            )
             
             if response and response.text:
                 try:
@@ -2655,9 +2950,8 @@ The note should be suitable for medical records and insurance documentation.
                     if f.get('status') in ['high', 'low', 'critical_high', 'critical_low']:
                         analyses_summary += f"- {f.get('parameter', 'Unknown')}: {f.get('value', '')} ({f.get('status', '')})\n"
         
+        # Static instructions live in RISK_SCORE_INSTRUCTIONS (cached prefix)
         prompt = f"""
-Analyze this patient's complete medical data and calculate comprehensive risk scores.
-
 **PATIENT DEMOGRAPHICS:**
 - Age: {patient_age}
 - Gender: {patient_context.get('gender', 'Not specified')}
@@ -2667,24 +2961,6 @@ Analyze this patient's complete medical data and calculate comprehensive risk sc
 
 {visits_summary}
 {analyses_summary}
-
-**RISK ASSESSMENT INSTRUCTIONS:**
-
-Based on all available data, calculate the following risk scores (0-100, where 100 is highest risk):
-
-1. **Overall Health Risk Score**: Combined assessment of all risk factors
-2. **Cardiovascular Risk**: Based on BP, lipids, age, lifestyle factors
-3. **Diabetes Risk**: Based on glucose levels, BMI, family history
-4. **Kidney Risk**: Based on creatinine, eGFR, urinalysis findings
-5. **Liver Risk**: Based on LFTs, lifestyle factors
-
-Also identify:
-- **Risk Factors**: Conditions or findings that increase health risk
-- **Protective Factors**: Positive health indicators
-- **Recommendations**: Actionable steps to reduce risk
-
-Use established medical risk frameworks (Framingham, ASCVD, etc.) as reference.
-Consider patient's age, gender, and medical history in all assessments.
 """
         return prompt
     
@@ -2883,8 +3159,11 @@ Include a dedicated "TREND ANALYSIS" section in your response.
                     mime_type="image/jpeg"
                 ))
             
-            # Create generation config with JSON schema
-            generation_config = types.GenerateContentConfig(
+            # Generate analysis with JSON schema (static instructions as cached prefix)
+            response = await self._generate_with_static_prefix(
+                "case_analysis",
+                CASE_ANALYSIS_INSTRUCTIONS,
+                [types.Content(role="user", parts=content_parts)],
                 temperature=0.3,
                 top_p=0.95,
                 max_output_tokens=8192,
@@ -2892,16 +3171,6 @@ Include a dedicated "TREND ANALYSIS" section in your response.
                 response_schema=CASE_ANALYSIS_SCHEMA
             )
             
-            # Generate analysis
-            response = await asyncio.get_event_loop().run_in_executor(
-                self.executor,
-                lambda: self.client.models.generate_content(
-                    model=f"publishers/google/models/{self.model_name}",
-                    contents=[types.Content(role="user", parts=content_parts)],
-                    config=generation_config
-                )
-            )
-            
             if not response or not response.text:
                 return {
                     "success": False,
@@ -3004,8 +3273,7 @@ Include a dedicated "TREND ANALYSIS" section in your response.
             )
             
             # Generate analysis
-            response = await asyncio.get_event_loop().run_in_executor(
-                self.executor,
+            response = await self._run_model_call(
                 lambda: self.client.models.generate_content(
                     model=f"publishers/google/models/{self.model_name}",
                     contents=[types.Content(role="user", parts=content_parts)],
@@ -3062,14 +3330,8 @@ Include a dedicated "TREND ANALYSIS" section in your response.
         # Sort visits by date
         sorted_visits = sorted(visits, key=lambda x: x.get("visit_date", ""))
         
+        # Static instructions live in CASE_ANALYSIS_INSTRUCTIONS (cached prefix)
         prompt = f"""
-═══════════════════════════════════════════════════════════════════════════════
-                    CASE/EPISODE OF CARE ANALYSIS
-═══════════════════════════════════════════════════════════════════════════════
-
-You are an experienced medical professional analyzing a complete case/episode of care.
-Analyze the treatment progress and provide comprehensive insights.
-
 ═══════════════════════════════════════════════════════════════════════════════
 **CASE INFORMATION:**
 ═══════════════════════════════════════════════════════════════════════════════
@@ -3133,19 +3395,6 @@ Please analyze any provided photos and compare the visual changes.
 ═══════════════════════════════════════════════════════════════════════════════
 **ANALYSIS TYPE: {analysis_type.upper()}**
 ═══════════════════════════════════════════════════════════════════════════════
-
-Please provide a comprehensive analysis including:
-
-1. **Case Overview**: Summary of the entire case journey
-2. **Treatment Effectiveness**: How effective has the treatment been?
-3. **Progress Assessment**: Overall progress from first to latest visit
-4. **Visual Progress** (if photos provided): Compare before/after photos
-5. **Red Flags**: Any concerns or warning signs
-6. **Recommendations**: Next steps and follow-up recommendations
-7. **Patient-Friendly Summary**: Simple explanation for the patient
-
-Be thorough but concise. Focus on actionable insights.
-═══════════════════════════════════════════════════════════════════════════════
 """
         
         return prompt
@@ -0,0 +1,316 @@
+"""
+Batch Prediction Backends for the AI Analysis Batch Lane
+Low-priority analyses are written to a JSONL job file (one GenerateContentRequest
+per line, keyed by queue id), submitted to a batch backend, and polled for results.
+
+Backends:
+- LocalBatchBackend: in-process stand-in that works through the job file with low
+  concurrency (development / offline, pairs with GEMINI_FAKE_MODEL)
+- VertexBatchBackend: Vertex AI batch prediction via Cloud Storage
+
+Queue items record the owner_id of the backend that claimed them. A worker only
+polls jobs of its own owner_id, so a job another worker's backend cannot see is
+never mistaken for a lost one.
+"""
+import asyncio
+import base64
+from abc import ABC, abstractmethod
+import json
+import os
+import socket
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+
+# Batch job states reported by every backend
+BATCH_STATE_RUNNING = "running"
+BATCH_STATE_SUCCEEDED = "succeeded"
+BATCH_STATE_FAILED = "failed"
+BATCH_STATE_UNKNOWN = "unknown"
+
+
+def to_rest_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an ai_schemas dict to the REST Schema form (upper-case type enums)"""
+    converted = {}
+    for key, value in schema.items():
+        if key == "type" and isinstance(value, str):
+            converted[key] = value.upper()
+        elif key == "properties" and isinstance(value, dict):
+            converted[key] = {name: to_rest_schema(prop) for name, prop in value.items()}
+        elif key == "items" and isinstance(value, dict):
+            converted[key] = to_rest_schema(value)
+        else:
+            converted[key] = value
+    return converted
+
+
+def content_part_to_rest(part: Any) -> Dict[str, Any]:
+    """SDK content part (str or types.Part) -> REST JSON part"""
+    if isinstance(part, str):
+        return {"text": part}
+    inline_data = getattr(part, "inline_data", None)
+    if inline_data is not None:
+        return {"inline_data": {
+            "mime_type": inline_data.mime_type,
+            "data": base64.b64encode(inline_data.data).decode("ascii")
+        }}
+    return {"text": getattr(part, "text", "") or ""}
+
+
+def write_jsonl(path: str, lines: List[Dict[str, Any]]) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+    return path
+
+
+def parse_prediction_line(line: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize one output line ({"request", "response"} or {"key", "response"}) to
+    {"key", "input_mode", "text", "usage", "error"}.
+    """
+    request = line.get("request") or {}
+    labels = request.get("labels") or {}
+    key = line.get("key") or labels.get("queue_id")
+
+    error = line.get("status") or line.get("error")
+    response = line.get("response") or {}
+    text_parts = []
+    for candidate in (response.get("candidates") or [])[:1]:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if part.get("text") and not part.get("thought"):
+                text_parts.append(part["text"])
+
+    usage = response.get("usageMetadata") or response.get("usage_metadata") or {}
+    return {
+        "key": str(key) if key is not None else None,
+        "input_mode": labels.get("input_mode"),
+        "text": "".join(text_parts) or None,
+        "usage": {
+            "prompt_tokens": usage.get("promptTokenCount", usage.get("prompt_token_count")),
+            "cached_tokens": usage.get("cachedContentTokenCount", usage.get("cached_content_token_count")),
+            "output_tokens": usage.get("candidatesTokenCount", usage.get("candidates_token_count")),
+            "total_tokens": usage.get("totalTokenCount", usage.get("total_token_count"))
+        },
+        "error": str(error) if error else None
+    }
+
+
+class BatchBackend(ABC):
+    """Interface for batch prediction backends"""
+
+    name = "base"
+    # Queue items claimed through this backend are tagged with it (batch_owner)
+    owner_id = "base"
+
+    @abstractmethod
+    async def submit(self, jsonl_path: str, display_name: str) -> str:
+        """Submit a JSONL job file (the backend takes ownership of it), return the job id"""
+
+    @abstractmethod
+    async def get_state(self, job_id: str) -> str:
+        """One of BATCH_STATE_*"""
+
+    @abstractmethod
+    async def fetch_results(self, job_id: str) -> List[Dict[str, Any]]:
+        """Parsed result lines (see parse_prediction_line)"""
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    In-process stand-in for a batch service.
+
+    Each submitted job runs as a background task that sends its requests one at a
+    time (max_concurrency) through the normal client, then writes a predictions
+    JSONL next to the job file.
+    """
+
+    name = "local"
+
+    def __init__(self, client, model_name: str, run_model_call, work_dir: str, max_concurrency: int = 1):
+        self.client = client
+        self.model_name = model_name
+        self.run_model_call = run_model_call
+        self.work_dir = work_dir
+        self.max_concurrency = max_concurrency
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # Jobs live in this process only
+        self.owner_id = f"local:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        os.makedirs(work_dir, exist_ok=True)
+
+    async def submit(self, jsonl_path: str, display_name: str) -> str:
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        output_path = os.path.join(self.work_dir, f"{job_id}.predictions.jsonl")
+        self._jobs[job_id] = {"state": BATCH_STATE_RUNNING, "output_path": output_path}
+        self._jobs[job_id]["task"] = asyncio.create_task(self._run_job(job_id, jsonl_path, output_path))
+        return job_id
+
+    async def _run_job(self, job_id: str, jsonl_path: str, output_path: str):
+        try:
+            with open(jsonl_path, encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            os.remove(jsonl_path)
+
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def run_line(line: Dict[str, Any]) -> Dict[str, Any]:
+                async with semaphore:
+                    try:
+                        response = await self.run_model_call(lambda: self._generate(line["request"]))
+                        usage = getattr(response, "usage_metadata", None)
+                        return {
+                            "request": line["request"],
+                            "response": {
+                                "candidates": [{"content": {"parts": [{"text": response.text or ""}]}}],
+                                "usageMetadata": {
+                                    "promptTokenCount": getattr(usage, "prompt_token_count", None),
+                                    "candidatesTokenCount": getattr(usage, "candidates_token_count", None),
+                                    "totalTokenCount": getattr(usage, "total_token_count", None)
+                                }
+                            }
+                        }
+                    except Exception as e:
+                        return {"request": line["request"], "status": str(e)}
+
+            results = await asyncio.gather(*[run_line(line) for line in lines])
+            write_jsonl(output_path, results)
+            self._jobs[job_id]["state"] = BATCH_STATE_SUCCEEDED
+        except Exception as e:
+            print(f"❌ Local batch job {job_id} failed: {e}")
+            self._jobs[job_id]["state"] = BATCH_STATE_FAILED
+
+    def _generate(self, request: Dict[str, Any]):
+        """Replay a REST GenerateContentRequest through the SDK client"""
+        parts = []
+        for part in request["contents"][0]["parts"]:
+            if "inline_data" in part:
+                parts.append(types.Part.from_bytes(
+                    data=base64.b64decode(part["inline_data"]["data"]),
+                    mime_type=part["inline_data"]["mime_type"]
+                ))
+            else:
+                parts.append(part.get("text", ""))
+
+        generation_config = dict(request.get("generation_config") or {})
+        thinking = generation_config.pop("thinking_config", None)
+        if thinking:
+            generation_config["thinking_config"] = types.ThinkingConfig(**thinking)
+        system_parts = (request.get("system_instruction") or {}).get("parts") or []
+        system_instruction = "".join(p.get("text", "") for p in system_parts) or None
+
+        return self.client.models.generate_content(
+            model=self.model_name,
+            contents=parts,
+            config=types.GenerateContentConfig(system_instruction=system_instruction, **generation_config)
+        )
+
+    async def get_state(self, job_id: str) -> str:
+        job = self._jobs.get(job_id)
+        return job["state"] if job else BATCH_STATE_UNKNOWN
+
+    async def fetch_results(self, job_id: str) -> List[Dict[str, Any]]:
+        job = self._jobs.pop(job_id)
+        with open(job["output_path"], encoding="utf-8") as f:
+            results = [parse_prediction_line(json.loads(line)) for line in f if line.strip()]
+        os.remove(job["output_path"])
+        return results
+
+
+class VertexBatchBackend(BatchBackend):
+    """
+    Vertex AI batch prediction.
+
+    The job file is uploaded to gs://<bucket>/<prefix>/<job>/input.jsonl and results
+    are read back from the job's output directory. Requires google-cloud-storage
+    (installed with firebase-admin) and a bucket the service account can write.
+    """
+
+    name = "vertex"
+
+    def __init__(self, client, model_name: str, executor, bucket: str, prefix: str = "ai-batch"):
+        if not bucket:
+            raise ValueError("AI_BATCH_GCS_BUCKET is required for the vertex batch backend")
+        from google.cloud import storage
+        self.client = client
+        self.model_name = model_name
+        self.executor = executor
+        self.bucket_name = bucket
+        self.prefix = prefix.strip("/")
+        self.storage = storage.Client()
+        # Jobs are visible to every worker using the same bucket and prefix
+        self.owner_id = f"vertex:{self.bucket_name}/{self.prefix}"
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _submit_sync(self, jsonl_path: str, display_name: str) -> str:
+        run_id = f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        bucket = self.storage.bucket(self.bucket_name)
+        blob = bucket.blob(f"{self.prefix}/{run_id}/input.jsonl")
+        blob.upload_from_filename(jsonl_path, content_type="application/jsonl")
+        os.remove(jsonl_path)
+        job = self.client.batches.create(
+            model=self.model_name,
+            src=f"gs://{self.bucket_name}/{blob.name}",
+            config=types.CreateBatchJobConfig(
+                display_name=display_name,
+                dest=f"gs://{self.bucket_name}/{self.prefix}/{run_id}/output"
+            )
+        )
+        return job.name
+
+    async def submit(self, jsonl_path: str, display_name: str) -> str:
+        return await self._run(self._submit_sync, jsonl_path, display_name)
+
+    async def get_state(self, job_id: str) -> str:
+        try:
+            job = await self._run(lambda: self.client.batches.get(name=job_id))
+        except Exception as e:
+            print(f"⚠️ Could not read batch job {job_id}: {e}")
+            return BATCH_STATE_UNKNOWN
+        state = str(getattr(job.state, "name", job.state))
+        if state == "JOB_STATE_SUCCEEDED":
+            return BATCH_STATE_SUCCEEDED
+        if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return BATCH_STATE_FAILED
+        return BATCH_STATE_RUNNING
+
+    def _fetch_sync(self, job_id: str) -> List[Dict[str, Any]]:
+        job = self.client.batches.get(name=job_id)
+        output_uri = job.dest.gcs_uri
+        path = output_uri[len(f"gs://{self.bucket_name}/"):].rstrip("/")
+        results = []
+        for blob in self.storage.list_blobs(self.bucket_name, prefix=path):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for raw in blob.download_as_text().splitlines():
+                if raw.strip():
+                    results.append(parse_prediction_line(json.loads(raw)))
+        return results
+
+    async def fetch_results(self, job_id: str) -> List[Dict[str, Any]]:
+        return await self._run(self._fetch_sync, job_id)
+
+
+def create_batch_backend(ai_service) -> BatchBackend:
+    """Build the backend selected by AI_BATCH_BACKEND (local | vertex)"""
+    backend_name = os.getenv("AI_BATCH_BACKEND", "local").lower()
+    if backend_name == "vertex":
+        return VertexBatchBackend(
+            ai_service.client,
+            ai_service.model_name,
+            ai_service.executor,
+            bucket=os.getenv("AI_BATCH_GCS_BUCKET", ""),
+            prefix=os.getenv("AI_BATCH_GCS_PREFIX", "ai-batch")
+        )
+    return LocalBatchBackend(
+        ai_service.client,
+        ai_service.model_name,
+        ai_service._run_model_call,
+        work_dir=os.getenv("AI_BATCH_WORK_DIR", os.path.join(tempfile.gettempdir(), "ai_batch_jobs"))
+    )
@@ -0,0 +1,179 @@
+"""
+AI Queue Scheduler
+Chooses which pending ai_analysis_queue items the processor dispatches next.
+
+Items are split into an interactive lane (uploads a doctor is waiting on) and a
+background lane (bulk requests such as /reports/batch-analyze). Within a lane,
+priority classes are served highest first and doctors are served round-robin
+inside each class, so one doctor's 200-report backlog cannot starve another
+doctor's fresh lab result. Per-lane queue depth and wait-time histograms are
+kept for the status endpoint.
+"""
+import bisect
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BACKGROUND)
+
+# Upper bounds (seconds) of the wait-time histogram buckets; the last bucket is +Inf
+WAIT_TIME_BUCKETS_SECONDS = (5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def queue_lane(item: Dict[str, Any]) -> str:
+    """Scheduler lane of a queue row (batch-lane rows are background work)"""
+    return LANE_INTERACTIVE if (item.get("lane") or LANE_INTERACTIVE) == LANE_INTERACTIVE else LANE_BACKGROUND
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class LaneMetrics:
+    """Queue depth gauge and cumulative wait-time histogram for one lane"""
+
+    def __init__(self):
+        self.depth = 0
+        self.max_depth = 0
+        self.dispatched = 0
+        self.wait_sum_seconds = 0.0
+        self.wait_counts = [0] * (len(WAIT_TIME_BUCKETS_SECONDS) + 1)
+
+    def observe_depth(self, depth: int) -> None:
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def observe_wait(self, seconds: float) -> None:
+        self.dispatched += 1
+        self.wait_sum_seconds += seconds
+        self.wait_counts[bisect.bisect_left(WAIT_TIME_BUCKETS_SECONDS, seconds)] += 1
+
+    def _quantile(self, q: float) -> Optional[float]:
+        """Bucket upper bound containing the q-quantile (None above the last bound)"""
+        if not self.dispatched:
+            return None
+        target = q * self.dispatched
+        running = 0
+        for bound, count in zip(WAIT_TIME_BUCKETS_SECONDS, self.wait_counts):
+            running += count
+            if running >= target:
+                return float(bound)
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        histogram = {}
+        running = 0
+        for bound, count in zip(WAIT_TIME_BUCKETS_SECONDS, self.wait_counts):
+            running += count
+            histogram[f"le_{bound}s"] = running
+        histogram["le_inf"] = self.dispatched
+
+        return {
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+            "dispatched": self.dispatched,
+            "avg_wait_seconds": round(self.wait_sum_seconds / self.dispatched, 2) if self.dispatched else None,
+            "p50_wait_seconds_le": self._quantile(0.5),
+            "p95_wait_seconds_le": self._quantile(0.95),
+            "wait_time_histogram": histogram
+        }
+
+
+class FairQueueScheduler:
+    """
+    Picks up to N items per dispatch from a window of pending candidates.
+
+    The interactive lane is served first, except that background_reserved_slots
+    are held back for the background lane whenever it has work and more than one
+    slot is free, so bulk work keeps moving. Slots a lane cannot use go to the
+    other lane. Round-robin order persists across dispatches: doctors served
+    least recently go first, ties broken by their oldest queued item.
+    """
+
+    def __init__(self, background_reserved_slots: int = 1):
+        self.background_reserved_slots = background_reserved_slots
+        self.metrics = {lane: LaneMetrics() for lane in LANES}
+        self._turn = 0
+        self._last_served: Dict[str, int] = {}
+
+    def plan(
+        self,
+        candidates: List[Dict[str, Any]],
+        slots: int,
+        lane_depths: Optional[Dict[str, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Choose the items to dispatch now.
+
+        Args:
+            candidates: Pending queue rows (ideally the first few per doctor and lane)
+            slots: How many items can be dispatched
+            lane_depths: Total pending per lane if known; defaults to the candidate counts
+        """
+        by_lane: Dict[str, List[Dict[str, Any]]] = {lane: [] for lane in LANES}
+        for item in candidates:
+            by_lane[queue_lane(item)].append(item)
+
+        for lane in LANES:
+            depth = (lane_depths or {}).get(lane, len(by_lane[lane]))
+            self.metrics[lane].observe_depth(depth)
+
+        reserved = 0
+        if slots > 1 and by_lane[LANE_BACKGROUND]:
+            reserved = min(self.background_reserved_slots, slots - 1)
+
+        selected = self._round_robin(by_lane[LANE_INTERACTIVE], slots - reserved)
+        selected += self._round_robin(by_lane[LANE_BACKGROUND], slots - len(selected))
+        if len(selected) < slots:
+            # Background lane had less than its share - give the rest back to interactive
+            chosen_ids = {item["id"] for item in selected}
+            remaining = [item for item in by_lane[LANE_INTERACTIVE] if item["id"] not in chosen_ids]
+            selected += self._round_robin(remaining, slots - len(selected))
+
+        now = datetime.now(timezone.utc)
+        for item in selected:
+            queued_at = _parse_timestamp(item.get("queued_at"))
+            if queued_at:
+                self.metrics[queue_lane(item)].observe_wait(max(0.0, (now - queued_at).total_seconds()))
+        return selected
+
+    def _round_robin(self, items: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """Highest priority class first, one item per doctor per round inside a class"""
+        if limit <= 0 or not items:
+            return []
+
+        classes: Dict[int, Dict[str, deque]] = {}
+        for item in sorted(items, key=lambda i: i.get("queued_at") or ""):
+            doctor_queues = classes.setdefault(item.get("priority") or 1, {})
+            doctor_queues.setdefault(item["doctor_firebase_uid"], deque()).append(item)
+
+        selected: List[Dict[str, Any]] = []
+        for priority in sorted(classes, reverse=True):
+            doctor_queues = classes[priority]
+            doctor_order = sorted(
+                doctor_queues,
+                key=lambda uid: (self._last_served.get(uid, 0), doctor_queues[uid][0].get("queued_at") or "")
+            )
+            while len(selected) < limit and doctor_order:
+                for uid in list(doctor_order):
+                    if len(selected) >= limit:
+                        break
+                    selected.append(doctor_queues[uid].popleft())
+                    self._turn += 1
+                    self._last_served[uid] = self._turn
+                    if not doctor_queues[uid]:
+                        doctor_order.remove(uid)
+            if len(selected) >= limit:
+                break
+        return selected
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "background_reserved_slots": self.background_reserved_slots,
+            "lanes": {lane: metrics.snapshot() for lane, metrics in self.metrics.items()}
+        }
@@ -0,0 +1,91 @@
+"""
+AI Analysis Retry Policy
+Classifies analysis failures and decides whether a queue item is retried (and
+when) or closed. Transient errors back off exponentially with jitter per error
+class; items that keep failing go to the dead_letter status instead of being
+retried forever. Permanent errors (missing data, unsupported documents) fail
+immediately.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+
+# Error classes recorded in ai_analysis_queue.last_error_class
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_TIMEOUT = "timeout"
+ERROR_DOWNLOAD = "download"
+ERROR_SERVER = "server"
+ERROR_STORAGE = "storage"
+ERROR_MISSING_DATA = "missing_data"
+ERROR_INVALID_INPUT = "invalid_input"
+ERROR_UNKNOWN = "unknown"
+
+# base/max backoff in seconds; non-retryable classes fail on the first attempt
+RETRY_POLICIES: Dict[str, Dict[str, Any]] = {
+    ERROR_RATE_LIMIT: {"retryable": True, "base_seconds": 60, "max_seconds": 1800},
+    ERROR_TIMEOUT: {"retryable": True, "base_seconds": 30, "max_seconds": 900},
+    ERROR_DOWNLOAD: {"retryable": True, "base_seconds": 30, "max_seconds": 1800},
+    ERROR_SERVER: {"retryable": True, "base_seconds": 30, "max_seconds": 900},
+    ERROR_STORAGE: {"retryable": True, "base_seconds": 10, "max_seconds": 300},
+    ERROR_UNKNOWN: {"retryable": True, "base_seconds": 120, "max_seconds": 3600},
+    ERROR_MISSING_DATA: {"retryable": False},
+    ERROR_INVALID_INPUT: {"retryable": False},
+}
+
+# Matched against the lower-cased error message, first match wins
+_ERROR_PATTERNS = (
+    (ERROR_RATE_LIMIT, ("429", "resource exhausted", "resource_exhausted", "rate limit", "quota")),
+    (ERROR_TIMEOUT, ("timeout", "timed out", "deadline", "504")),
+    (ERROR_DOWNLOAD, ("download",)),
+    (ERROR_SERVER, ("500", "502", "503", "unavailable", "internal error", "overloaded", "connection")),
+    (ERROR_STORAGE, ("save analysis", "database")),
+    (ERROR_MISSING_DATA, ("missing required data", "not found")),
+    (ERROR_INVALID_INPUT, ("unable to process document", "unsupported", "invalid argument", "invalid_argument", "safety")),
+)
+
+
+def classify_error(error: Any) -> str:
+    """Map an exception or error message to one of the ERROR_* classes"""
+    if error is None:
+        return ERROR_UNKNOWN
+    message = str(error).lower()
+    for error_class, patterns in _ERROR_PATTERNS:
+        if any(pattern in message for pattern in patterns):
+            return error_class
+    return ERROR_UNKNOWN
+
+
+def backoff_seconds(error_class: str, attempts: int) -> float:
+    """
+    Delay before the next attempt after `attempts` failures.
+
+    Exponential in the attempt count, capped per class, with "equal jitter"
+    (half fixed, half random) so items that failed together spread out.
+    """
+    policy = RETRY_POLICIES.get(error_class, RETRY_POLICIES[ERROR_UNKNOWN])
+    if not policy["retryable"]:
+        return 0.0
+    ceiling = min(policy["max_seconds"], policy["base_seconds"] * (2 ** max(0, attempts - 1)))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def plan_retry(error: Any, attempts: int, max_attempts: int) -> Dict[str, Any]:
+    """
+    Decide what happens to a queue item that just failed its attempts-th attempt.
+
+    Returns:
+        {"action": "retry" | "dead_letter" | "fail", "error_class", "next_attempt_at"}
+    """
+    error_class = classify_error(error)
+    policy = RETRY_POLICIES.get(error_class, RETRY_POLICIES[ERROR_UNKNOWN])
+
+    if not policy["retryable"]:
+        return {"action": "fail", "error_class": error_class, "next_attempt_at": None}
+    if attempts >= max_attempts:
+        return {"action": "dead_letter", "error_class": error_class, "next_attempt_at": None}
+
+    next_attempt_at: Optional[datetime] = datetime.now(timezone.utc) + timedelta(
+        seconds=backoff_seconds(error_class, attempts)
+    )
+    return {"action": "retry", "error_class": error_class, "next_attempt_at": next_attempt_at}
@@ -9,10 +9,15 @@ Part of Phase 1: Foundation Fixes (1.2 Add Critical Findings Alert System)
 """
 
 import logging
+import re
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Set
 from enum import Enum
 
+from optimized_cache import optimized_cache
+from push_channel import push_hub, EVENT_ALERTS_CREATED, EVENT_ALERTS_ACKNOWLEDGED, alert_event_rows
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,6 +38,211 @@ class AlertSeverity(Enum):
     LOW = "low"
 
 
+# Keywords indicating critical findings
+CRITICAL_KEYWORDS = [
+    "critical", "urgent", "emergency", "immediate attention",
+    "life-threatening", "severe", "danger", "acute",
+    "malignant", "carcinoma", "cancer", "tumor mass",
+    "fracture", "hemorrhage", "bleeding", "infarction",
+    "sepsis", "shock", "respiratory failure", "cardiac arrest",
+    "stroke", "myocardial infarction", "pulmonary embolism"
+]
+
+# Every keyword family looked for in a finding's text
+KEYWORD_FAMILIES: Dict[str, List[str]] = {
+    "critical": CRITICAL_KEYWORDS,
+    AlertSeverity.HIGH.value: [
+        "life-threatening", "emergency", "immediate", "critical",
+        "severe", "acute", "cardiac arrest", "stroke", "hemorrhage"
+    ],
+    AlertSeverity.MEDIUM.value: [
+        "urgent", "concerning", "abnormal", "elevated", "decreased",
+        "warrants attention", "monitor closely"
+    ],
+    AlertType.DRUG_INTERACTION.value: ["interaction", "contraindicated", "avoid"],
+    AlertType.DIAGNOSIS_CONCERN.value: ["malignant", "cancer", "tumor", "carcinoma", "suspicious"],
+    AlertType.FOLLOW_UP_URGENT.value: ["follow-up", "follow up", "review", "recheck"],
+    AlertType.SAFETY_CONCERN.value: ["safety", "fall risk", "allergy", "adverse"],
+    AlertType.TREATMENT_ALERT.value: ["treatment", "therapy", "medication", "dose"],
+    "treatment_concern": [
+        "contraindicated", "adverse", "allergic", "interaction",
+        "discontinue", "avoid", "dangerous", "risk"
+    ],
+}
+
+# Alert types in the order _determine_alert_type tries them
+ALERT_TYPE_PRECEDENCE = (
+    AlertType.DRUG_INTERACTION.value,
+    AlertType.DIAGNOSIS_CONCERN.value,
+    AlertType.FOLLOW_UP_URGENT.value,
+    AlertType.SAFETY_CONCERN.value,
+    AlertType.TREATMENT_ALERT.value,
+)
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Regex for a set of literals, factored as a prefix trie (longest match first)"""
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordFamilyMatcher:
+    """
+    Finds every keyword family present in a text with one compiled regex.
+    
+    The keywords of all families are compiled into a single prefix-trie regex, so
+    the text is scanned once instead of once per keyword per family. Matches are
+    leftmost-longest and do not overlap; a keyword nested inside a longer one
+    ("infarction" in "myocardial infarction") is credited through the longer one,
+    which keeps the old substring semantics.
+    """
+    
+    def __init__(self, families: Dict[str, List[str]]):
+        keyword_families: Dict[str, Set[str]] = {}
+        for family, keywords in families.items():
+            for keyword in keywords:
+                keyword_families.setdefault(keyword.lower(), set()).add(family)
+        
+        self.families = {
+            keyword: frozenset().union(*(
+                keyword_families[nested] for nested in keyword_families if nested in keyword
+            ))
+            for keyword in keyword_families
+        }
+        self.pattern = re.compile(_trie_pattern(list(keyword_families)))
+    
+    def match(self, text: str) -> FrozenSet[str]:
+        """Families with at least one keyword in text (expects lower-cased text)"""
+        hits: Set[str] = set()
+        for keyword in self.pattern.findall(text):
+            hits.update(self.families[keyword])
+        return frozenset(hits)
+
+
+KEYWORD_MATCHER = KeywordFamilyMatcher(KEYWORD_FAMILIES)
+
+
+# Critical value ranges, keyed by normalized parameter name
+CRITICAL_VALUE_RANGES: Dict[str, Dict[str, Any]] = {
+    # Lab value patterns
+    "hemoglobin": {"low": 7.0, "high": 18.0, "unit": "g/dL"},
+    "hb": {"low": 7.0, "high": 18.0, "unit": "g/dL"},
+    "wbc": {"low": 2000, "high": 30000, "unit": "/μL"},
+    "platelet": {"low": 50000, "high": 500000, "unit": "/μL"},
+    "creatinine": {"low": 0.4, "high": 4.0, "unit": "mg/dL"},
+    "potassium": {"low": 2.5, "high": 6.5, "unit": "mEq/L"},
+    "sodium": {"low": 120, "high": 160, "unit": "mEq/L"},
+    "glucose": {"low": 40, "high": 500, "unit": "mg/dL"},
+    "blood sugar": {"low": 40, "high": 500, "unit": "mg/dL"},
+    "bp systolic": {"low": 80, "high": 180, "unit": "mmHg"},
+    "bp diastolic": {"low": 50, "high": 120, "unit": "mmHg"},
+    "inr": {"low": 0.5, "high": 4.5, "unit": ""},
+    "troponin": {"low": 0, "high": 0.04, "unit": "ng/mL"},
+}
+
+# Other spellings AI analyses use for the same parameters
+PARAMETER_ALIASES: Dict[str, str] = {
+    "haemoglobin": "hemoglobin",
+    "hgb": "hemoglobin",
+    "white blood cells": "wbc",
+    "white blood cell count": "wbc",
+    "total leukocyte count": "wbc",
+    "tlc": "wbc",
+    "platelets": "platelet",
+    "plt": "platelet",
+    "blood glucose": "glucose",
+    "fbs": "glucose",
+    "rbs": "glucose",
+    "ppbs": "glucose",
+    "systolic": "bp systolic",
+    "systolic bp": "bp systolic",
+    "systolic blood pressure": "bp systolic",
+    "diastolic": "bp diastolic",
+    "diastolic bp": "bp diastolic",
+    "diastolic blood pressure": "bp diastolic",
+}
+
+
+def normalize_parameter_name(parameter: str) -> str:
+    """'Serum Creatinine (mg/dL)' -> 'serum creatinine', 'BP_Systolic' -> 'bp systolic'"""
+    parameter = re.sub(r"\([^)]*\)|\[[^\]]*\]", " ", parameter.lower())
+    return " ".join(re.findall(r"[a-z0-9]+", parameter))
+
+
+PARAMETER_RANGE_TABLE: Dict[str, Dict[str, Any]] = {
+    **{normalize_parameter_name(name): ranges for name, ranges in CRITICAL_VALUE_RANGES.items()},
+    **{alias: CRITICAL_VALUE_RANGES[name] for alias, name in PARAMETER_ALIASES.items()},
+}
+
+
+@lru_cache(maxsize=1024)
+def critical_range_for(parameter: str) -> Optional[Dict[str, Any]]:
+    """
+    Critical range for a finding's parameter name, or None.
+    
+    The normalized name is looked up whole, then its word n-grams longest first,
+    so qualifiers ("Serum Potassium", "Fasting Blood Sugar") still resolve while
+    unrelated names that merely contain a short key ("HbA1c") do not.
+    """
+    words = normalize_parameter_name(parameter).split()
+    for size in range(len(words), 0, -1):
+        for start in range(len(words) - size + 1):
+            ranges = PARAMETER_RANGE_TABLE.get(" ".join(words[start:start + size]))
+            if ranges is not None:
+                return ranges
+    return None
+
+
+# Severities an alert row can carry (see migrations/001_add_clinical_alerts.sql)
+ALERT_SEVERITY_LEVELS = ("critical", "urgent", "high", "medium", "low")
+
+
+def alert_cache_keys(doctor_firebase_uid: str, patient_ids: Any = ()) -> List[str]:
+    """Every cached alert list / count key made stale by an alert write for these patients"""
+    keys = [f"alert_counts:{doctor_firebase_uid}", f"alerts_doctor:{doctor_firebase_uid}"]
+    keys += [f"alerts_doctor:{doctor_firebase_uid}:{severity}" for severity in ALERT_SEVERITY_LEVELS]
+    for patient_id in {pid for pid in patient_ids if pid is not None}:
+        keys += [f"alert_counts:{doctor_firebase_uid}:{patient_id}", f"alerts_patient:{patient_id}:{doctor_firebase_uid}"]
+        keys += [f"alerts_patient:{patient_id}:{doctor_firebase_uid}:{severity}" for severity in ALERT_SEVERITY_LEVELS]
+    return keys
+
+
+async def invalidate_alert_caches(doctor_firebase_uid: str, patient_ids: Any = ()) -> None:
+    for key in alert_cache_keys(doctor_firebase_uid, patient_ids):
+        await optimized_cache.delete(key)
+
+
+async def fetch_alert_counts(supabase_client, doctor_firebase_uid: str, patient_id: Optional[int] = None) -> Dict[str, int]:
+    """
+    Open-alert counts by severity from ai_alert_counters (one row, maintained by a
+    trigger - migrations/024_alert_counters.sql). patient_id=None reads the
+    doctor-wide row. Raises if the counters table is not available.
+    """
+    response = await supabase_client.table("ai_alert_counters") \
+        .select("critical_count, urgent_count, high_count, medium_count, low_count, total_count") \
+        .eq("doctor_firebase_uid", doctor_firebase_uid) \
+        .eq("patient_id", patient_id or 0) \
+        .limit(1) \
+        .execute()
+    row = response.data[0] if response.data else {}
+    counts = {severity: row.get(f"{severity}_count") or 0 for severity in ALERT_SEVERITY_LEVELS}
+    counts["total"] = row.get("total_count") or 0
+    return counts
+
+
 class ClinicalAlertService:
     """
     Service for managing clinical alerts from AI analysis.
@@ -53,33 +263,9 @@ class ClinicalAlertService:
         """
         self.supabase = supabase_client
         
-        # Critical value patterns to detect
-        self.critical_patterns = {
-            # Lab value patterns
-            "hemoglobin": {"low": 7.0, "high": 18.0, "unit": "g/dL"},
-            "hb": {"low": 7.0, "high": 18.0, "unit": "g/dL"},
-            "wbc": {"low": 2000, "high": 30000, "unit": "/μL"},
-            "platelet": {"low": 50000, "high": 500000, "unit": "/μL"},
-            "creatinine": {"low": 0.4, "high": 4.0, "unit": "mg/dL"},
-            "potassium": {"low": 2.5, "high": 6.5, "unit": "mEq/L"},
-            "sodium": {"low": 120, "high": 160, "unit": "mEq/L"},
-            "glucose": {"low": 40, "high": 500, "unit": "mg/dL"},
-            "blood sugar": {"low": 40, "high": 500, "unit": "mg/dL"},
-            "bp_systolic": {"low": 80, "high": 180, "unit": "mmHg"},
-            "bp_diastolic": {"low": 50, "high": 120, "unit": "mmHg"},
-            "inr": {"low": 0.5, "high": 4.5, "unit": ""},
-            "troponin": {"low": 0, "high": 0.04, "unit": "ng/mL"},
-        }
-        
-        # Keywords indicating critical findings
-        self.critical_keywords = [
-            "critical", "urgent", "emergency", "immediate attention",
-            "life-threatening", "severe", "danger", "acute",
-            "malignant", "carcinoma", "cancer", "tumor mass",
-            "fracture", "hemorrhage", "bleeding", "infarction",
-            "sepsis", "shock", "respiratory failure", "cardiac arrest",
-            "stroke", "myocardial infarction", "pulmonary embolism"
-        ]
+        # Critical value patterns and keywords (compiled at module import)
+        self.critical_patterns = CRITICAL_VALUE_RANGES
+        self.critical_keywords = CRITICAL_KEYWORDS
     
     async def process_analysis_for_alerts(
         self,
@@ -111,42 +297,47 @@ class ClinicalAlertService:
             # Also check findings for critical values
             findings = analysis_data.get("findings", [])
             
+            # Build every alert row in memory first, then write them in one call
+            alert_rows = []
+            
             # Process explicit critical findings
             for finding in critical_findings:
-                alert = await self._create_alert_from_critical_finding(
+                alert_rows.append(self._build_alert_from_critical_finding(
                     finding=finding,
                     analysis_id=analysis_id,
                     patient_id=patient_id,
                     doctor_firebase_uid=doctor_firebase_uid,
                     visit_id=visit_id
-                )
-                if alert:
-                    alerts_created.append(alert)
+                ))
             
-            # Check regular findings for critical values
+            # Check regular findings for critical values (keyword scan once per finding)
             for finding in findings:
-                if self._is_critical_finding(finding):
-                    alert = await self._create_alert_from_finding(
+                families = self._keyword_families(finding)
+                if self._is_critical_finding(finding, families):
+                    alert_rows.append(self._build_alert_from_finding(
                         finding=finding,
                         analysis_id=analysis_id,
                         patient_id=patient_id,
                         doctor_firebase_uid=doctor_firebase_uid,
-                        visit_id=visit_id
-                    )
-                    if alert:
-                        alerts_created.append(alert)
+                        visit_id=visit_id,
+                        families=families
+                    ))
             
             # Check treatment evaluation for concerns
             treatment_eval = analysis_data.get("treatment_evaluation", {})
             if treatment_eval:
-                treatment_alerts = await self._check_treatment_alerts(
+                alert_rows.extend(self._build_treatment_alerts(
                     treatment_eval=treatment_eval,
                     analysis_id=analysis_id,
                     patient_id=patient_id,
                     doctor_firebase_uid=doctor_firebase_uid,
                     visit_id=visit_id
-                )
-                alerts_created.extend(treatment_alerts)
+                ))
+            
+            alert_rows = await self._deduplicate_alerts(
+                [row for row in alert_rows if row], patient_id, doctor_firebase_uid
+            )
+            alerts_created = await self._insert_alerts(alert_rows, patient_id, doctor_firebase_uid)
             
             logger.info(
                 f"Processed analysis {analysis_id}: created {len(alerts_created)} alerts"
@@ -157,88 +348,141 @@ class ClinicalAlertService:
         
         return alerts_created
     
-    def _is_critical_finding(self, finding: Dict[str, Any]) -> bool:
+    @staticmethod
+    def _alert_key(alert: Dict[str, Any]) -> tuple:
+        """Identity of an alert for deduplication"""
+        return (alert.get("alert_type"), (alert.get("title") or "").strip().lower())
+    
+    async def _deduplicate_alerts(
+        self,
+        alert_rows: List[Dict[str, Any]],
+        patient_id: str,
+        doctor_firebase_uid: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Drop alerts that repeat each other or an alert the doctor has not
+        acknowledged yet for this patient (one lookup for the whole batch).
+        """
+        if not alert_rows:
+            return []
+        
+        existing_keys = set()
+        try:
+            result = await self.supabase.table("ai_clinical_alerts") \
+                .select("alert_type, title") \
+                .eq("doctor_firebase_uid", doctor_firebase_uid) \
+                .eq("patient_id", patient_id) \
+                .eq("is_acknowledged", False) \
+                .execute()
+            existing_keys = {self._alert_key(alert) for alert in (result.data or [])}
+        except Exception as e:
+            logger.warning(f"Could not load existing alerts for deduplication: {e}")
+        
+        unique_rows = []
+        for row in alert_rows:
+            key = self._alert_key(row)
+            if key in existing_keys:
+                continue
+            existing_keys.add(key)
+            unique_rows.append(row)
+        
+        skipped = len(alert_rows) - len(unique_rows)
+        if skipped:
+            logger.info(f"Skipped {skipped} duplicate alerts for patient {patient_id}")
+        return unique_rows
+    
+    async def _insert_alerts(
+        self,
+        alert_rows: List[Dict[str, Any]],
+        patient_id: str,
+        doctor_firebase_uid: str
+    ) -> List[Dict[str, Any]]:
+        """Insert alert rows in a single call and invalidate the doctor's alert caches once"""
+        if not alert_rows:
+            return []
+        
+        try:
+            result = await self.supabase.table("ai_clinical_alerts").insert(alert_rows).execute()
+            created = result.data or []
+        except Exception as e:
+            # A bulk insert is all-or-nothing; retry row by row so one bad row doesn't drop the rest
+            logger.warning(f"Bulk alert insert failed, inserting individually: {e}")
+            created = []
+            for row in alert_rows:
+                try:
+                    result = await self.supabase.table("ai_clinical_alerts").insert(row).execute()
+                    created.extend(result.data or [])
+                except Exception as row_error:
+                    logger.error(f"Error creating alert '{row.get('title', '')[:50]}': {row_error}")
+        
+        if created:
+            logger.info(f"Created {len(created)} alerts for patient {patient_id}")
+            await invalidate_alert_caches(doctor_firebase_uid, [patient_id])
+            await push_hub.publish(doctor_firebase_uid, EVENT_ALERTS_CREATED, {
+                "patient_id": patient_id,
+                "alerts": alert_event_rows(created)
+            })
+        
+        return created
+    
+    def _keyword_families(self, finding: Any) -> FrozenSet[str]:
+        """Keyword families present anywhere in a finding (stringified once)"""
+        return KEYWORD_MATCHER.match(str(finding).lower())
+    
+    def _is_critical_finding(self, finding: Dict[str, Any], families: Optional[FrozenSet[str]] = None) -> bool:
         """Check if a finding should be considered critical."""
         # Check for explicit critical flag
         if finding.get("is_critical", False):
             return True
         
         # Check the text content for critical keywords
-        finding_text = str(finding).lower()
-        for keyword in self.critical_keywords:
-            if keyword in finding_text:
-                return True
+        if families is None:
+            families = self._keyword_families(finding)
+        if "critical" in families:
+            return True
         
         # Check for out-of-range values
         value = finding.get("value")
-        parameter = finding.get("parameter", "").lower()
+        parameter = finding.get("parameter", "")
         
         if value is not None and parameter:
-            for param_name, ranges in self.critical_patterns.items():
-                if param_name in parameter:
-                    try:
-                        numeric_value = float(str(value).replace(",", ""))
-                        if numeric_value < ranges["low"] or numeric_value > ranges["high"]:
-                            return True
-                    except (ValueError, TypeError):
-                        pass
+            ranges = critical_range_for(str(parameter))
+            if ranges:
+                try:
+                    numeric_value = float(str(value).replace(",", ""))
+                    if numeric_value < ranges["low"] or numeric_value > ranges["high"]:
+                        return True
+                except (ValueError, TypeError):
+                    pass
         
         return False
     
-    def _determine_severity(self, finding: Dict[str, Any]) -> str:
+    def _determine_severity(self, finding: Dict[str, Any], families: Optional[FrozenSet[str]] = None) -> str:
         """Determine the severity level of a finding."""
-        finding_text = str(finding).lower()
-        
-        # High severity keywords
-        high_severity = [
-            "life-threatening", "emergency", "immediate", "critical",
-            "severe", "acute", "cardiac arrest", "stroke", "hemorrhage"
-        ]
+        if families is None:
+            families = self._keyword_families(finding)
         
-        # Medium severity keywords
-        medium_severity = [
-            "urgent", "concerning", "abnormal", "elevated", "decreased",
-            "warrants attention", "monitor closely"
-        ]
+        if AlertSeverity.HIGH.value in families:
+            return AlertSeverity.HIGH.value
         
-        for keyword in high_severity:
-            if keyword in finding_text:
-                return AlertSeverity.HIGH.value
-        
-        for keyword in medium_severity:
-            if keyword in finding_text:
-                return AlertSeverity.MEDIUM.value
+        if AlertSeverity.MEDIUM.value in families:
+            return AlertSeverity.MEDIUM.value
         
         return AlertSeverity.LOW.value
     
-    def _determine_alert_type(self, finding: Dict[str, Any]) -> str:
+    def _determine_alert_type(self, finding: Dict[str, Any], families: Optional[FrozenSet[str]] = None) -> str:
         """Determine the type of alert based on the finding content."""
-        finding_text = str(finding).lower()
-        
-        # Drug interaction patterns
-        if any(word in finding_text for word in ["interaction", "contraindicated", "avoid"]):
-            return AlertType.DRUG_INTERACTION.value
-        
-        # Diagnosis concern patterns
-        if any(word in finding_text for word in ["malignant", "cancer", "tumor", "carcinoma", "suspicious"]):
-            return AlertType.DIAGNOSIS_CONCERN.value
+        if families is None:
+            families = self._keyword_families(finding)
         
-        # Follow-up urgency
-        if any(word in finding_text for word in ["follow-up", "follow up", "review", "recheck"]):
-            return AlertType.FOLLOW_UP_URGENT.value
-        
-        # Safety concerns
-        if any(word in finding_text for word in ["safety", "fall risk", "allergy", "adverse"]):
-            return AlertType.SAFETY_CONCERN.value
-        
-        # Treatment alerts
-        if any(word in finding_text for word in ["treatment", "therapy", "medication", "dose"]):
-            return AlertType.TREATMENT_ALERT.value
+        for alert_type in ALERT_TYPE_PRECEDENCE:
+            if alert_type in families:
+                return alert_type
         
         # Default to critical value
         return AlertType.CRITICAL_VALUE.value
     
-    async def _create_alert_from_critical_finding(
+    def _build_alert_from_critical_finding(
         self,
         finding: Dict[str, Any],
         analysis_id: str,
@@ -246,8 +490,10 @@ class ClinicalAlertService:
         doctor_firebase_uid: str,
         visit_id: Optional[str]
     ) -> Optional[Dict[str, Any]]:
-        """Create an alert from an explicitly critical finding."""
+        """Build the alert row for an explicitly critical finding."""
         try:
+            families = self._keyword_families(finding)
+            
             # Build alert title and message
             title = finding.get("finding", "Critical Finding Detected")[:200]
             message = finding.get("clinical_significance", finding.get("description", ""))
@@ -261,8 +507,8 @@ class ClinicalAlertService:
                 "doctor_firebase_uid": doctor_firebase_uid,
                 "visit_id": visit_id,
                 "analysis_id": analysis_id,
-                "alert_type": self._determine_alert_type(finding),
-                "severity": self._determine_severity(finding),
+                "alert_type": self._determine_alert_type(finding, families),
+                "severity": self._determine_severity(finding, families),
                 "title": title,
                 "message": message[:2000] if message else "Critical finding detected",
                 "finding_data": finding,
@@ -270,26 +516,23 @@ class ClinicalAlertService:
                 "created_at": datetime.utcnow().isoformat()
             }
             
-            result = self.supabase.table("ai_clinical_alerts").insert(alert_data).execute()
-            
-            if result.data:
-                logger.info(f"Created critical alert for patient {patient_id}: {title[:50]}")
-                return result.data[0]
+            return alert_data
             
         except Exception as e:
-            logger.error(f"Error creating alert from critical finding: {e}")
+            logger.error(f"Error building alert from critical finding: {e}")
         
         return None
     
-    async def _create_alert_from_finding(
+    def _build_alert_from_finding(
         self,
         finding: Dict[str, Any],
         analysis_id: str,
         patient_id: str,
         doctor_firebase_uid: str,
-        visit_id: Optional[str]
+        visit_id: Optional[str],
+        families: Optional[FrozenSet[str]] = None
     ) -> Optional[Dict[str, Any]]:
-        """Create an alert from a finding that was detected as critical."""
+        """Build the alert row for a finding that was detected as critical."""
         try:
             parameter = finding.get("parameter", "Unknown Parameter")
             value = finding.get("value", "N/A")
@@ -308,7 +551,7 @@ class ClinicalAlertService:
                 "visit_id": visit_id,
                 "analysis_id": analysis_id,
                 "alert_type": AlertType.CRITICAL_VALUE.value,
-                "severity": self._determine_severity(finding),
+                "severity": self._determine_severity(finding, families),
                 "title": title[:200],
                 "message": message[:2000],
                 "finding_data": finding,
@@ -316,18 +559,14 @@ class ClinicalAlertService:
                 "created_at": datetime.utcnow().isoformat()
             }
             
-            result = self.supabase.table("ai_clinical_alerts").insert(alert_data).execute()
-            
-            if result.data:
-                logger.info(f"Created value alert for patient {patient_id}: {title}")
-                return result.data[0]
+            return alert_data
             
         except Exception as e:
-            logger.error(f"Error creating alert from finding: {e}")
+            logger.error(f"Error building alert from finding: {e}")
         
         return None
     
-    async def _check_treatment_alerts(
+    def _build_treatment_alerts(
         self,
         treatment_eval: Dict[str, Any],
         analysis_id: str,
@@ -335,7 +574,7 @@ class ClinicalAlertService:
         doctor_firebase_uid: str,
         visit_id: Optional[str]
     ) -> List[Dict[str, Any]]:
-        """Check treatment evaluation for alerts."""
+        """Build alert rows for treatment evaluation concerns and interactions."""
         alerts = []
         
         try:
@@ -350,10 +589,7 @@ class ClinicalAlertService:
                     severity = "medium"
                 
                 # Only create alerts for significant concerns
-                if any(word in concern_text.lower() for word in [
-                    "contraindicated", "adverse", "allergic", "interaction",
-                    "discontinue", "avoid", "dangerous", "risk"
-                ]):
+                if "treatment_concern" in KEYWORD_MATCHER.match(concern_text.lower()):
                     alert_data = {
                         "patient_id": patient_id,
                         "doctor_firebase_uid": doctor_firebase_uid,
@@ -368,9 +604,7 @@ class ClinicalAlertService:
                         "created_at": datetime.utcnow().isoformat()
                     }
                     
-                    result = self.supabase.table("ai_clinical_alerts").insert(alert_data).execute()
-                    if result.data:
-                        alerts.append(result.data[0])
+                    alerts.append(alert_data)
             
             # Check medication interactions
             interactions = treatment_eval.get("medication_interactions", [])
@@ -400,9 +634,7 @@ class ClinicalAlertService:
                     "created_at": datetime.utcnow().isoformat()
                 }
                 
-                result = self.supabase.table("ai_clinical_alerts").insert(alert_data).execute()
-                if result.data:
-                    alerts.append(result.data[0])
+                alerts.append(alert_data)
                     
         except Exception as e:
             logger.error(f"Error checking treatment alerts: {e}")
@@ -442,7 +674,7 @@ class ClinicalAlertService:
             if severity:
                 query = query.eq("severity", severity)
             
-            result = query.execute()
+            result = await query.execute()
             return result.data or []
             
         except Exception as e:
@@ -451,54 +683,24 @@ class ClinicalAlertService:
     
     async def get_alert_counts(
         self,
-        doctor_firebase_uid: str
+        doctor_firebase_uid: str,
+        patient_id: Optional[int] = None
     ) -> Dict[str, int]:
         """
-        Get counts of alerts by severity for a doctor.
+        Get counts of open alerts by severity for a doctor (or one of their patients).
         
         Args:
             doctor_firebase_uid: The doctor's Firebase UID
+            patient_id: Optional patient to count for
             
         Returns:
             Dictionary with counts by severity
         """
         try:
-            # Use the database function if available, otherwise count manually
-            result = self.supabase.rpc(
-                "get_alert_counts",
-                {"p_doctor_firebase_uid": doctor_firebase_uid}
-            ).execute()
-            
-            if result.data and len(result.data) > 0:
-                counts = result.data[0]
-                return {
-                    "high": counts.get("high_count", 0),
-                    "medium": counts.get("medium_count", 0),
-                    "low": counts.get("low_count", 0),
-                    "total": counts.get("total_count", 0)
-                }
-            
-        except Exception as e:
-            logger.warning(f"Error using get_alert_counts RPC, falling back to manual count: {e}")
-        
-        # Fallback: manual counting
-        try:
-            alerts = await self.get_unacknowledged_alerts(
-                doctor_firebase_uid=doctor_firebase_uid,
-                limit=1000
-            )
-            
-            counts = {"high": 0, "medium": 0, "low": 0, "total": 0}
-            for alert in alerts:
-                severity = alert.get("severity", "low")
-                counts[severity] = counts.get(severity, 0) + 1
-                counts["total"] += 1
-            
-            return counts
-            
+            return await fetch_alert_counts(self.supabase, doctor_firebase_uid, patient_id)
         except Exception as e:
-            logger.error(f"Error getting alert counts: {e}")
-            return {"high": 0, "medium": 0, "low": 0, "total": 0}
+            logger.error(f"Error reading alert counters: {e}")
+            return {**{severity: 0 for severity in ALERT_SEVERITY_LEVELS}, "total": 0}
     
     async def acknowledge_alert(
         self,
@@ -527,13 +729,21 @@ class ClinicalAlertService:
             if notes:
                 update_data["acknowledgment_notes"] = notes
             
-            result = self.supabase.table("ai_clinical_alerts") \
+            result = await self.supabase.table("ai_clinical_alerts") \
                 .update(update_data) \
                 .eq("id", alert_id) \
                 .eq("doctor_firebase_uid", doctor_firebase_uid) \
                 .execute()
             
-            return len(result.data) > 0 if result.data else False
+            if not result.data:
+                return False
+            
+            await invalidate_alert_caches(doctor_firebase_uid, [row.get("patient_id") for row in result.data])
+            await push_hub.publish(doctor_firebase_uid, EVENT_ALERTS_ACKNOWLEDGED, {
+                "patient_id": result.data[0].get("patient_id"),
+                "alerts": alert_event_rows(result.data)
+            })
+            return True
             
         except Exception as e:
             logger.error(f"Error acknowledging alert {alert_id}: {e}")
@@ -561,14 +771,21 @@ class ClinicalAlertService:
                 "acknowledged_by": doctor_firebase_uid
             }
             
-            result = self.supabase.table("ai_clinical_alerts") \
+            result = await self.supabase.table("ai_clinical_alerts") \
                 .update(update_data) \
                 .eq("patient_id", patient_id) \
                 .eq("doctor_firebase_uid", doctor_firebase_uid) \
                 .eq("is_acknowledged", False) \
                 .execute()
             
-            return len(result.data) if result.data else 0
+            count = len(result.data) if result.data else 0
+            if count:
+                await invalidate_alert_caches(doctor_firebase_uid, [patient_id])
+                await push_hub.publish(doctor_firebase_uid, EVENT_ALERTS_ACKNOWLEDGED, {
+                    "patient_id": patient_id,
+                    "alerts": alert_event_rows(result.data)
+                })
+            return count
             
         except Exception as e:
             logger.error(f"Error acknowledging alerts for patient {patient_id}: {e}")
@@ -606,7 +823,7 @@ class ClinicalAlertService:
             if not include_acknowledged:
                 query = query.eq("is_acknowledged", False)
             
-            result = query.execute()
+            result = await query.execute()
             return result.data or []
             
         except Exception as e:
@@ -629,7 +846,7 @@ class ClinicalAlertService:
             List of alert records for the visit
         """
         try:
-            result = self.supabase.table("ai_clinical_alerts") \
+            result = await self.supabase.table("ai_clinical_alerts") \
                 .select("*") \
                 .eq("visit_id", visit_id) \
                 .eq("doctor_firebase_uid", doctor_firebase_uid) \
@@ -663,3 +880,36 @@ def get_alert_service(supabase_client) -> ClinicalAlertService:
         _alert_service_instance = ClinicalAlertService(supabase_client)
     
     return _alert_service_instance
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: per-method keyword loops (previous implementation) vs one compiled scan
+    import timeit
+
+    finding = {
+        "parameter": "Serum Potassium",
+        "value": "5.9",
+        "unit": "mEq/L",
+        "status": "high",
+        "reference_range": "3.5-5.1",
+        "interpretation": "Mildly elevated potassium, likely haemolysed sample; correlate with ECG",
+        "clinical_significance": "Recheck within 24 hours and review ACE inhibitor dose"
+    }
+
+    def _keyword_loops():
+        # _is_critical_finding, _determine_severity and _determine_alert_type each stringified the finding
+        text = str(finding).lower()
+        critical = any(k in text for k in CRITICAL_KEYWORDS)
+        text = str(finding).lower()
+        severity = [any(k in text for k in KEYWORD_FAMILIES[s]) for s in (AlertSeverity.HIGH.value, AlertSeverity.MEDIUM.value)]
+        text = str(finding).lower()
+        alert_type = [any(k in text for k in KEYWORD_FAMILIES[t]) for t in ALERT_TYPE_PRECEDENCE]
+        ranges = [name for name in CRITICAL_VALUE_RANGES if name in finding["parameter"].lower()]
+        return critical, severity, alert_type, ranges
+
+    def _compiled_scan():
+        return KEYWORD_MATCHER.match(str(finding).lower()), critical_range_for(finding["parameter"])
+
+    loops_us = min(timeit.repeat(_keyword_loops, number=2000, repeat=5)) / 2000 * 1e6
+    compiled_us = min(timeit.repeat(_compiled_scan, number=2000, repeat=5)) / 2000 * 1e6
+    print(f"keyword loops: {loops_us:.1f} us/finding | compiled scan: {compiled_us:.1f} us/finding | {loops_us / compiled_us:.1f}x")
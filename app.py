@@ -1,11 +1,11 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request, File, Form, UploadFile, Body, Query
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, HTTPException, Depends, status, Request, File, Form, UploadFile, Body, Query, Header
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from pydantic import BaseModel, EmailStr, ValidationError, Field
 from datetime import datetime, timezone, timedelta, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from enum import Enum
 from supabase import create_client, Client, AsyncClient
 from dotenv import load_dotenv
@@ -32,6 +32,11 @@ from async_file_downloader import file_downloader
 from connection_pool import get_supabase_client, get_async_supabase_client, close_connection_pools
 from thread_pool_manager import shutdown_thread_pool
 from optimized_cache import optimized_cache
+from streaming_response import validate_stream_format, stream_rows, map_stream, limit_stream
+from fast_json import FastJSONResponse, FAST_JSON_RESPONSES_ENABLED, respond_rows
+from event_bus import EventBus, LocalEventBus, create_event_bus, warn_if_workers_split
+from push_channel import push_hub
+from cache_change_feed import cache_change_feed
 import firebase_admin
 import hashlib
 import hmac
@@ -42,6 +47,7 @@ from database import DatabaseManager
 # Import custom exceptions
 from firebase_manager import AsyncFirebaseManager, TokenExpiredError, TokenInvalidError, TokenVerificationError
 from whatsapp_service import WhatsAppService
+from whatsapp_outbox import WhatsAppOutbox, outbox_response_fields
 from pdf_generator import PatientProfilePDFGenerator  # New import for PDF generation
 
 # Import AI analysis service
@@ -50,6 +56,7 @@ from ai_analysis_processor import AIAnalysisProcessor
 
 # Import Appointment Reminder Service
 from appointment_reminder_service import AppointmentReminderService
+from medication_service import find_drug_mentions
 
 # Load environment variables
 load_dotenv()
@@ -59,12 +66,18 @@ supabase: Optional[AsyncClient] = None
 db: Optional[DatabaseManager] = None
 firebase_manager: Optional[AsyncFirebaseManager] = None
 whatsapp_service: Optional[WhatsAppService] = None
+whatsapp_outbox: Optional[WhatsAppOutbox] = None
 ai_analysis_service: Optional[AIAnalysisService] = None
 ai_processor: Optional[AIAnalysisProcessor] = None
 appointment_reminder_service: Optional[AppointmentReminderService] = None
+event_bus: Optional[EventBus] = None
 background_task = None
 cleanup_task = None
 reminder_task = None
+outbox_task = None
+
+# Idle seconds between heartbeats on /events/stream (keeps proxies from closing it)
+PUSH_HEARTBEAT_SECONDS = float(os.getenv("PUSH_HEARTBEAT_SECONDS", "25"))
 
 # In-memory set to track in-progress analyses (simple deduplication)
 _analyses_in_progress: set = set()
@@ -101,7 +114,7 @@ async def periodic_queue_cleanup(db_instance, interval_hours: int = 1):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global supabase, db, firebase_manager, whatsapp_service, ai_analysis_service, ai_processor, appointment_reminder_service, background_task, cleanup_task, reminder_task
+    global supabase, db, firebase_manager, whatsapp_service, whatsapp_outbox, ai_analysis_service, ai_processor, appointment_reminder_service, event_bus, background_task, cleanup_task, reminder_task, outbox_task
     
     print("🚀 Starting application...")
     
@@ -145,6 +158,10 @@ async def lifespan(app: FastAPI):
         whatsapp_service = WhatsAppService()
         print("WhatsApp service initialized successfully")
         
+        # Outbox for WhatsApp messages sent on behalf of endpoints
+        whatsapp_outbox = WhatsAppOutbox(db, whatsapp_service)
+        print("WhatsApp outbox initialized successfully")
+        
         # Initialize AI Analysis service
         ai_analysis_service = AIAnalysisService()
         print("AI Analysis service initialized successfully")
@@ -154,9 +171,24 @@ async def lifespan(app: FastAPI):
         print("AI Analysis processor initialized successfully")
         
         # Initialize Appointment Reminder Service
-        appointment_reminder_service = AppointmentReminderService(db, whatsapp_service)
+        # Uses the outbox's token bucket (this worker's share of WHATSAPP_SEND_RATE_PER_SECOND),
+        # so reminders and outbox messages of all workers together stay within the send rate
+        appointment_reminder_service = AppointmentReminderService(
+            db, whatsapp_service, rate_limiter=whatsapp_outbox.rate_limiter
+        )
         print("Appointment Reminder service initialized successfully")
         
+        # Event bus that carries push events between workers (EVENT_BUS_BACKEND)
+        try:
+            event_bus = create_event_bus()
+        except Exception as bus_error:
+            print(f"⚠️ Event bus backend unavailable, push events stay in this worker ({bus_error})")
+            event_bus = LocalEventBus()
+        push_hub.attach(event_bus)
+        cache_change_feed.attach(event_bus)
+        print(f"Event bus initialized ({event_bus.name})")
+        warn_if_workers_split(event_bus)
+        
     except Exception as e:
         print(f"ERROR initializing Supabase: {e}")
         raise
@@ -176,6 +208,14 @@ async def lifespan(app: FastAPI):
         reminder_task = asyncio.create_task(appointment_reminder_service.start())
         print("✅ Appointment reminder service started (checks every 15 minutes)")
         
+        # Start the WhatsApp outbox worker
+        outbox_task = asyncio.create_task(whatsapp_outbox.start())
+        print("✅ WhatsApp outbox worker started")
+        
+        # Start listening for push events from other workers
+        await event_bus.start()
+        print(f"✅ Event bus started ({event_bus.name})")
+        
         # Run initial cleanup on startup
         print("🧹 Running initial queue cleanup on startup...")
         await db.cleanup_completed_queue_items(hours_old=24)
@@ -200,6 +240,11 @@ async def lifespan(app: FastAPI):
                 pass
         print("✅ AI Analysis background processor stopped")
         
+        # Delete this worker's Gemini context caches instead of leaving them until their TTL
+        if ai_analysis_service:
+            await ai_analysis_service.context_cache.close()
+            print("✅ Gemini context caches deleted")
+        
         # Stop cleanup task
         if cleanup_task:
             cleanup_task.cancel()
@@ -221,6 +266,21 @@ async def lifespan(app: FastAPI):
                 pass
         print("✅ Appointment reminder service stopped")
         
+        # Stop WhatsApp outbox worker (unsent rows stay in the outbox for the next start)
+        if whatsapp_outbox:
+            whatsapp_outbox.stop()
+        if outbox_task:
+            outbox_task.cancel()
+            try:
+                await outbox_task
+            except asyncio.CancelledError:
+                pass
+        
+        # Stop event bus
+        if event_bus:
+            await event_bus.stop()
+            print("✅ Event bus stopped")
+        
         # Get cache stats before shutdown
         print("📊 Final cache statistics:")
         cache_stats = await optimized_cache.get_stats()
@@ -259,6 +319,7 @@ Patient registration now supports detailed prior medical history including:
 - Reason for seeking new consultation
 """,
     lifespan=lifespan,
+    default_response_class=FastJSONResponse if FAST_JSON_RESPONSES_ENABLED else JSONResponse,
     openapi_tags=[
         {
             "name": "Authentication",
@@ -2590,10 +2651,16 @@ def parse_medications_text_to_items(medications_text: Optional[str]) -> List[Dic
     """Parse free-text medications into structured items"""
     if not medications_text:
         return []
-    entries = re.split(r"[\n;]+", medications_text)
+    # One scan over the whole text; each item gets the known drugs inside its span
+    mentions = find_drug_mentions(medications_text)
+    mention_index = 0
     items: List[Dict[str, Any]] = []
-    for entry in entries:
-        raw = entry.strip()
+    for entry in re.finditer(r"[^\n;]+", medications_text):
+        drug_ids = []
+        while mention_index < len(mentions) and mentions[mention_index]["start"] < entry.end():
+            drug_ids.append(mentions[mention_index]["drug"])
+            mention_index += 1
+        raw = entry.group().strip()
         if not raw:
             continue
         item_name = raw
@@ -2601,6 +2668,8 @@ def parse_medications_text_to_items(medications_text: Optional[str]) -> List[Dic
             "name": item_name,
             "medicine_name": item_name
         }
+        if drug_ids:
+            item["drug_ids"] = drug_ids
         if "-" in raw:
             name_part, detail_part = raw.split("-", 1)
             cleaned_name = name_part.strip()
@@ -2649,6 +2718,137 @@ def normalize_medication_items(raw_items: Optional[Any]) -> List[Dict[str, Any]]
     return normalized
 
 
+# Keywords used to route recommended tests to the doctor's pathology or radiology lab
+LAB_PATHOLOGY_KEYWORDS = ['blood', 'urine', 'stool', 'cbc', 'complete blood count', 'glucose', 'cholesterol', 'bilirubin', 'creatinine', 'urea', 'hemoglobin', 'culture', 'sensitivity', 'liver', 'kidney', 'thyroid', 'hormone', 'enzyme', 'protein', 'electrolyte', 'lipid', 'serum', 'plasma', 'wbc', 'rbc', 'platelet', 'hematocrit', 'biochemistry', 'microbiology', 'pathology', 'histopathology']
+LAB_RADIOLOGY_KEYWORDS = ['xray', 'x-ray', 'ct', 'scan', 'mri', 'ultrasound', 'echo', 'mammogram', 'bone', 'chest', 'abdomen', 'pelvis', 'spine', 'brain', 'cardiac', 'doppler', 'angiogram', 'radiolog', 'imaging', 'sonography', 'ecg', 'ekg', 'fluoroscopy']
+
+
+def parse_tests_recommended(tests_recommended: str) -> List[str]:
+    """Split the free-text tests_recommended field into individual test names"""
+    tests_recommended = (tests_recommended or "").strip()
+    if not tests_recommended:
+        return []
+    
+    # Try different common delimiters to split tests
+    test_list = []
+    for delimiter in [',', ';', '\n', '|']:
+        if delimiter in tests_recommended:
+            test_list = [test.strip() for test in tests_recommended.split(delimiter)]
+            break
+    
+    # If no delimiter found, treat as single test
+    if not test_list:
+        test_list = [tests_recommended]
+    
+    # Remove empty entries
+    return [test for test in test_list if test.strip()]
+
+
+def classify_lab_test(test_name: str) -> str:
+    """Determine report type based on test keywords (defaults to pathology)"""
+    test_lower = test_name.lower()
+    if any(keyword in test_lower for keyword in LAB_PATHOLOGY_KEYWORDS):
+        return "pathology"
+    if any(keyword in test_lower for keyword in LAB_RADIOLOGY_KEYWORDS):
+        return "radiology"
+    return "pathology"
+
+
+async def create_lab_requests_for_tests(
+    visit_id: int,
+    patient: Dict[str, Any],
+    doctor_profile: Dict[str, Any],
+    test_list: List[str]
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Bulk lab-request builder for a visit's recommended tests.
+    
+    Lab contacts are resolved once per lab type and all lab_report_requests rows
+    are inserted in a single call, so latency does not grow with the number of tests.
+    
+    Returns:
+        (lab_requests_created, skipped_tests)
+    """
+    doctor_uid = doctor_profile["firebase_uid"]
+    skipped_tests: List[str] = []
+    
+    # Resolve the configured lab for each report type from the doctor profile
+    labs_by_type: Dict[str, Dict[str, str]] = {}
+    if doctor_profile.get("pathology_lab_phone"):
+        labs_by_type["pathology"] = {
+            "phone": doctor_profile["pathology_lab_phone"],
+            "lab_name": doctor_profile.get("pathology_lab_name") or "Pathology Lab",
+            "lab_type": "pathology"
+        }
+    if doctor_profile.get("radiology_lab_phone"):
+        labs_by_type["radiology"] = {
+            "phone": doctor_profile["radiology_lab_phone"],
+            "lab_name": doctor_profile.get("radiology_lab_name") or "Radiology Lab",
+            "lab_type": "radiology"
+        }
+    
+    routed_tests: List[Tuple[str, str]] = []
+    for test_name in test_list:
+        report_type = classify_lab_test(test_name)
+        if report_type in labs_by_type:
+            routed_tests.append((test_name.strip(), report_type))
+        else:
+            print(f"No lab contact configured for {report_type} test: {test_name}")
+            skipped_tests.append(f"{test_name} (no {report_type} lab contact)")
+    
+    if not routed_tests:
+        return [], skipped_tests
+    
+    # One lab_contacts lookup (plus one insert for any missing) for all lab types in use
+    used_labs = [labs_by_type[t] for t in sorted({report_type for _, report_type in routed_tests})]
+    contact_ids = await db.ensure_lab_contacts_exist(doctor_uid, used_labs)
+    
+    now = datetime.now(timezone.utc)
+    expires_at = (now + timedelta(days=7)).isoformat()
+    patient_name = f"{patient['first_name']} {patient['last_name']}"
+    
+    request_rows = []
+    for test_name, report_type in routed_tests:
+        lab = labs_by_type[report_type]
+        request_rows.append({
+            "visit_id": visit_id,
+            "patient_id": patient["id"],
+            "doctor_firebase_uid": doctor_uid,
+            "lab_contact_id": contact_ids.get(lab["phone"]),  # Link to actual lab contact
+            "patient_name": patient_name,
+            "report_type": report_type,
+            "test_name": test_name,
+            "instructions": f"Auto-generated request for test: {test_name}",
+            "status": "pending",
+            "request_token": str(uuid.uuid4()),
+            "expires_at": expires_at,
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat()
+        })
+    
+    created_requests = await db.bulk_create_lab_report_requests(request_rows)
+    created_by_token = {req.get("request_token"): req for req in created_requests}
+    
+    lab_requests_created = []
+    for row in request_rows:
+        created_request = created_by_token.get(row["request_token"])
+        if not created_request:
+            skipped_tests.append(f"{row['test_name']} (creation failed)")
+            continue
+        lab = labs_by_type[row["report_type"]]
+        lab_requests_created.append({
+            "request_id": created_request["id"],
+            "test_name": row["test_name"],
+            "report_type": row["report_type"],
+            "lab_name": lab["lab_name"],
+            "lab_phone": lab["phone"],
+            "request_token": row["request_token"]
+        })
+        print(f"Auto-created lab request for {row['test_name']} -> {lab['lab_name']} ({lab['phone']})")
+    
+    return lab_requests_created, skipped_tests
+
+
 async def sync_pharmacy_prescription_from_visit(visit: Dict[str, Any], doctor: Dict[str, Any], patient: Dict[str, Any]) -> None:
     """Create or update pharmacy prescription data whenever visit medications change"""
     try:
@@ -3800,9 +4000,11 @@ async def get_low_stock_alerts(pharmacy_id: int):
 async def get_pharmacy_sales_report(
     pharmacy_id: int,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    stream: Optional[str] = Query(default=None, description="Stream invoices as 'ndjson' or a chunked 'json' array")
 ):
     await get_current_pharmacy_user(pharmacy_id)
+    stream_format = validate_stream_format(stream)
 
     if start_date:
         try:
@@ -3817,6 +4019,17 @@ async def get_pharmacy_sales_report(
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_date must be YYYY-MM-DD")
 
     summary = await db.get_pharmacy_invoice_summary(pharmacy_id, start_date=start_date, end_date=end_date)
+
+    if stream_format:
+        invoices_stream = db.iter_pharmacy_invoices_by_pharmacy(pharmacy_id, start_date=start_date, end_date=end_date)
+        return stream_rows(
+            map_stream(invoices_stream, map_invoice_to_response),
+            stream_format,
+            header={"summary": summary},
+            items_key="invoices",
+            filename=f"pharmacy_{pharmacy_id}_sales"
+        )
+
     invoices_raw = await db.get_pharmacy_invoices_by_pharmacy(pharmacy_id)
 
     if start_date or end_date:
@@ -3932,16 +4145,49 @@ async def get_hospital_doctors(frontdesk_id: int):
             detail="Failed to fetch hospital doctors"
         )
 
+def map_patient_with_doctor_info(patient: Dict[str, Any]) -> PatientWithDoctorInfo:
+    return PatientWithDoctorInfo(
+        id=patient["id"],
+        first_name=patient["first_name"],
+        last_name=patient["last_name"],
+        email=patient.get("email"),
+        phone=patient["phone"],
+        date_of_birth=patient["date_of_birth"],
+        gender=patient["gender"],
+        address=patient.get("address"),
+        blood_group=patient.get("blood_group"),
+        allergies=patient.get("allergies"),
+        medical_history=patient.get("medical_history"),
+        doctor_name=patient["doctor_name"],
+        doctor_specialization=patient["doctor_specialization"],
+        doctor_phone=patient["doctor_phone"],
+        created_at=patient["created_at"],
+        updated_at=patient["updated_at"]
+    )
+
 @app.get("/frontdesk/{frontdesk_id}/patients", response_model=List[PatientWithDoctorInfo])
-async def get_hospital_patients(frontdesk_id: int, limit: Optional[int] = None):
+async def get_hospital_patients(
+    frontdesk_id: int,
+    limit: Optional[int] = None,
+    stream: Optional[str] = Query(default=None, description="Stream patients as 'ndjson' or a chunked 'json' array")
+):
     """Get all patients under doctors of the frontdesk user's hospital"""
     try:
         # Get and verify frontdesk user
         frontdesk_user = await get_current_frontdesk_user(frontdesk_id)
         hospital_name = frontdesk_user["hospital_name"]
+        stream_format = validate_stream_format(stream)
         
         print(f"Fetching patients for hospital: {hospital_name}")
         
+        if stream_format:
+            patients_stream = db.iter_patients_with_doctor_info_by_hospital(hospital_name)
+            return stream_rows(
+                map_stream(limit_stream(patients_stream, limit if limit and limit > 0 else None), map_patient_with_doctor_info),
+                stream_format,
+                filename="hospital_patients"
+            )
+        
         # Get patients with doctor info
         patients = await db.get_patients_with_doctor_info_by_hospital(hospital_name)
         
@@ -3950,27 +4196,7 @@ async def get_hospital_patients(frontdesk_id: int, limit: Optional[int] = None):
             patients = patients[:limit]
         
         # Convert to response models
-        patient_responses = []
-        for patient in patients:
-            patient_response = PatientWithDoctorInfo(
-                id=patient["id"],
-                first_name=patient["first_name"],
-                last_name=patient["last_name"],
-                email=patient.get("email"),
-                phone=patient["phone"],
-                date_of_birth=patient["date_of_birth"],
-                gender=patient["gender"],
-                address=patient.get("address"),
-                blood_group=patient.get("blood_group"),
-                allergies=patient.get("allergies"),
-                medical_history=patient.get("medical_history"),
-                doctor_name=patient["doctor_name"],
-                doctor_specialization=patient["doctor_specialization"],
-                doctor_phone=patient["doctor_phone"],
-                created_at=patient["created_at"],
-                updated_at=patient["updated_at"]
-            )
-            patient_responses.append(patient_response)
+        patient_responses = [map_patient_with_doctor_info(patient) for patient in patients]
         
         print(f"Returning {len(patient_responses)} patients for hospital: {hospital_name}")
         return patient_responses
@@ -4638,6 +4864,58 @@ async def delete_appointment_by_frontdesk(frontdesk_id: int, appointment_id: int
             detail=f"Appointment delete error: {str(e)}"
         )
 
+@app.get("/frontdesk/{frontdesk_id}/doctors/{doctor_firebase_uid}/free-slots", response_model=dict)
+async def get_doctor_free_slots_by_frontdesk(
+    frontdesk_id: int,
+    doctor_firebase_uid: str,
+    date: str = Query(..., description="Date in YYYY-MM-DD format"),
+    slot_minutes: int = Query(default=30, ge=5, le=480, description="Length of each bookable slot"),
+    step_minutes: Optional[int] = Query(default=None, ge=5, le=480, description="Spacing between slot starts (defaults to slot_minutes)"),
+    day_start: str = Query(default="09:00", description="Working day start (HH:MM)"),
+    day_end: str = Query(default="18:00", description="Working day end (HH:MM)")
+):
+    """Get all free appointment slots for a doctor on a given day"""
+    try:
+        # Get and verify frontdesk user
+        frontdesk_user = await get_current_frontdesk_user(frontdesk_id)
+        hospital_name = frontdesk_user["hospital_name"]
+        
+        is_valid_doctor = await db.validate_doctor_belongs_to_hospital(doctor_firebase_uid, hospital_name)
+        if not is_valid_doctor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Selected doctor does not belong to this hospital"
+            )
+        
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+            datetime.strptime(day_start, "%H:%M")
+            datetime.strptime(day_end, "%H:%M")
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid format. Use YYYY-MM-DD for date and HH:MM for day_start/day_end"
+            )
+        
+        return await db.get_doctor_free_slots(
+            doctor_firebase_uid,
+            date,
+            slot_minutes=slot_minutes,
+            day_start=day_start,
+            day_end=day_end,
+            step_minutes=step_minutes
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error finding free slots: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to find free slots"
+        )
+
 @app.get("/")
 async def root():
     """Welcome page with all available access links"""
@@ -5096,7 +5374,7 @@ async def register_patient(patient: PatientRegister, current_doctor = Depends(ge
 async def get_all_patients(current_doctor = Depends(get_current_doctor)):
     try:
         patients = await db.get_all_patients_for_doctor(current_doctor["firebase_uid"])
-        return [PatientProfile(**patient) for patient in patients]
+        return respond_rows(patients, PatientProfile)
     except Exception as e:
         print(f"Error fetching patients: {e}")
         raise HTTPException(
@@ -5399,112 +5677,45 @@ async def create_visit(
             visit_id = created_visit["id"]
             print(f"Visit created successfully. ID: {visit_id}")
             
-            # Clean up outdated patient history analyses since we added new data
-            await db.cleanup_outdated_patient_history_analyses(patient_id, current_doctor["firebase_uid"])
+            # Post-commit side effects run concurrently; none of them may fail the visit
+            async def cleanup_history_task():
+                await db.cleanup_outdated_patient_history_analyses(patient_id, current_doctor["firebase_uid"])
+            
+            async def lab_requests_task():
+                # AUTO-CREATE LAB REPORT REQUESTS if tests are recommended
+                test_list = parse_tests_recommended(visit.tests_recommended)
+                if not test_list:
+                    return []
+                created, _ = await create_lab_requests_for_tests(visit_id, existing_patient, current_doctor, test_list)
+                return created
+            
+            async def pharmacy_sync_task():
+                print(f"🔍 DEBUG: About to sync pharmacy prescription for visit {visit_id}")
+                print(f"🔍 DEBUG: Visit medications: {created_visit.get('medications')}")
+                print(f"🔍 DEBUG: Doctor hospital: {current_doctor.get('hospital_name')}")
+                await sync_pharmacy_prescription_from_visit(created_visit, current_doctor, existing_patient)
+            
+            cleanup_result, lab_result, pharmacy_result = await asyncio.gather(
+                cleanup_history_task(),
+                lab_requests_task(),
+                pharmacy_sync_task(),
+                return_exceptions=True
+            )
+            
+            if isinstance(cleanup_result, Exception):
+                print(f"Error cleaning up outdated history analyses: {cleanup_result}")
             
-            # AUTO-CREATE LAB REPORT REQUESTS if tests are recommended
             lab_requests_created = []
-            if visit.tests_recommended and visit.tests_recommended.strip():
-                try:
-                    # Get doctor profile to check for lab contacts
-                    doctor_profile = await db.get_doctor_by_firebase_uid(current_doctor["firebase_uid"])
-                    
-                    # Get patient details for the request
-                    patient = await db.get_patient_by_id(visit.patient_id, current_doctor["firebase_uid"])
-                    
-                    if doctor_profile and patient:
-                        # Parse the tests_recommended field to identify individual tests
-                        tests_recommended = visit.tests_recommended.strip()
-                        
-                        # Try different common delimiters to split tests
-                        test_list = []
-                        for delimiter in [',', ';', '\n', '|']:
-                            if delimiter in tests_recommended:
-                                test_list = [test.strip() for test in tests_recommended.split(delimiter)]
-                                break
-                        
-                        # If no delimiter found, treat as single test
-                        if not test_list:
-                            test_list = [tests_recommended]
-                        
-                        # Remove empty entries
-                        test_list = [test for test in test_list if test.strip()]
-                        
-                        # Automatically determine lab type based on test keywords
-                        pathology_keywords = ['blood', 'urine', 'stool', 'cbc', 'complete blood count', 'glucose', 'cholesterol', 'bilirubin', 'creatinine', 'urea', 'hemoglobin', 'culture', 'sensitivity', 'liver', 'kidney', 'thyroid', 'hormone', 'enzyme', 'protein', 'electrolyte', 'lipid', 'serum', 'plasma', 'wbc', 'rbc', 'platelet', 'hematocrit', 'biochemistry', 'microbiology', 'pathology', 'histopathology']
-                        radiology_keywords = ['xray', 'x-ray', 'ct', 'scan', 'mri', 'ultrasound', 'echo', 'mammogram', 'bone', 'chest', 'abdomen', 'pelvis', 'spine', 'brain', 'cardiac', 'doppler', 'angiogram', 'radiolog', 'imaging', 'sonography', 'ecg', 'ekg', 'fluoroscopy']
-                        
-                        for test_name in test_list:
-                            test_lower = test_name.lower()
-                            
-                            # Determine report type based on test keywords
-                            report_type = None
-                            if any(keyword in test_lower for keyword in pathology_keywords):
-                                report_type = "pathology"
-                            elif any(keyword in test_lower for keyword in radiology_keywords):
-                                report_type = "radiology"
-                            else:
-                                # Default to pathology for unknown tests
-                                report_type = "pathology"
-                            
-                            # Check if doctor has lab contact for this type
-                            lab_phone = None
-                            lab_name = None
-                            
-                            if report_type == "pathology" and doctor_profile.get("pathology_lab_phone"):
-                                lab_phone = doctor_profile.get("pathology_lab_phone")
-                                lab_name = doctor_profile.get("pathology_lab_name", "Pathology Lab")
-                            elif report_type == "radiology" and doctor_profile.get("radiology_lab_phone"):
-                                lab_phone = doctor_profile.get("radiology_lab_phone")
-                                lab_name = doctor_profile.get("radiology_lab_name", "Radiology Lab")
-                            
-                            # Create lab report request if lab contact exists
-                            if lab_phone:
-                                # Ensure we have a valid lab_contact_id from the table
-                                lab_contact_id = await db.ensure_lab_contact_exists(
-                                    current_doctor["firebase_uid"], 
-                                    lab_phone, 
-                                    lab_name, 
-                                    report_type
-                                )
-                                
-                                request_token = str(uuid.uuid4())
-                                request_data = {
-                                    "visit_id": visit_id,
-                                    "patient_id": visit.patient_id,
-                                    "doctor_firebase_uid": current_doctor["firebase_uid"],
-                                    "lab_contact_id": lab_contact_id,  # Link to actual lab contact
-                                    "patient_name": f"{patient['first_name']} {patient['last_name']}",
-                                    "report_type": report_type,
-                                    "test_name": test_name.strip(),
-                                    "instructions": f"Auto-generated request for test: {test_name.strip()}",
-                                    "status": "pending",
-                                    "request_token": request_token,
-                                    "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-                                    "created_at": datetime.now(timezone.utc).isoformat(),
-                                    "updated_at": datetime.now(timezone.utc).isoformat()
-                                }
-                                
-                                created_request = await db.create_lab_report_request(request_data)
-                                if created_request:
-                                    lab_requests_created.append({
-                                        "request_id": created_request["id"],
-                                        "test_name": test_name.strip(),
-                                        "report_type": report_type,
-                                        "lab_name": lab_name,
-                                        "lab_phone": lab_phone,
-                                        "request_token": request_token
-                                    })
-                                    print(f"Auto-created lab request for {test_name} -> {lab_name} ({lab_phone})")
-                                else:
-                                    print(f"Failed to create lab request for: {test_name}")
-                            else:
-                                print(f"No lab contact configured for {report_type} test: {test_name}")
-                        
-                except Exception as lab_error:
-                    print(f"Error auto-creating lab requests: {lab_error}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    # Don't fail the visit creation if lab request creation fails
+            if isinstance(lab_result, Exception):
+                # Don't fail the visit creation if lab request creation fails
+                print(f"Error auto-creating lab requests: {lab_result}")
+                print("".join(traceback.format_exception(lab_result)))
+            else:
+                lab_requests_created = lab_result
+            
+            if isinstance(pharmacy_result, Exception):
+                print(f"❌ ERROR: Could not sync pharmacy prescription for visit {visit_id}: {pharmacy_result}")
+                print("".join(traceback.format_exception(pharmacy_result)))
             
             response_data = {
                 "message": "Visit created successfully", 
@@ -5525,18 +5736,8 @@ async def create_visit(
                     "is_case_opener": visit.is_case_opener
                 }
 
-            try:
-                print(f"🔍 DEBUG: About to sync pharmacy prescription for visit {visit_id}")
-                print(f"🔍 DEBUG: Visit medications: {created_visit.get('medications')}")
-                print(f"🔍 DEBUG: Doctor hospital: {current_doctor.get('hospital_name')}")
-                await sync_pharmacy_prescription_from_visit(created_visit, current_doctor, existing_patient)
-            except Exception as pharmacy_sync_error:
-                print(f"❌ ERROR: Could not sync pharmacy prescription for visit {visit_id}: {pharmacy_sync_error}")
-                print(f"Traceback: {traceback.format_exc()}")
-            
-            # If handwritten is selected, add template info to response
+            # If handwritten is selected, add template info to response (template validated above)
             if visit.note_input_type == "handwritten" and visit.selected_template_id:
-                template = await db.get_pdf_template_by_id(visit.selected_template_id, current_doctor["firebase_uid"])
                 if template:
                     response_data.update({
                         "handwriting_enabled": True,
@@ -5576,7 +5777,7 @@ async def get_patient_visits(patient_id: int, current_doctor = Depends(get_curre
         )
     
     visits = await db.get_visits_by_patient_id(patient_id, current_doctor["firebase_uid"])
-    return [Visit(**visit) for visit in visits]
+    return respond_rows(visits, Visit)
 
 @app.get("/visits/{visit_id}", response_model=dict)
 async def get_visit_details(visit_id: int, current_doctor = Depends(get_current_doctor)):
@@ -6760,9 +6961,15 @@ async def delete_handwritten_note(
 async def resend_handwritten_note_whatsapp(
     note_id: int, 
     custom_message: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_doctor = Depends(get_current_doctor)
 ):
-    """Resend a handwritten note via WhatsApp"""
+    """
+    Resend a handwritten note via WhatsApp.
+    The message is queued in the WhatsApp outbox; the note is marked as sent once
+    Twilio accepts it. Repeating the request with the same Idempotency-Key (or
+    within a few minutes without one) returns the already queued message.
+    """
     try:
         # Get the handwritten note
         note = await db.get_handwritten_visit_note_by_id(note_id, current_doctor["firebase_uid"])
@@ -6782,40 +6989,33 @@ async def resend_handwritten_note_whatsapp(
                 detail="Patient phone number not available"
             )
         
-        # Send WhatsApp message
-        whatsapp_result = await whatsapp_service.send_handwritten_visit_note(
+        # Queue WhatsApp message (note is updated by the outbox worker once sent)
+        queued = await whatsapp_outbox.enqueue_handwritten_visit_note(
+            doctor_firebase_uid=current_doctor["firebase_uid"],
+            patient_id=note["patient_id"],
+            note_id=note_id,
             patient_name=f"{patient['first_name']} {patient['last_name']}",
             doctor_name=f"Dr. {current_doctor['first_name']} {current_doctor['last_name']}",
             phone_number=patient["phone"],
             pdf_url=note["handwritten_pdf_url"],
             visit_date=visit["visit_date"] if visit else "Unknown",
-            custom_message=custom_message or ""
+            custom_message=custom_message or "",
+            client_key=idempotency_key
         )
         
-        if whatsapp_result["success"]:
-            # Update note with WhatsApp info
-            await db.update_handwritten_visit_note(
-                note_id, 
-                current_doctor["firebase_uid"], 
-                {
-                    "sent_via_whatsapp": True,
-                    "whatsapp_message_id": whatsapp_result.get("message_id"),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            )
-            
-            return {
-                "message": "Handwritten note sent via WhatsApp successfully",
-                "whatsapp_message_id": whatsapp_result.get("message_id"),
-                "patient_name": f"{patient['first_name']} {patient['last_name']}",
-                "patient_phone": patient["phone"]
-            }
-        else:
+        if queued.get("status") in ("failed", "dead_letter"):
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to send WhatsApp message: {whatsapp_result.get('error', 'Unknown error')}"
+                detail=f"Failed to send WhatsApp message: {queued.get('last_error') or 'Unknown error'}"
             )
         
+        return {
+            "message": "Handwritten note queued for WhatsApp delivery" if queued.get("id") else "Handwritten note sent via WhatsApp successfully",
+            "patient_name": f"{patient['first_name']} {patient['last_name']}",
+            "patient_phone": patient["phone"],
+            **outbox_response_fields(queued)
+        }
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -7363,6 +7563,7 @@ async def get_remote_prescription_context(
 async def send_remote_prescription(
     visit_id: int,
     request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_doctor = Depends(get_current_doctor)
 ):
     """
@@ -7489,33 +7690,21 @@ async def send_remote_prescription(
                     
                     whatsapp_message = custom_message if custom_message else default_message
                     
-                    whatsapp_result = await whatsapp_service.send_handwritten_visit_note(
+                    # Queued in the outbox; the note is marked as sent by the outbox worker
+                    queued = await whatsapp_outbox.enqueue_handwritten_visit_note(
+                        doctor_firebase_uid=current_doctor["firebase_uid"],
+                        patient_id=visit["patient_id"],
+                        note_id=created_note["id"] if created_note else None,
                         patient_name=f"{patient['first_name']} {patient['last_name']}",
                         doctor_name=f"Dr. {current_doctor['first_name']} {current_doctor['last_name']}",
                         phone_number=patient["phone"],
                         pdf_url=file_url,
                         visit_date=visit["visit_date"],
-                        custom_message=whatsapp_message
+                        custom_message=whatsapp_message,
+                        client_key=idempotency_key
                     )
-                    
-                    if whatsapp_result["success"]:
-                        response_data["whatsapp_sent"] = True
-                        response_data["whatsapp_message_id"] = whatsapp_result.get("message_id")
-                        print(f"✅ Remote prescription sent via WhatsApp to {patient['phone']}")
-                        
-                        # Update note record
-                        if created_note:
-                            await db.update_handwritten_visit_note(
-                                created_note["id"],
-                                current_doctor["firebase_uid"],
-                                {
-                                    "sent_via_whatsapp": True,
-                                    "whatsapp_message_id": whatsapp_result.get("message_id"),
-                                    "whatsapp_sent_at": datetime.now(timezone.utc).isoformat()
-                                }
-                            )
-                    else:
-                        response_data["whatsapp_error"] = whatsapp_result.get("error", "Unknown error")
+                    response_data.update(outbox_response_fields(queued))
+                    print(f"📤 Remote prescription for {patient['phone']} {queued.get('status')} (outbox #{queued.get('id')})")
                         
                 except Exception as wa_error:
                     print(f"WhatsApp error: {wa_error}")
@@ -7655,9 +7844,14 @@ async def generate_report_upload_link(
 async def send_whatsapp_report_link(
     visit_id: int,
     request_data: WhatsAppReportRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_doctor = Depends(get_current_doctor)
 ):
-    """Generate upload link and send it via WhatsApp to the patient"""
+    """
+    Generate upload link and send it via WhatsApp to the patient.
+    The message is queued in the WhatsApp outbox (whatsapp_status / whatsapp_outbox_id
+    in the response); a repeated request with the same Idempotency-Key does not send again.
+    """
     try:
         # Verify the visit exists and belongs to the current doctor
         visit = await db.get_visit_by_id(visit_id, current_doctor["firebase_uid"])
@@ -7736,22 +7930,28 @@ async def send_whatsapp_report_link(
         # Send WhatsApp message if requested
         if request_data.send_whatsapp:
             try:
-                whatsapp_result = await whatsapp_service.send_report_upload_link(
+                queued = await whatsapp_outbox.enqueue_report_upload_link(
+                    doctor_firebase_uid=current_doctor["firebase_uid"],
+                    patient_id=visit["patient_id"],
+                    visit_id=visit_id,
                     patient_name=f"{patient['first_name']} {patient['last_name']}",
                     doctor_name=f"Dr. {current_doctor['first_name']} {current_doctor['last_name']}",
                     phone_number=patient["phone"],
                     upload_url=upload_url,
                     tests_recommended=tests_recommended,
-                    expires_at=expires_at.isoformat()
+                    expires_at=expires_at.isoformat(),
+                    client_key=idempotency_key
                 )
+                response_data.update(outbox_response_fields(queued))
                 
-                if whatsapp_result["success"]:
-                    response_data["whatsapp_sent"] = True
-                    response_data["whatsapp_message_id"] = whatsapp_result.get("message_id")
+                if response_data["whatsapp_error"]:
+                    response_data["message"] = "Report upload link generated but WhatsApp sending failed"
+                elif response_data["whatsapp_deduplicated"]:
+                    response_data["message"] = "Report upload link generated; the patient was already sent a link for this visit moments ago"
+                elif response_data["whatsapp_sent"]:
                     response_data["message"] = "Report upload link generated and sent via WhatsApp successfully"
                 else:
-                    response_data["whatsapp_error"] = whatsapp_result.get("error")
-                    response_data["message"] = "Report upload link generated but WhatsApp sending failed"
+                    response_data["message"] = "Report upload link generated and queued for WhatsApp delivery"
                     
             except Exception as whatsapp_error:
                 print(f"WhatsApp sending error: {whatsapp_error}")
@@ -10075,6 +10275,10 @@ class ReminderServiceStatus(BaseModel):
     pending_reminders: int
     sent_today: int
     failed_today: int
+    send_concurrency: Optional[int] = None
+    rate_limiter: Optional[Dict[str, Any]] = None
+    cycles_completed: int = 0
+    last_cycle: Optional[Dict[str, Any]] = None  # counts, duration_seconds, reminders_per_second
 
 
 @app.get("/reminders/settings", response_model=dict, tags=["Appointment Reminders"])
@@ -10451,9 +10655,11 @@ async def get_yearly_earnings(
 @app.post("/earnings/custom", response_model=EarningsReport, tags=["Billing"])
 async def get_custom_earnings_report(
     filters: EarningsFilter,
+    stream: Optional[str] = Query(default=None, description="Stream the report with its visits as 'ndjson' or a chunked 'json' array"),
     current_doctor = Depends(get_current_doctor)
 ):
     """Get custom earnings report with filters"""
+    stream_format = validate_stream_format(stream)
     try:
         report_data = await db.get_earnings_report(
             current_doctor["firebase_uid"],
@@ -10471,7 +10677,7 @@ async def get_custom_earnings_report(
         elif filters.end_date:
             period_desc = f"Until {filters.end_date}"
         
-        return EarningsReport(
+        report = EarningsReport(
             period=period_desc,
             total_consultations=report_data["total_consultations"],
             paid_consultations=report_data["paid_consultations"],
@@ -10483,6 +10689,25 @@ async def get_custom_earnings_report(
             breakdown_by_payment_method=report_data["breakdown_by_payment_method"],
             breakdown_by_visit_type=report_data["breakdown_by_visit_type"]
         )
+        
+        if stream_format:
+            # Aggregates come from the RPC; the visit rows are streamed page by page
+            visits_stream = db.iter_earnings_visits(
+                current_doctor["firebase_uid"],
+                filters.start_date,
+                filters.end_date,
+                filters.payment_status,
+                filters.visit_type
+            )
+            return stream_rows(
+                visits_stream,
+                stream_format,
+                header=report.model_dump(),
+                items_key="visits",
+                filename="earnings_report"
+            )
+        
+        return report
     except Exception as e:
         print(f"Error getting custom earnings report: {e}")
         raise HTTPException(
@@ -10495,7 +10720,7 @@ async def get_pending_payments(current_doctor = Depends(get_current_doctor)):
     """Get all visits with pending payments"""
     try:
         pending = await db.get_pending_payments(current_doctor["firebase_uid"])
-        return [Visit(**visit) for visit in pending]
+        return respond_rows(pending, Visit)
     except Exception as e:
         print(f"Error getting pending payments: {e}")
         raise HTTPException(
@@ -11067,9 +11292,10 @@ async def download_visit_report(report_id: int, current_doctor = Depends(get_cur
 async def resend_visit_report_whatsapp(
     report_id: int, 
     custom_message: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_doctor = Depends(get_current_doctor)
 ):
-    """Resend a visit report via WhatsApp"""
+    """Resend a visit report via WhatsApp (queued in the WhatsApp outbox)"""
     try:
         # Get the visit report
         report = await db.get_visit_report_by_id(report_id, current_doctor["firebase_uid"])
@@ -11089,34 +11315,32 @@ async def resend_visit_report_whatsapp(
                 detail="Patient phone number not found"
             )
         
-        # Send WhatsApp message
-        whatsapp_result = await whatsapp_service.send_visit_report(
+        # Queue WhatsApp message (report is updated by the outbox worker once sent)
+        queued = await whatsapp_outbox.enqueue_visit_report(
+            doctor_firebase_uid=current_doctor["firebase_uid"],
+            patient_id=report["patient_id"],
+            report_id=report_id,
             patient_name=f"{patient['first_name']} {patient['last_name']}",
             doctor_name=f"Dr. {current_doctor['first_name']} {current_doctor['last_name']}",
             phone_number=patient["phone"],
             report_url=report["file_url"],
             visit_date=visit["visit_date"],
-            custom_message=custom_message or ""
+            custom_message=custom_message or "",
+            client_key=idempotency_key
         )
         
-        if whatsapp_result["success"]:
-            # Update report record
-            await db.update_visit_report(report_id, {
-                "sent_via_whatsapp": True,
-                "whatsapp_message_id": whatsapp_result.get("message_id")
-            })
-            
-            return {
-                "message": "Visit report sent via WhatsApp successfully",
-                "whatsapp_message_id": whatsapp_result.get("message_id"),
-                "patient_phone": patient["phone"]
-            }
-        else:
+        if queued.get("status") in ("failed", "dead_letter"):
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to send WhatsApp message: {whatsapp_result.get('error')}"
+                detail=f"Failed to send WhatsApp message: {queued.get('last_error')}"
             )
         
+        return {
+            "message": "Visit report queued for WhatsApp delivery" if queued.get("id") else "Visit report sent via WhatsApp successfully",
+            "patient_phone": patient["phone"],
+            **outbox_response_fields(queued)
+        }
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -11126,6 +11350,28 @@ async def resend_visit_report_whatsapp(
             detail="Failed to resend visit report via WhatsApp"
         )
 
+@app.get("/whatsapp/outbox/{outbox_id}", response_model=dict)
+async def get_whatsapp_outbox_message(
+    outbox_id: int,
+    current_doctor = Depends(get_current_doctor)
+):
+    """Delivery status of a queued WhatsApp message (whatsapp_outbox_id from the send endpoints)"""
+    message = await db.get_whatsapp_outbox_message(outbox_id, current_doctor["firebase_uid"])
+    if not message:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Queued WhatsApp message not found"
+        )
+    return message
+
+@app.get("/whatsapp/outbox-status", response_model=dict)
+async def get_whatsapp_outbox_status(current_doctor = Depends(get_current_doctor)):
+    """The doctor's queued WhatsApp messages per status and this worker's sender stats"""
+    return {
+        "counts": await db.get_whatsapp_outbox_counts(current_doctor["firebase_uid"]),
+        "worker": whatsapp_outbox.get_status() if whatsapp_outbox else None
+    }
+
 # Test endpoint for simple WhatsApp messages (Twilio)
 @app.post("/test-whatsapp-simple", response_model=dict)
 async def test_whatsapp_simple_message(
@@ -11295,6 +11541,9 @@ async def analyze_report_with_ai(
                 "analysis_success": True,
                 "analysis_error": None,
                 "processing_time_ms": int(processing_time),
+                "input_token_count": analysis_result["analysis"].get("token_usage", {}).get("prompt_tokens"),
+                "output_token_count": analysis_result["analysis"].get("token_usage", {}).get("output_tokens"),
+                "document_input_mode": analysis_result["analysis"].get("input_mode"),
                 "analyzed_at": analysis_result["processed_at"],
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
@@ -11543,7 +11792,7 @@ async def get_visit_analyses(
             )
         
         analyses = await db.get_ai_analyses_by_visit_id(visit_id, current_doctor["firebase_uid"])
-        return [AIAnalysisResult(**analysis) for analysis in analyses]
+        return respond_rows(analyses, AIAnalysisResult)
         
     except HTTPException:
         raise
@@ -11584,10 +11833,13 @@ async def get_visit_consolidated_analyses(
 @app.get("/patients/{patient_id}/analyses", response_model=List[AIAnalysisResult])
 async def get_patient_analyses(
     patient_id: int,
+    stream: Optional[str] = Query(default=None, description="Stream analyses as 'ndjson' or a chunked 'json' array"),
     current_doctor = Depends(get_current_doctor)
 ):
     """Get all AI analyses for a patient"""
     try:
+        stream_format = validate_stream_format(stream)
+        
         # Verify the patient exists
         patient = await db.get_patient_by_id(patient_id, current_doctor["firebase_uid"])
         if not patient:
@@ -11596,8 +11848,16 @@ async def get_patient_analyses(
                 detail="Patient not found"
             )
         
+        if stream_format:
+            analyses_stream = db.iter_ai_analyses_by_patient_id(patient_id, current_doctor["firebase_uid"])
+            return stream_rows(
+                map_stream(analyses_stream, lambda analysis: AIAnalysisResult(**analysis)),
+                stream_format,
+                filename=f"patient_{patient_id}_analyses"
+            )
+        
         analyses = await db.get_ai_analyses_by_patient_id(patient_id, current_doctor["firebase_uid"])
-        return [AIAnalysisResult(**analysis) for analysis in analyses]
+        return respond_rows(analyses, AIAnalysisResult)
         
     except HTTPException:
         raise
@@ -11685,9 +11945,10 @@ async def get_ai_analysis_summary_for_doctor(
 async def batch_analyze_reports(
     report_ids: List[int],
     priority: int = 1,
+    background: bool = True,
     current_doctor = Depends(get_current_doctor)
 ):
-    """Queue multiple reports for AI analysis"""
+    """Queue multiple reports for AI analysis (background=true routes them to the batch lane)"""
     try:
         # Check if AI is enabled for this doctor
         check_ai_enabled(current_doctor)
@@ -11722,6 +11983,7 @@ async def batch_analyze_reports(
                 "doctor_firebase_uid": current_doctor["firebase_uid"],
                 "priority": priority,
                 "status": "pending",
+                "lane": "batch" if background else "interactive",
                 "queued_at": datetime.now(timezone.utc).isoformat()
             }
             
@@ -11771,6 +12033,8 @@ async def get_ai_processor_status(current_doctor: dict = Depends(get_current_doc
             "processor_running": ai_processor.is_running,
             "processing_interval_seconds": ai_processor.process_interval,
             "max_concurrent_analyses": ai_processor.max_concurrent,
+            "scheduler": ai_processor.scheduler.get_metrics(),
+            "batch_lane": ai_processor.get_batch_lane_status(),
             "queue_statistics": stats
         }
         
@@ -11802,19 +12066,40 @@ async def get_ai_queue_stats(current_doctor: dict = Depends(get_current_doctor))
             detail="Failed to get queue statistics"
         )
 
+@app.post("/ai-queue/dead-letter/requeue")
+async def requeue_dead_letter_analyses(
+    queue_ids: Optional[List[int]] = None,
+    current_doctor: dict = Depends(get_current_doctor)
+):
+    """Requeue AI analyses that exhausted their retries (all of the doctor's, or the given queue ids)"""
+    try:
+        requeued = await db.requeue_dead_letter_ai_analyses(current_doctor["firebase_uid"], queue_ids)
+        
+        return {
+            "message": f"Requeued {len(requeued)} dead-letter analyses",
+            "requeued_queue_ids": [item["id"] for item in requeued],
+            "requeued_count": len(requeued)
+        }
+    except Exception as e:
+        print(f"Error requeueing dead-letter analyses: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to requeue dead-letter analyses"
+        )
+
 @app.post("/ai-queue-cleanup")
 async def trigger_queue_cleanup(current_doctor: dict = Depends(get_current_doctor)):
     """Manually trigger AI analysis queue cleanup"""
     try:
         # Get stats before cleanup
-        before_stats = await db.get_queue_stats()
+        before_stats = await db.get_queue_stats(use_cache=False)
         
         # Run cleanup
         completed_cleaned = await db.cleanup_completed_queue_items(hours_old=24)
         stale_reset = await db.cleanup_stale_processing_items(hours_stale=2)
         
         # Get stats after cleanup
-        after_stats = await db.get_queue_stats()
+        after_stats = await db.get_queue_stats(use_cache=False)
         
         return {
             "message": "Queue cleanup completed",
@@ -11884,26 +12169,32 @@ async def get_clinical_alerts(
         )
 
 @app.get("/alerts/counts", response_model=dict, tags=["Clinical Alerts"])
-async def get_alert_counts(current_doctor: dict = Depends(get_current_doctor)):
+async def get_alert_counts(
+    patient_id: Optional[int] = Query(None, description="Count only this patient's alerts"),
+    current_doctor: dict = Depends(get_current_doctor)
+):
     """
     Get counts of unacknowledged alerts grouped by severity.
     
     Useful for displaying alert badges/indicators in the UI without
     fetching full alert details.
     
+    **Query Parameters:**
+    - **patient_id**: Optional patient to count for (default: all patients)
+    
     **Response:**
-    - **counts**: Object with high, medium, low, and total counts
+    - **counts**: Object with critical, urgent, high, medium, low, and total counts
     - **has_alerts**: Boolean indicating if any alerts exist
-    - **has_high_priority**: Boolean indicating critical alerts exist
+    - **has_high_priority**: Boolean indicating critical, urgent or high alerts exist
     """
     try:
         doctor_uid = current_doctor["firebase_uid"]
-        counts = await db.get_alert_counts(doctor_uid)
+        counts = await db.get_alert_counts(doctor_uid, patient_id=patient_id)
         
         return {
             "counts": counts,
             "has_alerts": counts.get("total", 0) > 0,
-            "has_high_priority": counts.get("high", 0) > 0
+            "has_high_priority": any(counts.get(severity, 0) > 0 for severity in ("critical", "urgent", "high"))
         }
     except Exception as e:
         print(f"Error getting alert counts: {e}")
@@ -12109,6 +12400,11 @@ class MedicationCheckRequest(BaseModel):
     patient_allergies: str = Field(default="", description="Patient's known allergies")
     patient_conditions: Optional[List[str]] = Field(default=None, description="Patient's medical conditions")
 
+class PharmacySafetyCheckRequest(BaseModel):
+    prescription_ids: Optional[List[int]] = Field(default=None, description="Prescriptions to check; defaults to the pharmacy's queue")
+    statuses: List[str] = Field(default=["pending"], description="Queue statuses to check when prescription_ids is omitted")
+    include_unassigned: bool = Field(default=True, description="Include prescriptions not yet assigned to a pharmacy")
+
 class VisitSummaryRequest(BaseModel):
     include_reports: bool = Field(default=True, description="Include AI report analyses")
     include_handwritten: bool = Field(default=True, description="Include handwritten note analyses")
@@ -12243,6 +12539,96 @@ async def check_patient_medication_safety(
             detail="Failed to check medication safety"
         )
 
+@app.post("/pharmacy/{pharmacy_id}/prescriptions/safety-check", response_model=dict, tags=["Clinical Intelligence"])
+async def check_pharmacy_prescriptions_safety(
+    pharmacy_id: int,
+    request: PharmacySafetyCheckRequest = PharmacySafetyCheckRequest()
+):
+    """
+    Check medication safety for a pharmacy's prescription queue in one request.
+    
+    Each prescription's medications are checked against the patient's current
+    medications, allergies and medical history. Patients are fetched in one bulk
+    query and identical regimens are only checked once.
+    
+    **Path Parameters:**
+    - **pharmacy_id**: ID of the pharmacy
+    
+    **Request Body:**
+    - **prescription_ids**: Optional explicit prescriptions (default: the queue)
+    - **statuses**: Queue statuses to include (default: pending)
+    - **include_unassigned**: Include unassigned hospital prescriptions (default: true)
+    
+    **Response:**
+    - **results**: Per-prescription safety summary and full check result
+    - **flagged_count**: Prescriptions with critical or high severity warnings
+    """
+    try:
+        pharmacy_user = await get_current_pharmacy_user(pharmacy_id)
+        prescriptions = await db.get_pharmacy_prescriptions(pharmacy_user["hospital_name"], None)
+        
+        prescriptions = [
+            p for p in prescriptions
+            if p.get("pharmacy_id") == pharmacy_id or (request.include_unassigned and p.get("pharmacy_id") is None)
+        ]
+        if request.prescription_ids:
+            wanted_ids = set(request.prescription_ids)
+            prescriptions = [p for p in prescriptions if p.get("id") in wanted_ids]
+        else:
+            desired = {s.strip().lower() for s in request.statuses if s.strip()}
+            prescriptions = [p for p in prescriptions if (p.get("status") or "").lower() in desired]
+        
+        patients = await db.get_patients_medication_profiles([p.get("patient_id") for p in prescriptions])
+        
+        checks = []
+        for prescription in prescriptions:
+            patient = patients.get(prescription.get("patient_id")) or {}
+            current_meds = [
+                (med.get("name") or med.get("medicine_name") or "") if isinstance(med, dict) else str(med)
+                for med in patient.get("current_medications") or []
+            ]
+            checks.append({
+                "key": prescription["id"],
+                "current_medications": current_meds,
+                "new_medications": [prescription.get("medications_text") or ""],
+                "patient_allergies": patient.get("allergies") or "",
+                "medical_history": patient.get("medical_history") or ""
+            })
+        
+        batch = await get_medication_service().batch_medication_check(checks)
+        
+        results = []
+        for prescription, checked in zip(prescriptions, batch["results"]):
+            summary = checked["check_result"]["summary"]
+            results.append({
+                "prescription_id": prescription["id"],
+                "patient_id": prescription.get("patient_id"),
+                "patient_name": prescription.get("patient_name"),
+                "status": prescription.get("status"),
+                "flagged": summary["critical_count"] > 0 or summary["high_count"] > 0,
+                "safe_to_prescribe": summary["safe_to_prescribe"],
+                "check_result": checked["check_result"]
+            })
+        
+        print(f"💊 Safety-checked {len(results)} prescriptions for pharmacy {pharmacy_id}: {batch['stats']}")
+        return {
+            "success": True,
+            "pharmacy_id": pharmacy_id,
+            "checked_count": len(results),
+            "flagged_count": sum(1 for result in results if result["flagged"]),
+            "results": results,
+            "stats": batch["stats"],
+            "checked_at": datetime.now(timezone.utc).isoformat()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error checking pharmacy prescription safety: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to check prescription safety"
+        )
+
 # -------------------------------------------------------------------------
 # Visit Summary / SOAP Note Generation (Phase 2.3)
 # -------------------------------------------------------------------------
@@ -13230,7 +13616,7 @@ async def get_notifications(
             limit=limit
         )
         
-        return [Notification(**notification) for notification in notifications]
+        return respond_rows(notifications, Notification)
         
     except Exception as e:
         print(f"Error getting notifications: {e}")
@@ -13372,6 +13758,44 @@ async def delete_notification(
             detail="Failed to delete notification"
         )
 
+@app.get("/events/stream", tags=["Notifications"])
+async def stream_doctor_events(
+    request: Request,
+    current_doctor = Depends(get_current_doctor)
+):
+    """
+    Server-Sent Events stream of the doctor's notifications and clinical alert changes.
+    
+    Replaces polling /notifications/unread/count and /alerts/counts: the first event
+    is a `snapshot` with both counts, followed by `notification`, `alerts_created`
+    and `alerts_acknowledged` events as they happen (from any worker). A new
+    `snapshot` is sent whenever events may have been missed.
+    """
+    doctor_uid = current_doctor["firebase_uid"]
+    
+    async def load_snapshot() -> Dict[str, Any]:
+        unread_count, alert_counts = await asyncio.gather(
+            db.get_unread_notification_count(doctor_uid),
+            db.get_alert_counts(doctor_uid)
+        )
+        return {"unread_notifications": unread_count, "alert_counts": alert_counts}
+    
+    return StreamingResponse(
+        push_hub.stream(
+            doctor_uid,
+            load_snapshot,
+            heartbeat_seconds=PUSH_HEARTBEAT_SECONDS,
+            is_disconnected=request.is_disconnected
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/events/status", response_model=dict, tags=["Notifications"])
+async def get_push_channel_status(current_doctor = Depends(get_current_doctor)):
+    """Open event streams in this worker, event bus health and cache change feed"""
+    return {**push_hub.get_status(), "cache_change_feed": cache_change_feed.get_status()}
+
 # Lab Management Endpoints
 @app.post("/lab-contacts", response_model=dict)
 async def create_lab_contact(
@@ -13536,14 +13960,14 @@ async def auto_create_lab_requests_for_visit(
                 "lab_requests": []
             }
         
-        # Get existing lab requests for this visit to avoid duplicates
-        existing_requests = await db.get_lab_report_requests_by_visit_id(visit_id)
+        # Get existing lab requests, doctor profile and patient details concurrently
+        existing_requests, doctor_profile, patient = await asyncio.gather(
+            db.get_lab_report_requests_by_visit_id(visit_id),
+            db.get_doctor_by_firebase_uid(current_doctor["firebase_uid"]),
+            db.get_patient_by_id(visit["patient_id"], current_doctor["firebase_uid"])
+        )
         existing_test_names = {req.get("test_name", "").lower().strip() for req in existing_requests}
         
-        # Get doctor profile and patient details
-        doctor_profile = await db.get_doctor_by_firebase_uid(current_doctor["firebase_uid"])
-        patient = await db.get_patient_by_id(visit["patient_id"], current_doctor["firebase_uid"])
-        
         if not doctor_profile:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -13556,102 +13980,23 @@ async def auto_create_lab_requests_for_visit(
                 detail="Patient not found"
             )
         
-        lab_requests_created = []
-        
         # Parse the tests_recommended field
         tests_recommended = visit["tests_recommended"].strip()
-        
-        # Try different common delimiters to split tests
-        test_list = []
-        for delimiter in [',', ';', '\n', '|']:
-            if delimiter in tests_recommended:
-                test_list = [test.strip() for test in tests_recommended.split(delimiter)]
-                break
-        
-        # If no delimiter found, treat as single test
-        if not test_list:
-            test_list = [tests_recommended]
-        
-        # Remove empty entries
-        test_list = [test for test in test_list if test.strip()]
-        
-        # Automatically determine lab type based on test keywords
-        pathology_keywords = ['blood', 'urine', 'stool', 'cbc', 'complete blood count', 'glucose', 'cholesterol', 'bilirubin', 'creatinine', 'urea', 'hemoglobin', 'culture', 'sensitivity', 'liver', 'kidney', 'thyroid', 'hormone', 'enzyme', 'protein', 'electrolyte', 'lipid', 'serum', 'plasma', 'wbc', 'rbc', 'platelet', 'hematocrit', 'biochemistry', 'microbiology', 'pathology', 'histopathology']
-        radiology_keywords = ['xray', 'x-ray', 'ct', 'scan', 'mri', 'ultrasound', 'echo', 'mammogram', 'bone', 'chest', 'abdomen', 'pelvis', 'spine', 'brain', 'cardiac', 'doppler', 'angiogram', 'radiolog', 'imaging', 'sonography', 'ecg', 'ekg', 'fluoroscopy']
+        test_list = parse_tests_recommended(tests_recommended)
         
         skipped_tests = []
-        
+        new_tests = []
         for test_name in test_list:
-            test_lower = test_name.lower().strip()
-            
             # Skip if request already exists for this test
-            if test_lower in existing_test_names:
+            if test_name.lower().strip() in existing_test_names:
                 skipped_tests.append(f"{test_name} (already requested)")
-                continue
-            
-            # Determine report type based on test keywords
-            report_type = None
-            if any(keyword in test_lower for keyword in pathology_keywords):
-                report_type = "pathology"
-            elif any(keyword in test_lower for keyword in radiology_keywords):
-                report_type = "radiology"
             else:
-                # Default to pathology for unknown tests
-                report_type = "pathology"
-            
-            # Check if doctor has lab contact for this type
-            lab_phone = None
-            lab_name = None
-            
-            if report_type == "pathology" and doctor_profile.get("pathology_lab_phone"):
-                lab_phone = doctor_profile.get("pathology_lab_phone")
-                lab_name = doctor_profile.get("pathology_lab_name", "Pathology Lab")
-            elif report_type == "radiology" and doctor_profile.get("radiology_lab_phone"):
-                lab_phone = doctor_profile.get("radiology_lab_phone")
-                lab_name = doctor_profile.get("radiology_lab_name", "Radiology Lab")
-            
-            # Create lab report request if lab contact exists
-            if lab_phone:
-                # Ensure we have a valid lab_contact_id from the table
-                lab_contact_id = await db.ensure_lab_contact_exists(
-                    current_doctor["firebase_uid"], 
-                    lab_phone, 
-                    lab_name, 
-                    report_type
-                )
-
-                request_token = str(uuid.uuid4())
-                request_data = {
-                    "visit_id": visit_id,
-                    "patient_id": visit["patient_id"],
-                    "doctor_firebase_uid": current_doctor["firebase_uid"],
-                    "lab_contact_id": lab_contact_id,
-                    "patient_name": f"{patient['first_name']} {patient['last_name']}",
-                    "report_type": report_type,
-                    "test_name": test_name.strip(),
-                    "instructions": f"Auto-generated request for test: {test_name.strip()}",
-                    "status": "pending",
-                    "request_token": request_token,
-                    "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                created_request = await db.create_lab_report_request(request_data)
-                if created_request:
-                    lab_requests_created.append({
-                        "request_id": created_request["id"],
-                        "test_name": test_name.strip(),
-                        "report_type": report_type,
-                        "lab_name": lab_name,
-                        "lab_phone": lab_phone,
-                        "request_token": request_token
-                    })
-                    print(f"Created lab request for {test_name} -> {lab_name} ({lab_phone})")
-                else:
-                    skipped_tests.append(f"{test_name} (creation failed)")
-            else:
-                skipped_tests.append(f"{test_name} (no {report_type} lab contact)")
+                new_tests.append(test_name)
+        
+        lab_requests_created, skipped_new = await create_lab_requests_for_tests(
+            visit_id, patient, doctor_profile, new_tests
+        )
+        skipped_tests.extend(skipped_new)
         
         return {
             "message": f"Successfully created {len(lab_requests_created)} lab report requests",
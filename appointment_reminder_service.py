@@ -12,13 +12,19 @@ Features:
 - Tracks sent reminders to avoid duplicates
 - Supports retry logic for failed sends
 - Configurable per-doctor settings
+- Sends each cycle's reminders concurrently (REMINDER_SEND_CONCURRENCY) under the
+  WhatsApp messages-per-second limit, creating and updating reminder rows in bulk
 """
 
 import asyncio
 import logging
+import os
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, List
 
+from rate_limiter import TokenBucket, per_worker_rate
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,13 +39,15 @@ class AppointmentReminderService:
     4. Tracks success/failure and supports retries
     """
     
-    def __init__(self, db_manager, whatsapp_service):
+    def __init__(self, db_manager, whatsapp_service, rate_limiter: Optional[TokenBucket] = None):
         """
         Initialize the appointment reminder service.
         
         Args:
             db_manager: DatabaseManager instance for database operations
             whatsapp_service: WhatsAppService instance for sending messages
+            rate_limiter: Token bucket shared with other WhatsApp senders of this worker
+                (defaults to a new one at this worker's share of WHATSAPP_SEND_RATE_PER_SECOND)
         """
         self.db = db_manager
         self.whatsapp = whatsapp_service
@@ -51,6 +59,17 @@ class AppointmentReminderService:
         self.default_hours_before = 24    # Default reminder time before appointment
         self.max_retries = 3              # Maximum retry attempts for failed sends
         self.retry_delay_minutes = 30     # Delay between retries
+        self.lock_seconds = 900           # Lease on reminders a worker is sending (next_retry_at)
+        self.claim_limit = 500            # Due reminders claimed per retry pass
+        self.send_concurrency = int(os.getenv("REMINDER_SEND_CONCURRENCY", "10"))  # Sends in flight
+        self.rate_limiter = rate_limiter or TokenBucket(
+            per_worker_rate(float(os.getenv("WHATSAPP_SEND_RATE_PER_SECOND", "10")))
+        )
+        
+        # Metrics of the current and the last completed cycle
+        self._cycle = self._new_cycle()
+        self.last_cycle: Optional[Dict[str, Any]] = None
+        self.cycles_completed = 0
         
         print("📅 AppointmentReminderService initialized")
     
@@ -77,12 +96,16 @@ class AppointmentReminderService:
         
         while self._running:
             try:
+                self._cycle = self._new_cycle()
+                
                 # Process reminders
                 await self._process_reminders()
                 
                 # Process pending retry queue
                 await self._process_retry_queue()
                 
+                self._finish_cycle()
+                
             except asyncio.CancelledError:
                 print("📅 Reminder loop cancelled")
                 break
@@ -96,8 +119,39 @@ class AppointmentReminderService:
         
         print("📅 Reminder loop ended")
     
+    @staticmethod
+    def _new_cycle() -> Dict[str, Any]:
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "_started": time.monotonic(),
+            "appointments_checked": 0,
+            "reminders_created": 0,
+            "retries_due": 0,
+            "sent": 0,
+            "retrying": 0,
+            "failed": 0,
+            "send_seconds": 0.0
+        }
+    
+    def _finish_cycle(self):
+        """Close the current cycle's metrics"""
+        cycle = self._cycle
+        duration = time.monotonic() - cycle.pop("_started")
+        attempted = cycle["sent"] + cycle["retrying"] + cycle["failed"]
+        cycle["duration_seconds"] = round(duration, 2)
+        cycle["send_seconds"] = round(cycle["send_seconds"], 2)
+        cycle["reminders_per_second"] = round(attempted / cycle["send_seconds"], 2) if cycle["send_seconds"] else 0.0
+        self.last_cycle = cycle
+        self.cycles_completed += 1
+        
+        if attempted:
+            print(f"📊 Reminder cycle: {cycle['sent']}/{attempted} sent in {cycle['duration_seconds']}s "
+                  f"({cycle['reminders_per_second']}/s while sending)")
+        if duration > self.check_interval_minutes * 60:
+            print(f"⚠️ Reminder cycle took {duration:.0f}s, longer than the {self.check_interval_minutes} minute interval")
+    
     async def _process_reminders(self):
-        """Check for appointments needing reminders and schedule them"""
+        """Check for appointments needing reminders, create their records in bulk and send them"""
         try:
             print("📅 Checking for appointments needing reminders...")
             
@@ -105,6 +159,7 @@ class AppointmentReminderService:
             appointments = await self.db.get_appointments_needing_reminders(
                 hours_before=self.default_hours_before
             )
+            self._cycle["appointments_checked"] = len(appointments)
             
             if not appointments:
                 print("📅 No appointments need reminders at this time")
@@ -112,144 +167,187 @@ class AppointmentReminderService:
             
             print(f"📅 Found {len(appointments)} appointments needing reminders")
             
+            reminder_rows = []
             for appointment in appointments:
                 try:
-                    await self._create_and_send_reminder(appointment)
+                    reminder_data = self._build_reminder(appointment)
+                    if reminder_data:
+                        reminder_rows.append(reminder_data)
                 except Exception as e:
-                    print(f"❌ Error processing reminder for appointment: {e}")
+                    print(f"❌ Error preparing reminder for appointment: {e}")
                     continue
-                
-                # Small delay between sends to avoid rate limiting
-                await asyncio.sleep(1)
+            
+            if not reminder_rows:
+                return
+            
+            lease_until = self._lease_until(len(reminder_rows))
+            for row in reminder_rows:
+                row["next_retry_at"] = lease_until
+            
+            # Create all reminder records before sending: a crash mid-cycle leaves them
+            # pending for the retry queue instead of losing them. They are created leased to
+            # this worker, so other workers' retry queues leave them alone while they are sent
+            reminders = await self.db.create_appointment_reminders(reminder_rows)
+            self._cycle["reminders_created"] += len(reminders)
+            if len(reminders) < len(reminder_rows):
+                print(f"❌ Failed to create {len(reminder_rows) - len(reminders)} reminder records")
+            
+            await self._send_batch(reminders)
                 
         except Exception as e:
             print(f"❌ Error processing reminders: {e}")
     
-    async def _create_and_send_reminder(self, appointment: Dict[str, Any]):
-        """Create a reminder record and send the WhatsApp message"""
-        try:
-            # Calculate scheduled send time (24 hours before appointment)
-            appointment_date = datetime.strptime(
-                appointment["appointment_date"], "%Y-%m-%d"
-            ).date()
-            
-            # Get appointment time or default to 9:00 AM
-            appointment_time_str = appointment.get("appointment_time")
-            if appointment_time_str:
+    def _build_reminder(self, appointment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Reminder record for an appointment whose reminder is due, or None if it is not due yet"""
+        # Calculate scheduled send time (24 hours before appointment)
+        appointment_date = datetime.strptime(
+            appointment["appointment_date"], "%Y-%m-%d"
+        ).date()
+        
+        # Get appointment time or default to 9:00 AM
+        appointment_time_str = appointment.get("appointment_time")
+        if appointment_time_str:
+            try:
+                if isinstance(appointment_time_str, str):
+                    appointment_time = datetime.strptime(
+                        appointment_time_str, "%H:%M:%S"
+                    ).time()
+                else:
+                    appointment_time = appointment_time_str
+            except:
                 try:
-                    if isinstance(appointment_time_str, str):
-                        appointment_time = datetime.strptime(
-                            appointment_time_str, "%H:%M:%S"
-                        ).time()
-                    else:
-                        appointment_time = appointment_time_str
+                    appointment_time = datetime.strptime(
+                        appointment_time_str, "%H:%M"
+                    ).time()
                 except:
-                    try:
-                        appointment_time = datetime.strptime(
-                            appointment_time_str, "%H:%M"
-                        ).time()
-                    except:
-                        appointment_time = datetime.strptime("09:00", "%H:%M").time()
-            else:
-                appointment_time = datetime.strptime("09:00", "%H:%M").time()
-            
-            appointment_datetime = datetime.combine(appointment_date, appointment_time)
-            appointment_datetime = appointment_datetime.replace(tzinfo=timezone.utc)
-            
-            # Scheduled send time is 24 hours before
-            scheduled_send_time = appointment_datetime - timedelta(hours=self.default_hours_before)
-            
-            # Only create and send reminder if:
-            # - Scheduled time is in the past or within 30 minutes from now
-            # - This catches appointments that need to be sent now
-            now = datetime.now(timezone.utc)
-            time_until_send = scheduled_send_time - now
-            
-            # Skip if reminder should be sent more than 30 minutes from now
-            # The service runs every 15 mins, so 30 mins gives buffer
-            if time_until_send > timedelta(minutes=30):
-                print(f"⏰ Appointment for {appointment['patient_name']} on {appointment_date}: reminder scheduled in {time_until_send}")
-                return  # Don't create record yet, will catch it in a later run
-            
-            # Generate the message
-            message = self._generate_reminder_message(appointment)
-            
-            # Create reminder record
-            reminder_data = {
-                "visit_id": appointment.get("visit_id"),
-                "appointment_id": appointment.get("appointment_id"),
-                "patient_id": appointment["patient_id"],
-                "doctor_firebase_uid": appointment["doctor_firebase_uid"],
-                "appointment_date": appointment["appointment_date"],
-                "appointment_time": appointment_time_str,
-                "patient_name": appointment["patient_name"],
-                "patient_phone": appointment["patient_phone"],
-                "doctor_name": appointment["doctor_name"],
-                "hospital_name": appointment.get("hospital_name"),
-                "reminder_type": "24h_before",
-                "scheduled_send_time": scheduled_send_time.isoformat(),
+                    appointment_time = datetime.strptime("09:00", "%H:%M").time()
+        else:
+            appointment_time = datetime.strptime("09:00", "%H:%M").time()
+        
+        appointment_datetime = datetime.combine(appointment_date, appointment_time)
+        appointment_datetime = appointment_datetime.replace(tzinfo=timezone.utc)
+        
+        # Scheduled send time is 24 hours before
+        scheduled_send_time = appointment_datetime - timedelta(hours=self.default_hours_before)
+        
+        # Only create and send reminder if:
+        # - Scheduled time is in the past or within 30 minutes from now
+        # - This catches appointments that need to be sent now
+        now = datetime.now(timezone.utc)
+        time_until_send = scheduled_send_time - now
+        
+        # Skip if reminder should be sent more than 30 minutes from now
+        # The service runs every 15 mins, so 30 mins gives buffer
+        if time_until_send > timedelta(minutes=30):
+            print(f"⏰ Appointment for {appointment['patient_name']} on {appointment_date}: reminder scheduled in {time_until_send}")
+            return None  # Don't create record yet, will catch it in a later run
+        
+        return {
+            "visit_id": appointment.get("visit_id"),
+            "appointment_id": appointment.get("appointment_id"),
+            "patient_id": appointment["patient_id"],
+            "doctor_firebase_uid": appointment["doctor_firebase_uid"],
+            "appointment_date": appointment["appointment_date"],
+            "appointment_time": appointment_time_str,
+            "patient_name": appointment["patient_name"],
+            "patient_phone": appointment["patient_phone"],
+            "doctor_name": appointment["doctor_name"],
+            "hospital_name": appointment.get("hospital_name"),
+            "reminder_type": "24h_before",
+            "scheduled_send_time": scheduled_send_time.isoformat(),
+            "status": "pending",
+            "message_content": self._generate_reminder_message(appointment),
+            "created_at": now.isoformat()
+        }
+    
+    def _lease_seconds(self, count: int) -> int:
+        """Lease long enough to send `count` reminders at this worker's rate, plus lock_seconds"""
+        return self.lock_seconds + int(count / self.rate_limiter.rate)
+    
+    def _lease_until(self, count: int = 1) -> str:
+        """next_retry_at for reminders this worker is about to send"""
+        return (datetime.now(timezone.utc) + timedelta(seconds=self._lease_seconds(count))).isoformat()
+    
+    async def _send_batch(self, reminders: List[Dict[str, Any]]) -> None:
+        """
+        Send reminders with at most send_concurrency in flight, paced by the shared
+        WhatsApp rate limiter, then record all outcomes in one batch update.
+        """
+        if not reminders:
+            return
+        
+        semaphore = asyncio.Semaphore(self.send_concurrency)
+        
+        async def send(reminder: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    await self.rate_limiter.acquire()
+                    print(f"📤 Sending reminder to {reminder['patient_phone']}...")
+                    result = await self.whatsapp.send_message(
+                        to_phone=reminder["patient_phone"],
+                        message=reminder.get("message_content") or self._generate_reminder_message(reminder)
+                    )
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+                return {"id": reminder["id"], **self._result_update(result, (reminder.get("retry_count") or 0) + 1)}
+        
+        started = time.monotonic()
+        updates = await asyncio.gather(*(send(reminder) for reminder in reminders))
+        send_seconds = time.monotonic() - started
+        
+        await self.db.update_appointment_reminders(updates)
+        
+        sent = sum(1 for update in updates if update["status"] == "sent")
+        retrying = sum(1 for update in updates if update["status"] == "pending")
+        self._cycle["sent"] += sent
+        self._cycle["retrying"] += retrying
+        self._cycle["failed"] += len(updates) - sent - retrying
+        self._cycle["send_seconds"] += send_seconds
+        print(f"📨 Reminder batch: {sent}/{len(updates)} sent in {send_seconds:.1f}s ({retrying} to retry)")
+    
+    def _result_update(self, result: Dict[str, Any], retry_count: int) -> Dict[str, Any]:
+        """Reminder columns to update for a WhatsApp send result (retry_count counts this attempt)"""
+        if result.get("success"):
+            print(f"✅ Reminder sent successfully (ID: {result.get('message_id')})")
+            return {
+                "status": "sent",
+                "sent_at": datetime.now(timezone.utc).isoformat(),
+                "whatsapp_message_id": result.get("message_id"),
+                "whatsapp_status": result.get("status")
+            }
+        
+        error_msg = result.get("error", "Unknown error")
+        if retry_count < self.max_retries:
+            next_retry = datetime.now(timezone.utc) + timedelta(minutes=self.retry_delay_minutes)
+            print(f"⚠️ Reminder failed, will retry ({retry_count}/{self.max_retries}): {error_msg}")
+            return {
                 "status": "pending",
-                "message_content": message,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "error_message": error_msg,
+                "retry_count": retry_count,
+                "next_retry_at": next_retry.isoformat()
             }
-            
-            # Create the reminder record
-            reminder = await self.db.create_appointment_reminder(reminder_data)
-            
-            if not reminder:
-                print(f"❌ Failed to create reminder record for patient {appointment['patient_name']}")
-                return
-            
-            # Send immediately since we're within the 30-minute window
-            await self._send_reminder(reminder["id"], appointment["patient_phone"], message)
-                
-        except Exception as e:
-            print(f"❌ Error creating/sending reminder: {e}")
-            import traceback
-            traceback.print_exc()
+        
+        print(f"❌ Reminder failed after {self.max_retries} retries: {error_msg}")
+        return {
+            "status": "failed",
+            "error_message": error_msg
+        }
     
     async def _send_reminder(self, reminder_id: int, phone: str, message: str) -> bool:
-        """Send a WhatsApp reminder message"""
+        """Send a single WhatsApp reminder message (manual reminders)"""
         try:
             print(f"📤 Sending reminder to {phone}...")
             
             # Send via WhatsApp
+            await self.rate_limiter.acquire()
             result = await self.whatsapp.send_message(
                 to_phone=phone,
                 message=message
             )
             
-            if result.get("success"):
-                # Update reminder as sent
-                await self.db.update_appointment_reminder(reminder_id, {
-                    "status": "sent",
-                    "sent_at": datetime.now(timezone.utc).isoformat(),
-                    "whatsapp_message_id": result.get("message_id"),
-                    "whatsapp_status": result.get("status")
-                })
-                print(f"✅ Reminder sent successfully (ID: {result.get('message_id')})")
-                return True
-            else:
-                # Update reminder as failed
-                error_msg = result.get("error", "Unknown error")
-                retry_count = await self._increment_retry_count(reminder_id)
-                
-                if retry_count < self.max_retries:
-                    next_retry = datetime.now(timezone.utc) + timedelta(minutes=self.retry_delay_minutes)
-                    await self.db.update_appointment_reminder(reminder_id, {
-                        "status": "pending",
-                        "error_message": error_msg,
-                        "retry_count": retry_count,
-                        "next_retry_at": next_retry.isoformat()
-                    })
-                    print(f"⚠️ Reminder failed, will retry ({retry_count}/{self.max_retries}): {error_msg}")
-                else:
-                    await self.db.update_appointment_reminder(reminder_id, {
-                        "status": "failed",
-                        "error_message": error_msg
-                    })
-                    print(f"❌ Reminder failed after {self.max_retries} retries: {error_msg}")
-                return False
+            retry_count = 1 if result.get("success") else await self._increment_retry_count(reminder_id)
+            await self.db.update_appointment_reminder(reminder_id, self._result_update(result, retry_count))
+            return bool(result.get("success"))
                 
         except Exception as e:
             print(f"❌ Error sending reminder: {e}")
@@ -274,37 +372,14 @@ class AppointmentReminderService:
             return 1
     
     async def _process_retry_queue(self):
-        """Process reminders that need to be retried"""
+        """Send pending reminders that are due (new ones left over, or failed ones due for retry)"""
         try:
-            # Get pending reminders that are due for retry
-            pending = await self.db.get_pending_reminders()
+            # Claimed atomically: a failed send waits until next_retry_at, and rows another
+            # worker is sending stay leased to it
+            due = await self.db.claim_due_reminders(self._lease_seconds(self.claim_limit), self.claim_limit)
             
-            for reminder in pending:
-                try:
-                    # Check if it's time to send/retry
-                    scheduled_time = reminder.get("scheduled_send_time") or reminder.get("next_retry_at")
-                    if scheduled_time:
-                        if isinstance(scheduled_time, str):
-                            scheduled_dt = datetime.fromisoformat(scheduled_time.replace("Z", "+00:00"))
-                        else:
-                            scheduled_dt = scheduled_time
-                        
-                        if scheduled_dt > datetime.now(timezone.utc):
-                            continue  # Not time yet
-                    
-                    # Send the reminder
-                    await self._send_reminder(
-                        reminder["id"],
-                        reminder["patient_phone"],
-                        reminder.get("message_content") or self._generate_reminder_message(reminder)
-                    )
-                    
-                    # Small delay between sends
-                    await asyncio.sleep(1)
-                    
-                except Exception as e:
-                    print(f"❌ Error processing retry for reminder {reminder['id']}: {e}")
-                    continue
+            self._cycle["retries_due"] = len(due)
+            await self._send_batch(due)
                     
         except Exception as e:
             print(f"❌ Error processing retry queue: {e}")
@@ -461,6 +536,7 @@ _This is an automated reminder. Please do not reply to this message._"""
                 "reminder_type": "custom",
                 "scheduled_send_time": datetime.now(timezone.utc).isoformat(),
                 "status": "pending",
+                "next_retry_at": self._lease_until(),
                 "message_content": message,
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
@@ -527,7 +603,11 @@ _This is an automated reminder. Please do not reply to this message._"""
                 "default_hours_before": self.default_hours_before,
                 "pending_reminders": pending_count,
                 "sent_today": sent_today,
-                "failed_today": failed_today
+                "failed_today": failed_today,
+                "send_concurrency": self.send_concurrency,
+                "rate_limiter": self.rate_limiter.get_status(),
+                "cycles_completed": self.cycles_completed,
+                "last_cycle": self.last_cycle
             }
         except Exception as e:
             return {
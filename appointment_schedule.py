@@ -0,0 +1,120 @@
+"""
+Per-Doctor Day Schedule with Interval Lookup
+Sorted, merged busy intervals for one doctor on one day.
+Conflict checks are O(log n) via bisect and free-slot search is a single linear sweep.
+"""
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_time_to_minutes(time_str: str) -> int:
+    """Convert "HH:MM" or "HH:MM:SS" to minutes since midnight (seconds are ignored)"""
+    parts = time_str.strip().split(":")
+    if len(parts) < 2:
+        raise ValueError(f"Invalid time format: {time_str}")
+    hours, minutes = int(parts[0]), int(parts[1])
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time value: {time_str}")
+    return hours * 60 + minutes
+
+
+def format_minutes(minutes: int) -> str:
+    """Convert minutes since midnight to "HH:MM" """
+    minutes = max(0, min(minutes, MINUTES_PER_DAY))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class DaySchedule:
+    """
+    Busy intervals for a doctor on a single date.
+
+    Appointments are stored as half-open [start, end) minute ranges and merged into
+    a sorted, non-overlapping list so a conflict check is one bisect plus one comparison.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]]):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+        for start, end in sorted(i for i in intervals if i[1] > i[0]):
+            if self._ends and start < self._ends[-1]:
+                # Overlaps the previous busy block - extend it
+                self._ends[-1] = max(self._ends[-1], end)
+            elif self._ends and start == self._ends[-1]:
+                # Back-to-back appointments form one continuous busy block
+                self._ends[-1] = end
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    @classmethod
+    def from_appointments(
+        cls,
+        appointments: Iterable[Dict[str, Any]],
+        exclude_appointment_id: Optional[int] = None,
+        default_duration: int = 30
+    ) -> "DaySchedule":
+        """Build a schedule from appointment rows (appointment_time, duration_minutes)"""
+        intervals = []
+        for apt in appointments:
+            if exclude_appointment_id and apt.get("id") == exclude_appointment_id:
+                continue
+            if not apt.get("appointment_time"):
+                continue
+            start = parse_time_to_minutes(apt["appointment_time"])
+            duration = apt.get("duration_minutes") or default_duration
+            intervals.append((start, start + int(duration)))
+        return cls(intervals)
+
+    @property
+    def busy_blocks(self) -> List[Tuple[int, int]]:
+        """Merged busy intervals as (start_minute, end_minute) pairs"""
+        return list(zip(self._starts, self._ends))
+
+    def has_conflict(self, start: int, end: int) -> bool:
+        """True if [start, end) overlaps any busy block (O(log n))"""
+        # Last busy block starting before the requested end is the only candidate
+        idx = bisect_left(self._starts, end) - 1
+        return idx >= 0 and self._ends[idx] > start
+
+    def free_slots(
+        self,
+        day_start: int,
+        day_end: int,
+        slot_minutes: int,
+        step_minutes: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        All bookable [start, start + slot_minutes) slots inside [day_start, day_end).
+
+        Args:
+            day_start: Working-day start in minutes since midnight
+            day_end: Working-day end in minutes since midnight
+            slot_minutes: Length of the slot to book
+            step_minutes: Spacing between candidate slot starts (defaults to slot_minutes)
+        """
+        step = step_minutes or slot_minutes
+        slots: List[Tuple[int, int]] = []
+        if slot_minutes <= 0 or step <= 0 or day_end <= day_start:
+            return slots
+
+        cursor = day_start
+        # Skip busy blocks that finish before the working day starts
+        idx = bisect_left(self._ends, day_start + 1)
+
+        while cursor + slot_minutes <= day_end:
+            if idx < len(self._starts) and self._starts[idx] < cursor + slot_minutes:
+                # Slot would overlap this block: jump past it on the step grid
+                block_end = self._ends[idx]
+                if block_end > cursor:
+                    steps = -(-(block_end - day_start) // step)
+                    cursor = day_start + steps * step
+                idx += 1
+                continue
+            slots.append((cursor, cursor + slot_minutes))
+            cursor += step
+
+        return slots
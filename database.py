@@ -1,10 +1,18 @@
 from supabase import AsyncClient
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable
 import traceback
 import asyncio
 from datetime import datetime, timezone
 from optimized_cache import optimized_cache
+from cache_change_feed import cache_change_feed, cache_tag
+from alert_service import ALERT_SEVERITY_LEVELS, alert_cache_keys, fetch_alert_counts
+from push_channel import push_hub, EVENT_NOTIFICATION, EVENT_ALERTS_CREATED, EVENT_ALERTS_ACKNOWLEDGED, alert_event_rows
 from thread_pool_manager import get_executor
+from appointment_schedule import DaySchedule, parse_time_to_minutes, format_minutes
+
+# Statuses of ai_analysis_queue rows
+AI_QUEUE_STATUSES = ("pending", "processing", "completed", "failed", "dead_letter")
+
 
 class DatabaseManager:
     def __init__(self, supabase_client: AsyncClient, enable_cache: bool = True):
@@ -19,6 +27,35 @@ class DatabaseManager:
         if self.cache:
             print("✅ Optimized query cache enabled (5000 entries, 200MB)")
     
+    # Streaming / paginated reads
+    async def iter_paginated(
+        self,
+        build_query: Callable[[], Any],
+        page_size: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield rows from a Supabase query one page at a time.
+        
+        build_query must return a fresh, deterministically ordered query builder
+        on every call (postgrest builders are mutated by .range()). Memory use is
+        bounded by page_size regardless of the total result size.
+        """
+        offset = 0
+        while True:
+            try:
+                response = await build_query().range(offset, offset + page_size - 1).execute()
+            except Exception as e:
+                print(f"Error fetching page at offset {offset}: {e}")
+                raise
+            
+            rows = response.data or []
+            for row in rows:
+                yield row
+            
+            if len(rows) < page_size:
+                break
+            offset += page_size
+
     # Doctor related operations
     async def get_doctor_by_firebase_uid(self, firebase_uid: str) -> Optional[Dict[str, Any]]:
         """Get doctor by Firebase UID (CACHED)"""
@@ -32,6 +69,9 @@ class DatabaseManager:
             
             print(f"Fetching doctor by Firebase UID: {firebase_uid}")
             
+            # Taken before the query: a doctors change event during it keeps the row out of the cache
+            generation = self.cache.generation() if self.cache else None
+            
             # Async Supabase call
             response = await self.supabase.table("doctors").select("*").eq("firebase_uid", firebase_uid).execute()
             print(f"Supabase response for UID lookup: {response}")
@@ -41,7 +81,11 @@ class DatabaseManager:
             # Cache result
             if self.cache and result:
                 cache_key = f"doctor_uid:{firebase_uid}"
-                await self.cache.set(cache_key, result, ttl=600)  # Cache for 10 minutes
+                # 10 minutes, or hours while the change feed evicts it on any doctors write
+                await self.cache.set(
+                    cache_key, result, ttl=cache_change_feed.ttl(600),
+                    tags=[cache_tag("doctors", "firebase_uid", firebase_uid)], generation=generation
+                )
             
             return result
         except Exception as e:
@@ -95,8 +139,8 @@ class DatabaseManager:
 
             # Invalidate cache for the updated doctor
             if self.cache:
-                await self.cache.delete(f"doctor_uid_{firebase_uid}")
-                print(f"Cache invalidated for doctor_uid_{firebase_uid}")
+                await self.cache.invalidate_tags([cache_tag("doctors", "firebase_uid", firebase_uid)])
+                print(f"Cache invalidated for doctor_uid:{firebase_uid}")
 
             # If lab phone numbers are in the update, sync the lab_contacts table
             if 'pathology_lab_phone' in update_data:
@@ -198,6 +242,9 @@ class DatabaseManager:
                 if cached_result is not None:
                     return cached_result
             
+            # Taken before the query: a patients change event during it keeps the row out of the cache
+            generation = self.cache.generation() if self.cache else None
+            
             # Async Supabase call
             response = await self.supabase.table("patients").select("*").eq("id", patient_id).eq("created_by_doctor", doctor_firebase_uid).execute()
             
@@ -206,7 +253,11 @@ class DatabaseManager:
             # Cache result
             if self.cache and result:
                 cache_key = f"patient:{patient_id}:{doctor_firebase_uid}"
-                await self.cache.set(cache_key, result, ttl=600)  # Cache for 10 minutes
+                # 10 minutes, or hours while the change feed evicts it on any patients write
+                await self.cache.set(
+                    cache_key, result, ttl=cache_change_feed.ttl(600),
+                    tags=[cache_tag("patients", "id", patient_id)], generation=generation
+                )
             
             return result
         except Exception as e:
@@ -258,6 +309,10 @@ class DatabaseManager:
         try:
             # Async Supabase call
             response = await self.supabase.table("patients").update(update_data).eq("id", patient_id).eq("created_by_doctor", doctor_firebase_uid).execute()
+            
+            if response.data and self.cache:
+                await self.cache.invalidate_tags([cache_tag("patients", "id", patient_id)])
+            
             return bool(response.data)
         except Exception as e:
             print(f"Error updating patient: {e}")
@@ -309,7 +364,7 @@ class DatabaseManager:
             # Cache result
             if self.cache and result:
                 cache_key = f"visit:{visit_id}:{doctor_firebase_uid}"
-                await self.cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
+                await self.cache.set(cache_key, result, ttl=300, tags=[cache_tag("visits", "id", visit_id)])  # Cache for 5 minutes
             
             return result
         except Exception as e:
@@ -574,7 +629,7 @@ class DatabaseManager:
             
             # Cache result
             if self.cache and result:
-                await self.cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
+                await self.cache.set(cache_key, result, ttl=300, tags=[cache_tag("ai_document_analysis", "report_id", report_id)])  # Cache for 5 minutes
             
             return result
         except Exception as e:
@@ -599,7 +654,7 @@ class DatabaseManager:
             # Cache result
             if self.cache:
                 cache_key = f"ai_analyses_visit:{visit_id}:{doctor_firebase_uid}"
-                await self.cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
+                await self.cache.set(cache_key, result, ttl=300, tags=[cache_tag("ai_document_analysis", "visit_id", visit_id)])  # Cache for 5 minutes
             
             return result
         except Exception as e:
@@ -623,13 +678,25 @@ class DatabaseManager:
             
             # Cache result
             if self.cache:
-                await self.cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
+                await self.cache.set(cache_key, result, ttl=300, tags=[cache_tag("ai_document_analysis", "patient_id", patient_id)])  # Cache for 5 minutes
             
             return result
         except Exception as e:
             print(f"Error fetching AI analyses by patient ID: {e}")
             return []
 
+    def iter_ai_analyses_by_patient_id(self, patient_id: int, doctor_firebase_uid: str, page_size: int = 200) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all AI analyses for a patient page by page (uncached, for large exports)"""
+        return self.iter_paginated(
+            lambda: self.supabase.table("ai_document_analysis")
+                .select("*")
+                .eq("patient_id", patient_id)
+                .eq("doctor_firebase_uid", doctor_firebase_uid)
+                .order("analyzed_at", desc=True)
+                .order("id", desc=True),
+            page_size=page_size
+        )
+
     async def create_consolidated_analysis(self, analysis_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create a consolidated AI analysis record"""
         try:
@@ -690,7 +757,7 @@ class DatabaseManager:
             
             if status == "processing":
                 update_data["started_at"] = datetime.now(timezone.utc).isoformat()
-            elif status in ["completed", "failed"]:
+            elif status in ["completed", "failed", "dead_letter"]:
                 update_data["completed_at"] = datetime.now(timezone.utc).isoformat()
             
             if error_message:
@@ -704,6 +771,186 @@ class DatabaseManager:
             print(f"Error updating AI analysis queue status: {e}")
             return False
 
+    async def record_failed_ai_analysis_attempt(
+        self,
+        queue_id: int,
+        status: str,
+        attempts: int,
+        error_class: str,
+        error_message: str,
+        next_attempt_at: Optional[str] = None
+    ) -> bool:
+        """
+        Record a failed attempt on a queue item.
+        status='pending' schedules a retry at next_attempt_at; 'failed' / 'dead_letter' close the item.
+        """
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            update_data = {
+                "status": status,
+                "attempts": attempts,
+                "last_error_class": error_class,
+                "error_message": error_message,
+                "batch_job_id": None,
+                "batch_owner": None,
+                "updated_at": now
+            }
+            
+            if status == "pending":
+                update_data["started_at"] = None
+                update_data["next_attempt_at"] = next_attempt_at or now
+            else:
+                update_data["completed_at"] = now
+            
+            response = await self.supabase.table("ai_analysis_queue").update(update_data).eq("id", queue_id).execute()
+            
+            return bool(response.data)
+        except Exception as e:
+            print(f"Error recording failed AI analysis attempt: {e}")
+            return False
+
+    async def requeue_dead_letter_ai_analyses(self, doctor_firebase_uid: str, queue_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """Move a doctor's dead-lettered queue items back to pending with a fresh attempt budget"""
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            query = self.supabase.table("ai_analysis_queue").update({
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "started_at": None,
+                "completed_at": None,
+                # The previous failure no longer describes a pending item
+                "last_error_class": None,
+                "error_message": None,
+                "updated_at": now
+            }).eq("doctor_firebase_uid", doctor_firebase_uid).eq("status", "dead_letter")
+            
+            if queue_ids:
+                query = query.in_("id", queue_ids)
+            
+            response = await query.execute()
+            return response.data if response.data else []
+        except Exception as e:
+            print(f"Error requeueing dead-letter AI analyses: {e}")
+            return []
+
+    async def get_pending_ai_analyses_for_lane(self, lane: str, limit: int = 200) -> List[Dict[str, Any]]:
+        """Get pending AI analysis tasks in a processing lane (interactive / batch), oldest first"""
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            response = await self.supabase.table("ai_analysis_queue").select("*").eq("lane", lane).eq("status", "pending").lte("next_attempt_at", now).order("priority", desc=True).order("queued_at").limit(limit).execute()
+            
+            return response.data if response.data else []
+        except Exception as e:
+            print(f"Error fetching pending {lane} AI analyses: {e}")
+            return []
+
+    async def get_ai_queue_candidates(self, lanes: List[str], per_doctor: int = 3, limit: int = 500) -> Dict[str, Any]:
+        """
+        Pending queue rows for the fair scheduler: the first few per (lane, doctor, priority)
+        plus the pending depth per lane (get_ai_queue_candidates RPC).
+        Falls back to the global head of the queue if the RPC is not installed.
+        """
+        try:
+            response = await self.supabase.rpc('get_ai_queue_candidates', {
+                'p_per_doctor': per_doctor,
+                'p_lanes': lanes,
+                'p_limit': limit
+            }).execute()
+            
+            data = response.data if isinstance(response.data, dict) else {}
+            return {"items": data.get("items") or [], "lane_depths": data.get("lane_depths") or {}}
+        except Exception as rpc_error:
+            print(f"⚠️ RPC function not available, using fallback (queue head): {rpc_error}")
+        
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            response = await self.supabase.table("ai_analysis_queue").select("*").eq("status", "pending").in_("lane", lanes).lte("next_attempt_at", now).order("priority", desc=True).order("queued_at").limit(limit).execute()
+            
+            return {"items": response.data if response.data else [], "lane_depths": None}
+        except Exception as e:
+            print(f"Error fetching AI queue candidates: {e}")
+            return {"items": [], "lane_depths": None}
+
+    async def claim_ai_analyses_for_batch(self, queue_ids: List[int], batch_job_id: str, batch_owner: str) -> List[Dict[str, Any]]:
+        """Move pending queue items to processing under a batch job id and owner; returns the rows actually claimed"""
+        if not queue_ids:
+            return []
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            # Conditional on status so items claimed by another worker are skipped
+            response = await self.supabase.table("ai_analysis_queue").update({
+                "status": "processing",
+                "batch_job_id": batch_job_id,
+                "batch_owner": batch_owner,
+                "started_at": now,
+                "updated_at": now
+            }).in_("id", queue_ids).eq("status", "pending").execute()
+            
+            return response.data if response.data else []
+        except Exception as e:
+            print(f"Error claiming AI analyses for batch: {e}")
+            return []
+
+    async def set_ai_analysis_batch_job(self, queue_ids: List[int], batch_job_id: str, claim_id: str) -> bool:
+        """Record the submitted batch job id on queue items still held under claim_id"""
+        if not queue_ids:
+            return True
+        try:
+            response = await self.supabase.table("ai_analysis_queue").update({
+                "batch_job_id": batch_job_id,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }).in_("id", queue_ids).eq("batch_job_id", claim_id).execute()
+            
+            return bool(response.data)
+        except Exception as e:
+            print(f"Error setting AI analysis batch job: {e}")
+            return False
+
+    async def get_batched_ai_analyses(self, batch_owner: str) -> List[Dict[str, Any]]:
+        """Get queue items that are processing as part of a batch job of one owner"""
+        try:
+            response = await self.supabase.table("ai_analysis_queue").select("*").eq("status", "processing").eq("batch_owner", batch_owner).not_.is_("batch_job_id", "null").execute()
+            
+            return response.data if response.data else []
+        except Exception as e:
+            print(f"Error fetching batched AI analyses: {e}")
+            return []
+
+    async def take_ai_analysis_batch_job(self, batch_job_id: str, batch_owner: str, new_owner: str) -> List[Dict[str, Any]]:
+        """
+        Hand a finished job's items from a shared owner to one worker before its results
+        are stored; returns the rows taken (empty if another worker got there first).
+        """
+        try:
+            response = await self.supabase.table("ai_analysis_queue").update({
+                "batch_owner": new_owner,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }).eq("batch_job_id", batch_job_id).eq("batch_owner", batch_owner).eq("status", "processing").execute()
+            
+            return response.data if response.data else []
+        except Exception as e:
+            print(f"Error taking AI analysis batch job {batch_job_id}: {e}")
+            return []
+
+    async def release_ai_analyses_from_batch(self, queue_ids: List[int]) -> bool:
+        """Return batch queue items to pending so they are picked up again"""
+        if not queue_ids:
+            return True
+        try:
+            response = await self.supabase.table("ai_analysis_queue").update({
+                "status": "pending",
+                "batch_job_id": None,
+                "batch_owner": None,
+                "started_at": None,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }).in_("id", queue_ids).execute()
+            
+            return bool(response.data)
+        except Exception as e:
+            print(f"Error releasing batched AI analyses: {e}")
+            return False
+
     async def get_ai_analysis_summary(self, doctor_firebase_uid: str, patient_id: int = None, visit_id: int = None) -> Dict[str, Any]:
         """Get AI analysis summary using the database function"""
         try:
@@ -804,22 +1051,27 @@ class DatabaseManager:
             print(f"Error cleaning up queue items: {e}")
             return 0
 
-    async def cleanup_stale_processing_items(self, hours_stale: int = 2) -> int:
+    async def cleanup_stale_processing_items(self, hours_stale: int = 2, batch_hours_stale: int = 26) -> int:
         """
         Reset stale 'processing' items that got stuck (e.g., server crashed mid-processing).
         Items stuck in 'processing' for too long are reset to 'pending' for retry.
+        Batch-lane items (batch_job_id set) get batch_hours_stale instead, since a
+        batch prediction job may legitimately run for up to 24 hours.
         """
         try:
             from datetime import timedelta
-            cutoff_time = (datetime.now(timezone.utc) - timedelta(hours=hours_stale)).isoformat()
+            now = datetime.now(timezone.utc)
+            cutoff_time = (now - timedelta(hours=hours_stale)).isoformat()
+            batch_cutoff_time = (now - timedelta(hours=batch_hours_stale)).isoformat()
             
             # Find items stuck in processing
-            stale_response = await self.supabase.table("ai_analysis_queue").select("id").eq("status", "processing").lt("started_at", cutoff_time).execute()
+            stale_response = await self.supabase.table("ai_analysis_queue").select("id").eq("status", "processing").is_("batch_job_id", "null").lt("started_at", cutoff_time).execute()
+            stale_batch_response = await self.supabase.table("ai_analysis_queue").select("id").eq("status", "processing").not_.is_("batch_job_id", "null").lt("started_at", batch_cutoff_time).execute()
             
-            if not stale_response.data:
+            stale_ids = [item["id"] for item in (stale_response.data or []) + (stale_batch_response.data or [])]
+            if not stale_ids:
                 return 0
             
-            stale_ids = [item["id"] for item in stale_response.data]
             reset_count = 0
             
             for queue_id in stale_ids:
@@ -827,38 +1079,81 @@ class DatabaseManager:
                 update_response = await self.supabase.table("ai_analysis_queue").update({
                     "status": "pending",
                     "started_at": None,
+                    "batch_job_id": None,
+                    "batch_owner": None,
                     "error_message": "Reset from stale processing state",
                     "updated_at": datetime.now(timezone.utc).isoformat()
-                }).eq("id", queue_id).execute()
+                }).eq("id", queue_id).eq("status", "processing").execute()
                 
                 if update_response.data:
                     reset_count += 1
             
             if reset_count > 0:
-                print(f"🔄 Queue cleanup: Reset {reset_count} stale processing items (stuck > {hours_stale}h)")
+                print(f"🔄 Queue cleanup: Reset {reset_count} stale processing items (stuck > {hours_stale}h, batch lane > {batch_hours_stale}h)")
             
             return reset_count
         except Exception as e:
             print(f"Error resetting stale processing items: {e}")
             return 0
 
-    async def get_queue_stats(self, doctor_firebase_uid: str = None) -> Dict[str, int]:
-        """Get queue statistics for monitoring"""
+    async def get_queue_stats(self, doctor_firebase_uid: str = None, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Get queue statistics for monitoring (CACHED briefly)
+        
+        All status counts plus the age of the oldest pending item in one
+        statement (get_ai_queue_stats RPC); falls back to one count per status.
+        """
+        cache_key = f"ai_queue_stats:{doctor_firebase_uid or 'all'}"
         try:
-            stats = {"pending": 0, "processing": 0, "completed": 0, "failed": 0, "total": 0}
+            if self.cache and use_cache:
+                cached_result = await self.cache.get(cache_key)
+                if cached_result is not None:
+                    return cached_result
+            
+            try:
+                response = await self.supabase.rpc('get_ai_queue_stats', {
+                    'p_doctor_firebase_uid': doctor_firebase_uid
+                }).execute()
+                
+                data = response.data if isinstance(response.data, dict) else {}
+                counts = data.get("counts") or {}
+                oldest_pending = data.get("oldest_pending_queued_at")
+            except Exception as rpc_error:
+                print(f"⚠️ RPC get_ai_queue_stats not available, using fallback (count per status): {rpc_error}")
+                counts, oldest_pending = await self._get_queue_stats_fallback(doctor_firebase_uid)
             
-            for status_name in ["pending", "processing", "completed", "failed"]:
-                query = self.supabase.table("ai_analysis_queue").select("id", count="exact")
-                if doctor_firebase_uid:
-                    query = query.eq("doctor_firebase_uid", doctor_firebase_uid)
-                response = await query.eq("status", status_name).execute()
-                stats[status_name] = response.count if response.count else 0
+            stats = {status_name: counts.get(status_name, 0) for status_name in AI_QUEUE_STATUSES}
+            stats["total"] = sum(counts.values())
+            stats["oldest_pending_age_seconds"] = None
+            if oldest_pending:
+                oldest = datetime.fromisoformat(oldest_pending.replace("Z", "+00:00"))
+                stats["oldest_pending_age_seconds"] = int((datetime.now(timezone.utc) - oldest).total_seconds())
+            
+            if self.cache:
+                await self.cache.set(cache_key, stats, ttl=15)  # Short TTL, monitoring only
             
-            stats["total"] = sum(stats[s] for s in ["pending", "processing", "completed", "failed"])
             return stats
         except Exception as e:
             print(f"Error getting queue stats: {e}")
-            return {"pending": 0, "processing": 0, "completed": 0, "failed": 0, "total": 0}
+            return {**{status_name: 0 for status_name in AI_QUEUE_STATUSES}, "total": 0, "oldest_pending_age_seconds": None}
+
+    async def _get_queue_stats_fallback(self, doctor_firebase_uid: str = None):
+        """Per-status counts used when the get_ai_queue_stats RPC is unavailable"""
+        counts = {}
+        for status_name in AI_QUEUE_STATUSES:
+            query = self.supabase.table("ai_analysis_queue").select("id", count="exact")
+            if doctor_firebase_uid:
+                query = query.eq("doctor_firebase_uid", doctor_firebase_uid)
+            response = await query.eq("status", status_name).execute()
+            counts[status_name] = response.count if response.count else 0
+        
+        query = self.supabase.table("ai_analysis_queue").select("queued_at").eq("status", "pending")
+        if doctor_firebase_uid:
+            query = query.eq("doctor_firebase_uid", doctor_firebase_uid)
+        response = await query.order("queued_at").limit(1).execute()
+        oldest_pending = response.data[0]["queued_at"] if response.data else None
+        
+        return counts, oldest_pending
 
     # =========================================================================
     # CLINICAL ALERTS (AI-GENERATED)
@@ -870,15 +1165,14 @@ class DatabaseManager:
             response = await self.supabase.table("ai_clinical_alerts").insert(alert_data).execute()
             
             if response.data:
-                # Invalidate related caches
-                if self.cache:
-                    doctor_uid = alert_data.get("doctor_firebase_uid")
-                    patient_id = alert_data.get("patient_id")
-                    if doctor_uid:
-                        await self.cache.delete(f"alerts_doctor:{doctor_uid}")
-                        await self.cache.delete(f"alert_counts:{doctor_uid}")
-                    if patient_id and doctor_uid:
-                        await self.cache.delete(f"alerts_patient:{patient_id}:{doctor_uid}")
+                # Invalidate related caches (counters are updated by the table trigger)
+                doctor_uid = alert_data.get("doctor_firebase_uid")
+                if doctor_uid:
+                    await self._invalidate_alert_caches(doctor_uid, [alert_data.get("patient_id")])
+                    await push_hub.publish(doctor_uid, EVENT_ALERTS_CREATED, {
+                        "patient_id": alert_data.get("patient_id"),
+                        "alerts": alert_event_rows(response.data)
+                    })
                 
                 return response.data[0]
             return None
@@ -927,63 +1221,80 @@ class DatabaseManager:
             
             # Cache result
             if self.cache:
-                await self.cache.set(cache_key, result, ttl=60)  # Cache for 1 minute (alerts change frequently)
+                await self.cache.set(
+                    cache_key, result, ttl=60,  # Cache for 1 minute (alerts change frequently)
+                    tags=[cache_tag("ai_clinical_alerts", "doctor_firebase_uid", doctor_firebase_uid)]
+                )
             
             return result
         except Exception as e:
             print(f"Error getting unacknowledged alerts: {e}")
             return []
 
-    async def get_alert_counts(self, doctor_firebase_uid: str) -> Dict[str, int]:
-        """Get alert counts by severity for a doctor (CACHED)"""
+    async def _invalidate_alert_caches(self, doctor_firebase_uid: str, patient_ids: List[Any] = ()) -> None:
+        """Drop every cached alert list / count an alert write for these patients made stale"""
+        if self.cache:
+            for key in alert_cache_keys(doctor_firebase_uid, patient_ids):
+                await self.cache.delete(key)
+
+    async def get_alert_counts(self, doctor_firebase_uid: str, patient_id: Optional[int] = None) -> Dict[str, int]:
+        """Get open alert counts by severity for a doctor or one of their patients (CACHED)"""
+        empty_counts = {**{severity: 0 for severity in ALERT_SEVERITY_LEVELS}, "total": 0}
         try:
+            cache_key = f"alert_counts:{doctor_firebase_uid}"
+            if patient_id:
+                cache_key += f":{patient_id}"
+            
             # Check cache first
             if self.cache:
-                cache_key = f"alert_counts:{doctor_firebase_uid}"
                 cached_result = await self.cache.get(cache_key)
                 if cached_result is not None:
                     return cached_result
             
-            # Try to use the database function
+            # Single-row read of the trigger-maintained counters
+            try:
+                result = await fetch_alert_counts(self.supabase, doctor_firebase_uid, patient_id)
+            except Exception as counter_error:
+                print(f"⚠️ Alert counters not available, using fallback ({counter_error})")
+                result = await self._count_alerts_fallback(doctor_firebase_uid, patient_id)
+            
+            # Writes in this process invalidate explicitly, other writers through the change
+            # feed when it runs; the short TTL bounds staleness when it does not
+            if self.cache:
+                await self.cache.set(
+                    cache_key, result, ttl=15,
+                    tags=[cache_tag("ai_clinical_alerts", "doctor_firebase_uid", doctor_firebase_uid)]
+                )
+            
+            return result
+        except Exception as e:
+            print(f"Error getting alert counts: {e}")
+            return empty_counts
+
+    async def _count_alerts_fallback(self, doctor_firebase_uid: str, patient_id: Optional[int] = None) -> Dict[str, int]:
+        """Counts for databases without migrations/024_alert_counters.sql"""
+        counts = {**{severity: 0 for severity in ALERT_SEVERITY_LEVELS}, "total": 0}
+        if not patient_id:
             try:
                 response = await self.supabase.rpc(
                     "get_alert_counts",
                     {"p_doctor_firebase_uid": doctor_firebase_uid}
                 ).execute()
-                
-                if response.data and len(response.data) > 0:
-                    counts = response.data[0]
-                    result = {
-                        "high": counts.get("high_count", 0),
-                        "medium": counts.get("medium_count", 0),
-                        "low": counts.get("low_count", 0),
-                        "total": counts.get("total_count", 0)
-                    }
-                    
-                    # Cache result
-                    if self.cache:
-                        await self.cache.set(cache_key, result, ttl=60)
-                    
-                    return result
+                if response.data:
+                    row = response.data[0]
+                    for severity in ALERT_SEVERITY_LEVELS:
+                        counts[severity] = row.get(f"{severity}_count") or 0
+                    counts["total"] = row.get("total_count") or 0
+                    return counts
             except Exception as rpc_error:
                 print(f"RPC get_alert_counts failed, falling back to manual count: {rpc_error}")
-            
-            # Fallback: manual counting
-            alerts = await self.get_unacknowledged_alerts(doctor_firebase_uid, limit=1000)
-            counts = {"high": 0, "medium": 0, "low": 0, "total": 0}
-            for alert in alerts:
-                severity = alert.get("severity", "low")
-                counts[severity] = counts.get(severity, 0) + 1
-                counts["total"] += 1
-            
-            # Cache result
-            if self.cache:
-                await self.cache.set(cache_key, counts, ttl=60)
-            
-            return counts
-        except Exception as e:
-            print(f"Error getting alert counts: {e}")
-            return {"high": 0, "medium": 0, "low": 0, "total": 0}
+        
+        alerts = await self.get_unacknowledged_alerts(doctor_firebase_uid, patient_id=patient_id, limit=1000)
+        for alert in alerts:
+            severity = alert.get("severity", "low")
+            counts[severity] = counts.get(severity, 0) + 1
+            counts["total"] += 1
+        return counts
 
     async def acknowledge_alert(
         self, 
@@ -1010,10 +1321,15 @@ class DatabaseManager:
             
             success = len(response.data) > 0 if response.data else False
             
-            # Invalidate caches
-            if success and self.cache:
-                await self.cache.delete(f"alerts_doctor:{doctor_firebase_uid}")
-                await self.cache.delete(f"alert_counts:{doctor_firebase_uid}")
+            # Invalidate caches, including the acknowledged alert's patient
+            if success:
+                await self._invalidate_alert_caches(
+                    doctor_firebase_uid, [row.get("patient_id") for row in response.data]
+                )
+                await push_hub.publish(doctor_firebase_uid, EVENT_ALERTS_ACKNOWLEDGED, {
+                    "patient_id": response.data[0].get("patient_id"),
+                    "alerts": alert_event_rows(response.data)
+                })
             
             return success
         except Exception as e:
@@ -1043,10 +1359,12 @@ class DatabaseManager:
             count = len(response.data) if response.data else 0
             
             # Invalidate caches
-            if count > 0 and self.cache:
-                await self.cache.delete(f"alerts_doctor:{doctor_firebase_uid}")
-                await self.cache.delete(f"alerts_patient:{patient_id}:{doctor_firebase_uid}")
-                await self.cache.delete(f"alert_counts:{doctor_firebase_uid}")
+            if count > 0:
+                await self._invalidate_alert_caches(doctor_firebase_uid, [patient_id])
+                await push_hub.publish(doctor_firebase_uid, EVENT_ALERTS_ACKNOWLEDGED, {
+                    "patient_id": patient_id,
+                    "alerts": alert_event_rows(response.data)
+                })
             
             return count
         except Exception as e:
@@ -1215,7 +1533,7 @@ class DatabaseManager:
             # Cache result
             if self.cache:
                 cache_key = f"reports_visit:{visit_id}:{doctor_firebase_uid}"
-                await self.cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
+                await self.cache.set(cache_key, result, ttl=300, tags=[cache_tag("reports", "visit_id", visit_id)])  # Cache for 5 minutes
             
             return result
         except Exception as e:
@@ -1320,6 +1638,33 @@ class DatabaseManager:
                 "visits": []
             }
 
+    def iter_earnings_visits(
+        self,
+        doctor_firebase_uid: str,
+        start_date: str = None,
+        end_date: str = None,
+        payment_status: str = None,
+        visit_type: str = None,
+        page_size: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the billing rows behind an earnings report page by page"""
+        def build_query():
+            query = self.supabase.table("visits") \
+                .select("id, patient_id, visit_date, visit_type, consultation_fee, additional_charges, "
+                        "discount, total_amount, payment_status, payment_method, payment_date") \
+                .eq("doctor_firebase_uid", doctor_firebase_uid)
+            if start_date:
+                query = query.gte("visit_date", start_date)
+            if end_date:
+                query = query.lte("visit_date", end_date)
+            if payment_status:
+                query = query.eq("payment_status", payment_status)
+            if visit_type:
+                query = query.eq("visit_type", visit_type)
+            return query.order("visit_date", desc=True).order("id", desc=True)
+        
+        return self.iter_paginated(build_query, page_size=page_size)
+
     async def get_daily_earnings(self, doctor_firebase_uid: str, date: str) -> Dict[str, Any]:
         """Get earnings for a specific date"""
         return await self.get_earnings_report(doctor_firebase_uid, date, date)
@@ -1357,6 +1702,17 @@ class DatabaseManager:
             return []
 
     # PDF Template Management Methods
+    def _template_tag(self, doctor_firebase_uid: str) -> str:
+        return cache_tag("pdf_templates", "doctor_firebase_uid", doctor_firebase_uid)
+
+    def _template_cache_ttl(self) -> int:
+        # 10 minutes, or hours while the change feed evicts it on any pdf_templates write
+        return cache_change_feed.ttl(600)
+
+    async def _invalidate_template_caches(self, doctor_firebase_uid: Optional[str]) -> None:
+        if self.cache and doctor_firebase_uid:
+            await self.cache.invalidate_tags([self._template_tag(doctor_firebase_uid)])
+
     async def create_pdf_template(self, template_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create a new PDF template"""
         try:
@@ -1367,6 +1723,7 @@ class DatabaseManager:
             print(f"PDF template creation response: {response}")
             
             if response.data:
+                await self._invalidate_template_caches(template_data.get("doctor_firebase_uid"))
                 return response.data[0]
             return None
         except Exception as e:
@@ -1375,35 +1732,47 @@ class DatabaseManager:
             return None
 
     async def get_pdf_templates_by_doctor(self, doctor_firebase_uid: str) -> List[Dict[str, Any]]:
-        """Get all PDF templates for a doctor"""
+        """Get all PDF templates for a doctor (CACHED)"""
         try:
+            cache_key = f"pdf_templates:{doctor_firebase_uid}"
+            if self.cache:
+                cached_result = await self.cache.get(cache_key)
+                if cached_result is not None:
+                    return cached_result
+            
+            generation = self.cache.generation() if self.cache else None
+            
             # Async Supabase call
             response = await self.supabase.table("pdf_templates").select("*").eq("doctor_firebase_uid", doctor_firebase_uid).order("created_at", desc=True).execute()
-            return response.data if response.data else []
+            result = response.data if response.data else []
+            
+            if self.cache:
+                await self.cache.set(
+                    cache_key, result, ttl=self._template_cache_ttl(),
+                    tags=[self._template_tag(doctor_firebase_uid)], generation=generation
+                )
+            
+            return result
         except Exception as e:
             print(f"Error fetching PDF templates: {e}")
             return []
 
     async def get_pdf_template_by_id(self, template_id: int, doctor_firebase_uid: str) -> Optional[Dict[str, Any]]:
-        """Get a specific PDF template by ID"""
+        """Get a specific PDF template by ID (CACHED via the template list)"""
         try:
-            # Async Supabase call
-            response = await self.supabase.table("pdf_templates").select("*").eq("id", template_id).eq("doctor_firebase_uid", doctor_firebase_uid).execute()
-            if response.data:
-                return response.data[0]
-            return None
+            # Served from the doctor's cached template list
+            templates = await self.get_pdf_templates_by_doctor(doctor_firebase_uid)
+            return next((template for template in templates if str(template.get("id")) == str(template_id)), None)
         except Exception as e:
             print(f"Error fetching PDF template by ID: {e}")
             return None
 
     async def get_doctor_prescription_template(self, doctor_firebase_uid: str) -> Optional[Dict[str, Any]]:
-        """Get the default/first prescription template for a doctor"""
+        """Get the default/first prescription template for a doctor (CACHED via the template list)"""
         try:
-            # Get templates ordered by created_at, return the first one (most recent or default)
-            response = await self.supabase.table("pdf_templates").select("*").eq("doctor_firebase_uid", doctor_firebase_uid).order("created_at", desc=True).limit(1).execute()
-            if response.data:
-                return response.data[0]
-            return None
+            # Templates are ordered by created_at, return the first one (most recent or default)
+            templates = await self.get_pdf_templates_by_doctor(doctor_firebase_uid)
+            return templates[0] if templates else None
         except Exception as e:
             print(f"Error fetching doctor prescription template: {e}")
             return None
@@ -1413,6 +1782,7 @@ class DatabaseManager:
         try:
             # Async Supabase call
             response = await self.supabase.table("pdf_templates").update(update_data).eq("id", template_id).eq("doctor_firebase_uid", doctor_firebase_uid).execute()
+            await self._invalidate_template_caches(doctor_firebase_uid)
             return bool(response.data)
         except Exception as e:
             print(f"Error updating PDF template: {e}")
@@ -1423,6 +1793,7 @@ class DatabaseManager:
         try:
             # Async Supabase call
             response = await self.supabase.table("pdf_templates").delete().eq("id", template_id).eq("doctor_firebase_uid", doctor_firebase_uid).execute()
+            await self._invalidate_template_caches(doctor_firebase_uid)
             return bool(response.data)
         except Exception as e:
             print(f"Error deleting PDF template: {e}")
@@ -1750,7 +2121,7 @@ class DatabaseManager:
             # Cache result
             if self.cache:
                 cache_key = f"hw_notes_visit:{visit_id}:{doctor_firebase_uid}"
-                await self.cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
+                await self.cache.set(cache_key, result, ttl=300, tags=[cache_tag("handwritten_visit_notes", "visit_id", visit_id)])  # Cache for 5 minutes
             
             return result
         except Exception as e:
@@ -2092,6 +2463,7 @@ class DatabaseManager:
             
             if response.data:
                 print(f"Notification created: {response.data[0]['id']}")
+                await push_hub.publish(response.data[0].get("doctor_firebase_uid"), EVENT_NOTIFICATION, response.data[0])
                 return response.data[0]
             return None
         except Exception as e:
@@ -2332,6 +2704,63 @@ class DatabaseManager:
             print(f"Error ensuring lab contact exists: {e}")
             return None
 
+    async def ensure_lab_contacts_exist(self, doctor_uid: str, labs: List[Dict[str, str]]) -> Dict[str, Optional[int]]:
+        """
+        Batch version of ensure_lab_contact_exists.
+        Looks up the doctor's contacts once and creates only the missing ones.
+        
+        Args:
+            doctor_uid: Doctor's Firebase UID
+            labs: List of {"phone", "lab_name", "lab_type"} dicts
+            
+        Returns:
+            Mapping of phone -> lab contact ID (None if it could not be created)
+        """
+        contact_ids: Dict[str, Optional[int]] = {}
+        try:
+            existing_contacts = await self.get_doctor_lab_contacts(doctor_uid, active_only=False)
+            existing_by_phone = {c["contact_phone"]: c["id"] for c in existing_contacts}
+            
+            missing = []
+            for lab in labs:
+                phone = lab["phone"]
+                if phone in existing_by_phone:
+                    contact_ids[phone] = existing_by_phone[phone]
+                elif phone not in contact_ids:
+                    contact_ids[phone] = None
+                    missing.append({
+                        "doctor_firebase_uid": doctor_uid,
+                        "lab_type": lab["lab_type"],
+                        "lab_name": lab["lab_name"],
+                        "contact_phone": phone,
+                        "is_active": True
+                    })
+            
+            if missing:
+                response = await self.supabase.table("lab_contacts").insert(missing).execute()
+                for contact in response.data or []:
+                    contact_ids[contact["contact_phone"]] = contact["id"]
+                    print(f"Auto-created lab contact record for {contact.get('lab_name')} ({contact['contact_phone']})")
+            
+            return contact_ids
+        except Exception as e:
+            print(f"Error ensuring lab contacts exist: {e}")
+            return contact_ids
+
+    async def bulk_create_lab_report_requests(self, requests_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create several lab report upload requests in a single insert"""
+        if not requests_data:
+            return []
+        try:
+            # Async Supabase call - one round-trip for all rows
+            response = await self.supabase.table("lab_report_requests").insert(requests_data).execute()
+            created = response.data or []
+            print(f"Lab report requests created in bulk: {len(created)}")
+            return created
+        except Exception as e:
+            print(f"Error bulk creating lab report requests: {e}")
+            return []
+
     async def create_lab_report_request(self, request_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create a lab report upload request"""
         try:
@@ -2347,7 +2776,29 @@ class DatabaseManager:
             return None
 
     async def get_lab_report_requests_by_phone(self, phone: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get lab report requests for a lab contact by phone (supports both profile contacts and lab_contacts table)"""
+        """
+        Get lab report requests for a lab contact by phone (OPTIMIZED - SINGLE RPC)
+        
+        Resolves phone -> lab contacts / doctor profile lab phones -> requests with the
+        patient and visit join in one statement (get_lab_report_requests_for_phone).
+        Falls back to the multi-query path if the RPC is not installed.
+        """
+        try:
+            response = await self.supabase.rpc('get_lab_report_requests_for_phone', {
+                'p_phone': phone,
+                'p_status': status
+            }).execute()
+            
+            # RPC returns a JSONB array (empty array when nothing matches)
+            requests = response.data if isinstance(response.data, list) else []
+            print(f"✅ Found {len(requests)} lab report requests for phone {phone} (1 query)")
+            return requests
+        except Exception as rpc_error:
+            print(f"⚠️ RPC function not available, using fallback (multi-query method): {rpc_error}")
+            return await self._get_lab_report_requests_by_phone_fallback(phone, status)
+
+    async def _get_lab_report_requests_by_phone_fallback(self, phone: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Multi-query lookup used when the get_lab_report_requests_for_phone RPC is unavailable"""
         try:
             print(f"🔍 Fetching lab report requests for phone: {phone}, status: {status}")
             
@@ -2848,6 +3299,22 @@ class DatabaseManager:
             print(f"Error fetching pharmacy prescriptions: {e}")
             return []
 
+    async def get_patients_medication_profiles(self, patient_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Allergies, history and current medications for many patients in one query, keyed by patient id"""
+        try:
+            unique_ids = list({patient_id for patient_id in patient_ids if patient_id is not None})
+            if not unique_ids:
+                return {}
+            # Async Supabase call
+            response = await self.supabase.table("patients") \
+                .select("id, first_name, last_name, allergies, medical_history, current_medications") \
+                .in_("id", unique_ids) \
+                .execute()
+            return {patient["id"]: patient for patient in response.data or []}
+        except Exception as e:
+            print(f"Error fetching patient medication profiles: {e}")
+            return {}
+
     async def update_pharmacy_prescription(self, prescription_id: int, update_data: Dict[str, Any]) -> bool:
         """Update pharmacy prescription"""
         try:
@@ -2888,6 +3355,26 @@ class DatabaseManager:
             print(f"Error fetching pharmacy invoices: {e}")
             return []
 
+    def iter_pharmacy_invoices_by_pharmacy(
+        self,
+        pharmacy_id: int,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        page_size: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a pharmacy's invoices page by page, with the date range filtered in the database"""
+        def build_query():
+            query = self.supabase.table("pharmacy_invoices") \
+                .select("*") \
+                .eq("pharmacy_id", pharmacy_id)
+            if start_date:
+                query = query.gte("generated_at", start_date)
+            if end_date:
+                query = query.lte("generated_at", f"{end_date}T23:59:59.999999+00:00")
+            return query.order("generated_at", desc=True).order("id", desc=True)
+        
+        return self.iter_paginated(build_query, page_size=page_size)
+
     async def get_pharmacy_patient_summary_optimized(self, pharmacy_id: int, hospital_name: str) -> List[Dict[str, Any]]:
         """
         Get aggregated patient summary for pharmacy - OPTIMIZED via SQL function.
@@ -3200,6 +3687,32 @@ class DatabaseManager:
             print(f"Traceback: {traceback.format_exc()}")
             return []
 
+    async def iter_patients_with_doctor_info_by_hospital(self, hospital_name: str, page_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream patients with doctor info for a hospital page by page via the RPC"""
+        yielded_any = False
+        try:
+            rows = self.iter_paginated(
+                lambda: self.supabase.rpc('get_patients_with_doctor_info', {
+                    'hospital_name_param': hospital_name
+                }).order("id"),
+                page_size=page_size
+            )
+            async for patient in rows:
+                patient_data = dict(patient)
+                if 'doctor_name' not in patient_data:
+                    patient_data['doctor_name'] = f"{patient.get('doctor_first_name', '')} {patient.get('doctor_last_name', '')}".strip()
+                patient_data['doctor_specialization'] = patient.get('doctor_specialization', '')
+                patient_data['doctor_phone'] = patient.get('doctor_phone', '')
+                yielded_any = True
+                yield patient_data
+        except Exception as e:
+            if yielded_any:
+                raise
+            # RPC not available: fall back to the non-streaming path
+            print(f"⚠️ Paginated RPC unavailable, streaming from fallback: {e}")
+            for patient in await self.get_patients_with_doctor_info_by_hospital(hospital_name):
+                yield patient
+
     async def validate_doctor_belongs_to_hospital(self, doctor_firebase_uid: str, hospital_name: str) -> bool:
         """Validate that a doctor belongs to a specific hospital"""
         try:
@@ -3530,67 +4043,92 @@ class DatabaseManager:
             print(f"Error fetching appointment: {e}")
             return None
 
+    async def get_doctor_day_schedule(self, doctor_firebase_uid: str, appointment_date: str,
+                                      exclude_appointment_id: Optional[int] = None) -> DaySchedule:
+        """Load a doctor's non-cancelled appointments for a date into a sorted interval schedule"""
+        # Async Supabase call
+        response = await self.supabase.table("appointments") \
+            .select("id, appointment_time, duration_minutes") \
+            .eq("doctor_firebase_uid", doctor_firebase_uid) \
+            .eq("appointment_date", appointment_date) \
+            .neq("status", "cancelled") \
+            .execute()
+        
+        return DaySchedule.from_appointments(
+            response.data or [],
+            exclude_appointment_id=exclude_appointment_id
+        )
+
     async def check_appointment_conflicts(self, doctor_firebase_uid: str, appointment_date: str, 
                                         appointment_time: str, duration_minutes: int, 
                                         exclude_appointment_id: Optional[int] = None) -> bool:
-        """Check if an appointment conflicts with existing appointments"""
+        """
+        Check if an appointment conflicts with existing appointments (OPTIMIZED)
+        
+        Uses the check_appointment_conflict RPC (GiST index on appointments.time_range);
+        falls back to an in-memory DaySchedule with bisect lookup if the RPC is unavailable.
+        """
         try:
-            from datetime import datetime, timedelta
-            
-            # Parse the appointment time (handle both HH:MM and HH:MM:SS formats)
-            if len(appointment_time.split(':')) == 2:
-                apt_time = datetime.strptime(appointment_time, "%H:%M").time()
-            else:
-                apt_time = datetime.strptime(appointment_time, "%H:%M:%S").time()
-            
-            apt_datetime = datetime.combine(datetime.strptime(appointment_date, "%Y-%m-%d").date(), apt_time)
-            
-            # Calculate end time
-            end_datetime = apt_datetime + timedelta(minutes=duration_minutes)
-            end_time = end_datetime.time().strftime("%H:%M")
-            
-            print(f"Checking conflicts for doctor {doctor_firebase_uid} on {appointment_date} from {appointment_time} to {end_time}")
-            
-            # Get existing appointments for this doctor on this date
-            # Async Supabase call
-            response = await self.supabase.table("appointments") \
-                .select("id, appointment_time, duration_minutes, status") \
-                .eq("doctor_firebase_uid", doctor_firebase_uid) \
-                .eq("appointment_date", appointment_date) \
-                .neq("status", "cancelled") \
-                .execute()
+            start_minute = parse_time_to_minutes(appointment_time)
+            end_minute = start_minute + duration_minutes
+            print(f"Checking conflicts for doctor {doctor_firebase_uid} on {appointment_date} "
+                  f"from {format_minutes(start_minute)} to {format_minutes(end_minute)}")
             
-            existing_appointments = response.data if response.data else []
-            
-            # Check for conflicts
-            for existing_apt in existing_appointments:
-                # Skip the appointment we're updating
-                if exclude_appointment_id and existing_apt["id"] == exclude_appointment_id:
-                    continue
-                
-                # Calculate existing appointment time range (handle both HH:MM and HH:MM:SS formats)
-                existing_time_str = existing_apt["appointment_time"]
-                if len(existing_time_str.split(':')) == 2:
-                    existing_time = datetime.strptime(existing_time_str, "%H:%M").time()
-                else:
-                    existing_time = datetime.strptime(existing_time_str, "%H:%M:%S").time()
-                
-                existing_datetime = datetime.combine(datetime.strptime(appointment_date, "%Y-%m-%d").date(), existing_time)
-                existing_end_datetime = existing_datetime + timedelta(minutes=existing_apt["duration_minutes"])
-                
-                # Check for overlap
-                if (apt_datetime < existing_end_datetime and end_datetime > existing_datetime):
-                    print(f"Conflict found with appointment {existing_apt['id']}")
-                    return True
+            try:
+                response = await self.supabase.rpc('check_appointment_conflict', {
+                    'p_doctor_uid': doctor_firebase_uid,
+                    'p_appointment_date': appointment_date,
+                    'p_appointment_time': appointment_time,
+                    'p_duration_minutes': duration_minutes,
+                    'p_exclude_appointment_id': exclude_appointment_id
+                }).execute()
+                has_conflict = bool(response.data)
+            except Exception as rpc_error:
+                print(f"⚠️ RPC function not available, using in-memory schedule: {rpc_error}")
+                schedule = await self.get_doctor_day_schedule(
+                    doctor_firebase_uid, appointment_date, exclude_appointment_id
+                )
+                has_conflict = schedule.has_conflict(start_minute, end_minute)
             
-            print("No conflicts found")
-            return False
+            print("Conflict found" if has_conflict else "No conflicts found")
+            return has_conflict
             
         except Exception as e:
             print(f"Error checking appointment conflicts: {e}")
             print(f"Traceback: {traceback.format_exc()}")
             return True  # Return True to be safe if we can't check
 
+    async def get_doctor_free_slots(self, doctor_firebase_uid: str, appointment_date: str,
+                                    slot_minutes: int = 30, day_start: str = "09:00",
+                                    day_end: str = "18:00", step_minutes: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Find every bookable slot for a doctor on a date (single query + one sweep)
+        
+        Returns:
+            Dict with the free slots and the merged busy blocks for the day
+        """
+        schedule = await self.get_doctor_day_schedule(doctor_firebase_uid, appointment_date)
+        slots = schedule.free_slots(
+            parse_time_to_minutes(day_start),
+            parse_time_to_minutes(day_end),
+            slot_minutes,
+            step_minutes
+        )
+        
+        return {
+            "doctor_firebase_uid": doctor_firebase_uid,
+            "date": appointment_date,
+            "slot_minutes": slot_minutes,
+            "free_slots": [
+                {"start_time": format_minutes(start), "end_time": format_minutes(end)}
+                for start, end in slots
+            ],
+            "busy_blocks": [
+                {"start_time": format_minutes(start), "end_time": format_minutes(end)}
+                for start, end in schedule.busy_blocks
+            ]
+        }
+
     async def get_appointment_statistics_by_hospital(self, hospital_name: str, start_date: str, end_date: str) -> Dict[str, Any]:
         """Get appointment statistics for a hospital"""
         try:
@@ -3680,7 +4218,7 @@ class DatabaseManager:
             result = response.data[0] if response.data else None
             
             if self.cache and result:
-                await self.cache.set(cache_key, result, ttl=600)
+                await self.cache.set(cache_key, result, ttl=600, tags=[cache_tag("patient_risk_scores", "patient_id", patient_id)])
             
             return result
         except Exception as e:
@@ -5020,18 +5558,100 @@ class DatabaseManager:
             print(f"Error updating appointment reminder: {e}")
             return None
 
-    async def get_pending_reminders(self) -> List[Dict[str, Any]]:
-        """Get all pending reminders that are due to be sent"""
+    async def create_appointment_reminders(self, reminders: List[Dict[str, Any]], chunk_size: int = 200) -> List[Dict[str, Any]]:
+        """
+        Insert reminder records in bulk; returns the created rows.
+        A chunk that fails (e.g. a reminder another worker already created) is retried row by row.
+        """
+        created = []
+        for start in range(0, len(reminders), chunk_size):
+            chunk = reminders[start:start + chunk_size]
+            try:
+                response = await self.supabase.table("appointment_reminders").insert(chunk).execute()
+                created.extend(response.data or [])
+            except Exception as e:
+                print(f"⚠️ Bulk reminder insert failed, inserting {len(chunk)} rows one by one: {e}")
+                rows = await asyncio.gather(*(self.create_appointment_reminder(row) for row in chunk))
+                created.extend(row for row in rows if row)
+        
+        if created:
+            print(f"✅ Created {len(created)} appointment reminders")
+        return created
+
+    async def update_appointment_reminders(self, updates: List[Dict[str, Any]]) -> int:
+        """
+        Apply several reminder updates (each a dict with "id" and the changed columns).
+        Returns the number of rows updated.
+        """
+        if not updates:
+            return 0
         try:
-            now = datetime.now(timezone.utc).isoformat()
+            response = await self.supabase.rpc('update_appointment_reminders_batch', {
+                'p_updates': updates
+            }).execute()
             
-            response = await self.supabase.table("appointment_reminders").select("*").eq(
-                "status", "pending"
-            ).lte("scheduled_send_time", now).order("scheduled_send_time").execute()
+            return response.data if isinstance(response.data, int) else len(updates)
+        except Exception as rpc_error:
+            print(f"⚠️ RPC function not available, using fallback (update per reminder): {rpc_error}")
+        
+        results = await asyncio.gather(*(
+            self.update_appointment_reminder(update["id"], {k: v for k, v in update.items() if k != "id"})
+            for update in updates
+        ))
+        return sum(1 for result in results if result)
+
+    async def claim_due_reminders(self, lock_seconds: int = 900, limit: int = 500) -> List[Dict[str, Any]]:
+        """
+        Claim pending reminders that are due (left over or due for retry) for this worker.
+        Claiming moves next_retry_at lock_seconds ahead so no other worker sends them meanwhile.
+        """
+        try:
+            response = await self.supabase.rpc('claim_appointment_reminders', {
+                'p_lock_seconds': lock_seconds,
+                'p_limit': limit
+            }).execute()
             
             return response.data if response.data else []
+        except Exception as rpc_error:
+            print(f"⚠️ RPC function not available, using fallback (select then conditional update): {rpc_error}")
+        
+        try:
+            from datetime import timedelta
+            now_dt = datetime.now(timezone.utc)
+            now = now_dt.isoformat()
+            lease_until = (now_dt + timedelta(seconds=lock_seconds)).isoformat()
+            
+            # Never attempted, or attempted and due again (failed send or expired lease)
+            fresh = await self.supabase.table("appointment_reminders").select("*").eq("status", "pending").lte(
+                "scheduled_send_time", now
+            ).is_("next_retry_at", "null").order("scheduled_send_time").limit(limit).execute()
+            retry = await self.supabase.table("appointment_reminders").select("*").eq("status", "pending").lte(
+                "scheduled_send_time", now
+            ).lte("next_retry_at", now).order("scheduled_send_time").limit(limit).execute()
+            
+            rows = sorted(
+                (fresh.data or []) + (retry.data or []),
+                key=lambda r: r.get("scheduled_send_time") or ""
+            )[:limit]
+            
+            claimed = []
+            for row in rows:
+                # Guarding on the next_retry_at that was read keeps two workers from claiming the same row
+                query = self.supabase.table("appointment_reminders").update({
+                    "next_retry_at": lease_until,
+                    "updated_at": now
+                }).eq("id", row["id"]).eq("status", "pending")
+                if row.get("next_retry_at"):
+                    query = query.eq("next_retry_at", row["next_retry_at"])
+                else:
+                    query = query.is_("next_retry_at", "null")
+                response = await query.execute()
+                
+                if response.data:
+                    claimed.append(response.data[0])
+            return claimed
         except Exception as e:
-            print(f"Error getting pending reminders: {e}")
+            print(f"Error claiming due reminders: {e}")
             return []
 
     async def get_reminder_history(self, doctor_firebase_uid: str, days: int = 7) -> List[Dict[str, Any]]:
@@ -5094,6 +5714,9 @@ class DatabaseManager:
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }).eq("firebase_uid", doctor_firebase_uid).execute()
             
+            if response.data and self.cache:
+                await self.cache.invalidate_tags([cache_tag("doctors", "firebase_uid", doctor_firebase_uid)])
+            
             return bool(response.data)
         except Exception as e:
             print(f"Error updating doctor reminder settings: {e}")
@@ -5115,3 +5738,125 @@ class DatabaseManager:
         except Exception as e:
             print(f"Error getting doctor reminder settings: {e}")
             return {"enabled": True, "hours_before": 24}
+
+    # ============================================================
+    # WHATSAPP OUTBOX METHODS
+    # ============================================================
+
+    async def enqueue_whatsapp_message(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Insert an outbox row unless its idempotency_key is already queued.
+        Returns the new or existing row with "deduplicated" set, or None if the outbox is unavailable.
+        """
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            row = {**message, "status": "pending", "next_attempt_at": now, "created_at": now, "updated_at": now}
+            response = await self.supabase.table("whatsapp_outbox").upsert(
+                row, on_conflict="idempotency_key", ignore_duplicates=True
+            ).execute()
+            
+            if response.data:
+                return {**response.data[0], "deduplicated": False}
+            
+            existing = await self.supabase.table("whatsapp_outbox").select("*").eq(
+                "idempotency_key", message["idempotency_key"]
+            ).limit(1).execute()
+            
+            if existing.data:
+                return {**existing.data[0], "deduplicated": True}
+            return None
+        except Exception as e:
+            print(f"Error enqueuing WhatsApp message: {e}")
+            return None
+
+    async def claim_whatsapp_outbox(self, worker_id: str, limit: int = 20, lock_seconds: int = 120) -> List[Dict[str, Any]]:
+        """Claim due outbox rows for a worker (status -> sending, attempts + 1)"""
+        try:
+            response = await self.supabase.rpc('claim_whatsapp_outbox', {
+                'p_worker': worker_id,
+                'p_limit': limit,
+                'p_lock_seconds': lock_seconds
+            }).execute()
+            
+            return response.data if response.data else []
+        except Exception as rpc_error:
+            print(f"⚠️ RPC function not available, using fallback (select then conditional update): {rpc_error}")
+        
+        try:
+            now_dt = datetime.now(timezone.utc)
+            now = now_dt.isoformat()
+            due = await self.supabase.table("whatsapp_outbox").select("*").eq("status", "pending").lte(
+                "next_attempt_at", now
+            ).order("next_attempt_at").limit(limit).execute()
+            
+            # Rows whose worker died mid-send, same as the RPC's expired-lock branch
+            from datetime import timedelta
+            stale_before = (now_dt - timedelta(seconds=lock_seconds)).isoformat()
+            expired = await self.supabase.table("whatsapp_outbox").select("*").eq("status", "sending").lt(
+                "locked_at", stale_before
+            ).order("next_attempt_at").limit(limit).execute()
+            
+            rows = sorted(
+                (due.data or []) + (expired.data or []),
+                key=lambda r: r.get("next_attempt_at") or ""
+            )[:limit]
+            
+            claimed = []
+            for row in rows:
+                # Guarding on the status (and lock) that was read keeps two workers from claiming the same row
+                query = self.supabase.table("whatsapp_outbox").update({
+                    "status": "sending",
+                    "attempts": (row.get("attempts") or 0) + 1,
+                    "locked_by": worker_id,
+                    "locked_at": now,
+                    "updated_at": now
+                }).eq("id", row["id"]).eq("status", row["status"])
+                if row["status"] == "sending":
+                    query = query.eq("locked_at", row["locked_at"])
+                response = await query.execute()
+                
+                if response.data:
+                    claimed.append(response.data[0])
+            return claimed
+        except Exception as e:
+            print(f"Error claiming WhatsApp outbox rows: {e}")
+            return []
+
+    async def update_whatsapp_outbox(self, outbox_id: int, worker_id: str, update_data: Dict[str, Any]) -> bool:
+        """Record the outcome of a send; only the worker holding the row may update it"""
+        try:
+            update_data = {**update_data, "updated_at": datetime.now(timezone.utc).isoformat()}
+            response = await self.supabase.table("whatsapp_outbox").update(update_data).eq(
+                "id", outbox_id
+            ).eq("locked_by", worker_id).execute()
+            
+            return bool(response.data)
+        except Exception as e:
+            print(f"Error updating WhatsApp outbox row {outbox_id}: {e}")
+            return False
+
+    async def get_whatsapp_outbox_message(self, outbox_id: int, doctor_firebase_uid: str) -> Optional[Dict[str, Any]]:
+        """Get one of a doctor's outbox rows"""
+        try:
+            response = await self.supabase.table("whatsapp_outbox").select(
+                "id, message_type, patient_id, to_phone, status, attempts, max_attempts, next_attempt_at, "
+                "provider_message_id, provider_status, last_error, last_error_class, created_at, updated_at, sent_at"
+            ).eq("id", outbox_id).eq("doctor_firebase_uid", doctor_firebase_uid).execute()
+            
+            return response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error getting WhatsApp outbox row: {e}")
+            return None
+
+    async def get_whatsapp_outbox_counts(self, doctor_firebase_uid: str) -> Dict[str, int]:
+        """Number of a doctor's outbox rows per status"""
+        counts = {}
+        try:
+            for status_name in ("pending", "sending", "sent", "failed", "dead_letter"):
+                response = await self.supabase.table("whatsapp_outbox").select(
+                    "id", count="exact"
+                ).eq("doctor_firebase_uid", doctor_firebase_uid).eq("status", status_name).limit(1).execute()
+                counts[status_name] = response.count or 0
+        except Exception as e:
+            print(f"Error counting WhatsApp outbox rows: {e}")
+        return counts
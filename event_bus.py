@@ -0,0 +1,320 @@
+"""
+Cross-Worker Event Bus
+Fans small JSON messages out to every uvicorn worker. Handlers subscribe to a
+channel; a message published on a channel in any worker reaches the handlers of
+that channel in all workers.
+
+Backends:
+- LocalEventBus: in-process only (single worker / development)
+- PostgresEventBus: Postgres LISTEN/NOTIFY over a direct psycopg2 connection
+  (EVENT_BUS_DATABASE_URL). Messages are limited to NOTIFY's 8000-byte payload.
+
+Messages published while a listener connection is down are lost for that
+worker; when the connection drops and again after it reconnects every handler
+receives RESYNC_MESSAGE so it can reload whatever it derives from the missed
+events.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fast_json import fast_dumps
+from rate_limiter import worker_count
+from thread_pool_manager import get_executor
+
+
+# Delivered to every channel's handlers when the listener drops and when it reconnects
+RESYNC_EVENT = "resync"
+RESYNC_MESSAGE = {"event": RESYNC_EVENT}
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+CHANNEL_PATTERN = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def encode_message(message: Dict[str, Any]) -> str:
+    """Compact JSON payload for a bus message (raises ValueError if too large)"""
+    payload = fast_dumps(message)
+    if len(payload) > MAX_PAYLOAD_BYTES:
+        raise ValueError(f"Event bus message is {len(payload)} bytes (limit {MAX_PAYLOAD_BYTES})")
+    return payload.decode("utf-8")
+
+
+class EventBus(ABC):
+    """Interface and handler registry shared by the backends"""
+
+    name = "base"
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        self.stats = {"published": 0, "received": 0, "handler_errors": 0, "resyncs": 0}
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        """Register an async handler for a channel (lower-case identifier)"""
+        if not CHANNEL_PATTERN.match(channel):
+            raise ValueError(f"Invalid event bus channel name: {channel!r}")
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        """Deliver a message to the channel's handlers in every worker"""
+
+    async def _dispatch(self, channel: str, message: Dict[str, Any]) -> None:
+        self.stats["received"] += 1
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(message)
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                print(f"⚠️ Event bus handler for '{channel}' failed: {e}")
+
+    async def _dispatch_resync(self) -> None:
+        self.stats["resyncs"] += 1
+        for channel in list(self._handlers):
+            await self._dispatch(channel, dict(RESYNC_MESSAGE))
+
+    def get_status(self) -> Dict[str, Any]:
+        return {"backend": self.name, "channels": sorted(self._handlers), **self.stats}
+
+
+class LocalEventBus(EventBus):
+    """Delivers messages to handlers in this process only"""
+
+    name = "local"
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        encode_message(message)  # same size limit as the cross-worker backend
+        self.stats["published"] += 1
+        await self._dispatch(channel, message)
+
+
+class PostgresEventBus(EventBus):
+    """
+    Postgres LISTEN/NOTIFY.
+
+    One autocommit connection per worker LISTENs on every subscribed channel and
+    is watched with loop.add_reader, so waiting for notifications costs no
+    thread. Publishing uses a second connection through the shared thread pool.
+    Publishers receive their own messages through the listener like every other
+    worker; if a publish fails the message is delivered locally instead.
+
+    Works with any Postgres that allows LISTEN, e.g. Supabase's direct (session
+    mode) connection string - not the transaction-mode pooler - or a local one.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, max_reconnect_delay: float = 60.0):
+        if not dsn:
+            raise ValueError("EVENT_BUS_DATABASE_URL is required for the postgres event bus")
+        import psycopg2
+        import psycopg2.extensions
+        super().__init__()
+        self._psycopg2 = psycopg2
+        self.dsn = dsn
+        self.max_reconnect_delay = max_reconnect_delay
+        self._listener = None
+        self._publisher = None
+        self._publisher_lock = threading.Lock()
+        self._inbox: Optional[asyncio.Queue] = None
+        self._lost: Optional[asyncio.Event] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.connected = False
+        self.stats.update({"reconnects": 0, "publish_failures": 0})
+
+    def _connect_sync(self):
+        conn = self._psycopg2.connect(
+            self.dsn,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
+            application_name="doctor-app-event-bus"
+        )
+        conn.set_isolation_level(self._psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _listen_sync(self, channels: List[str]) -> None:
+        with self._listener.cursor() as cur:
+            for channel in channels:
+                cur.execute(f'LISTEN "{channel}"')
+
+    def _notify_sync(self, channel: str, payload: str) -> None:
+        with self._publisher_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None or self._publisher.closed:
+                        self._publisher = self._connect_sync()
+                    with self._publisher.cursor() as cur:
+                        cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+                    return
+                except self._psycopg2.OperationalError:
+                    # Stale connection (server restart, idle timeout): reconnect once
+                    self._close_sync(self._publisher)
+                    self._publisher = None
+                    if attempt:
+                        raise
+
+    @staticmethod
+    def _close_sync(conn) -> None:
+        try:
+            if conn is not None and not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+
+    async def _run_sync(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), fn, *args)
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        is_new = channel not in self._handlers
+        super().subscribe(channel, handler)
+        if is_new and self.connected:
+            asyncio.ensure_future(self._run_sync(self._listen_sync, [channel]))
+
+    async def start(self) -> None:
+        self._stopping = False
+        self._inbox = asyncio.Queue()
+        self._lost = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in (self._supervisor, self._dispatcher):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._drop_listener()
+        with self._publisher_lock:
+            self._close_sync(self._publisher)
+            self._publisher = None
+
+    async def _supervise(self) -> None:
+        """Keep the listener connected, reconnecting with exponential backoff"""
+        delay = 1.0
+        had_connection = False
+        while not self._stopping:
+            try:
+                self._listener = await self._run_sync(self._connect_sync)
+                await self._run_sync(self._listen_sync, list(self._handlers))
+                self._lost.clear()
+                asyncio.get_running_loop().add_reader(self._listener.fileno(), self._on_readable)
+                self.connected = True
+                print(f"✅ Event bus listening on {len(self._handlers)} channel(s)")
+                if had_connection:
+                    self.stats["reconnects"] += 1
+                    await self._inbox.put(None)  # resync after anything missed while down
+                had_connection = True
+                delay = 1.0
+                await self._lost.wait()
+                await self._inbox.put(None)  # handlers stop trusting the feed until reconnected
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Event bus listener unavailable: {e}")
+            finally:
+                self._drop_listener()
+            if self._stopping:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _drop_listener(self) -> None:
+        self.connected = False
+        if self._listener is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._listener.fileno())
+            except Exception:
+                pass
+            self._close_sync(self._listener)
+            self._listener = None
+
+    def _on_readable(self) -> None:
+        """Reader callback: drain pending notifications into the inbox"""
+        try:
+            self._listener.poll()
+        except Exception as e:
+            print(f"⚠️ Event bus listener connection lost: {e}")
+            asyncio.get_running_loop().remove_reader(self._listener.fileno())
+            self.connected = False
+            self._lost.set()
+            return
+        while self._listener.notifies:
+            notify = self._listener.notifies.pop(0)
+            try:
+                message = json.loads(notify.payload)
+            except ValueError:
+                print(f"⚠️ Ignoring non-JSON event bus payload on '{notify.channel}'")
+                continue
+            self._inbox.put_nowait((notify.channel, message))
+
+    async def _dispatch_loop(self) -> None:
+        """Run handlers in arrival order, off the reader callback"""
+        while True:
+            item = await self._inbox.get()
+            if item is None:
+                await self._dispatch_resync()
+            else:
+                await self._dispatch(*item)
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        payload = encode_message(message)
+        try:
+            await self._run_sync(self._notify_sync, channel, payload)
+            self.stats["published"] += 1
+        except Exception as e:
+            self.stats["publish_failures"] += 1
+            print(f"⚠️ Event bus publish failed, delivering locally only: {e}")
+            await self._dispatch(channel, message)
+
+    def get_status(self) -> Dict[str, Any]:
+        status = super().get_status()
+        status["connected"] = self.connected
+        return status
+
+
+def create_event_bus() -> EventBus:
+    """
+    Build the bus selected by EVENT_BUS_BACKEND (local | postgres). When it is not set,
+    several workers (WEB_CONCURRENCY > 1) with EVENT_BUS_DATABASE_URL get the postgres bus.
+    """
+    database_url = os.getenv("EVENT_BUS_DATABASE_URL", "")
+    default_backend = "postgres" if worker_count() > 1 and database_url else "local"
+    backend_name = os.getenv("EVENT_BUS_BACKEND", default_backend).lower()
+    if backend_name == "postgres":
+        return PostgresEventBus(database_url)
+    return LocalEventBus()
+
+
+def warn_if_workers_split(bus: EventBus) -> bool:
+    """Print a prominent warning if a local bus runs under several workers; returns True if so"""
+    workers = worker_count()
+    if bus.name != "local" or workers <= 1:
+        return False
+    print("=" * 78)
+    print(f"⚠️  EVENT BUS IS LOCAL BUT WEB_CONCURRENCY={workers}")
+    print("⚠️  Push events (/events/stream) and cache evictions stay in the worker that")
+    print("⚠️  published them; clients connected to other workers will miss them.")
+    print("⚠️  Set EVENT_BUS_BACKEND=postgres and EVENT_BUS_DATABASE_URL, or run one worker.")
+    print("=" * 78)
+    return True
@@ -0,0 +1,153 @@
+"""
+Local Fake Gemini Client
+In-process stand-in for genai.Client (models.generate_content and caches.*) so the
+AI analysis paths, including context caching, can run offline. Enable with
+GEMINI_FAKE_MODEL=true. Responses are schema-shaped placeholder JSON and
+usage_metadata reports estimated prompt / cached token counts.
+"""
+import itertools
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from prompt_budget import estimate_tokens
+
+
+# Approximate token cost Gemini charges for one image / PDF page part
+BINARY_PART_TOKENS = 258
+
+
+def sample_from_schema(schema: Optional[Dict[str, Any]]) -> Any:
+    """Build a minimal value that satisfies a JSON schema (dict form used in ai_schemas)"""
+    if not schema:
+        return {}
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = str(schema.get("type", "object")).lower()
+    if schema_type == "object":
+        return {name: sample_from_schema(prop) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return []
+    if schema_type in ("number", "integer"):
+        return 0
+    if schema_type == "boolean":
+        return False
+    return ""
+
+
+def _parse_ttl_seconds(ttl: Optional[str], default: int = 3600) -> int:
+    if not ttl:
+        return default
+    return int(float(str(ttl).rstrip("s")))
+
+
+def _count_content_tokens(contents: Any) -> int:
+    """Estimate tokens for str / Part / Content / list inputs"""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(_count_content_tokens(item) for item in contents)
+    parts = getattr(contents, "parts", None)
+    if parts is not None:
+        return _count_content_tokens(parts)
+    if getattr(contents, "text", None):
+        return estimate_tokens(contents.text)
+    if getattr(contents, "inline_data", None) is not None:
+        return BINARY_PART_TOKENS
+    return 0
+
+
+class _FakeCaches:
+    def __init__(self):
+        self._caches: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, model: str, config: Any = None):
+        instruction = getattr(config, "system_instruction", None) or ""
+        with self._lock:
+            name = f"cachedContents/fake-{next(self._ids)}"
+            self._caches[name] = {
+                "model": model,
+                "tokens": _count_content_tokens(instruction),
+                "expires_at": time.time() + _parse_ttl_seconds(getattr(config, "ttl", None))
+            }
+        return SimpleNamespace(name=name, model=model, usage_metadata=SimpleNamespace(
+            total_token_count=self._caches[name]["tokens"]
+        ))
+
+    def update(self, name: str, config: Any = None):
+        with self._lock:
+            cache = self._lookup(name)
+            cache["expires_at"] = time.time() + _parse_ttl_seconds(getattr(config, "ttl", None))
+        return SimpleNamespace(name=name)
+
+    def get(self, name: str):
+        with self._lock:
+            cache = self._lookup(name)
+        return SimpleNamespace(name=name, model=cache["model"])
+
+    def delete(self, name: str):
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def _lookup(self, name: str) -> Dict[str, Any]:
+        cache = self._caches.get(name)
+        if not cache or cache["expires_at"] <= time.time():
+            self._caches.pop(name, None)
+            raise Exception(f"404 NOT_FOUND: cached content {name} not found or expired")
+        return cache
+
+    def tokens_for(self, name: str) -> int:
+        with self._lock:
+            return self._lookup(name)["tokens"]
+
+
+class _FakeModels:
+    def __init__(self, caches: _FakeCaches, seconds_per_1k_tokens: float):
+        self._caches = caches
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.calls: List[Dict[str, Any]] = []
+
+    def generate_content(self, model: str, contents: Any, config: Any = None):
+        cached_tokens = 0
+        cached_content = getattr(config, "cached_content", None)
+        if cached_content:
+            cached_tokens = self._caches.tokens_for(cached_content)
+        uncached_tokens = _count_content_tokens(contents) + _count_content_tokens(
+            getattr(config, "system_instruction", None)
+        )
+
+        # Simulated prefill time scales with the tokens that were not served from cache
+        if self.seconds_per_1k_tokens:
+            time.sleep(self.seconds_per_1k_tokens * uncached_tokens / 1000)
+
+        schema = getattr(config, "response_schema", None)
+        if getattr(config, "response_mime_type", None) == "application/json":
+            text = json.dumps(sample_from_schema(schema if isinstance(schema, dict) else None))
+        else:
+            text = "Fake analysis generated locally."
+
+        output_tokens = estimate_tokens(text)
+        self.calls.append({"model": model, "prompt_tokens": uncached_tokens + cached_tokens, "cached_tokens": cached_tokens})
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=uncached_tokens + cached_tokens,
+                cached_content_token_count=cached_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=uncached_tokens + cached_tokens + output_tokens
+            )
+        )
+
+
+class FakeGeminiClient:
+    """Drop-in for genai.Client exposing .models and .caches"""
+
+    def __init__(self, seconds_per_1k_tokens: float = 0.0):
+        self.caches = _FakeCaches()
+        self.models = _FakeModels(self.caches, seconds_per_1k_tokens)
@@ -0,0 +1,208 @@
+"""
+Fake Twilio REST Server
+Local stand-in for the parts of the Twilio API the app uses, for development,
+manual tests and throughput benchmarks of WhatsApp sending (no real messages).
+
+Endpoints (form-encoded requests, JSON responses like Twilio's):
+- POST /2010-04-01/Accounts/{sid}/Messages.json        send a message
+- GET  /2010-04-01/Accounts/{sid}/Messages/{msid}.json fetch a message
+- GET  /2010-04-01/Accounts/{sid}.json                 fetch the account
+
+Point the app at it with TWILIO_API_BASE_URL=http://127.0.0.1:8099 and any
+TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN / TWILIO_WHATSAPP_NUMBER values.
+
+    python fake_twilio_server.py --port 8099 --latency-ms 200 --rate-limit 20
+
+Recipients starting with whatsapp:+000 are rejected as invalid numbers (21211).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeTwilioState:
+    """Options and counters of a running fake server"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: Optional[float] = None
+    ):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.messages: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _over_rate_limit(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count > self.rate_limit
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "max_in_flight": self.max_in_flight
+        }
+
+
+def _twilio_error(status: int, code: int, message: str) -> Tuple[int, Dict[str, Any]]:
+    return status, {
+        "code": code,
+        "message": message,
+        "more_info": f"https://www.twilio.com/docs/errors/{code}",
+        "status": status
+    }
+
+
+async def _handle(state: FakeTwilioState, method: str, path: str, form: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+    parts = [part for part in path.split("/") if part]
+    # ["2010-04-01", "Accounts", sid, ...]
+    if len(parts) < 3 or parts[0] != "2010-04-01" or parts[1] != "Accounts":
+        return _twilio_error(404, 20404, "The requested resource was not found")
+    account_sid = parts[2].removesuffix(".json")
+
+    if len(parts) == 3 and method == "GET":
+        return 200, {"sid": account_sid, "status": "active", "friendly_name": "Fake Twilio account"}
+
+    if len(parts) == 4 and parts[3] == "Messages.json" and method == "POST":
+        if state._over_rate_limit():
+            return _twilio_error(429, 20429, "Too Many Requests")
+        if state.error_rate and random.random() < state.error_rate:
+            return _twilio_error(500, 20500, "Internal Server Error")
+        to = form.get("To", "")
+        if not to or to.startswith("whatsapp:+000"):
+            return _twilio_error(400, 21211, f"The 'To' number {to} is not a valid phone number.")
+        sid = "SM" + uuid.uuid4().hex
+        message = {
+            "sid": sid,
+            "account_sid": account_sid,
+            "to": to,
+            "from": form.get("From"),
+            "body": form.get("Body"),
+            "num_media": "1" if form.get("MediaUrl") else "0",
+            "status": "queued",
+            "date_created": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime()),
+            "date_sent": None,
+            "error_code": None,
+            "error_message": None
+        }
+        state.messages[sid] = message
+        return 201, message
+
+    if len(parts) == 5 and parts[3] == "Messages" and method == "GET":
+        message = state.messages.get(parts[4].removesuffix(".json"))
+        if not message:
+            return _twilio_error(404, 20404, "The requested resource was not found")
+        return 200, {**message, "status": "delivered", "date_sent": message["date_created"]}
+
+    return _twilio_error(405, 20004, "Method not allowed")
+
+
+async def _serve_connection(state: FakeTwilioState, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Minimal HTTP/1.1 with keep-alive - enough for httpx clients"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+            form = {key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+            state.requests += 1
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                if state.latency_ms:
+                    await asyncio.sleep(state.latency_ms / 1000)
+                status, payload = await _handle(state, method, urlsplit(target).path, form)
+            finally:
+                state.in_flight -= 1
+            if status < 300:
+                state.accepted += 1
+            else:
+                state.rejected += 1
+
+            data = json.dumps(payload).encode("utf-8")
+            keep_alive = headers.get("connection", "").lower() != "close"
+            writer.write(
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_fake_twilio_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    **options
+) -> Tuple[asyncio.AbstractServer, FakeTwilioState, str]:
+    """Start the server in the current loop; returns (server, state, base_url)"""
+    state = FakeTwilioState(**options)
+    server = await asyncio.start_server(lambda r, w: _serve_connection(state, r, w), host, port)
+    bound_port = server.sockets[0].getsockname()[1]
+    return server, state, f"http://{host}:{bound_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Twilio REST server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Added delay per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of sends answered with a 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Sends per second before 429s")
+    args = parser.parse_args()
+
+    async def main():
+        server, state, base_url = await start_fake_twilio_server(
+            args.host, args.port,
+            latency_ms=args.latency_ms, error_rate=args.error_rate, rate_limit=args.rate_limit
+        )
+        print(f"Fake Twilio listening on {base_url} (Ctrl+C to stop)")
+        try:
+            async with server:
+                while True:
+                    await asyncio.sleep(10)
+                    print(f"📊 {state.stats()}")
+        finally:
+            print(f"📊 {state.stats()}")
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,155 @@
+"""
+Fast JSON Serialization for API Responses
+orjson-backed response class plus a "trusted passthrough" mode for read
+endpoints that returns database rows without a second round of Pydantic validation
+"""
+import json
+import os
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+
+# Opt-in switches (both default off)
+# FAST_JSON_RESPONSES: use FastJSONResponse as the app-wide default response class
+# TRUSTED_PASSTHROUGH_READS: list endpoints return DB rows projected onto the
+#   response model's fields instead of constructing and re-validating models
+FAST_JSON_RESPONSES_ENABLED = os.getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
+TRUSTED_PASSTHROUGH_ENABLED = os.getenv("TRUSTED_PASSTHROUGH_READS", "false").lower() == "true"
+
+
+def _default(value: Any) -> Any:
+    """Fallback encoder for types neither orjson nor json handle natively"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def fast_dumps(content: Any) -> bytes:
+    """Serialize content to UTF-8 JSON bytes using orjson when available"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        default=_default,
+        ensure_ascii=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that renders with orjson (falls back to stdlib json)"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return fast_dumps(content)
+
+
+@lru_cache(maxsize=256)
+def _model_projection(model: Type[BaseModel]) -> Tuple[Tuple[str, Any], ...]:
+    """(field_name, default) pairs for a response model, computed once per model"""
+    projection = []
+    for name, field in model.model_fields.items():
+        default = None if field.is_required() else field.get_default(call_default_factory=True)
+        projection.append((name, default))
+    return tuple(projection)
+
+
+def project_rows(rows: List[Dict[str, Any]], model: Type[BaseModel]) -> List[Dict[str, Any]]:
+    """
+    Shape DB rows like the response model without validating them.
+    Extra columns are dropped and missing fields take the model default.
+    """
+    projection = _model_projection(model)
+    return [
+        {name: row.get(name, default) for name, default in projection}
+        for row in rows
+    ]
+
+
+def respond_rows(rows: List[Dict[str, Any]], model: Type[BaseModel]) -> Any:
+    """
+    Return a list endpoint's payload.
+
+    With TRUSTED_PASSTHROUGH_READS enabled the rows (which already came back as
+    JSON from Supabase) are projected and encoded directly, skipping both model
+    construction and FastAPI's response_model re-validation. Otherwise models are
+    built as before so the endpoint's response_model applies.
+    """
+    if TRUSTED_PASSTHROUGH_ENABLED:
+        return FastJSONResponse(content=project_rows(rows, model))
+    return [model(**row) for row in rows]
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: validated models + stdlib json vs trusted passthrough + fast_dumps
+    import timeit
+    from typing import Optional
+
+    class _BenchRow(BaseModel):
+        id: int
+        patient_id: int
+        doctor_firebase_uid: str
+        visit_date: str
+        visit_type: str
+        chief_complaint: str
+        diagnosis: Optional[str] = None
+        medications: Optional[str] = None
+        vitals: Optional[dict] = None
+        total_amount: Optional[float] = None
+        created_at: str
+        updated_at: str
+
+    def _make_rows(count: int) -> List[Dict[str, Any]]:
+        return [
+            {
+                "id": i,
+                "patient_id": i % 97,
+                "doctor_firebase_uid": "doctor-uid-123",
+                "visit_date": "2025-01-15",
+                "visit_type": "Follow-up",
+                "chief_complaint": "Persistent cough and mild fever for three days",
+                "diagnosis": "Upper respiratory tract infection",
+                "medications": "Tab Azithromycin 500mg OD x 3 days, Tab Paracetamol 650mg SOS",
+                "vitals": {"temperature": 99.1, "blood_pressure_systolic": 122, "pulse_rate": 84},
+                "total_amount": 500.0,
+                "extra_column": "dropped by projection",
+                "created_at": "2025-01-15T10:00:00+00:00",
+                "updated_at": "2025-01-15T10:00:00+00:00",
+            }
+            for i in range(count)
+        ]
+
+    def _validated(rows):
+        models = [_BenchRow(**row) for row in rows]
+        payload = [_BenchRow.model_validate(m.model_dump()).model_dump(mode="json") for m in models]
+        return json.dumps(payload).encode("utf-8")
+
+    def _passthrough(rows):
+        return fast_dumps(project_rows(rows, _BenchRow))
+
+    print(f"orjson available: {ORJSON_AVAILABLE}")
+    print(f"{'rows':>7} | {'validated (ms)':>15} | {'passthrough (ms)':>17} | speedup")
+    for count in (100, 1_000, 10_000):
+        rows = _make_rows(count)
+        repeats = max(3, 2000 // count)
+        validated_ms = min(timeit.repeat(lambda: _validated(rows), number=1, repeat=repeats)) * 1000
+        passthrough_ms = min(timeit.repeat(lambda: _passthrough(rows), number=1, repeat=repeats)) * 1000
+        print(f"{count:>7} | {validated_ms:>15.2f} | {passthrough_ms:>17.2f} | {validated_ms / passthrough_ms:.1f}x")
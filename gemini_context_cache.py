@@ -0,0 +1,154 @@
+"""
+Gemini Context Cache Manager
+Keeps one explicit context cache per static prompt prefix (system instructions)
+so repeated analyses only send their dynamic suffix. Handles creation, TTL
+refresh before expiry, invalidation and fallback to inline instructions.
+"""
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, Optional
+
+from google.genai import types
+
+from prompt_budget import estimate_tokens
+
+
+class ContextCacheManager:
+    """
+    Maps a prefix key (e.g. "document_analysis") to a live cachedContents handle.
+
+    get_cache_name() returns None whenever caching is disabled, the prefix is below
+    the provider's minimum cacheable size, or cache creation failed recently; callers
+    then send the prefix inline as system_instruction.
+    """
+
+    def __init__(
+        self,
+        client,
+        executor,
+        ttl_seconds: int = 3600,
+        refresh_margin_seconds: int = 300,
+        min_tokens: int = 1024,
+        enabled: bool = True
+    ):
+        self.client = client
+        self.executor = executor
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.min_tokens = min_tokens
+        self.enabled = enabled
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # Keys whose cache creation failed -> monotonic time to retry
+        self._unavailable_until: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"hits": 0, "created": 0, "refreshed": 0, "inline": 0, "errors": 0}
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _create(self, model: str, key: str, system_instruction: str):
+        return self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"prefix-{key}",
+                system_instruction=system_instruction,
+                ttl=f"{self.ttl_seconds}s"
+            )
+        )
+
+    def _refresh(self, name: str):
+        return self.client.caches.update(
+            name=name,
+            config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+        )
+
+    def _delete(self, name: str):
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            print(f"⚠️ Failed to delete context cache {name}: {e}")
+
+    async def get_cache_name(self, key: str, model: str, system_instruction: str) -> Optional[str]:
+        """Return a live cache handle for this prefix, creating or refreshing it as needed"""
+        if not self.enabled or estimate_tokens(system_instruction) < self.min_tokens:
+            self.stats["inline"] += 1
+            return None
+
+        cache_key = f"{model}:{key}"
+        now = time.monotonic()
+        if self._unavailable_until.get(cache_key, 0) > now:
+            self.stats["inline"] += 1
+            return None
+
+        fingerprint = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+        lock = self._locks.setdefault(cache_key, asyncio.Lock())
+
+        async with lock:
+            now = time.monotonic()
+            entry = self._entries.get(cache_key)
+
+            if entry and entry["fingerprint"] != fingerprint:
+                # Instructions changed (deploy) - retire the stale cache
+                self._entries.pop(cache_key, None)
+                await self._run(self._delete, entry["name"])
+                entry = None
+
+            if entry:
+                remaining = entry["expires_at"] - now
+                if remaining > self.refresh_margin_seconds:
+                    self.stats["hits"] += 1
+                    return entry["name"]
+                if remaining > 0:
+                    try:
+                        await self._run(self._refresh, entry["name"])
+                        entry["expires_at"] = now + self.ttl_seconds
+                        self.stats["refreshed"] += 1
+                        return entry["name"]
+                    except Exception as e:
+                        print(f"⚠️ Context cache refresh failed for {key}, recreating: {e}")
+                self._entries.pop(cache_key, None)
+
+            try:
+                cached = await self._run(self._create, model, key, system_instruction)
+            except Exception as e:
+                print(f"⚠️ Context cache unavailable for {key}, sending instructions inline: {e}")
+                self._unavailable_until[cache_key] = now + self.ttl_seconds
+                self.stats["errors"] += 1
+                return None
+
+            self._entries[cache_key] = {
+                "name": cached.name,
+                "fingerprint": fingerprint,
+                "expires_at": now + self.ttl_seconds
+            }
+            self.stats["created"] += 1
+            print(f"🗄️ Created context cache for {key}: {cached.name}")
+            return cached.name
+
+    def invalidate(self, key: str, model: str) -> None:
+        """Forget a handle (e.g. the provider reported it expired or missing)"""
+        self._entries.pop(f"{model}:{key}", None)
+
+    async def close(self) -> None:
+        """Delete all caches created by this process"""
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            await self._run(self._delete, entry["name"])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "active_caches": len(self._entries),
+            "ttl_seconds": self.ttl_seconds
+        }
+
+
+def is_cache_miss_error(error: Exception) -> bool:
+    """True if a generate call failed because its cached content no longer exists"""
+    message = str(error).lower()
+    return "cached" in message and ("not_found" in message or "404" in message or "expired" in message)
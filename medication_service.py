@@ -14,8 +14,10 @@ Created: January 17, 2026
 """
 
 import logging
-from typing import Any, Dict, List, Optional, Set, Tuple
+from collections import deque
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 from enum import Enum
+from types import MappingProxyType
 import re
 
 logger = logging.getLogger(__name__)
@@ -30,6 +32,669 @@ class InteractionSeverity(Enum):
     UNKNOWN = "unknown"        # Unknown interaction level
 
 
+# =====================================================================
+# DRUG INTERACTION DATABASE
+# Format: (drug1, drug2) -> interaction_info
+# Drug names are normalized to lowercase for matching
+# =====================================================================
+DRUG_INTERACTIONS: Dict[Tuple[str, str], Dict[str, Any]] = {
+    # Anticoagulant interactions
+    ("warfarin", "aspirin"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased bleeding risk due to additive anticoagulant effects",
+        "mechanism": "Both drugs affect clotting; aspirin inhibits platelets while warfarin inhibits clotting factors",
+        "recommendation": "Monitor INR closely. Consider alternative antiplatelet if needed. Watch for signs of bleeding.",
+        "alternatives": ["Clopidogrel with caution", "Low-dose aspirin with close monitoring"]
+    },
+    ("warfarin", "ibuprofen"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased bleeding risk and potential INR elevation",
+        "mechanism": "NSAIDs inhibit platelet function and can displace warfarin from protein binding",
+        "recommendation": "Avoid combination. Use acetaminophen for pain if possible.",
+        "alternatives": ["Acetaminophen (paracetamol)", "Topical NSAIDs with caution"]
+    },
+    ("warfarin", "naproxen"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased bleeding risk",
+        "mechanism": "NSAID inhibits platelet aggregation",
+        "recommendation": "Avoid combination. Monitor for GI bleeding.",
+        "alternatives": ["Acetaminophen"]
+    },
+    ("warfarin", "vitamin k"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Decreased anticoagulant effect",
+        "mechanism": "Vitamin K antagonizes warfarin's mechanism of action",
+        "recommendation": "Maintain consistent vitamin K intake. Adjust warfarin dose if needed.",
+        "alternatives": []
+    },
+    
+    # Antibiotic interactions
+    ("metronidazole", "alcohol"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Severe disulfiram-like reaction: flushing, nausea, vomiting, headache",
+        "mechanism": "Metronidazole inhibits aldehyde dehydrogenase",
+        "recommendation": "Avoid alcohol during treatment and 48 hours after completing course",
+        "alternatives": []
+    },
+    ("ciprofloxacin", "antacids"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced ciprofloxacin absorption and effectiveness",
+        "mechanism": "Metal cations in antacids chelate with fluoroquinolones",
+        "recommendation": "Take ciprofloxacin 2 hours before or 6 hours after antacids",
+        "alternatives": ["H2 blockers", "PPIs"]
+    },
+    ("ciprofloxacin", "theophylline"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased theophylline levels, risk of toxicity",
+        "mechanism": "Ciprofloxacin inhibits CYP1A2 metabolism of theophylline",
+        "recommendation": "Monitor theophylline levels. Consider dose reduction.",
+        "alternatives": ["Azithromycin", "Amoxicillin"]
+    },
+    ("tetracycline", "calcium"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced tetracycline absorption",
+        "mechanism": "Calcium chelates with tetracycline",
+        "recommendation": "Separate doses by 2-3 hours",
+        "alternatives": []
+    },
+    ("tetracycline", "iron"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced absorption of both drugs",
+        "mechanism": "Iron chelates with tetracycline",
+        "recommendation": "Separate doses by 2-3 hours",
+        "alternatives": []
+    },
+    
+    # Diabetes medication interactions
+    ("metformin", "contrast"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Risk of lactic acidosis, especially with iodinated contrast",
+        "mechanism": "Contrast-induced nephropathy impairs metformin clearance",
+        "recommendation": "Hold metformin 48 hours before and after contrast administration. Check renal function before resuming.",
+        "alternatives": []
+    },
+    ("metformin", "alcohol"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Increased risk of hypoglycemia and lactic acidosis",
+        "mechanism": "Alcohol potentiates hypoglycemic effect and impairs lactate metabolism",
+        "recommendation": "Limit alcohol intake. Monitor blood glucose.",
+        "alternatives": []
+    },
+    ("glipizide", "fluconazole"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased hypoglycemia risk",
+        "mechanism": "Fluconazole inhibits CYP2C9 metabolism of sulfonylureas",
+        "recommendation": "Monitor blood glucose closely. May need dose reduction.",
+        "alternatives": ["Different antifungal"]
+    },
+    ("insulin", "beta blockers"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Masked hypoglycemia symptoms, prolonged hypoglycemia",
+        "mechanism": "Beta blockers mask tachycardia and tremor signs of hypoglycemia",
+        "recommendation": "Use cardioselective beta blockers. Educate patient on alternative hypoglycemia signs.",
+        "alternatives": ["Cardioselective beta blockers (metoprolol, atenolol)"]
+    },
+    
+    # Cardiovascular interactions
+    ("digoxin", "amiodarone"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased digoxin levels (50-100% increase), risk of toxicity",
+        "mechanism": "Amiodarone inhibits P-glycoprotein and reduces renal clearance",
+        "recommendation": "Reduce digoxin dose by 50%. Monitor digoxin levels and for toxicity signs.",
+        "alternatives": []
+    },
+    ("digoxin", "verapamil"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased digoxin levels and enhanced AV block",
+        "mechanism": "Verapamil inhibits P-glycoprotein; both cause AV nodal depression",
+        "recommendation": "Reduce digoxin dose. Monitor heart rate and rhythm.",
+        "alternatives": ["Diltiazem with caution"]
+    },
+    ("atenolol", "verapamil"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Severe bradycardia, heart block, hypotension",
+        "mechanism": "Additive negative chronotropic and dromotropic effects",
+        "recommendation": "Avoid combination. If necessary, use with extreme caution and monitoring.",
+        "alternatives": ["Dihydropyridine calcium blockers (amlodipine)"]
+    },
+    ("lisinopril", "potassium"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Hyperkalemia risk",
+        "mechanism": "ACE inhibitors reduce aldosterone, retaining potassium",
+        "recommendation": "Monitor potassium levels. Avoid potassium supplements unless hypokalemic.",
+        "alternatives": []
+    },
+    ("lisinopril", "spironolactone"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Significant hyperkalemia risk",
+        "mechanism": "Both drugs cause potassium retention",
+        "recommendation": "Monitor potassium closely. Consider lower doses. Check renal function.",
+        "alternatives": ["Thiazide diuretics"]
+    },
+    ("amlodipine", "simvastatin"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Increased simvastatin levels, higher myopathy risk",
+        "mechanism": "Amlodipine inhibits CYP3A4 metabolism of simvastatin",
+        "recommendation": "Limit simvastatin to 20mg daily with amlodipine.",
+        "alternatives": ["Pravastatin", "Rosuvastatin"]
+    },
+    
+    # Pain medication interactions
+    ("tramadol", "ssri"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Serotonin syndrome risk, increased seizure risk",
+        "mechanism": "Both drugs increase serotonin; tramadol lowers seizure threshold",
+        "recommendation": "Avoid combination if possible. Monitor for serotonin syndrome symptoms.",
+        "alternatives": ["Non-serotonergic analgesics"]
+    },
+    ("tramadol", "maoi"): {
+        "severity": InteractionSeverity.CRITICAL,
+        "effect": "Life-threatening serotonin syndrome",
+        "mechanism": "MAOIs potentiate serotonergic effects of tramadol",
+        "recommendation": "CONTRAINDICATED. Do not use within 14 days of MAOI.",
+        "alternatives": ["Non-opioid analgesics"]
+    },
+    ("codeine", "paroxetine"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced analgesic effect of codeine",
+        "mechanism": "Paroxetine inhibits CYP2D6 conversion of codeine to morphine",
+        "recommendation": "Consider alternative analgesic or antidepressant.",
+        "alternatives": ["Morphine", "Oxycodone"]
+    },
+    
+    # Psychiatric medication interactions
+    ("lithium", "ibuprofen"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased lithium levels, toxicity risk",
+        "mechanism": "NSAIDs reduce renal lithium clearance",
+        "recommendation": "Avoid NSAIDs. Monitor lithium levels if necessary.",
+        "alternatives": ["Acetaminophen"]
+    },
+    ("lithium", "ace inhibitors"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased lithium levels",
+        "mechanism": "ACE inhibitors reduce lithium clearance",
+        "recommendation": "Monitor lithium levels closely. May need dose reduction.",
+        "alternatives": []
+    },
+    ("ssri", "maoi"): {
+        "severity": InteractionSeverity.CRITICAL,
+        "effect": "Life-threatening serotonin syndrome",
+        "mechanism": "Massive serotonin accumulation",
+        "recommendation": "CONTRAINDICATED. Wait 2-5 weeks between switching medications.",
+        "alternatives": []
+    },
+    
+    # Antifungal interactions
+    ("ketoconazole", "simvastatin"): {
+        "severity": InteractionSeverity.CRITICAL,
+        "effect": "Severe myopathy and rhabdomyolysis risk",
+        "mechanism": "Ketoconazole strongly inhibits CYP3A4 metabolism of statins",
+        "recommendation": "CONTRAINDICATED. Hold statin during antifungal treatment.",
+        "alternatives": ["Fluconazole with pravastatin", "Topical antifungals"]
+    },
+    ("fluconazole", "warfarin"): {
+        "severity": InteractionSeverity.HIGH,
+        "effect": "Increased INR and bleeding risk",
+        "mechanism": "Fluconazole inhibits CYP2C9 metabolism of warfarin",
+        "recommendation": "Monitor INR closely. May need warfarin dose reduction.",
+        "alternatives": []
+    },
+    
+    # Proton pump inhibitor interactions
+    ("omeprazole", "clopidogrel"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced antiplatelet effect of clopidogrel",
+        "mechanism": "Omeprazole inhibits CYP2C19 activation of clopidogrel",
+        "recommendation": "Use pantoprazole or H2 blocker instead.",
+        "alternatives": ["Pantoprazole", "Famotidine"]
+    },
+    ("omeprazole", "methotrexate"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Increased methotrexate levels",
+        "mechanism": "PPIs inhibit renal elimination of methotrexate",
+        "recommendation": "Consider temporary discontinuation of PPI with high-dose methotrexate.",
+        "alternatives": ["H2 blockers"]
+    },
+    
+    # Thyroid medication interactions
+    ("levothyroxine", "calcium"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced levothyroxine absorption",
+        "mechanism": "Calcium binds to levothyroxine in GI tract",
+        "recommendation": "Separate doses by 4 hours.",
+        "alternatives": []
+    },
+    ("levothyroxine", "iron"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced levothyroxine absorption",
+        "mechanism": "Iron binds to levothyroxine",
+        "recommendation": "Separate doses by 4 hours.",
+        "alternatives": []
+    },
+    ("levothyroxine", "antacids"): {
+        "severity": InteractionSeverity.MODERATE,
+        "effect": "Reduced levothyroxine absorption",
+        "mechanism": "Antacids alter GI pH and bind levothyroxine",
+        "recommendation": "Separate doses by 4 hours.",
+        "alternatives": []
+    },
+}
+
+# =====================================================================
+# DRUG CLASS MAPPINGS
+# Map generic drug names to their classes for broader interaction checking
+# =====================================================================
+DRUG_CLASSES: Dict[str, List[str]] = {
+    "ssri": ["fluoxetine", "sertraline", "paroxetine", "citalopram", "escitalopram", "fluvoxamine"],
+    "maoi": ["phenelzine", "tranylcypromine", "isocarboxazid", "selegiline", "moclobemide"],
+    "nsaid": ["ibuprofen", "naproxen", "diclofenac", "indomethacin", "piroxicam", "meloxicam", "celecoxib"],
+    "ace_inhibitor": ["lisinopril", "enalapril", "ramipril", "captopril", "benazepril", "perindopril"],
+    "arb": ["losartan", "valsartan", "irbesartan", "olmesartan", "candesartan", "telmisartan"],
+    "beta_blocker": ["atenolol", "metoprolol", "propranolol", "carvedilol", "bisoprolol", "nebivolol"],
+    "calcium_blocker": ["amlodipine", "verapamil", "diltiazem", "nifedipine", "felodipine"],
+    "statin": ["atorvastatin", "simvastatin", "rosuvastatin", "pravastatin", "lovastatin", "fluvastatin"],
+    "sulfonylurea": ["glipizide", "glyburide", "glimepiride", "glibenclamide"],
+    "fluoroquinolone": ["ciprofloxacin", "levofloxacin", "moxifloxacin", "ofloxacin"],
+    "macrolide": ["azithromycin", "clarithromycin", "erythromycin"],
+    "antacid": ["aluminum hydroxide", "magnesium hydroxide", "calcium carbonate", "tums", "maalox"],
+    "ppi": ["omeprazole", "esomeprazole", "pantoprazole", "lansoprazole", "rabeprazole"],
+    "anticoagulant": ["warfarin", "heparin", "enoxaparin", "rivaroxaban", "apixaban", "dabigatran"],
+    "antiplatelet": ["aspirin", "clopidogrel", "prasugrel", "ticagrelor"],
+    "opioid": ["morphine", "codeine", "oxycodone", "hydrocodone", "fentanyl", "tramadol", "methadone"],
+    "benzodiazepine": ["diazepam", "lorazepam", "alprazolam", "clonazepam", "midazolam"],
+    "diuretic_potassium_sparing": ["spironolactone", "eplerenone", "amiloride", "triamterene"],
+    "diuretic_loop": ["furosemide", "bumetanide", "torsemide"],
+    "diuretic_thiazide": ["hydrochlorothiazide", "chlorthalidone", "indapamide", "metolazone"],
+}
+
+# Reverse mapping: drug name -> class
+DRUG_TO_CLASS: Dict[str, str] = {
+    drug.lower(): drug_class
+    for drug_class, drugs in DRUG_CLASSES.items()
+    for drug in drugs
+}
+
+# =====================================================================
+# ALLERGY CROSS-REACTIVITY DATABASE
+# Drugs that may cause reactions in patients with specific allergies
+# =====================================================================
+ALLERGY_CROSS_REACTIVITY: Dict[str, List[str]] = {
+    "penicillin": ["amoxicillin", "ampicillin", "piperacillin", "cephalosporin", "cefazolin", 
+                  "cephalexin", "ceftriaxone", "cefuroxime", "cefdinir"],
+    "sulfa": ["sulfamethoxazole", "trimethoprim-sulfamethoxazole", "bactrim", "septra",
+             "sulfasalazine", "dapsone", "sulfadiazine"],
+    "aspirin": ["ibuprofen", "naproxen", "diclofenac", "ketorolac", "indomethacin", "piroxicam"],
+    "nsaid": ["aspirin", "ibuprofen", "naproxen", "diclofenac", "celecoxib"],
+    "codeine": ["morphine", "hydrocodone", "oxycodone", "tramadol"],
+    "morphine": ["codeine", "hydrocodone", "oxycodone", "fentanyl"],
+    "iodine": ["contrast dye", "povidone-iodine", "amiodarone", "iodinated contrast"],
+    "latex": [],  # Not medication-related but important
+    "egg": ["propofol", "influenza vaccine"],
+    "shellfish": [],  # Note: shellfish allergy is NOT a contraindication for iodinated contrast
+}
+
+# =====================================================================
+# CONDITION-BASED CONTRAINDICATIONS
+# Conditions that contraindicate certain medications
+# =====================================================================
+CONDITION_CONTRAINDICATIONS: Dict[str, List[Dict[str, Any]]] = {
+    "renal failure": [
+        {"drug_class": "nsaid", "severity": "high", "reason": "NSAIDs can worsen renal function"},
+        {"drug": "metformin", "severity": "high", "reason": "Risk of lactic acidosis in renal impairment"},
+        {"drug_class": "ace_inhibitor", "severity": "moderate", "reason": "May worsen renal function; monitor closely"},
+    ],
+    "liver disease": [
+        {"drug": "acetaminophen", "severity": "high", "reason": "Hepatotoxicity risk; limit dose to 2g/day"},
+        {"drug_class": "statin", "severity": "moderate", "reason": "May worsen liver function; monitor LFTs"},
+    ],
+    "heart failure": [
+        {"drug_class": "nsaid", "severity": "high", "reason": "NSAIDs cause fluid retention and worsen heart failure"},
+        {"drug_class": "calcium_blocker", "severity": "moderate", "reason": "Some CCBs have negative inotropic effects"},
+        {"drug": "metformin", "severity": "moderate", "reason": "Risk in unstable or acute heart failure"},
+    ],
+    "asthma": [
+        {"drug_class": "beta_blocker", "severity": "high", "reason": "Can trigger bronchospasm"},
+        {"drug": "aspirin", "severity": "moderate", "reason": "May trigger aspirin-sensitive asthma"},
+    ],
+    "peptic ulcer": [
+        {"drug_class": "nsaid", "severity": "high", "reason": "Increases GI bleeding risk"},
+        {"drug": "aspirin", "severity": "high", "reason": "Increases GI bleeding risk"},
+    ],
+    "diabetes": [
+        {"drug_class": "beta_blocker", "severity": "moderate", "reason": "Can mask hypoglycemia symptoms"},
+    ],
+    "pregnancy": [
+        {"drug_class": "ace_inhibitor", "severity": "critical", "reason": "Teratogenic; contraindicated in pregnancy"},
+        {"drug_class": "arb", "severity": "critical", "reason": "Teratogenic; contraindicated in pregnancy"},
+        {"drug": "methotrexate", "severity": "critical", "reason": "Abortifacient and teratogenic"},
+        {"drug": "warfarin", "severity": "critical", "reason": "Teratogenic, especially in first trimester"},
+        {"drug_class": "statin", "severity": "critical", "reason": "Contraindicated in pregnancy"},
+    ],
+    "breastfeeding": [
+        {"drug": "methotrexate", "severity": "critical", "reason": "Excreted in breast milk; contraindicated"},
+        {"drug": "lithium", "severity": "high", "reason": "Excreted in breast milk; avoid if possible"},
+    ],
+}
+
+
+# Interaction-table names that refer to a whole drug class
+CLASS_ALIASES: Dict[str, str] = {
+    "ace inhibitors": "ace_inhibitor",
+    "antacids": "antacid",
+    "beta blockers": "beta_blocker",
+}
+
+SEVERITY_ORDER: Dict[str, int] = {
+    InteractionSeverity.CRITICAL.value: 0,
+    InteractionSeverity.HIGH.value: 1,
+    InteractionSeverity.MODERATE.value: 2,
+    InteractionSeverity.LOW.value: 3,
+    InteractionSeverity.UNKNOWN.value: 4,
+}
+
+
+class InteractionIndex:
+    """
+    Compiled, read-only view of DRUG_INTERACTIONS and DRUG_CLASSES.
+    
+    Every drug and class name is interned to an integer term id, and each term id
+    maps to its interaction partners (partner id -> interaction id). A prescription
+    is checked by walking the partners of the drugs it contains instead of looking
+    up every pair of drugs, so the cost grows with the number of real interactions
+    rather than with the square of the prescription size.
+    """
+    
+    __slots__ = ("term_ids", "terms", "class_of", "partners", "interactions")
+    
+    def __init__(
+        self,
+        interactions: Dict[Tuple[str, str], Dict[str, Any]],
+        drug_classes: Dict[str, List[str]],
+        class_aliases: Dict[str, str]
+    ):
+        term_ids: Dict[str, int] = {}
+        terms: List[str] = []
+        
+        def intern(name: str) -> int:
+            name = name.lower()
+            name = class_aliases.get(name, name)
+            if name not in term_ids:
+                term_ids[name] = len(terms)
+                terms.append(name)
+            return term_ids[name]
+        
+        class_of: Dict[int, int] = {}
+        for drug_class, drugs in drug_classes.items():
+            class_id = intern(drug_class)
+            for drug in drugs:
+                class_of[intern(drug)] = class_id
+        
+        compiled: List[Tuple[str, str, str, str, Tuple[str, ...]]] = []
+        partners: Dict[int, Dict[int, int]] = {}
+        for (name1, name2), info in interactions.items():
+            severity = info["severity"]
+            interaction_id = len(compiled)
+            compiled.append((
+                severity.value if isinstance(severity, InteractionSeverity) else severity,
+                info.get("effect", ""),
+                info.get("mechanism", ""),
+                info.get("recommendation", ""),
+                tuple(info.get("alternatives", []))
+            ))
+            id1, id2 = intern(name1), intern(name2)
+            partners.setdefault(id1, {}).setdefault(id2, interaction_id)
+            partners.setdefault(id2, {}).setdefault(id1, interaction_id)
+        
+        for alias, class_name in class_aliases.items():
+            term_ids[alias] = intern(class_name)
+        
+        self.term_ids = MappingProxyType(term_ids)
+        self.terms = tuple(terms)
+        self.class_of = MappingProxyType(class_of)
+        self.partners = MappingProxyType({term: MappingProxyType(p) for term, p in partners.items()})
+        self.interactions = tuple(compiled)
+    
+    def resolve(self, drug_name: str) -> Tuple[Optional[int], Optional[int]]:
+        """(term id, class id) of a normalized drug name; either may be None"""
+        term_id = self.term_ids.get(drug_name)
+        if term_id is None:
+            return None, None
+        return term_id, self.class_of.get(term_id)
+    
+    def lookup(self, name1: str, name2: str) -> Optional[int]:
+        """Interaction id of a directly listed pair of drug/class names"""
+        id1 = self.term_ids.get(name1.lower())
+        id2 = self.term_ids.get(name2.lower())
+        if id1 is None or id2 is None:
+            return None
+        return self.partners.get(id1, {}).get(id2)
+    
+    def interaction_dict(self, interaction_id: int) -> Dict[str, Any]:
+        """Fresh result dict for an interaction (callers are free to mutate it)"""
+        severity, effect, mechanism, recommendation, alternatives = self.interactions[interaction_id]
+        return {
+            "type": "drug_interaction",
+            "severity": severity,
+            "effect": effect,
+            "mechanism": mechanism,
+            "recommendation": recommendation,
+            "alternatives": list(alternatives)
+        }
+    
+    def find_interactions(self, drugs: Set[str]) -> List[Tuple[str, str, int, Optional[str]]]:
+        """
+        Interacting pairs among a set of normalized drug names.
+        
+        A directly listed drug pair wins over a class-drug entry, which wins over
+        a class-class entry, so each pair of drugs is reported at most once.
+        
+        Returns:
+            (drug1, drug2, interaction id, via_class or None) per interacting pair
+        """
+        # term id -> (drug name, matched via its class) for every prescribed drug
+        present: Dict[int, List[Tuple[str, bool]]] = {}
+        resolved: List[Tuple[str, int, Optional[int]]] = []
+        for drug in drugs:
+            term_id, class_id = self.resolve(drug)
+            if term_id is None:
+                continue
+            resolved.append((drug, term_id, class_id))
+            present.setdefault(term_id, []).append((drug, False))
+            if class_id is not None:
+                present.setdefault(class_id, []).append((drug, True))
+        
+        best: Dict[Tuple[str, str], Tuple[int, str, str, int, Optional[str]]] = {}
+        for drug1, term_id, class_id in resolved:
+            own_terms = ((term_id, False),) if class_id is None else ((term_id, False), (class_id, True))
+            for own_term, own_via_class in own_terms:
+                for partner, interaction_id in self.partners.get(own_term, {}).items():
+                    for drug2, partner_via_class in present.get(partner, ()):
+                        if drug2 == drug1:
+                            continue
+                        pair = (drug1, drug2) if drug1 < drug2 else (drug2, drug1)
+                        rank = own_via_class + partner_via_class
+                        current = best.get(pair)
+                        if current is not None and current[0] <= rank:
+                            continue
+                        via_class = None
+                        if own_via_class:
+                            via_class = self.terms[own_term]
+                        elif partner_via_class:
+                            via_class = self.terms[partner]
+                        best[pair] = (rank, drug1, drug2, interaction_id, via_class)
+        
+        return [match[1:] for match in best.values()]
+
+
+# Compiled once at import and shared by every MedicationInteractionService instance
+INTERACTION_INDEX = InteractionIndex(DRUG_INTERACTIONS, DRUG_CLASSES, CLASS_ALIASES)
+
+
+# Common brand names -> generic name used in the tables above
+DRUG_BRAND_ALIASES: Dict[str, str] = {
+    "advil": "ibuprofen",
+    "aldactone": "spironolactone",
+    "augmentin": "amoxicillin",
+    "brufen": "ibuprofen",
+    "ciplox": "ciprofloxacin",
+    "cipro": "ciprofloxacin",
+    "coumadin": "warfarin",
+    "crestor": "rosuvastatin",
+    "diflucan": "fluconazole",
+    "disprin": "aspirin",
+    "ecosprin": "aspirin",
+    "eliquis": "apixaban",
+    "eltroxin": "levothyroxine",
+    "flagyl": "metronidazole",
+    "glucophage": "metformin",
+    "lanoxin": "digoxin",
+    "lasix": "furosemide",
+    "lipitor": "atorvastatin",
+    "motrin": "ibuprofen",
+    "nizoral": "ketoconazole",
+    "norvasc": "amlodipine",
+    "omez": "omeprazole",
+    "plavix": "clopidogrel",
+    "prilosec": "omeprazole",
+    "prozac": "fluoxetine",
+    "synthroid": "levothyroxine",
+    "thyronorm": "levothyroxine",
+    "ultram": "tramadol",
+    "xarelto": "rivaroxaban",
+    "zocor": "simvastatin",
+    "zoloft": "sertraline",
+}
+
+
+class DrugNameMatcher:
+    """
+    Aho-Corasick automaton over every drug, class and brand name the service knows.
+    
+    The automaton runs over word tokens rather than characters: names are token
+    sequences ("aluminum hydroxide", "trimethoprim - sulfamethoxazole"), the text
+    is tokenized once by a regex, and any token outside the name vocabulary resets
+    the automaton without a lookup. scan() therefore finds every known name in one
+    left-to-right pass, including drugs embedded in phrases ("Tab Amlodipine 5mg
+    OD after food"), and matches always fall on word boundaries. Overlapping
+    matches resolve to the leftmost, then longest, name ("calcium carbonate"
+    rather than "calcium").
+    """
+    
+    TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+    
+    __slots__ = ("goto", "fail", "output", "patterns", "vocabulary")
+    
+    def __init__(self, names: Dict[str, str]):
+        """names: pattern (any case) -> canonical drug name"""
+        goto: List[Dict[str, int]] = [{}]
+        output: List[List[int]] = [[]]
+        patterns: List[Tuple[int, str]] = []
+        vocabulary: Set[str] = set()
+        
+        for pattern, canonical in names.items():
+            tokens = self.TOKEN_PATTERN.findall(pattern.lower())
+            if not tokens:
+                continue
+            vocabulary.update(tokens)
+            state = 0
+            for token in tokens:
+                next_state = goto[state].get(token)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][token] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(len(patterns))
+            patterns.append((len(tokens), canonical.lower()))
+        
+        # Breadth-first failure links; each state inherits its fallback's outputs
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and token not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(token, 0)
+                output[next_state] = output[next_state] + output[fail[next_state]]
+        
+        self.goto = tuple(MappingProxyType(transitions) for transitions in goto)
+        self.fail = tuple(fail)
+        self.output = tuple(tuple(matches) for matches in output)
+        self.patterns = tuple(patterns)
+        self.vocabulary = frozenset(vocabulary)
+    
+    def scan(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Known drug names in text, in order of appearance.
+        
+        Returns:
+            [{"drug": canonical name, "start", "end", "text": as written}]
+        """
+        if not text:
+            return []
+        
+        goto, fail, output, patterns, vocabulary = self.goto, self.fail, self.output, self.patterns, self.vocabulary
+        candidates: List[Tuple[int, int, str]] = []
+        spans: List[Tuple[int, int]] = []
+        state = 0
+        for token_match in self.TOKEN_PATTERN.finditer(text.lower()):
+            spans.append(token_match.span())
+            token = token_match.group()
+            if token not in vocabulary:
+                state = 0
+                continue
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for pattern_id in output[state]:
+                token_count, canonical = patterns[pattern_id]
+                candidates.append((spans[-token_count][0], -spans[-1][1], canonical))
+        
+        matches: List[Dict[str, Any]] = []
+        covered_until = 0
+        for start, negative_end, canonical in sorted(candidates):
+            if start < covered_until:
+                continue
+            covered_until = -negative_end
+            matches.append({"drug": canonical, "start": start, "end": covered_until, "text": text[start:covered_until]})
+        return matches
+
+
+def _matcher_names() -> Dict[str, str]:
+    names: Dict[str, str] = {}
+    for pair in DRUG_INTERACTIONS:
+        for name in pair:
+            names[name] = name
+    for drug_class, drugs in DRUG_CLASSES.items():
+        names[drug_class.replace("_", " ")] = drug_class
+        for drug in drugs:
+            names[drug] = drug
+    for allergen, reactive_drugs in ALLERGY_CROSS_REACTIVITY.items():
+        names[allergen] = allergen
+        for drug in reactive_drugs:
+            names[drug] = drug
+    for contraindications in CONDITION_CONTRAINDICATIONS.values():
+        for contra in contraindications:
+            if "drug" in contra:
+                names[contra["drug"]] = contra["drug"]
+    names.update(DRUG_BRAND_ALIASES)
+    return names
+
+
+# Built once at import alongside INTERACTION_INDEX
+DRUG_NAME_MATCHER = DrugNameMatcher(_matcher_names())
+
+
+def find_drug_mentions(text: Optional[str]) -> List[Dict[str, Any]]:
+    """Known drug names in free text with their spans (see DrugNameMatcher.scan)"""
+    return DRUG_NAME_MATCHER.scan(text or "")
+
+
 class MedicationInteractionService:
     """
     Service for checking drug interactions, allergies, and contraindications.
@@ -43,350 +708,12 @@ class MedicationInteractionService:
     
     def __init__(self):
         """Initialize the medication interaction service with interaction database"""
-        
-        # =====================================================================
-        # DRUG INTERACTION DATABASE
-        # Format: (drug1, drug2) -> interaction_info
-        # Drug names are normalized to lowercase for matching
-        # =====================================================================
-        self.DRUG_INTERACTIONS: Dict[Tuple[str, str], Dict[str, Any]] = {
-            # Anticoagulant interactions
-            ("warfarin", "aspirin"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased bleeding risk due to additive anticoagulant effects",
-                "mechanism": "Both drugs affect clotting; aspirin inhibits platelets while warfarin inhibits clotting factors",
-                "recommendation": "Monitor INR closely. Consider alternative antiplatelet if needed. Watch for signs of bleeding.",
-                "alternatives": ["Clopidogrel with caution", "Low-dose aspirin with close monitoring"]
-            },
-            ("warfarin", "ibuprofen"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased bleeding risk and potential INR elevation",
-                "mechanism": "NSAIDs inhibit platelet function and can displace warfarin from protein binding",
-                "recommendation": "Avoid combination. Use acetaminophen for pain if possible.",
-                "alternatives": ["Acetaminophen (paracetamol)", "Topical NSAIDs with caution"]
-            },
-            ("warfarin", "naproxen"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased bleeding risk",
-                "mechanism": "NSAID inhibits platelet aggregation",
-                "recommendation": "Avoid combination. Monitor for GI bleeding.",
-                "alternatives": ["Acetaminophen"]
-            },
-            ("warfarin", "vitamin k"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Decreased anticoagulant effect",
-                "mechanism": "Vitamin K antagonizes warfarin's mechanism of action",
-                "recommendation": "Maintain consistent vitamin K intake. Adjust warfarin dose if needed.",
-                "alternatives": []
-            },
-            
-            # Antibiotic interactions
-            ("metronidazole", "alcohol"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Severe disulfiram-like reaction: flushing, nausea, vomiting, headache",
-                "mechanism": "Metronidazole inhibits aldehyde dehydrogenase",
-                "recommendation": "Avoid alcohol during treatment and 48 hours after completing course",
-                "alternatives": []
-            },
-            ("ciprofloxacin", "antacids"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced ciprofloxacin absorption and effectiveness",
-                "mechanism": "Metal cations in antacids chelate with fluoroquinolones",
-                "recommendation": "Take ciprofloxacin 2 hours before or 6 hours after antacids",
-                "alternatives": ["H2 blockers", "PPIs"]
-            },
-            ("ciprofloxacin", "theophylline"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased theophylline levels, risk of toxicity",
-                "mechanism": "Ciprofloxacin inhibits CYP1A2 metabolism of theophylline",
-                "recommendation": "Monitor theophylline levels. Consider dose reduction.",
-                "alternatives": ["Azithromycin", "Amoxicillin"]
-            },
-            ("tetracycline", "calcium"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced tetracycline absorption",
-                "mechanism": "Calcium chelates with tetracycline",
-                "recommendation": "Separate doses by 2-3 hours",
-                "alternatives": []
-            },
-            ("tetracycline", "iron"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced absorption of both drugs",
-                "mechanism": "Iron chelates with tetracycline",
-                "recommendation": "Separate doses by 2-3 hours",
-                "alternatives": []
-            },
-            
-            # Diabetes medication interactions
-            ("metformin", "contrast"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Risk of lactic acidosis, especially with iodinated contrast",
-                "mechanism": "Contrast-induced nephropathy impairs metformin clearance",
-                "recommendation": "Hold metformin 48 hours before and after contrast administration. Check renal function before resuming.",
-                "alternatives": []
-            },
-            ("metformin", "alcohol"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Increased risk of hypoglycemia and lactic acidosis",
-                "mechanism": "Alcohol potentiates hypoglycemic effect and impairs lactate metabolism",
-                "recommendation": "Limit alcohol intake. Monitor blood glucose.",
-                "alternatives": []
-            },
-            ("glipizide", "fluconazole"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased hypoglycemia risk",
-                "mechanism": "Fluconazole inhibits CYP2C9 metabolism of sulfonylureas",
-                "recommendation": "Monitor blood glucose closely. May need dose reduction.",
-                "alternatives": ["Different antifungal"]
-            },
-            ("insulin", "beta blockers"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Masked hypoglycemia symptoms, prolonged hypoglycemia",
-                "mechanism": "Beta blockers mask tachycardia and tremor signs of hypoglycemia",
-                "recommendation": "Use cardioselective beta blockers. Educate patient on alternative hypoglycemia signs.",
-                "alternatives": ["Cardioselective beta blockers (metoprolol, atenolol)"]
-            },
-            
-            # Cardiovascular interactions
-            ("digoxin", "amiodarone"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased digoxin levels (50-100% increase), risk of toxicity",
-                "mechanism": "Amiodarone inhibits P-glycoprotein and reduces renal clearance",
-                "recommendation": "Reduce digoxin dose by 50%. Monitor digoxin levels and for toxicity signs.",
-                "alternatives": []
-            },
-            ("digoxin", "verapamil"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased digoxin levels and enhanced AV block",
-                "mechanism": "Verapamil inhibits P-glycoprotein; both cause AV nodal depression",
-                "recommendation": "Reduce digoxin dose. Monitor heart rate and rhythm.",
-                "alternatives": ["Diltiazem with caution"]
-            },
-            ("atenolol", "verapamil"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Severe bradycardia, heart block, hypotension",
-                "mechanism": "Additive negative chronotropic and dromotropic effects",
-                "recommendation": "Avoid combination. If necessary, use with extreme caution and monitoring.",
-                "alternatives": ["Dihydropyridine calcium blockers (amlodipine)"]
-            },
-            ("lisinopril", "potassium"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Hyperkalemia risk",
-                "mechanism": "ACE inhibitors reduce aldosterone, retaining potassium",
-                "recommendation": "Monitor potassium levels. Avoid potassium supplements unless hypokalemic.",
-                "alternatives": []
-            },
-            ("lisinopril", "spironolactone"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Significant hyperkalemia risk",
-                "mechanism": "Both drugs cause potassium retention",
-                "recommendation": "Monitor potassium closely. Consider lower doses. Check renal function.",
-                "alternatives": ["Thiazide diuretics"]
-            },
-            ("amlodipine", "simvastatin"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Increased simvastatin levels, higher myopathy risk",
-                "mechanism": "Amlodipine inhibits CYP3A4 metabolism of simvastatin",
-                "recommendation": "Limit simvastatin to 20mg daily with amlodipine.",
-                "alternatives": ["Pravastatin", "Rosuvastatin"]
-            },
-            
-            # Pain medication interactions
-            ("tramadol", "ssri"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Serotonin syndrome risk, increased seizure risk",
-                "mechanism": "Both drugs increase serotonin; tramadol lowers seizure threshold",
-                "recommendation": "Avoid combination if possible. Monitor for serotonin syndrome symptoms.",
-                "alternatives": ["Non-serotonergic analgesics"]
-            },
-            ("tramadol", "maoi"): {
-                "severity": InteractionSeverity.CRITICAL,
-                "effect": "Life-threatening serotonin syndrome",
-                "mechanism": "MAOIs potentiate serotonergic effects of tramadol",
-                "recommendation": "CONTRAINDICATED. Do not use within 14 days of MAOI.",
-                "alternatives": ["Non-opioid analgesics"]
-            },
-            ("codeine", "paroxetine"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced analgesic effect of codeine",
-                "mechanism": "Paroxetine inhibits CYP2D6 conversion of codeine to morphine",
-                "recommendation": "Consider alternative analgesic or antidepressant.",
-                "alternatives": ["Morphine", "Oxycodone"]
-            },
-            
-            # Psychiatric medication interactions
-            ("lithium", "ibuprofen"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased lithium levels, toxicity risk",
-                "mechanism": "NSAIDs reduce renal lithium clearance",
-                "recommendation": "Avoid NSAIDs. Monitor lithium levels if necessary.",
-                "alternatives": ["Acetaminophen"]
-            },
-            ("lithium", "ace inhibitors"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased lithium levels",
-                "mechanism": "ACE inhibitors reduce lithium clearance",
-                "recommendation": "Monitor lithium levels closely. May need dose reduction.",
-                "alternatives": []
-            },
-            ("ssri", "maoi"): {
-                "severity": InteractionSeverity.CRITICAL,
-                "effect": "Life-threatening serotonin syndrome",
-                "mechanism": "Massive serotonin accumulation",
-                "recommendation": "CONTRAINDICATED. Wait 2-5 weeks between switching medications.",
-                "alternatives": []
-            },
-            
-            # Antifungal interactions
-            ("ketoconazole", "simvastatin"): {
-                "severity": InteractionSeverity.CRITICAL,
-                "effect": "Severe myopathy and rhabdomyolysis risk",
-                "mechanism": "Ketoconazole strongly inhibits CYP3A4 metabolism of statins",
-                "recommendation": "CONTRAINDICATED. Hold statin during antifungal treatment.",
-                "alternatives": ["Fluconazole with pravastatin", "Topical antifungals"]
-            },
-            ("fluconazole", "warfarin"): {
-                "severity": InteractionSeverity.HIGH,
-                "effect": "Increased INR and bleeding risk",
-                "mechanism": "Fluconazole inhibits CYP2C9 metabolism of warfarin",
-                "recommendation": "Monitor INR closely. May need warfarin dose reduction.",
-                "alternatives": []
-            },
-            
-            # Proton pump inhibitor interactions
-            ("omeprazole", "clopidogrel"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced antiplatelet effect of clopidogrel",
-                "mechanism": "Omeprazole inhibits CYP2C19 activation of clopidogrel",
-                "recommendation": "Use pantoprazole or H2 blocker instead.",
-                "alternatives": ["Pantoprazole", "Famotidine"]
-            },
-            ("omeprazole", "methotrexate"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Increased methotrexate levels",
-                "mechanism": "PPIs inhibit renal elimination of methotrexate",
-                "recommendation": "Consider temporary discontinuation of PPI with high-dose methotrexate.",
-                "alternatives": ["H2 blockers"]
-            },
-            
-            # Thyroid medication interactions
-            ("levothyroxine", "calcium"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced levothyroxine absorption",
-                "mechanism": "Calcium binds to levothyroxine in GI tract",
-                "recommendation": "Separate doses by 4 hours.",
-                "alternatives": []
-            },
-            ("levothyroxine", "iron"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced levothyroxine absorption",
-                "mechanism": "Iron binds to levothyroxine",
-                "recommendation": "Separate doses by 4 hours.",
-                "alternatives": []
-            },
-            ("levothyroxine", "antacids"): {
-                "severity": InteractionSeverity.MODERATE,
-                "effect": "Reduced levothyroxine absorption",
-                "mechanism": "Antacids alter GI pH and bind levothyroxine",
-                "recommendation": "Separate doses by 4 hours.",
-                "alternatives": []
-            },
-        }
-        
-        # =====================================================================
-        # DRUG CLASS MAPPINGS
-        # Map generic drug names to their classes for broader interaction checking
-        # =====================================================================
-        self.DRUG_CLASSES: Dict[str, List[str]] = {
-            "ssri": ["fluoxetine", "sertraline", "paroxetine", "citalopram", "escitalopram", "fluvoxamine"],
-            "maoi": ["phenelzine", "tranylcypromine", "isocarboxazid", "selegiline", "moclobemide"],
-            "nsaid": ["ibuprofen", "naproxen", "diclofenac", "indomethacin", "piroxicam", "meloxicam", "celecoxib"],
-            "ace_inhibitor": ["lisinopril", "enalapril", "ramipril", "captopril", "benazepril", "perindopril"],
-            "arb": ["losartan", "valsartan", "irbesartan", "olmesartan", "candesartan", "telmisartan"],
-            "beta_blocker": ["atenolol", "metoprolol", "propranolol", "carvedilol", "bisoprolol", "nebivolol"],
-            "calcium_blocker": ["amlodipine", "verapamil", "diltiazem", "nifedipine", "felodipine"],
-            "statin": ["atorvastatin", "simvastatin", "rosuvastatin", "pravastatin", "lovastatin", "fluvastatin"],
-            "sulfonylurea": ["glipizide", "glyburide", "glimepiride", "glibenclamide"],
-            "fluoroquinolone": ["ciprofloxacin", "levofloxacin", "moxifloxacin", "ofloxacin"],
-            "macrolide": ["azithromycin", "clarithromycin", "erythromycin"],
-            "antacid": ["aluminum hydroxide", "magnesium hydroxide", "calcium carbonate", "tums", "maalox"],
-            "ppi": ["omeprazole", "esomeprazole", "pantoprazole", "lansoprazole", "rabeprazole"],
-            "anticoagulant": ["warfarin", "heparin", "enoxaparin", "rivaroxaban", "apixaban", "dabigatran"],
-            "antiplatelet": ["aspirin", "clopidogrel", "prasugrel", "ticagrelor"],
-            "opioid": ["morphine", "codeine", "oxycodone", "hydrocodone", "fentanyl", "tramadol", "methadone"],
-            "benzodiazepine": ["diazepam", "lorazepam", "alprazolam", "clonazepam", "midazolam"],
-            "diuretic_potassium_sparing": ["spironolactone", "eplerenone", "amiloride", "triamterene"],
-            "diuretic_loop": ["furosemide", "bumetanide", "torsemide"],
-            "diuretic_thiazide": ["hydrochlorothiazide", "chlorthalidone", "indapamide", "metolazone"],
-        }
-        
-        # Reverse mapping: drug name -> class
-        self.DRUG_TO_CLASS: Dict[str, str] = {}
-        for drug_class, drugs in self.DRUG_CLASSES.items():
-            for drug in drugs:
-                self.DRUG_TO_CLASS[drug.lower()] = drug_class
-        
-        # =====================================================================
-        # ALLERGY CROSS-REACTIVITY DATABASE
-        # Drugs that may cause reactions in patients with specific allergies
-        # =====================================================================
-        self.ALLERGY_CROSS_REACTIVITY: Dict[str, List[str]] = {
-            "penicillin": ["amoxicillin", "ampicillin", "piperacillin", "cephalosporin", "cefazolin", 
-                          "cephalexin", "ceftriaxone", "cefuroxime", "cefdinir"],
-            "sulfa": ["sulfamethoxazole", "trimethoprim-sulfamethoxazole", "bactrim", "septra",
-                     "sulfasalazine", "dapsone", "sulfadiazine"],
-            "aspirin": ["ibuprofen", "naproxen", "diclofenac", "ketorolac", "indomethacin", "piroxicam"],
-            "nsaid": ["aspirin", "ibuprofen", "naproxen", "diclofenac", "celecoxib"],
-            "codeine": ["morphine", "hydrocodone", "oxycodone", "tramadol"],
-            "morphine": ["codeine", "hydrocodone", "oxycodone", "fentanyl"],
-            "iodine": ["contrast dye", "povidone-iodine", "amiodarone", "iodinated contrast"],
-            "latex": [],  # Not medication-related but important
-            "egg": ["propofol", "influenza vaccine"],
-            "shellfish": [],  # Note: shellfish allergy is NOT a contraindication for iodinated contrast
-        }
-        
-        # =====================================================================
-        # CONDITION-BASED CONTRAINDICATIONS
-        # Conditions that contraindicate certain medications
-        # =====================================================================
-        self.CONDITION_CONTRAINDICATIONS: Dict[str, List[Dict[str, Any]]] = {
-            "renal failure": [
-                {"drug_class": "nsaid", "severity": "high", "reason": "NSAIDs can worsen renal function"},
-                {"drug": "metformin", "severity": "high", "reason": "Risk of lactic acidosis in renal impairment"},
-                {"drug_class": "ace_inhibitor", "severity": "moderate", "reason": "May worsen renal function; monitor closely"},
-            ],
-            "liver disease": [
-                {"drug": "acetaminophen", "severity": "high", "reason": "Hepatotoxicity risk; limit dose to 2g/day"},
-                {"drug_class": "statin", "severity": "moderate", "reason": "May worsen liver function; monitor LFTs"},
-            ],
-            "heart failure": [
-                {"drug_class": "nsaid", "severity": "high", "reason": "NSAIDs cause fluid retention and worsen heart failure"},
-                {"drug_class": "calcium_blocker", "severity": "moderate", "reason": "Some CCBs have negative inotropic effects"},
-                {"drug": "metformin", "severity": "moderate", "reason": "Risk in unstable or acute heart failure"},
-            ],
-            "asthma": [
-                {"drug_class": "beta_blocker", "severity": "high", "reason": "Can trigger bronchospasm"},
-                {"drug": "aspirin", "severity": "moderate", "reason": "May trigger aspirin-sensitive asthma"},
-            ],
-            "peptic ulcer": [
-                {"drug_class": "nsaid", "severity": "high", "reason": "Increases GI bleeding risk"},
-                {"drug": "aspirin", "severity": "high", "reason": "Increases GI bleeding risk"},
-            ],
-            "diabetes": [
-                {"drug_class": "beta_blocker", "severity": "moderate", "reason": "Can mask hypoglycemia symptoms"},
-            ],
-            "pregnancy": [
-                {"drug_class": "ace_inhibitor", "severity": "critical", "reason": "Teratogenic; contraindicated in pregnancy"},
-                {"drug_class": "arb", "severity": "critical", "reason": "Teratogenic; contraindicated in pregnancy"},
-                {"drug": "methotrexate", "severity": "critical", "reason": "Abortifacient and teratogenic"},
-                {"drug": "warfarin", "severity": "critical", "reason": "Teratogenic, especially in first trimester"},
-                {"drug_class": "statin", "severity": "critical", "reason": "Contraindicated in pregnancy"},
-            ],
-            "breastfeeding": [
-                {"drug": "methotrexate", "severity": "critical", "reason": "Excreted in breast milk; contraindicated"},
-                {"drug": "lithium", "severity": "high", "reason": "Excreted in breast milk; avoid if possible"},
-            ],
-        }
+        self.DRUG_INTERACTIONS = DRUG_INTERACTIONS
+        self.DRUG_CLASSES = DRUG_CLASSES
+        self.DRUG_TO_CLASS = DRUG_TO_CLASS
+        self.ALLERGY_CROSS_REACTIVITY = ALLERGY_CROSS_REACTIVITY
+        self.CONDITION_CONTRAINDICATIONS = CONDITION_CONTRAINDICATIONS
+        self.interaction_index = INTERACTION_INDEX
         
         logger.info("MedicationInteractionService initialized with comprehensive drug database")
     
@@ -410,12 +737,19 @@ class MedicationInteractionService:
         if not medication_text:
             return []
         
-        # Split by common separators
-        drugs = re.split(r'[,;\n]+', medication_text)
+        # Known drugs anywhere in the text, in one pass
+        mentions = DRUG_NAME_MATCHER.scan(medication_text)
+        extracted = [mention["drug"] for mention in mentions]
         
-        extracted = []
-        for drug in drugs:
-            normalized = self._normalize_drug_name(drug)
+        # Fragments naming no known drug keep the old normalized-fragment behaviour,
+        # so allergy matching still sees drugs that are not in the tables
+        mention_index = 0
+        for fragment in re.finditer(r'[^,;\n]+', medication_text):
+            while mention_index < len(mentions) and mentions[mention_index]["end"] <= fragment.start():
+                mention_index += 1
+            if mention_index < len(mentions) and mentions[mention_index]["start"] < fragment.end():
+                continue
+            normalized = self._normalize_drug_name(fragment.group())
             if normalized and len(normalized) > 2:  # Filter out very short strings
                 extracted.append(normalized)
         
@@ -441,8 +775,6 @@ class MedicationInteractionService:
         Returns:
             List of interaction warnings
         """
-        interactions = []
-        
         # Normalize all drug names
         current_drugs = set()
         for med in current_medications:
@@ -452,83 +784,34 @@ class MedicationInteractionService:
         for med in new_medications:
             new_drugs.update(self._extract_drug_names(med))
         
-        all_drugs = current_drugs.union(new_drugs)
+        return self._find_interactions(current_drugs, new_drugs)
+    
+    def _find_interactions(self, current_drugs: Set[str], new_drugs: Set[str]) -> List[Dict[str, Any]]:
+        """Interaction warnings among already-extracted drug names"""
+        interactions = []
         
-        # Check each pair of drugs
-        checked_pairs = set()
+        all_drugs = current_drugs.union(new_drugs)
         
-        for drug1 in all_drugs:
-            for drug2 in all_drugs:
-                if drug1 == drug2:
-                    continue
-                
-                # Create sorted pair to avoid duplicate checks
-                pair = tuple(sorted([drug1, drug2]))
-                if pair in checked_pairs:
-                    continue
-                checked_pairs.add(pair)
-                
-                # Check direct interaction
-                interaction = self._check_pair_interaction(drug1, drug2)
-                if interaction:
-                    interaction["drugs"] = [drug1, drug2]
-                    interaction["is_new_medication"] = drug1 in new_drugs or drug2 in new_drugs
-                    interactions.append(interaction)
-                    continue
-                
-                # Check class-based interaction
-                class1 = self._get_drug_class(drug1)
-                class2 = self._get_drug_class(drug2)
-                
-                if class1:
-                    class_interaction = self._check_pair_interaction(class1, drug2)
-                    if class_interaction:
-                        class_interaction["drugs"] = [drug1, drug2]
-                        class_interaction["via_class"] = class1
-                        class_interaction["is_new_medication"] = drug1 in new_drugs or drug2 in new_drugs
-                        interactions.append(class_interaction)
-                        continue
-                
-                if class2:
-                    class_interaction = self._check_pair_interaction(drug1, class2)
-                    if class_interaction:
-                        class_interaction["drugs"] = [drug1, drug2]
-                        class_interaction["via_class"] = class2
-                        class_interaction["is_new_medication"] = drug1 in new_drugs or drug2 in new_drugs
-                        interactions.append(class_interaction)
+        # Walk the compiled adjacency index: only partners actually prescribed are visited
+        for drug1, drug2, interaction_id, via_class in self.interaction_index.find_interactions(all_drugs):
+            interaction = self.interaction_index.interaction_dict(interaction_id)
+            interaction["drugs"] = [drug1, drug2]
+            if via_class:
+                interaction["via_class"] = via_class
+            interaction["is_new_medication"] = drug1 in new_drugs or drug2 in new_drugs
+            interactions.append(interaction)
         
         # Sort by severity
-        severity_order = {
-            InteractionSeverity.CRITICAL: 0,
-            InteractionSeverity.HIGH: 1,
-            InteractionSeverity.MODERATE: 2,
-            InteractionSeverity.LOW: 3,
-            InteractionSeverity.UNKNOWN: 4
-        }
-        
-        interactions.sort(key=lambda x: severity_order.get(x.get("severity"), 5))
+        interactions.sort(key=lambda x: SEVERITY_ORDER.get(x.get("severity"), 5))
         
         return interactions
     
     def _check_pair_interaction(self, drug1: str, drug2: str) -> Optional[Dict[str, Any]]:
-        """Check if two drugs have a known interaction"""
-        # Check both orderings
-        key1 = (drug1.lower(), drug2.lower())
-        key2 = (drug2.lower(), drug1.lower())
-        
-        interaction = self.DRUG_INTERACTIONS.get(key1) or self.DRUG_INTERACTIONS.get(key2)
-        
-        if interaction:
-            return {
-                "type": "drug_interaction",
-                "severity": interaction["severity"].value if isinstance(interaction["severity"], InteractionSeverity) else interaction["severity"],
-                "effect": interaction.get("effect", ""),
-                "mechanism": interaction.get("mechanism", ""),
-                "recommendation": interaction.get("recommendation", ""),
-                "alternatives": interaction.get("alternatives", [])
-            }
-        
-        return None
+        """Check if two drugs (or drug classes) have a known interaction"""
+        interaction_id = self.interaction_index.lookup(drug1, drug2)
+        if interaction_id is None:
+            return None
+        return self.interaction_index.interaction_dict(interaction_id)
     
     async def check_allergy_conflicts(
         self,
@@ -545,19 +828,29 @@ class MedicationInteractionService:
         Returns:
             List of allergy warnings
         """
-        warnings = []
-        
         if not patient_allergies:
-            return warnings
-        
-        # Parse allergies
-        allergies = [a.strip().lower() for a in patient_allergies.split(",") if a.strip()]
+            return []
         
         # Extract all drug names from medications
         all_drugs = set()
         for med in medications:
             all_drugs.update(self._extract_drug_names(med))
         
+        return self._find_allergy_conflicts(patient_allergies, all_drugs)
+    
+    def _find_allergy_conflicts(self, patient_allergies: str, all_drugs: Set[str]) -> List[Dict[str, Any]]:
+        """Allergy warnings for already-extracted drug names"""
+        warnings = []
+        
+        if not patient_allergies:
+            return warnings
+        
+        # Parse allergies; brand names and phrases like "penicillin allergy" resolve to known names
+        allergies = [a.strip().lower() for a in patient_allergies.split(",") if a.strip()]
+        for mention in DRUG_NAME_MATCHER.scan(patient_allergies):
+            if mention["drug"] not in allergies:
+                allergies.append(mention["drug"])
+        
         for allergy in allergies:
             # Direct allergy match
             for drug in all_drugs:
@@ -603,19 +896,23 @@ class MedicationInteractionService:
         Returns:
             List of contraindication warnings
         """
-        warnings = []
-        
         if not patient_conditions:
-            return warnings
-        
-        # Normalize conditions
-        conditions = [c.strip().lower() for c in patient_conditions if c.strip()]
+            return []
         
         # Extract all drug names
         all_drugs = set()
         for med in medications:
             all_drugs.update(self._extract_drug_names(med))
         
+        return self._find_contraindications(patient_conditions, all_drugs)
+    
+    def _find_contraindications(self, patient_conditions: List[str], all_drugs: Set[str]) -> List[Dict[str, Any]]:
+        """Contraindication warnings for already-extracted drug names"""
+        warnings = []
+        
+        # Normalize conditions
+        conditions = [c.strip().lower() for c in patient_conditions if c.strip()]
+        
         for condition in conditions:
             # Find matching condition contraindications
             contraindications = self.CONDITION_CONTRAINDICATIONS.get(condition, [])
@@ -670,19 +967,7 @@ class MedicationInteractionService:
         Returns:
             Comprehensive safety check results
         """
-        results = {
-            "drug_interactions": [],
-            "allergy_warnings": [],
-            "contraindications": [],
-            "summary": {
-                "critical_count": 0,
-                "high_count": 0,
-                "moderate_count": 0,
-                "low_count": 0,
-                "safe_to_prescribe": True
-            },
-            "recommendations": []
-        }
+        results = self._empty_check_result()
         
         all_medications = current_medications + new_medications
         
@@ -709,6 +994,95 @@ class MedicationInteractionService:
                     additional_contra = await self.check_condition_contraindications(history_conditions, all_medications)
                     results["contraindications"].extend(additional_contra)
         
+        return self._summarize_check(results)
+    
+    async def batch_medication_check(self, checks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Run comprehensive_medication_check for many prescriptions in one call.
+        
+        Each medication text is scanned once, and identical work is shared through
+        memo tables: one interaction check per distinct (current, new) drug set and
+        one full result per distinct drug set + allergies + conditions. Prescriptions
+        in a pharmacy queue repeat the same regimens often, so most checks become
+        dictionary hits.
+        
+        Args:
+            checks: [{"key", "current_medications", "new_medications",
+                      "patient_allergies", "patient_conditions", "medical_history"}]
+            
+        Returns:
+            {"results": [{"key", "check_result"}] in input order, "stats": memo statistics}
+        """
+        drug_memo: Dict[str, FrozenSet[str]] = {}
+        history_memo: Dict[str, Tuple[str, ...]] = {}
+        interaction_memo: Dict[Tuple[FrozenSet[str], FrozenSet[str]], List[Dict[str, Any]]] = {}
+        result_memo: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        
+        def drugs_in(medications: List[str]) -> FrozenSet[str]:
+            drugs: Set[str] = set()
+            for med in medications or []:
+                if med not in drug_memo:
+                    drug_memo[med] = frozenset(self._extract_drug_names(med))
+                drugs.update(drug_memo[med])
+            return frozenset(drugs)
+        
+        results = []
+        for check in checks:
+            current_drugs = drugs_in(check.get("current_medications"))
+            new_drugs = drugs_in(check.get("new_medications"))
+            allergies = (check.get("patient_allergies") or "").strip().lower()
+            
+            conditions = {c.strip().lower() for c in check.get("patient_conditions") or [] if c.strip()}
+            medical_history = check.get("medical_history") or ""
+            if medical_history:
+                if medical_history not in history_memo:
+                    history_memo[medical_history] = tuple(self._extract_conditions_from_history(medical_history))
+                conditions.update(history_memo[medical_history])
+            
+            result_key = (current_drugs, new_drugs, allergies, frozenset(conditions))
+            result = result_memo.get(result_key)
+            if result is None:
+                interaction_key = (current_drugs, new_drugs)
+                if interaction_key not in interaction_memo:
+                    interaction_memo[interaction_key] = self._find_interactions(set(current_drugs), set(new_drugs))
+                
+                all_drugs = set(current_drugs | new_drugs)
+                result = self._empty_check_result()
+                result["drug_interactions"] = interaction_memo[interaction_key]
+                result["allergy_warnings"] = self._find_allergy_conflicts(allergies, all_drugs)
+                if conditions:
+                    result["contraindications"] = self._find_contraindications(sorted(conditions), all_drugs)
+                result_memo[result_key] = self._summarize_check(result)
+            
+            results.append({"key": check.get("key"), "check_result": result})
+        
+        return {
+            "results": results,
+            "stats": {
+                "checks": len(checks),
+                "unique_results": len(result_memo),
+                "unique_medication_sets": len(interaction_memo),
+                "unique_medication_texts": len(drug_memo)
+            }
+        }
+    
+    def _empty_check_result(self) -> Dict[str, Any]:
+        return {
+            "drug_interactions": [],
+            "allergy_warnings": [],
+            "contraindications": [],
+            "summary": {
+                "critical_count": 0,
+                "high_count": 0,
+                "moderate_count": 0,
+                "low_count": 0,
+                "safe_to_prescribe": True
+            },
+            "recommendations": []
+        }
+    
+    def _summarize_check(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in severity counts and recommendations of a safety check result"""
         # Count severities
         all_warnings = results["drug_interactions"] + results["allergy_warnings"] + results["contraindications"]
         
@@ -869,3 +1243,62 @@ def get_medication_service() -> MedicationInteractionService:
     if _medication_service_instance is None:
         _medication_service_instance = MedicationInteractionService()
     return _medication_service_instance
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: pairwise dict lookups (previous implementation) vs the compiled index
+    import random
+    import timeit
+
+    def _pairwise(drugs: Set[str]) -> int:
+        found = 0
+        checked_pairs = set()
+        for drug1 in drugs:
+            for drug2 in drugs:
+                if drug1 == drug2:
+                    continue
+                pair = tuple(sorted([drug1, drug2]))
+                if pair in checked_pairs:
+                    continue
+                checked_pairs.add(pair)
+                if DRUG_INTERACTIONS.get((drug1, drug2)) or DRUG_INTERACTIONS.get((drug2, drug1)):
+                    found += 1
+                    continue
+                class1 = DRUG_TO_CLASS.get(drug1)
+                class2 = DRUG_TO_CLASS.get(drug2)
+                if class1 and (DRUG_INTERACTIONS.get((class1, drug2)) or DRUG_INTERACTIONS.get((drug2, class1))):
+                    found += 1
+                    continue
+                if class2 and (DRUG_INTERACTIONS.get((drug1, class2)) or DRUG_INTERACTIONS.get((class2, drug1))):
+                    found += 1
+        return found
+
+    def _indexed(drugs: Set[str]) -> int:
+        return len(INTERACTION_INDEX.find_interactions(drugs))
+
+    # Known drugs mixed with names the database has never seen, as in real prescriptions
+    known = sorted(DRUG_TO_CLASS) + sorted({name for pair in DRUG_INTERACTIONS for name in pair} - set(DRUG_TO_CLASS))
+    rng = random.Random(42)
+    print(f"{'drugs':>6} | {'pairwise (us)':>14} | {'indexed (us)':>13} | speedup")
+    for count in (5, 20, 50):
+        drugs = set(rng.sample(known, count // 2)) | {f"unlisted drug {i}" for i in range(count - count // 2)}
+        pairwise_us = min(timeit.repeat(lambda: _pairwise(drugs), number=10, repeat=5)) / 10 * 1e6
+        indexed_us = min(timeit.repeat(lambda: _indexed(drugs), number=10, repeat=5)) / 10 * 1e6
+        print(f"{count:>6} | {pairwise_us:>14.1f} | {indexed_us:>13.1f} | {pairwise_us / indexed_us:.1f}x")
+
+    # Extraction: split + normalize each fragment (previous) vs one automaton pass
+    def _split_normalize(text: str) -> List[str]:
+        service = get_medication_service()
+        return [
+            normalized for normalized in (service._normalize_drug_name(fragment) for fragment in re.split(r'[,;\n]+', text))
+            if normalized and len(normalized) > 2
+        ]
+
+    line = "Tab Amlodipine 5mg OD after food, Tab Metformin 500mg BD; Cap Omeprazole 20mg before breakfast\n"
+    print(f"\n{'chars':>6} | {'split (us)':>11} | {'automaton (us)':>15} | drugs found (split / automaton)")
+    for repeat_lines in (1, 10, 100):
+        text = line * repeat_lines
+        split_us = min(timeit.repeat(lambda: _split_normalize(text), number=10, repeat=5)) / 10 * 1e6
+        scan_us = min(timeit.repeat(lambda: DRUG_NAME_MATCHER.scan(text), number=10, repeat=5)) / 10 * 1e6
+        known_split = sum(1 for name in _split_normalize(text) if name in DRUG_TO_CLASS or INTERACTION_INDEX.resolve(name)[0] is not None)
+        print(f"{len(text):>6} | {split_us:>11.1f} | {scan_us:>15.1f} | {known_split} / {len(DRUG_NAME_MATCHER.scan(text))}")
@@ -0,0 +1,89 @@
+-- Migration: Single-query lab dashboard lookup by phone
+-- Purpose: Replace O(contacts + doctors) round-trips in get_lab_report_requests_by_phone
+--          with one RPC that resolves phone -> lab contacts / doctor profiles -> requests
+--          and joins patient/visit info in the same statement
+--
+-- Matching rules (same as the Python implementation it replaces):
+--   1. Requests linked to any lab_contacts row with contact_phone = phone
+--   2. Requests of doctors whose pathology_lab_phone / radiology_lab_phone = phone,
+--      restricted to the report types that phone is configured for
+-- Returns a JSONB array deduplicated by request id, newest first. The nested
+-- "patients" and "visits" objects match the PostgREST embed shape the API returns.
+
+-- ============================================
+-- INDEXES
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_lab_contacts_contact_phone
+ON lab_contacts(contact_phone);
+
+CREATE INDEX IF NOT EXISTS idx_doctors_pathology_lab_phone
+ON doctors(pathology_lab_phone)
+WHERE pathology_lab_phone IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_doctors_radiology_lab_phone
+ON doctors(radiology_lab_phone)
+WHERE radiology_lab_phone IS NOT NULL;
+
+-- Doctor-profile branch filters by doctor + report type and sorts by recency
+CREATE INDEX IF NOT EXISTS idx_lab_requests_doctor_type_created
+ON lab_report_requests(doctor_firebase_uid, report_type, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_lab_requests_contact_created
+ON lab_report_requests(lab_contact_id, created_at DESC);
+
+-- ============================================
+-- RPC
+-- ============================================
+
+CREATE OR REPLACE FUNCTION get_lab_report_requests_for_phone(
+    p_phone TEXT,
+    p_status TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+    WITH contact_requests AS (
+        SELECT r.id
+        FROM lab_contacts lc
+        JOIN lab_report_requests r ON r.lab_contact_id = lc.id
+        WHERE lc.contact_phone = p_phone
+    ),
+    profile_requests AS (
+        SELECT r.id
+        FROM doctors d
+        JOIN lab_report_requests r ON r.doctor_firebase_uid = d.firebase_uid
+        WHERE (d.pathology_lab_phone = p_phone AND r.report_type = 'pathology')
+           OR (d.radiology_lab_phone = p_phone AND r.report_type = 'radiology')
+    ),
+    matched AS (
+        SELECT id FROM contact_requests
+        UNION
+        SELECT id FROM profile_requests
+    )
+    SELECT COALESCE(jsonb_agg(to_jsonb(r) || jsonb_build_object(
+        'patients', CASE WHEN p.id IS NULL THEN NULL ELSE jsonb_build_object(
+            'first_name', p.first_name,
+            'last_name', p.last_name,
+            'phone', p.phone
+        ) END,
+        'visits', CASE WHEN v.id IS NULL THEN NULL ELSE jsonb_build_object(
+            'visit_date', v.visit_date,
+            'visit_type', v.visit_type,
+            'chief_complaint', v.chief_complaint
+        ) END
+    ) ORDER BY r.created_at DESC), '[]'::jsonb)
+    FROM matched m
+    JOIN lab_report_requests r ON r.id = m.id
+    LEFT JOIN patients p ON p.id = r.patient_id
+    LEFT JOIN visits v ON v.id = r.visit_id
+    WHERE p_status IS NULL OR r.status = p_status;
+$$;
+
+GRANT EXECUTE ON FUNCTION get_lab_report_requests_for_phone(TEXT, TEXT) TO authenticated;
+GRANT EXECUTE ON FUNCTION get_lab_report_requests_for_phone(TEXT, TEXT) TO service_role;
+
+ANALYZE lab_contacts;
+ANALYZE lab_report_requests;
@@ -0,0 +1,63 @@
+-- Migration: Push appointment conflict detection into the database
+-- Purpose: check_appointment_conflicts used to fetch every appointment of the doctor's
+--          day and parse each time in Python on every booking. A stored tsrange column
+--          with a GiST index turns the check into a single O(log n) overlap probe.
+--
+-- Ranges are half-open [start, start + duration) so back-to-back bookings do not conflict.
+-- Cancelled appointments are excluded, matching the previous Python behaviour.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+-- ============================================
+-- STORED TIME RANGE
+-- ============================================
+
+ALTER TABLE public.appointments
+ADD COLUMN IF NOT EXISTS time_range tsrange
+GENERATED ALWAYS AS (
+    tsrange(
+        appointment_date + appointment_time,
+        appointment_date + appointment_time + make_interval(mins => COALESCE(duration_minutes, 30)),
+        '[)'
+    )
+) STORED;
+
+-- Doctor + range lookup for active appointments
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_time_range
+ON public.appointments USING gist (doctor_firebase_uid, time_range)
+WHERE status <> 'cancelled';
+
+-- ============================================
+-- RPC
+-- ============================================
+
+CREATE OR REPLACE FUNCTION check_appointment_conflict(
+    p_doctor_uid TEXT,
+    p_appointment_date DATE,
+    p_appointment_time TIME,
+    p_duration_minutes INTEGER,
+    p_exclude_appointment_id BIGINT DEFAULT NULL
+)
+RETURNS BOOLEAN
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+    SELECT EXISTS (
+        SELECT 1
+        FROM appointments a
+        WHERE a.doctor_firebase_uid = p_doctor_uid
+          AND a.status <> 'cancelled'
+          AND a.time_range && tsrange(
+                p_appointment_date + p_appointment_time,
+                p_appointment_date + p_appointment_time + make_interval(mins => p_duration_minutes),
+                '[)'
+              )
+          AND (p_exclude_appointment_id IS NULL OR a.id <> p_exclude_appointment_id)
+    );
+$$;
+
+GRANT EXECUTE ON FUNCTION check_appointment_conflict(TEXT, DATE, TIME, INTEGER, BIGINT) TO authenticated;
+GRANT EXECUTE ON FUNCTION check_appointment_conflict(TEXT, DATE, TIME, INTEGER, BIGINT) TO service_role;
+
+ANALYZE appointments;
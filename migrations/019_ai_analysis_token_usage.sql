@@ -0,0 +1,15 @@
+-- Migration: Record Gemini token usage per document analysis
+-- Purpose: Scanned PDFs used to be sent as the text repr of their raw bytes. They are
+--          now sent as native PDF/image parts; these columns make the per-report
+--          token cost visible so the savings can be tracked.
+--
+-- document_input_mode: text | image | pdf (native page subset) | images (rasterized pages)
+
+ALTER TABLE public.ai_document_analysis
+ADD COLUMN IF NOT EXISTS input_token_count INTEGER,
+ADD COLUMN IF NOT EXISTS output_token_count INTEGER,
+ADD COLUMN IF NOT EXISTS document_input_mode TEXT;
+
+COMMENT ON COLUMN public.ai_document_analysis.input_token_count IS 'Prompt tokens reported by Gemini (usage_metadata.prompt_token_count)';
+COMMENT ON COLUMN public.ai_document_analysis.output_token_count IS 'Response tokens reported by Gemini (usage_metadata.candidates_token_count)';
+COMMENT ON COLUMN public.ai_document_analysis.document_input_mode IS 'How the document was sent to the model: text, image, pdf or images';
@@ -0,0 +1,29 @@
+-- Migration: Batch-prediction lane for low-priority AI analyses
+-- Purpose: Bulk requests (/reports/batch-analyze) used to go through the same
+--          interactive Gemini path as fresh uploads. Items queued with lane = 'batch'
+--          are collected by the processor into batch prediction jobs instead, and
+--          batch_job_id links each claimed item to the job that will produce it.
+--
+-- batch_job_id values starting with 'claim:' mark items claimed but not yet submitted.
+
+ALTER TABLE public.ai_analysis_queue
+ADD COLUMN IF NOT EXISTS lane TEXT NOT NULL DEFAULT 'interactive',
+ADD COLUMN IF NOT EXISTS batch_job_id TEXT;
+
+ALTER TABLE public.ai_analysis_queue
+DROP CONSTRAINT IF EXISTS ai_analysis_queue_lane_check;
+
+ALTER TABLE public.ai_analysis_queue
+ADD CONSTRAINT ai_analysis_queue_lane_check CHECK (lane IN ('interactive', 'batch'));
+
+-- Pending items per lane in dispatch order
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_lane_pending
+ON public.ai_analysis_queue (lane, status, priority DESC, queued_at);
+
+-- In-flight batch items grouped by job
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_batch_job
+ON public.ai_analysis_queue (batch_job_id)
+WHERE batch_job_id IS NOT NULL;
+
+COMMENT ON COLUMN public.ai_analysis_queue.lane IS 'interactive (processed immediately) or batch (collected into batch prediction jobs)';
+COMMENT ON COLUMN public.ai_analysis_queue.batch_job_id IS 'Batch job producing this item while processing in the batch lane';
@@ -0,0 +1,58 @@
+-- Migration: Candidate window for fair AI queue scheduling
+-- Purpose: The processor used to take the first N pending rows by (priority, queued_at),
+--          so one doctor batch-queueing 200 reports starved everyone else. The scheduler
+--          now round-robins across doctors, which needs the head of every doctor's queue
+--          rather than the global head. This RPC returns the first p_per_doctor pending
+--          rows per (lane, doctor, priority) plus the total pending depth per lane.
+--
+-- Returns: {"items": [queue rows...], "lane_depths": {"interactive": n, "batch": n}}
+
+-- Per-doctor heads in dispatch order
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_doctor_pending
+ON public.ai_analysis_queue (lane, doctor_firebase_uid, priority DESC, queued_at)
+WHERE status = 'pending';
+
+CREATE OR REPLACE FUNCTION get_ai_queue_candidates(
+    p_per_doctor INTEGER DEFAULT 3,
+    p_lanes TEXT[] DEFAULT ARRAY['interactive', 'batch'],
+    p_limit INTEGER DEFAULT 500
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+    WITH pending AS (
+        SELECT
+            q.*,
+            row_number() OVER (
+                PARTITION BY q.lane, q.doctor_firebase_uid, q.priority
+                ORDER BY q.queued_at
+            ) AS doctor_rank
+        FROM ai_analysis_queue q
+        WHERE q.status = 'pending'
+          AND q.lane = ANY (p_lanes)
+    ),
+    heads AS (
+        SELECT *
+        FROM pending
+        WHERE doctor_rank <= p_per_doctor
+        ORDER BY priority DESC, queued_at
+        LIMIT p_limit
+    )
+    SELECT jsonb_build_object(
+        'items', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(h) - 'doctor_rank' ORDER BY h.priority DESC, h.queued_at) FROM heads h),
+            '[]'::jsonb
+        ),
+        'lane_depths', COALESCE(
+            (SELECT jsonb_object_agg(lane, depth) FROM (
+                SELECT lane, count(*) AS depth FROM pending GROUP BY lane
+            ) d),
+            '{}'::jsonb
+        )
+    );
+$$;
+
+GRANT EXECUTE ON FUNCTION get_ai_queue_candidates(INTEGER, TEXT[], INTEGER) TO authenticated;
+GRANT EXECUTE ON FUNCTION get_ai_queue_candidates(INTEGER, TEXT[], INTEGER) TO service_role;
@@ -0,0 +1,88 @@
+-- Migration: Retry with backoff and dead-lettering for the AI analysis queue
+-- Purpose: A transient Gemini 429 or download timeout used to close the queue row as
+--          'failed' (and store a failed analysis) with no automatic retry. Failed attempts
+--          now go back to 'pending' with next_attempt_at pushed out by an exponential,
+--          jittered backoff chosen by error class. After max_retries retries the row is
+--          moved to 'dead_letter' for inspection / manual requeue.
+--
+-- The dispatcher only picks up rows whose next_attempt_at has passed.
+
+ALTER TABLE public.ai_analysis_queue
+ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+ADD COLUMN IF NOT EXISTS last_error_class TEXT;
+
+-- Existing rows are eligible immediately
+UPDATE public.ai_analysis_queue
+SET next_attempt_at = queued_at
+WHERE status = 'pending';
+
+ALTER TABLE public.ai_analysis_queue
+DROP CONSTRAINT IF EXISTS ai_analysis_queue_status_check;
+
+ALTER TABLE public.ai_analysis_queue
+ADD CONSTRAINT ai_analysis_queue_status_check
+CHECK (status IN ('pending', 'processing', 'completed', 'failed', 'dead_letter'));
+
+ALTER TABLE public.ai_analysis_queue
+DROP CONSTRAINT IF EXISTS ai_analysis_queue_attempts_check;
+
+ALTER TABLE public.ai_analysis_queue
+ADD CONSTRAINT ai_analysis_queue_attempts_check CHECK (attempts >= 0);
+
+-- Ready-to-run pending rows
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_pending_next_attempt
+ON public.ai_analysis_queue (next_attempt_at)
+WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_dead_letter
+ON public.ai_analysis_queue (doctor_firebase_uid, completed_at DESC)
+WHERE status = 'dead_letter';
+
+COMMENT ON COLUMN public.ai_analysis_queue.attempts IS 'Failed attempts so far';
+COMMENT ON COLUMN public.ai_analysis_queue.next_attempt_at IS 'Earliest time the dispatcher may pick this row up';
+COMMENT ON COLUMN public.ai_analysis_queue.last_error_class IS 'Class of the last failure (rate_limit, timeout, download, server, storage, missing_data, invalid_input, unknown)';
+
+-- Candidate window for the fair scheduler (021), now skipping rows still backing off
+CREATE OR REPLACE FUNCTION get_ai_queue_candidates(
+    p_per_doctor INTEGER DEFAULT 3,
+    p_lanes TEXT[] DEFAULT ARRAY['interactive', 'batch'],
+    p_limit INTEGER DEFAULT 500
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+    WITH pending AS (
+        SELECT
+            q.*,
+            row_number() OVER (
+                PARTITION BY q.lane, q.doctor_firebase_uid, q.priority
+                ORDER BY q.queued_at
+            ) AS doctor_rank
+        FROM ai_analysis_queue q
+        WHERE q.status = 'pending'
+          AND q.next_attempt_at <= now()
+          AND q.lane = ANY (p_lanes)
+    ),
+    heads AS (
+        SELECT *
+        FROM pending
+        WHERE doctor_rank <= p_per_doctor
+        ORDER BY priority DESC, queued_at
+        LIMIT p_limit
+    )
+    SELECT jsonb_build_object(
+        'items', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(h) - 'doctor_rank' ORDER BY h.priority DESC, h.queued_at) FROM heads h),
+            '[]'::jsonb
+        ),
+        'lane_depths', COALESCE(
+            (SELECT jsonb_object_agg(lane, depth) FROM (
+                SELECT lane, count(*) AS depth FROM pending GROUP BY lane
+            ) d),
+            '{}'::jsonb
+        )
+    );
+$$;
@@ -0,0 +1,42 @@
+-- Migration: Single-statement AI queue statistics
+-- Purpose: get_queue_stats ran one count="exact" query per status and the processor's
+--          get_processing_stats downloaded every queue row to count statuses in Python.
+--          get_ai_queue_stats returns all status counts (one GROUP BY) and the age of the
+--          oldest pending item, optionally for a single doctor.
+--
+-- Returns: {"counts": {"pending": n, ...}, "oldest_pending_queued_at": timestamptz | null}
+
+-- Active rows only: completed / failed rows are garbage-collected after 24h
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_active_status_queued
+ON public.ai_analysis_queue (status, queued_at)
+WHERE status IN ('pending', 'processing');
+
+CREATE OR REPLACE FUNCTION get_ai_queue_stats(
+    p_doctor_firebase_uid TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+    SELECT jsonb_build_object(
+        'counts', COALESCE(
+            (SELECT jsonb_object_agg(s.status, s.status_count) FROM (
+                SELECT q.status, count(*) AS status_count
+                FROM ai_analysis_queue q
+                WHERE p_doctor_firebase_uid IS NULL OR q.doctor_firebase_uid = p_doctor_firebase_uid
+                GROUP BY q.status
+            ) s),
+            '{}'::jsonb
+        ),
+        'oldest_pending_queued_at', (
+            SELECT min(q.queued_at)
+            FROM ai_analysis_queue q
+            WHERE q.status = 'pending'
+              AND (p_doctor_firebase_uid IS NULL OR q.doctor_firebase_uid = p_doctor_firebase_uid)
+        )
+    );
+$$;
+
+GRANT EXECUTE ON FUNCTION get_ai_queue_stats(TEXT) TO authenticated;
+GRANT EXECUTE ON FUNCTION get_ai_queue_stats(TEXT) TO service_role;
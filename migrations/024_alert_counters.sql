@@ -0,0 +1,158 @@
+-- Migration: Incrementally maintained clinical alert counters
+-- Purpose: /alerts/counts aggregated every open alert of a doctor on each call (and the
+--          Python fallback downloaded up to 1000 alerts to count them). Open-alert counts
+--          per severity are now kept in ai_alert_counters by a trigger on
+--          ai_clinical_alerts, in the same transaction as the insert / acknowledge /
+--          dismiss that changes them, so reading them is a single-row lookup.
+--
+-- Rows: one per (doctor, patient) plus one doctor-wide row with patient_id = 0.
+-- Open alert: is_acknowledged = FALSE AND is_dismissed = FALSE. expires_at is not
+-- reflected (nothing sets it today); clear expired alerts by dismissing them.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ai_alert_counters (
+    doctor_firebase_uid TEXT NOT NULL REFERENCES doctors(firebase_uid) ON DELETE CASCADE,
+    patient_id INTEGER NOT NULL DEFAULT 0,  -- 0 = all patients of the doctor
+    critical_count INTEGER NOT NULL DEFAULT 0,
+    urgent_count INTEGER NOT NULL DEFAULT 0,
+    high_count INTEGER NOT NULL DEFAULT 0,
+    medium_count INTEGER NOT NULL DEFAULT 0,
+    low_count INTEGER NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (doctor_firebase_uid, patient_id)
+);
+
+-- Add delta to the doctor-wide and the patient row for one severity
+CREATE OR REPLACE FUNCTION apply_alert_counter_delta(
+    p_doctor_firebase_uid TEXT,
+    p_patient_id INTEGER,
+    p_severity TEXT,
+    p_delta INTEGER
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO ai_alert_counters AS c (
+        doctor_firebase_uid, patient_id,
+        critical_count, urgent_count, high_count, medium_count, low_count, total_count, updated_at
+    )
+    SELECT
+        p_doctor_firebase_uid, scope.patient_id,
+        CASE WHEN p_severity = 'critical' THEN p_delta ELSE 0 END,
+        CASE WHEN p_severity = 'urgent' THEN p_delta ELSE 0 END,
+        CASE WHEN p_severity = 'high' THEN p_delta ELSE 0 END,
+        CASE WHEN p_severity = 'medium' THEN p_delta ELSE 0 END,
+        CASE WHEN p_severity = 'low' THEN p_delta ELSE 0 END,
+        p_delta,
+        NOW()
+    FROM unnest(ARRAY[0, p_patient_id]) AS scope(patient_id)
+    ON CONFLICT (doctor_firebase_uid, patient_id) DO UPDATE SET
+        critical_count = c.critical_count + EXCLUDED.critical_count,
+        urgent_count = c.urgent_count + EXCLUDED.urgent_count,
+        high_count = c.high_count + EXCLUDED.high_count,
+        medium_count = c.medium_count + EXCLUDED.medium_count,
+        low_count = c.low_count + EXCLUDED.low_count,
+        total_count = c.total_count + EXCLUDED.total_count,
+        updated_at = NOW();
+$$;
+
+CREATE OR REPLACE FUNCTION maintain_alert_counters()
+RETURNS TRIGGER AS $$
+DECLARE
+    old_open BOOLEAN := FALSE;
+    new_open BOOLEAN := FALSE;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        old_open := NOT COALESCE(OLD.is_acknowledged, FALSE) AND NOT COALESCE(OLD.is_dismissed, FALSE);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        new_open := NOT COALESCE(NEW.is_acknowledged, FALSE) AND NOT COALESCE(NEW.is_dismissed, FALSE);
+    END IF;
+
+    -- Updates that leave the counted state alone cost nothing
+    IF TG_OP = 'UPDATE'
+        AND old_open = new_open
+        AND (NOT new_open OR (
+            OLD.severity = NEW.severity
+            AND OLD.patient_id = NEW.patient_id
+            AND OLD.doctor_firebase_uid = NEW.doctor_firebase_uid
+        )) THEN
+        RETURN NULL;
+    END IF;
+
+    IF old_open THEN
+        PERFORM apply_alert_counter_delta(OLD.doctor_firebase_uid, OLD.patient_id, OLD.severity, -1);
+    END IF;
+    IF new_open THEN
+        PERFORM apply_alert_counter_delta(NEW.doctor_firebase_uid, NEW.patient_id, NEW.severity, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill under a lock so no alert changes between the snapshot and the trigger
+LOCK TABLE ai_clinical_alerts IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS trigger_alert_counters ON ai_clinical_alerts;
+CREATE TRIGGER trigger_alert_counters
+    AFTER INSERT OR DELETE OR UPDATE OF is_acknowledged, is_dismissed, severity, patient_id, doctor_firebase_uid
+    ON ai_clinical_alerts
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_alert_counters();
+
+TRUNCATE ai_alert_counters;
+INSERT INTO ai_alert_counters (
+    doctor_firebase_uid, patient_id,
+    critical_count, urgent_count, high_count, medium_count, low_count, total_count
+)
+SELECT
+    doctor_firebase_uid,
+    COALESCE(patient_id, 0),
+    COUNT(*) FILTER (WHERE severity = 'critical'),
+    COUNT(*) FILTER (WHERE severity = 'urgent'),
+    COUNT(*) FILTER (WHERE severity = 'high'),
+    COUNT(*) FILTER (WHERE severity = 'medium'),
+    COUNT(*) FILTER (WHERE severity = 'low'),
+    COUNT(*)
+FROM ai_clinical_alerts
+WHERE COALESCE(is_acknowledged, FALSE) = FALSE
+    AND COALESCE(is_dismissed, FALSE) = FALSE
+GROUP BY GROUPING SETS ((doctor_firebase_uid, patient_id), (doctor_firebase_uid));
+
+-- get_alert_counts now reads the counter row (optionally for one patient)
+DROP FUNCTION IF EXISTS get_alert_counts(TEXT);
+
+CREATE OR REPLACE FUNCTION get_alert_counts(
+    p_doctor_firebase_uid TEXT,
+    p_patient_id INTEGER DEFAULT NULL
+)
+RETURNS TABLE (
+    total_count BIGINT,
+    critical_count BIGINT,
+    urgent_count BIGINT,
+    high_count BIGINT,
+    medium_count BIGINT,
+    low_count BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        COALESCE(c.total_count, 0)::BIGINT,
+        COALESCE(c.critical_count, 0)::BIGINT,
+        COALESCE(c.urgent_count, 0)::BIGINT,
+        COALESCE(c.high_count, 0)::BIGINT,
+        COALESCE(c.medium_count, 0)::BIGINT,
+        COALESCE(c.low_count, 0)::BIGINT
+    FROM (SELECT 1) AS one
+    LEFT JOIN ai_alert_counters c
+        ON c.doctor_firebase_uid = p_doctor_firebase_uid
+        AND c.patient_id = COALESCE(p_patient_id, 0);
+$$;
+
+GRANT EXECUTE ON FUNCTION get_alert_counts(TEXT, INTEGER) TO authenticated;
+GRANT EXECUTE ON FUNCTION get_alert_counts(TEXT, INTEGER) TO service_role;
+
+COMMIT;
@@ -0,0 +1,93 @@
+-- Migration: Change feed for application cache invalidation
+-- Purpose: Workers cache doctors, patients, templates, visits, reports and analyses in
+--          process memory and only evict entries for writes they make themselves.
+--          Writes from SQL, RPCs (e.g. delete_outdated_patient_history_analyses) or
+--          another worker left stale entries until the TTL ran out. These triggers
+--          NOTIFY 'table_changes' with the key columns of every changed row; workers
+--          running EVENT_BUS_BACKEND=postgres evict the matching entries
+--          (cache_change_feed.py), which lets entity TTLs go from minutes to hours.
+--
+-- Payload: {"table": "...", "op": "INSERT|UPDATE|DELETE", "keys": {"column": [values]}}
+--          values are the distinct non-null OLD/NEW values of each listed column.
+-- Notifications are sent on commit; identical ones in a transaction are sent once.
+-- The column lists must match CHANGE_FEED_TABLES in cache_change_feed.py.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION notify_cache_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    old_row JSONB;
+    new_row JSONB;
+    keys JSONB := '{}'::JSONB;
+    key_column TEXT;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        old_row := to_jsonb(OLD);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        new_row := to_jsonb(NEW);
+    END IF;
+
+    FOREACH key_column IN ARRAY TG_ARGV LOOP
+        keys := keys || jsonb_build_object(key_column, COALESCE((
+            SELECT jsonb_agg(DISTINCT v.value)
+            FROM (VALUES (old_row -> key_column), (new_row -> key_column)) AS v(value)
+            WHERE v.value IS NOT NULL AND v.value <> 'null'::JSONB
+        ), '[]'::JSONB));
+    END LOOP;
+
+    PERFORM pg_notify(
+        'table_changes',
+        jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'keys', keys)::TEXT
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_cache_change_doctors ON doctors;
+CREATE TRIGGER trigger_cache_change_doctors
+    AFTER INSERT OR UPDATE OR DELETE ON doctors
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('firebase_uid');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_patients ON patients;
+CREATE TRIGGER trigger_cache_change_patients
+    AFTER INSERT OR UPDATE OR DELETE ON patients
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('id');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_visits ON visits;
+CREATE TRIGGER trigger_cache_change_visits
+    AFTER INSERT OR UPDATE OR DELETE ON visits
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('id', 'patient_id');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_reports ON reports;
+CREATE TRIGGER trigger_cache_change_reports
+    AFTER INSERT OR UPDATE OR DELETE ON reports
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('id', 'visit_id', 'patient_id');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_ai_document_analysis ON ai_document_analysis;
+CREATE TRIGGER trigger_cache_change_ai_document_analysis
+    AFTER INSERT OR UPDATE OR DELETE ON ai_document_analysis
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('report_id', 'visit_id', 'patient_id');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_handwritten_visit_notes ON handwritten_visit_notes;
+CREATE TRIGGER trigger_cache_change_handwritten_visit_notes
+    AFTER INSERT OR UPDATE OR DELETE ON handwritten_visit_notes
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('visit_id', 'patient_id');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_patient_risk_scores ON patient_risk_scores;
+CREATE TRIGGER trigger_cache_change_patient_risk_scores
+    AFTER INSERT OR UPDATE OR DELETE ON patient_risk_scores
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('patient_id');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_pdf_templates ON pdf_templates;
+CREATE TRIGGER trigger_cache_change_pdf_templates
+    AFTER INSERT OR UPDATE OR DELETE ON pdf_templates
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('id', 'doctor_firebase_uid');
+
+DROP TRIGGER IF EXISTS trigger_cache_change_ai_clinical_alerts ON ai_clinical_alerts;
+CREATE TRIGGER trigger_cache_change_ai_clinical_alerts
+    AFTER INSERT OR UPDATE OR DELETE ON ai_clinical_alerts
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change('doctor_firebase_uid');
+
+COMMIT;
@@ -0,0 +1,88 @@
+-- Migration: Durable outbox for outgoing WhatsApp messages
+-- Purpose: Endpoints such as /visits/{id}/send-whatsapp-report-link called Twilio inline,
+--          so a slow provider call held the doctor's request open and a failed send was
+--          simply lost. Endpoints now insert a row here and return; the outbox worker
+--          (whatsapp_outbox.py) claims due rows, sends them under a messages-per-second
+--          limit and retries transient failures with backoff.
+--
+-- idempotency_key: a repeated enqueue with the same key returns the existing row
+--                  instead of sending the message twice (double taps, client retries).
+-- Delivery is at-least-once: a worker that dies after Twilio accepted a message but
+-- before recording it leaves the row 'sending'; it is reclaimed after the lock expires.
+
+CREATE TABLE IF NOT EXISTS public.whatsapp_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    idempotency_key TEXT NOT NULL,
+    doctor_firebase_uid TEXT REFERENCES doctors(firebase_uid) ON DELETE SET NULL,
+    patient_id BIGINT,
+    message_type TEXT NOT NULL DEFAULT 'text',   -- what the message is (report_upload_link, handwritten_note, ...)
+    to_phone TEXT NOT NULL,
+    body TEXT NOT NULL,
+    media_url TEXT,
+
+    status TEXT NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'sending', 'sent', 'failed', 'dead_letter')),
+    attempts INTEGER NOT NULL DEFAULT 0 CHECK (attempts >= 0),
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_by TEXT,
+    locked_at TIMESTAMPTZ,
+
+    provider_message_id TEXT,
+    provider_status TEXT,
+    last_error TEXT,
+    last_error_class TEXT,
+
+    -- Row to update once sent, e.g. {"type": "handwritten_note", "id": 12}
+    on_sent JSONB,
+
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    sent_at TIMESTAMPTZ,
+
+    CONSTRAINT whatsapp_outbox_idempotency_key_unique UNIQUE (idempotency_key)
+);
+
+-- Due rows and expired locks, in the order the worker claims them
+CREATE INDEX IF NOT EXISTS idx_whatsapp_outbox_due
+ON public.whatsapp_outbox (next_attempt_at)
+WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS idx_whatsapp_outbox_doctor_created
+ON public.whatsapp_outbox (doctor_firebase_uid, created_at DESC);
+
+COMMENT ON TABLE public.whatsapp_outbox IS 'Outgoing WhatsApp messages, sent asynchronously by the outbox worker';
+COMMENT ON COLUMN public.whatsapp_outbox.idempotency_key IS 'Deduplicates enqueues of the same logical message';
+COMMENT ON COLUMN public.whatsapp_outbox.attempts IS 'Send attempts so far (incremented when claimed)';
+
+-- Claim up to p_limit due rows for one worker. Rows stuck in 'sending' longer than
+-- p_lock_seconds (worker crashed) are claimed again. SKIP LOCKED lets several workers
+-- claim concurrently without handing the same row to two of them.
+CREATE OR REPLACE FUNCTION claim_whatsapp_outbox(
+    p_worker TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_lock_seconds INTEGER DEFAULT 120
+)
+RETURNS SETOF public.whatsapp_outbox
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    UPDATE whatsapp_outbox o
+    SET status = 'sending',
+        attempts = o.attempts + 1,
+        locked_by = p_worker,
+        locked_at = now(),
+        updated_at = now()
+    WHERE o.id IN (
+        SELECT c.id
+        FROM whatsapp_outbox c
+        WHERE (c.status = 'pending' AND c.next_attempt_at <= now())
+           OR (c.status = 'sending' AND c.locked_at < now() - make_interval(secs => p_lock_seconds))
+        ORDER BY c.next_attempt_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.*;
+$$;
+
+GRANT EXECUTE ON FUNCTION claim_whatsapp_outbox(TEXT, INTEGER, INTEGER) TO service_role;
@@ -0,0 +1,43 @@
+-- Migration: Batch update of appointment reminder send results
+-- Purpose: The reminder service sends a cycle's reminders concurrently and then records
+--          every outcome (sent / retry / failed) in one call instead of one UPDATE per
+--          reminder. Used by DatabaseManager.update_appointment_reminders; without this
+--          function the service falls back to concurrent per-row updates.
+--
+-- p_updates: [{"id": 1, "status": "sent", "sent_at": "...", "whatsapp_message_id": "SM..",
+--              "whatsapp_status": "queued"}, {"id": 2, "status": "pending",
+--              "error_message": "...", "retry_count": 1, "next_retry_at": "..."}, ...]
+-- Keys left out of an element keep the column's current value.
+
+CREATE OR REPLACE FUNCTION update_appointment_reminders_batch(p_updates JSONB)
+RETURNS INTEGER
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    WITH updated AS (
+        UPDATE appointment_reminders r
+        SET status = COALESCE(u.status, r.status),
+            sent_at = COALESCE(u.sent_at, r.sent_at),
+            whatsapp_message_id = COALESCE(u.whatsapp_message_id, r.whatsapp_message_id),
+            whatsapp_status = COALESCE(u.whatsapp_status, r.whatsapp_status),
+            error_message = COALESCE(u.error_message, r.error_message),
+            retry_count = COALESCE(u.retry_count, r.retry_count),
+            next_retry_at = COALESCE(u.next_retry_at, r.next_retry_at),
+            updated_at = now()
+        FROM jsonb_to_recordset(p_updates) AS u(
+            id BIGINT,
+            status TEXT,
+            sent_at TIMESTAMPTZ,
+            whatsapp_message_id TEXT,
+            whatsapp_status TEXT,
+            error_message TEXT,
+            retry_count INTEGER,
+            next_retry_at TIMESTAMPTZ
+        )
+        WHERE r.id = u.id
+        RETURNING r.id
+    )
+    SELECT count(*)::INTEGER FROM updated;
+$$;
+
+GRANT EXECUTE ON FUNCTION update_appointment_reminders_batch(JSONB) TO service_role;
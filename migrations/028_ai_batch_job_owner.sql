@@ -0,0 +1,19 @@
+-- Migration: Owner of an AI batch job
+-- Purpose: Every worker used to poll every batch-lane item with a batch_job_id. The
+--          local batch backend keeps its jobs in one worker's memory, so the other
+--          worker saw them as unknown and requeued items that were still running,
+--          sending the same documents to the model twice.
+--
+-- batch_owner is the owner id of the backend that claimed the items: one process for
+-- the local backend, the bucket/prefix for Vertex AI (any worker can read those jobs).
+-- Workers only poll, finish and release jobs of their own backend.
+
+ALTER TABLE public.ai_analysis_queue
+ADD COLUMN IF NOT EXISTS batch_owner TEXT;
+
+-- In-flight batch items of one owner
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_queue_batch_owner
+ON public.ai_analysis_queue (batch_owner)
+WHERE batch_owner IS NOT NULL;
+
+COMMENT ON COLUMN public.ai_analysis_queue.batch_owner IS 'Owner id of the batch backend that claimed this item (see ai_batch_backend.py)';
@@ -0,0 +1,36 @@
+-- Migration: Claim due appointment reminders
+-- Purpose: A reminder cycle creates all of its reminder rows first and then sends them
+--          over several minutes. Another worker's retry queue used to select the same
+--          pending rows and send them too, so patients got duplicate WhatsApp messages.
+--
+-- Rows are leased through next_retry_at: new rows are created with next_retry_at in the
+-- future, and this function claims due rows by moving next_retry_at p_lock_seconds ahead.
+-- A worker that dies mid-send leaves its rows due again once the lease runs out.
+-- Used by DatabaseManager.claim_due_reminders; without it the claim falls back to a
+-- conditional update per row.
+
+CREATE OR REPLACE FUNCTION claim_appointment_reminders(
+    p_lock_seconds INTEGER DEFAULT 900,
+    p_limit INTEGER DEFAULT 500
+)
+RETURNS SETOF public.appointment_reminders
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    UPDATE appointment_reminders r
+    SET next_retry_at = now() + make_interval(secs => p_lock_seconds),
+        updated_at = now()
+    WHERE r.id IN (
+        SELECT c.id
+        FROM appointment_reminders c
+        WHERE c.status = 'pending'
+          AND c.scheduled_send_time <= now()
+          AND (c.next_retry_at IS NULL OR c.next_retry_at <= now())
+        ORDER BY c.scheduled_send_time
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING r.*;
+$$;
+
+GRANT EXECUTE ON FUNCTION claim_appointment_reminders(INTEGER, INTEGER) TO service_role;
@@ -9,7 +9,7 @@ import sys
 import time
 from collections import OrderedDict
 from functools import wraps
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Dict, Iterable, Optional, Set
 
 
 class OptimizedCache:
@@ -23,6 +23,9 @@ class OptimizedCache:
     - Better memory estimation
     - Per-key TTL support
     - Cache warming support
+    - Tags: entries can be evicted by tag (e.g. "patients.id=42") instead of by key
+    - Tag generations: a read started before an invalidation of its tags is not cached
+      (take generation() before the query, pass it to set())
     """
     
     def __init__(
@@ -42,6 +45,16 @@ class OptimizedCache:
             cleanup_interval: Seconds between automatic cleanup (default: 60)
         """
         self.cache: OrderedDict = OrderedDict()
+        self.tag_index: Dict[str, Set[str]] = {}
+        
+        # Invalidation sequence: tag -> (seq, time) of its last invalidation, oldest first.
+        # Entries older than generation_window seconds are pruned; a read whose generation
+        # predates the pruned range can't be checked and is not cached.
+        self.invalidation_seq = 0
+        self.tag_generations: OrderedDict = OrderedDict()
+        self.tagged_clear_seq = 0
+        self.pruned_seq = 0
+        self.generation_window = 300
         self.default_ttl = default_ttl
         self.max_size = max_size
         self.max_memory_bytes = max_memory_mb * 1024 * 1024
@@ -52,6 +65,8 @@ class OptimizedCache:
         self.misses = 0
         self.evictions = 0
         self.expired = 0
+        self.tag_invalidations = 0
+        self.stale_sets_skipped = 0
         
         # Thread safety
         self.lock = asyncio.Lock()
@@ -87,6 +102,46 @@ class OptimizedCache:
             # Fallback for complex objects
             return len(str(value))
     
+    def _remove(self, key: str) -> None:
+        """Drop an entry and its tag index references (caller holds the lock)"""
+        entry = self.cache.pop(key, None)
+        if not entry:
+            return
+        for tag in entry.get('tags', ()):
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+    
+    def generation(self) -> int:
+        """Current invalidation sequence; take it before the query whose result will be cached"""
+        return self.invalidation_seq
+    
+    def _is_stale(self, tags, generation: int) -> bool:
+        """True if any of the tags was invalidated after `generation` (caller holds the lock)"""
+        if generation < self.tagged_clear_seq or generation < self.pruned_seq:
+            return True
+        for tag in tags:
+            invalidated = self.tag_generations.get(tag)
+            if invalidated and invalidated[0] > generation:
+                return True
+        return False
+    
+    def _record_invalidation(self, tags) -> None:
+        """Bump the sequence for invalidated tags and prune old records (caller holds the lock)"""
+        self.invalidation_seq += 1
+        now = time.time()
+        for tag in tags:
+            self.tag_generations.pop(tag, None)
+            self.tag_generations[tag] = (self.invalidation_seq, now)
+        while self.tag_generations:
+            oldest_tag, (seq, invalidated_at) = next(iter(self.tag_generations.items()))
+            if now - invalidated_at <= self.generation_window:
+                break
+            del self.tag_generations[oldest_tag]
+            self.pruned_seq = max(self.pruned_seq, seq)
+    
     async def _lazy_cleanup(self):
         """
         Lazy cleanup: Only run periodically to reduce overhead.
@@ -108,7 +163,7 @@ class OptimizedCache:
         
         # Remove in batch
         for key in expired_keys:
-            del self.cache[key]
+            self._remove(key)
             self.expired += 1
         
         if expired_keys:
@@ -136,7 +191,7 @@ class OptimizedCache:
             
             # Check expiration
             if self._is_expired(entry):
-                del self.cache[key]
+                self._remove(key)
                 self.misses += 1
                 self.expired += 1
                 return None
@@ -147,7 +202,14 @@ class OptimizedCache:
             
             return entry['value']
     
-    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+    async def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int] = None,
+        tags: Iterable[str] = (),
+        generation: Optional[int] = None
+    ) -> bool:
         """
         Set value in cache with TTL.
         
@@ -155,8 +217,22 @@ class OptimizedCache:
             key: Cache key
             value: Value to cache
             ttl: Time-to-live in seconds (uses default if None)
+            tags: Tags the entry can be invalidated by (see invalidate_tags)
+            generation: generation() taken before the value was read; if a tag was
+                invalidated since, the value may be stale and is not cached
+            
+        Returns:
+            False if the value was skipped as stale
         """
         async with self.lock:
+            tags = tuple(tags)
+            if generation is not None and self._is_stale(tags, generation):
+                self._remove(key)
+                self.stale_sets_skipped += 1
+                return False
+            
+            self._remove(key)
+            
             # Calculate expiration
             ttl = ttl or self.default_ttl
             expires_at = time.time() + ttl
@@ -166,17 +242,20 @@ class OptimizedCache:
                 'value': value,
                 'expires_at': expires_at,
                 'size': self._estimate_size(value),
-                'created_at': time.time()
+                'created_at': time.time(),
+                'tags': tags
             }
             
             # Add to cache
             self.cache[key] = entry
             self.cache.move_to_end(key)
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
             
             # Enforce size limit
             while len(self.cache) > self.max_size:
                 oldest_key = next(iter(self.cache))
-                del self.cache[oldest_key]
+                self._remove(oldest_key)
                 self.evictions += 1
             
             # Enforce memory limit
@@ -185,19 +264,47 @@ class OptimizedCache:
                 oldest_key = next(iter(self.cache))
                 evicted_entry = self.cache[oldest_key]
                 total_memory -= evicted_entry['size']
-                del self.cache[oldest_key]
+                self._remove(oldest_key)
                 self.evictions += 1
+            
+            return True
     
     async def delete(self, key: str):
         """Delete entry from cache"""
         async with self.lock:
-            if key in self.cache:
-                del self.cache[key]
+            self._remove(key)
+    
+    async def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Delete every entry carrying any of the tags, returns the number removed"""
+        async with self.lock:
+            tags = tuple(tags)
+            self._record_invalidation(tags)
+            removed = 0
+            for tag in tags:
+                for key in list(self.tag_index.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.tag_invalidations += removed
+            return removed
+    
+    async def clear_tagged(self) -> int:
+        """Delete every tagged entry (after invalidation events may have been missed)"""
+        async with self.lock:
+            self.invalidation_seq += 1
+            self.tagged_clear_seq = self.invalidation_seq
+            keys = {key for keys in self.tag_index.values() for key in keys}
+            for key in keys:
+                self._remove(key)
+            self.tag_invalidations += len(keys)
+            return len(keys)
     
     async def clear(self):
         """Clear all cache entries"""
         async with self.lock:
             self.cache.clear()
+            self.tag_index.clear()
+            self.invalidation_seq += 1
+            self.tagged_clear_seq = self.invalidation_seq
             print("🗑️ Cache cleared")
     
     async def get_stats(self) -> dict:
@@ -221,6 +328,9 @@ class OptimizedCache:
                 'misses': self.misses,
                 'evictions': self.evictions,
                 'expired': self.expired,
+                'tags': len(self.tag_index),
+                'tag_invalidations': self.tag_invalidations,
+                'stale_sets_skipped': self.stale_sets_skipped,
                 'hit_rate_pct': round(hit_rate, 2),
                 'total_requests': total_requests
             }
@@ -0,0 +1,114 @@
+"""
+Token-Budgeted Prompt Assembly
+Fits ranked prompt blocks into a fixed token budget. Each block can be included
+in full, fall back to a shorter summary, or be elided, and per-section token
+usage is reported for logging.
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Gemini tokenizes English/clinical text at roughly 4 characters per token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Cheap token estimate for budgeting (no API call)"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, marking the cut"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - 3)].rstrip() + "..."
+
+
+class PromptBudget:
+    """
+    Collects prompt blocks per section and selects what fits in the budget.
+
+    Fixed blocks (instructions, demographics) are always kept. Ranked blocks are
+    considered highest priority first: the full text is used if it fits, else the
+    summary, else the block is elided. Selected blocks are rendered back in the
+    order they were added (e.g. chronological) so the prompt stays readable.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self._fixed: Dict[str, str] = {}
+        self._blocks: List[Dict[str, Any]] = []
+
+    def add_fixed(self, section: str, text: str) -> None:
+        """Add text that is always included"""
+        self._fixed[section] = self._fixed.get(section, "") + text
+
+    def add_block(
+        self,
+        section: str,
+        text: str,
+        priority: float,
+        summary: Optional[str] = None
+    ) -> None:
+        """Add a ranked block with an optional compact fallback"""
+        self._blocks.append({
+            "section": section,
+            "text": text,
+            "summary": summary,
+            "priority": priority,
+            "position": len(self._blocks)
+        })
+
+    def select(self) -> Tuple[Dict[str, List[str]], Dict[str, Dict[str, int]]]:
+        """
+        Choose the blocks to render.
+
+        Returns:
+            (selected block texts per section in insertion order, per-section stats)
+        """
+        stats: Dict[str, Dict[str, int]] = {}
+        for section, text in self._fixed.items():
+            stats[section] = {"tokens": estimate_tokens(text), "full": 1, "summarized": 0, "elided": 0}
+
+        remaining = self.max_tokens - sum(s["tokens"] for s in stats.values())
+        chosen: List[Tuple[int, str, str]] = []
+
+        for block in sorted(self._blocks, key=lambda b: (-b["priority"], b["position"])):
+            section_stats = stats.setdefault(
+                block["section"], {"tokens": 0, "full": 0, "summarized": 0, "elided": 0}
+            )
+            full_tokens = estimate_tokens(block["text"])
+            summary_tokens = estimate_tokens(block["summary"])
+
+            if full_tokens <= remaining:
+                chosen.append((block["position"], block["section"], block["text"]))
+                section_stats["full"] += 1
+                section_stats["tokens"] += full_tokens
+                remaining -= full_tokens
+            elif block["summary"] and summary_tokens <= remaining:
+                chosen.append((block["position"], block["section"], block["summary"]))
+                section_stats["summarized"] += 1
+                section_stats["tokens"] += summary_tokens
+                remaining -= summary_tokens
+            else:
+                section_stats["elided"] += 1
+
+        selected: Dict[str, List[str]] = {}
+        for _, section, text in sorted(chosen):
+            selected.setdefault(section, []).append(text)
+        return selected, stats
+
+    @staticmethod
+    def format_stats(stats: Dict[str, Dict[str, int]], max_tokens: int) -> str:
+        """One-line summary of per-section token usage for logs"""
+        total = sum(s["tokens"] for s in stats.values())
+        parts = []
+        for section, s in stats.items():
+            detail = f"{section}={s['tokens']}"
+            if s["summarized"] or s["elided"]:
+                detail += f" (full {s['full']}, summarized {s['summarized']}, elided {s['elided']})"
+            parts.append(detail)
+        return f"~{total}/{max_tokens} tokens: " + ", ".join(parts)
@@ -0,0 +1,175 @@
+"""
+Push Channel for Doctor Events
+Server-Sent Events stream per doctor that replaces polling of the notification
+and alert count endpoints. Writers call push_hub.publish(doctor_uid, event, data);
+the message goes over the event bus so it reaches the doctor's stream whichever
+uvicorn worker holds it.
+
+Events sent on GET /events/stream:
+- snapshot: unread notification count and open alert counts (on connect and
+  after a bus resync - the client should treat it as the new baseline)
+- notification: a new notification row
+- alerts_created / alerts_acknowledged: alert changes for one patient
+- whatsapp_delivery: final status of a queued WhatsApp message (sent / failed)
+Comment lines (": ping") are sent as heartbeats.
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from event_bus import RESYNC_EVENT, EventBus, LocalEventBus, MAX_PAYLOAD_BYTES
+from fast_json import fast_dumps
+
+
+PUSH_CHANNEL = "doctor_events"
+
+EVENT_SNAPSHOT = "snapshot"
+EVENT_NOTIFICATION = "notification"
+EVENT_ALERTS_CREATED = "alerts_created"
+EVENT_ALERTS_ACKNOWLEDGED = "alerts_acknowledged"
+EVENT_WHATSAPP_DELIVERY = "whatsapp_delivery"
+
+# Fields of an alert row included in alert events (the rest is fetched on demand)
+ALERT_EVENT_FIELDS = ("id", "patient_id", "alert_type", "severity", "title", "created_at")
+
+# Room left in a bus message for everything but `data`
+_ENVELOPE_BYTES = 512
+
+
+def format_sse(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    """One Server-Sent Events frame"""
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {fast_dumps(data).decode('utf-8')}")
+    return "\n".join(lines) + "\n\n"
+
+
+def alert_event_rows(alerts: Any) -> list:
+    return [{field: alert.get(field) for field in ALERT_EVENT_FIELDS} for alert in alerts or []]
+
+
+class PushHub:
+    """
+    Per-doctor subscriber queues in this worker, fed from the event bus.
+
+    Each open stream owns a bounded queue; when a slow client lets it fill up the
+    backlog is discarded and replaced by a single snapshot.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.bus: EventBus = LocalEventBus()
+        self.bus.subscribe(PUSH_CHANNEL, self._on_bus_message)
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.stats = {"published": 0, "publish_errors": 0, "delivered": 0, "dropped": 0}
+
+    def attach(self, bus: EventBus) -> None:
+        """Publish and receive through a shared (cross-worker) bus from now on"""
+        self.bus = bus
+        bus.subscribe(PUSH_CHANNEL, self._on_bus_message)
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def publish(self, doctor_uid: str, event: str, data: Dict[str, Any]) -> None:
+        """Send an event to every open stream of a doctor; never raises"""
+        if not doctor_uid:
+            return
+        try:
+            message = {
+                "doctor_uid": doctor_uid,
+                "event": event,
+                "id": uuid.uuid4().hex[:16],
+                "data": data
+            }
+            if len(fast_dumps(data)) > MAX_PAYLOAD_BYTES - _ENVELOPE_BYTES:
+                # Too big for a NOTIFY payload - send the ids, the client fetches the rest
+                message["data"] = {"truncated": True, "id": data.get("id"), "patient_id": data.get("patient_id")}
+            await self.bus.publish(PUSH_CHANNEL, message)
+            self.stats["published"] += 1
+        except Exception as e:
+            self.stats["publish_errors"] += 1
+            print(f"⚠️ Could not push '{event}' to doctor {doctor_uid}: {e}")
+
+    async def _on_bus_message(self, message: Dict[str, Any]) -> None:
+        if message.get("event") == RESYNC_EVENT:
+            for doctor_uid in list(self._subscribers):
+                self._deliver(doctor_uid, message)
+            return
+        self._deliver(message.get("doctor_uid"), message)
+
+    def _deliver(self, doctor_uid: Optional[str], message: Dict[str, Any]) -> None:
+        for queue in self._subscribers.get(doctor_uid, ()):
+            if queue.full():
+                # Client is not keeping up: replace its backlog with one snapshot
+                self.stats["dropped"] += queue.qsize()
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"event": RESYNC_EVENT})
+                continue
+            queue.put_nowait(message)
+            self.stats["delivered"] += 1
+
+    def _connect(self, doctor_uid: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(doctor_uid, set()).add(queue)
+        return queue
+
+    def _disconnect(self, doctor_uid: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(doctor_uid)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[doctor_uid]
+
+    async def stream(
+        self,
+        doctor_uid: str,
+        load_snapshot: Callable[[], Awaitable[Dict[str, Any]]],
+        heartbeat_seconds: float = 25.0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> AsyncIterator[str]:
+        """
+        SSE frames for one client until it disconnects.
+
+        Args:
+            doctor_uid: Doctor whose events are streamed
+            load_snapshot: Returns the current counts (sent first and after resyncs)
+            heartbeat_seconds: Idle interval between ": ping" comments
+            is_disconnected: Optional check run at each heartbeat
+        """
+        # Subscribe before loading the snapshot so nothing slips in between
+        queue = self._connect(doctor_uid)
+        try:
+            yield "retry: 5000\n\n"
+            yield format_sse(EVENT_SNAPSHOT, await load_snapshot())
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    if is_disconnected and await is_disconnected():
+                        break
+                    yield f": ping {int(time.time())}\n\n"
+                    continue
+                if message.get("event") == RESYNC_EVENT:
+                    # Events may have been missed; a fresh snapshot resets the client
+                    yield format_sse(EVENT_SNAPSHOT, await load_snapshot())
+                    continue
+                yield format_sse(message["event"], message.get("data"), message.get("id"))
+        finally:
+            self._disconnect(doctor_uid, queue)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "doctors_connected": len(self._subscribers),
+            "connections": self.connection_count,
+            "bus": self.bus.get_status(),
+            **self.stats
+        }
+
+
+# Global push hub shared by DatabaseManager, ClinicalAlertService and the stream endpoint
+push_hub = PushHub()
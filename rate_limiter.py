@@ -0,0 +1,73 @@
+"""
+Async Token Bucket Rate Limiter
+Caps outbound calls to a provider (e.g. Twilio WhatsApp messages per second)
+across all tasks of a worker. Tokens refill continuously at `rate` per second up
+to `burst`; acquire() waits until a token is available.
+
+A bucket only paces its own process. For a limit that holds across uvicorn /
+gunicorn workers, size it with per_worker_rate(), which gives each worker its
+share of the total according to WEB_CONCURRENCY.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class TokenBucket:
+    """Token bucket shared by concurrent senders in one event loop"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens, sleeping until they are available; returns the seconds waited"""
+        waited = 0.0
+        # The lock makes waiters queue up in order instead of all waking on the same refill
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                delay = (tokens - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self._tokens -= tokens
+        self.acquired += 1
+        self.waited_seconds += waited
+        return waited
+
+    def get_status(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "available_tokens": round(self._tokens, 2),
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited_seconds, 2)
+        }
+
+
+def worker_count() -> int:
+    """Number of server worker processes (WEB_CONCURRENCY, as read by uvicorn and gunicorn)"""
+    try:
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    except ValueError:
+        return 1
+
+
+def per_worker_rate(total_rate: float) -> float:
+    """This worker's share of a rate limit that applies to all workers together"""
+    return total_rate / worker_count()
@@ -4,7 +4,9 @@
 
 echo "🚀 Starting FastAPI application with uvicorn..."
 echo "Port: $PORT"
-echo "Workers: 2"
+# WEB_CONCURRENCY is also read by the app to split WHATSAPP_SEND_RATE_PER_SECOND between workers
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
+echo "Workers: $WEB_CONCURRENCY"
 
 # Use uvicorn directly (ASGI server for FastAPI)
-exec uvicorn app:app --host 0.0.0.0 --port ${PORT:-10000} --workers 2 --log-level info
+exec uvicorn app:app --host 0.0.0.0 --port ${PORT:-10000} --workers $WEB_CONCURRENCY --log-level info
@@ -0,0 +1,141 @@
+"""
+Streaming Response Helpers for Large Exports
+Streams paginated query results as NDJSON or a chunked JSON array so memory
+stays bounded by a single page and the first byte goes out after the first fetch
+"""
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+from fast_json import fast_dumps
+
+
+# Supported stream formats (value of the `stream` query parameter)
+STREAM_FORMAT_NDJSON = "ndjson"
+STREAM_FORMAT_JSON = "json"
+STREAM_FORMATS = (STREAM_FORMAT_NDJSON, STREAM_FORMAT_JSON)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+
+
+def validate_stream_format(stream_format: Optional[str]) -> Optional[str]:
+    """
+    Normalize the `stream` query parameter.
+
+    Returns:
+        "ndjson", "json", or None when streaming was not requested
+
+    Raises:
+        HTTPException 400 for unsupported formats
+    """
+    if not stream_format:
+        return None
+
+    normalized = stream_format.strip().lower()
+    if normalized not in STREAM_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"stream must be one of: {', '.join(STREAM_FORMATS)}"
+        )
+    return normalized
+
+
+def _encode_item(item: Any) -> bytes:
+    """Serialize a single row (dict or Pydantic model) to compact JSON bytes"""
+    if hasattr(item, "model_dump_json"):
+        return item.model_dump_json().encode("utf-8")
+    return fast_dumps(item)
+
+
+async def _ndjson_chunks(
+    items: AsyncIterator[Any],
+    header: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[bytes]:
+    """One JSON document per line; the optional header is the first line"""
+    if header is not None:
+        yield _encode_item(header) + b"\n"
+    async for item in items:
+        yield _encode_item(item) + b"\n"
+
+
+async def _json_array_chunks(
+    items: AsyncIterator[Any],
+    header: Optional[Dict[str, Any]] = None,
+    items_key: str = "items"
+) -> AsyncIterator[bytes]:
+    """
+    A single JSON array emitted element by element.
+    With a header the array is wrapped as {**header, items_key: [...]}.
+    """
+    if header is not None:
+        prefix = _encode_item(header)[:-1]
+        separator = b"," if len(header) else b""
+        yield prefix + separator + json.dumps(items_key).encode("utf-8") + b":["
+    else:
+        yield b"["
+    first = True
+    async for item in items:
+        if first:
+            first = False
+            yield _encode_item(item)
+        else:
+            yield b"," + _encode_item(item)
+    yield b"]}" if header is not None else b"]"
+
+
+async def map_stream(
+    items: AsyncIterator[Any],
+    transform: Callable[[Any], Any]
+) -> AsyncIterator[Any]:
+    """Apply a per-row transform (e.g. a response-model mapper) lazily"""
+    async for item in items:
+        yield transform(item)
+
+
+async def limit_stream(items: AsyncIterator[Any], limit: Optional[int]) -> AsyncIterator[Any]:
+    """Stop after `limit` rows (no-op when limit is falsy)"""
+    count = 0
+    async for item in items:
+        if limit and count >= limit:
+            break
+        count += 1
+        yield item
+
+
+def stream_rows(
+    items: AsyncIterator[Any],
+    stream_format: str,
+    header: Optional[Dict[str, Any]] = None,
+    items_key: str = "items",
+    filename: Optional[str] = None
+) -> StreamingResponse:
+    """
+    Build a StreamingResponse over an async iterator of rows.
+
+    Args:
+        items: Async iterator of dicts or Pydantic models (e.g. DatabaseManager.iter_paginated)
+        stream_format: "ndjson" or "json"
+        header: Optional summary object sent before the rows (first NDJSON line,
+            or the enclosing object of the JSON array)
+        items_key: Key holding the row array when a header is used in JSON mode
+        filename: Optional download filename for Content-Disposition
+
+    Returns:
+        StreamingResponse that serializes rows as they arrive
+    """
+    if stream_format == STREAM_FORMAT_NDJSON:
+        body = _ndjson_chunks(items, header)
+        media_type = NDJSON_MEDIA_TYPE
+    else:
+        body = _json_array_chunks(items, header, items_key)
+        media_type = JSON_MEDIA_TYPE
+
+    headers = {"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    if filename:
+        extension = "ndjson" if stream_format == STREAM_FORMAT_NDJSON else "json"
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.{extension}"'
+
+    return StreamingResponse(body, media_type=media_type, headers=headers)
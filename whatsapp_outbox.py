@@ -0,0 +1,455 @@
+"""
+WhatsApp Outbox
+Endpoints enqueue outgoing WhatsApp messages in the whatsapp_outbox table
+(migrations/026_whatsapp_outbox.sql) and return immediately; a background
+worker claims due rows in batches, sends them concurrently under a
+messages-per-second token bucket, and records the result.
+
+- Idempotency: every row has an idempotency_key (client Idempotency-Key header,
+  or derived from the message type, recipient and source record). Enqueuing the
+  same key again returns the existing row.
+- Retries: rate limits, provider 5xx and network errors are retried with
+  exponential, jittered backoff; invalid / opted-out numbers fail at once; rows
+  that keep failing end in dead_letter.
+- on_sent: the source record (handwritten note, visit report) is marked as sent
+  once the provider accepted the message, and the doctor gets a push event.
+
+If the outbox table is missing, enqueue falls back to sending inline.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from push_channel import push_hub, EVENT_WHATSAPP_DELIVERY
+from rate_limiter import TokenBucket, per_worker_rate, worker_count
+
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENDING = "sending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+OUTBOX_DEAD_LETTER = "dead_letter"
+
+# Error classes recorded in whatsapp_outbox.last_error_class
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_PROVIDER = "provider"
+ERROR_INVALID_RECIPIENT = "invalid_recipient"
+ERROR_NOT_CONFIGURED = "not_configured"
+ERROR_UNKNOWN = "unknown"
+
+# Twilio error codes - https://www.twilio.com/docs/api/errors
+RATE_LIMIT_ERROR_CODES = {20429, 63018}
+INVALID_RECIPIENT_ERROR_CODES = {21211, 21408, 21610, 21612, 21614, 63003, 63016, 63024}
+
+# base/max backoff in seconds per retryable class
+RETRY_BACKOFF = {
+    ERROR_RATE_LIMIT: (30, 900),
+    ERROR_PROVIDER: (15, 900),
+    ERROR_NOT_CONFIGURED: (300, 3600),
+    ERROR_UNKNOWN: (30, 1800),
+}
+
+# Same message to the same number within this window is sent once (without a client key)
+IDEMPOTENCY_WINDOW_SECONDS = 300
+
+
+def make_idempotency_key(
+    message_type: str,
+    to_phone: str,
+    reference: Any = "",
+    client_key: Optional[str] = None
+) -> str:
+    """
+    Key that identifies one logical message.
+
+    A client-supplied Idempotency-Key wins (scoped to the message type). Otherwise
+    the key is the type, recipient and source reference within a 5-minute window,
+    so double taps are absorbed but a deliberate resend later goes out.
+    """
+    if client_key:
+        parts = ("client", message_type, client_key)
+    else:
+        parts = (message_type, to_phone, reference, int(time.time() // IDEMPOTENCY_WINDOW_SECONDS))
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def classify_send_error(result: Dict[str, Any]) -> str:
+    """Map a failed WhatsAppService send result to an ERROR_* class"""
+    code = result.get("code")
+    http_status = result.get("http_status")
+    error = str(result.get("error") or "").lower()
+    if code in RATE_LIMIT_ERROR_CODES or http_status == 429:
+        return ERROR_RATE_LIMIT
+    if code in INVALID_RECIPIENT_ERROR_CODES:
+        return ERROR_INVALID_RECIPIENT
+    if "not configured" in error:
+        return ERROR_NOT_CONFIGURED
+    if (http_status and http_status >= 500) or any(word in error for word in ("timeout", "timed out", "connection", "unavailable")):
+        return ERROR_PROVIDER
+    return ERROR_UNKNOWN
+
+
+def retry_delay_seconds(error_class: str, attempts: int) -> float:
+    """Exponential backoff with equal jitter after `attempts` failed sends"""
+    base, cap = RETRY_BACKOFF.get(error_class, RETRY_BACKOFF[ERROR_UNKNOWN])
+    ceiling = min(cap, base * (2 ** max(0, attempts - 1)))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class WhatsAppOutbox:
+    """Enqueue API plus the background sender worker"""
+
+    def __init__(
+        self,
+        db,
+        whatsapp_service,
+        rate_per_second: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        lock_seconds: int = 120
+    ):
+        self.db = db
+        self.whatsapp_service = whatsapp_service
+        self.rate_per_second = rate_per_second or float(os.getenv("WHATSAPP_SEND_RATE_PER_SECOND", "10"))
+        self.batch_size = batch_size or int(os.getenv("WHATSAPP_OUTBOX_BATCH_SIZE", "20"))
+        self.poll_interval = poll_interval or float(os.getenv("WHATSAPP_OUTBOX_POLL_SECONDS", "5"))
+        self.max_attempts = max_attempts or int(os.getenv("WHATSAPP_OUTBOX_MAX_ATTEMPTS", "5"))
+        self.lock_seconds = lock_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # rate_per_second is the limit for all workers; this process gets its share
+        self.rate_limiter = TokenBucket(per_worker_rate(self.rate_per_second))
+        self.is_running = False
+        self._wake = asyncio.Event()
+        self.stats = {
+            "enqueued": 0, "deduplicated": 0, "inline_fallbacks": 0,
+            "claimed": 0, "sent": 0, "retried": 0, "failed": 0, "dead_letter": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Enqueue
+    # ------------------------------------------------------------------
+
+    async def enqueue(
+        self,
+        doctor_firebase_uid: str,
+        to_phone: str,
+        body: str,
+        message_type: str = "text",
+        patient_id: Optional[int] = None,
+        media_url: Optional[str] = None,
+        on_sent: Optional[Dict[str, Any]] = None,
+        reference: Any = "",
+        client_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Queue a message and return its outbox row (existing row for a repeated key).
+
+        The row carries "deduplicated": True when the key was already queued.
+        """
+        phone = self.whatsapp_service._format_phone_number(to_phone)
+        row = {
+            "idempotency_key": make_idempotency_key(message_type, phone, reference, client_key),
+            "doctor_firebase_uid": doctor_firebase_uid,
+            "patient_id": patient_id,
+            "message_type": message_type,
+            "to_phone": phone,
+            "body": body,
+            "media_url": media_url,
+            "max_attempts": self.max_attempts,
+            "on_sent": on_sent
+        }
+
+        queued = await self.db.enqueue_whatsapp_message(row)
+        if queued is None:
+            # No outbox (migration 026 not applied / DB error): keep the old inline behaviour
+            print(f"⚠️ WhatsApp outbox unavailable, sending {message_type} inline")
+            self.stats["inline_fallbacks"] += 1
+            return await self._send_inline(row)
+
+        if queued.get("deduplicated"):
+            self.stats["deduplicated"] += 1
+        else:
+            self.stats["enqueued"] += 1
+            self._wake.set()
+        return queued
+
+    async def enqueue_report_upload_link(
+        self, doctor_firebase_uid: str, patient_id: int, visit_id: int, patient_name: str,
+        doctor_name: str, phone_number: str, upload_url: str, tests_recommended: str, expires_at: str,
+        client_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        body = self.whatsapp_service._format_upload_message(
+            patient_name, doctor_name, upload_url, tests_recommended, expires_at
+        )
+        # Every request mints a new upload token, so the URL can't identify a repeat
+        return await self.enqueue(
+            doctor_firebase_uid, phone_number, body,
+            message_type="report_upload_link", patient_id=patient_id,
+            reference=f"{visit_id}:{tests_recommended}", client_key=client_key
+        )
+
+    async def enqueue_handwritten_visit_note(
+        self, doctor_firebase_uid: str, patient_id: int, note_id: Optional[int], patient_name: str,
+        doctor_name: str, phone_number: str, pdf_url: str, visit_date: str, custom_message: str = "",
+        client_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        body = self.whatsapp_service._create_handwritten_note_message(
+            patient_name, doctor_name, pdf_url, visit_date, custom_message
+        )
+        return await self.enqueue(
+            doctor_firebase_uid, phone_number, body,
+            message_type="handwritten_note", patient_id=patient_id,
+            on_sent={"type": "handwritten_note", "id": note_id} if note_id else None,
+            reference=f"{note_id or pdf_url}:{custom_message}", client_key=client_key
+        )
+
+    async def enqueue_visit_report(
+        self, doctor_firebase_uid: str, patient_id: int, report_id: int, patient_name: str,
+        doctor_name: str, phone_number: str, report_url: str, visit_date: str, custom_message: str = "",
+        client_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        body = self.whatsapp_service._create_visit_report_message(
+            patient_name, doctor_name, report_url, visit_date, custom_message
+        )
+        return await self.enqueue(
+            doctor_firebase_uid, phone_number, body,
+            message_type="visit_report", patient_id=patient_id,
+            on_sent={"type": "visit_report", "id": report_id},
+            reference=f"{report_id}:{custom_message}", client_key=client_key
+        )
+
+    async def _send_inline(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self._provider_send(row)
+        if result.get("success"):
+            await self._run_on_sent(row, result)
+        return {
+            **row,
+            "id": None,
+            "status": OUTBOX_SENT if result.get("success") else OUTBOX_FAILED,
+            "provider_message_id": result.get("message_id"),
+            "last_error": result.get("error"),
+            "deduplicated": False
+        }
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """Claim and send due messages until stop() is called"""
+        self.is_running = True
+        print(
+            f"🚀 WhatsApp outbox worker started ({self.rate_limiter.rate:g} of "
+            f"{self.rate_per_second:g} msg/s across {worker_count()} workers, batch {self.batch_size})"
+        )
+        while self.is_running:
+            try:
+                claimed = await self.db.claim_whatsapp_outbox(self.worker_id, self.batch_size, self.lock_seconds)
+                if claimed:
+                    self.stats["claimed"] += len(claimed)
+                    await asyncio.gather(*(self._deliver(row) for row in claimed))
+                    if len(claimed) >= self.batch_size:
+                        continue  # more may be due - claim the next batch right away
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Error in WhatsApp outbox worker: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def stop(self):
+        self.is_running = False
+        self._wake.set()
+        print("⏹️  WhatsApp outbox worker stopped")
+
+    async def _provider_send(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        await self.rate_limiter.acquire()
+        if row.get("media_url"):
+            return await self.whatsapp_service.send_media_message(row["to_phone"], row["body"], row["media_url"])
+        return await self.whatsapp_service.send_message(row["to_phone"], row["body"])
+
+    async def _deliver(self, row: Dict[str, Any]) -> None:
+        """Send one claimed row and record the outcome"""
+        try:
+            result = await self._provider_send(row)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+
+        now = datetime.now(timezone.utc)
+        if result.get("success"):
+            await self.db.update_whatsapp_outbox(row["id"], self.worker_id, {
+                "status": OUTBOX_SENT,
+                "provider_message_id": result.get("message_id"),
+                "provider_status": result.get("status"),
+                "sent_at": now.isoformat(),
+                "last_error": None,
+                "locked_by": None
+            })
+            self.stats["sent"] += 1
+            await self._run_on_sent(row, result)
+            await self._notify_doctor(row, OUTBOX_SENT)
+            return
+
+        error_class = classify_send_error(result)
+        attempts = row.get("attempts") or 1
+        update = {"last_error": str(result.get("error"))[:1000], "last_error_class": error_class, "locked_by": None}
+        if error_class == ERROR_INVALID_RECIPIENT:
+            update["status"] = OUTBOX_FAILED
+            self.stats["failed"] += 1
+        elif attempts >= (row.get("max_attempts") or self.max_attempts):
+            update["status"] = OUTBOX_DEAD_LETTER
+            self.stats["dead_letter"] += 1
+        else:
+            update["status"] = OUTBOX_PENDING
+            update["next_attempt_at"] = (now + timedelta(seconds=retry_delay_seconds(error_class, attempts))).isoformat()
+            self.stats["retried"] += 1
+
+        await self.db.update_whatsapp_outbox(row["id"], self.worker_id, update)
+        if update["status"] != OUTBOX_PENDING:
+            print(f"❌ WhatsApp {row.get('message_type')} #{row['id']} {update['status']}: {update['last_error']}")
+            await self._notify_doctor(row, update["status"], update["last_error"])
+
+    async def _run_on_sent(self, row: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Mark the source record as sent"""
+        on_sent = row.get("on_sent") or {}
+        try:
+            if on_sent.get("type") == "handwritten_note":
+                await self.db.update_handwritten_visit_note(on_sent["id"], row["doctor_firebase_uid"], {
+                    "sent_via_whatsapp": True,
+                    "whatsapp_message_id": result.get("message_id"),
+                    "whatsapp_sent_at": datetime.now(timezone.utc).isoformat()
+                })
+            elif on_sent.get("type") == "visit_report":
+                await self.db.update_visit_report(on_sent["id"], {
+                    "sent_via_whatsapp": True,
+                    "whatsapp_message_id": result.get("message_id")
+                })
+        except Exception as e:
+            print(f"⚠️ WhatsApp sent but updating {on_sent} failed: {e}")
+
+    async def _notify_doctor(self, row: Dict[str, Any], status: str, error: Optional[str] = None) -> None:
+        await push_hub.publish(row.get("doctor_firebase_uid"), EVENT_WHATSAPP_DELIVERY, {
+            "outbox_id": row.get("id"),
+            "message_type": row.get("message_type"),
+            "patient_id": row.get("patient_id"),
+            "status": status,
+            "error": error
+        })
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self.is_running,
+            "batch_size": self.batch_size,
+            "poll_interval_seconds": self.poll_interval,
+            "max_attempts": self.max_attempts,
+            "total_rate_per_second": self.rate_per_second,
+            "workers": worker_count(),
+            "rate_limiter": self.rate_limiter.get_status(),
+            **self.stats
+        }
+
+
+def outbox_response_fields(queued: Dict[str, Any]) -> Dict[str, Any]:
+    """WhatsApp fields of an endpoint response for an enqueued message"""
+    status = queued.get("status")
+    return {
+        "whatsapp_queued": queued.get("id") is not None,
+        "whatsapp_outbox_id": queued.get("id"),
+        "whatsapp_status": status,
+        "whatsapp_sent": status == OUTBOX_SENT,
+        "whatsapp_message_id": queued.get("provider_message_id"),
+        "whatsapp_error": queued.get("last_error") if status in (OUTBOX_FAILED, OUTBOX_DEAD_LETTER) else None,
+        "whatsapp_deduplicated": bool(queued.get("deduplicated"))
+    }
+
+
+if __name__ == "__main__":
+    # Throughput benchmark against the local fake Twilio server:
+    #   python whatsapp_outbox.py
+    # Compares the time an endpoint spends on WhatsApp (inline send vs enqueue) and
+    # the worker's delivery rate at the configured limit.
+    import statistics
+    from fake_twilio_server import start_fake_twilio_server
+
+    class MemoryOutboxStore:
+        """In-memory stand-in for the DatabaseManager outbox methods"""
+
+        def __init__(self):
+            self.rows: Dict[int, Dict[str, Any]] = {}
+            self.keys: Dict[str, int] = {}
+
+        async def enqueue_whatsapp_message(self, row):
+            if row["idempotency_key"] in self.keys:
+                return {**self.rows[self.keys[row["idempotency_key"]]], "deduplicated": True}
+            row = {**row, "id": len(self.rows) + 1, "status": OUTBOX_PENDING, "attempts": 0,
+                   "next_attempt_at": time.time(), "created": time.perf_counter()}
+            self.rows[row["id"]] = row
+            self.keys[row["idempotency_key"]] = row["id"]
+            return {**row, "deduplicated": False}
+
+        async def claim_whatsapp_outbox(self, worker_id, limit, lock_seconds):
+            due = [r for r in self.rows.values() if r["status"] == OUTBOX_PENDING and r["next_attempt_at"] <= time.time()]
+            for row in due[:limit]:
+                row.update(status=OUTBOX_SENDING, attempts=row["attempts"] + 1, locked_by=worker_id)
+            return [dict(row) for row in due[:limit]]
+
+        async def update_whatsapp_outbox(self, outbox_id, worker_id, update):
+            row = self.rows[outbox_id]
+            if isinstance(update.get("next_attempt_at"), str):
+                update = {**update, "next_attempt_at": datetime.fromisoformat(update["next_attempt_at"]).timestamp()}
+            row.update(update)
+            if update.get("status") == OUTBOX_SENT:
+                row["done"] = time.perf_counter()
+            return True
+
+    async def benchmark(messages: int = 200, latency_ms: float = 250.0, rate: float = 50.0):
+        server, state, base_url = await start_fake_twilio_server(latency_ms=latency_ms)
+        os.environ.update({
+            "TWILIO_API_BASE_URL": base_url, "TWILIO_ACCOUNT_SID": "ACfake",
+            "TWILIO_AUTH_TOKEN": "fake", "TWILIO_WHATSAPP_NUMBER": "whatsapp:+15550000000"
+        })
+        from whatsapp_service import WhatsAppService
+        service = WhatsAppService()
+
+        inline = []
+        for i in range(10):
+            start = time.perf_counter()
+            await service.send_message(f"+9198{i:08d}", "benchmark")
+            inline.append(time.perf_counter() - start)
+
+        store = MemoryOutboxStore()
+        outbox = WhatsAppOutbox(store, service, rate_per_second=rate, batch_size=50, poll_interval=0.05)
+        worker = asyncio.create_task(outbox.start())
+        enqueue = []
+        started = time.perf_counter()
+        for i in range(messages):
+            start = time.perf_counter()
+            await outbox.enqueue("doc", f"+9197{i:08d}", "benchmark", reference=i)
+            enqueue.append(time.perf_counter() - start)
+        while outbox.stats["sent"] < messages:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        outbox.stop()
+        await worker
+        server.close()
+
+        ms = lambda values: f"{statistics.median(values) * 1000:8.2f} ms"
+        print(f"Fake Twilio latency {latency_ms:g} ms, outbox limit {rate:g} msg/s, {messages} messages")
+        print(f"{'request time spent on WhatsApp (inline send)':<48}{ms(inline)}")
+        print(f"{'request time spent on WhatsApp (enqueue)':<48}{ms(enqueue)}")
+        print(f"{'outbox delivery rate':<48}{messages / elapsed:8.1f} msg/s")
+        print(f"{'fake server max concurrent sends':<48}{state.max_in_flight:8d}")
+
+    asyncio.run(benchmark())
@@ -1,29 +1,44 @@
 import asyncio
-import concurrent.futures
 from typing import Optional, Dict, Any
 import traceback
 from dotenv import load_dotenv
 import os
 import datetime
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException
+import httpx
+
+from connection_pool import get_http_client
 
 # Load environment variables
 load_dotenv()
 
+TWILIO_API_VERSION = "2010-04-01"
+
+
+class TwilioAPIError(Exception):
+    """Error response from the Twilio REST API"""
+
+    def __init__(self, msg: str, code: Optional[int] = None, status: Optional[int] = None):
+        super().__init__(msg)
+        self.msg = msg
+        self.code = code
+        self.status = status
+
+
 class WhatsAppService:
     def __init__(self):
         # Twilio WhatsApp configuration
         self.account_sid = os.getenv("TWILIO_ACCOUNT_SID")
         self.auth_token = os.getenv("TWILIO_AUTH_TOKEN")
         self.whatsapp_number = os.getenv("TWILIO_WHATSAPP_NUMBER")
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=20)
         
-        # Initialize Twilio client
-        if self.account_sid and self.auth_token:
-            self.client = Client(self.account_sid, self.auth_token)
-        else:
-            self.client = None
+        # Twilio REST API over the shared httpx pool (keep-alive, no thread per request).
+        # TWILIO_API_BASE_URL points it at another host, e.g. fake_twilio_server.py for local tests
+        self.api_base_url = os.getenv("TWILIO_API_BASE_URL", "https://api.twilio.com").rstrip("/")
+        self.timeout = httpx.Timeout(
+            float(os.getenv("TWILIO_HTTP_TIMEOUT_SECONDS", "15")),
+            connect=float(os.getenv("TWILIO_HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+        )
+        self.configured = bool(self.account_sid and self.auth_token)
         
         # Validate required credentials
         if not all([self.account_sid, self.auth_token, self.whatsapp_number]):
@@ -37,11 +52,63 @@ class WhatsAppService:
             print(f"- auth_token: {'Set' if self.auth_token else 'Missing'}")
             print(f"- whatsapp_number: {self.whatsapp_number or 'Missing'}")
     
+    async def _twilio_request(self, method: str, path: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Call the Twilio REST API for this account and return the JSON body.
+        path is relative to /2010-04-01/Accounts/{sid}; raises TwilioAPIError on error responses.
+        """
+        url = f"{self.api_base_url}/{TWILIO_API_VERSION}/Accounts/{self.account_sid}{path}"
+        response = await get_http_client().request(
+            method, url, data=data, auth=(self.account_sid, self.auth_token), timeout=self.timeout
+        )
+        
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        
+        if response.status_code >= 400:
+            raise TwilioAPIError(
+                payload.get("message") or f"HTTP {response.status_code}",
+                code=payload.get("code"),
+                status=response.status_code
+            )
+        return payload
+    
+    def _error_result(self, error: Exception) -> Dict[str, Any]:
+        """Failed send result for a Twilio error or a transport failure"""
+        if isinstance(error, TwilioAPIError):
+            return {
+                "success": False,
+                "error": f"Twilio WhatsApp error: {error.msg}",
+                "code": error.code,
+                "http_status": error.status
+            }
+        if isinstance(error, httpx.TimeoutException):
+            return {"success": False, "error": f"Twilio request timed out: {error!r}", "code": None, "http_status": None}
+        # Other httpx.TransportError: connection refused / reset, DNS, protocol errors
+        return {"success": False, "error": f"Twilio connection error: {error!r}", "code": None, "http_status": None}
+    
+    @staticmethod
+    def _message_result(message_obj: Dict[str, Any], phone_number: str) -> Dict[str, Any]:
+        return {
+            "success": True,
+            "message_id": message_obj.get("sid"),
+            "phone_number": phone_number,
+            "status": message_obj.get("status"),
+            "response": {
+                "sid": message_obj.get("sid"),
+                "status": message_obj.get("status"),
+                "to": message_obj.get("to"),
+                "from": message_obj.get("from")
+            }
+        }
+    
     async def send_message(self, to_phone: str, message: str) -> Dict[str, Any]:
         """Send a simple text message via Twilio WhatsApp"""
         try:
             # Validate credentials
-            if not self.client:
+            if not self.configured:
                 return {
                     "success": False,
                     "error": "Twilio client not configured - missing credentials"
@@ -50,39 +117,19 @@ class WhatsAppService:
             # Format phone number for Twilio (with + prefix)
             phone_number = self._format_phone_number(to_phone)
             
-            # Run the Twilio API call in a thread pool to make it async
-            loop = asyncio.get_event_loop()
-            message_obj = await loop.run_in_executor(
-                self.executor,
-                lambda: self.client.messages.create(
-                    body=message,
-                    from_=self.whatsapp_number,
-                    to=f"whatsapp:{phone_number}"
-                )
-            )
+            message_obj = await self._twilio_request("POST", "/Messages.json", {
+                "Body": message,
+                "From": self.whatsapp_number,
+                "To": f"whatsapp:{phone_number}"
+            })
             
             print(f"Twilio WhatsApp message sent successfully to {phone_number}")
             
-            return {
-                "success": True,
-                "message_id": message_obj.sid,
-                "phone_number": phone_number,
-                "status": message_obj.status,
-                "response": {
-                    "sid": message_obj.sid,
-                    "status": message_obj.status,
-                    "to": message_obj.to,
-                    "from": message_obj.from_
-                }
-            }
+            return self._message_result(message_obj, phone_number)
                 
-        except TwilioException as e:
-            print(f"Twilio WhatsApp error: {e}")
-            return {
-                "success": False,
-                "error": f"Twilio WhatsApp error: {e.msg if hasattr(e, 'msg') else str(e)}",
-                "code": getattr(e, 'code', None)
-            }
+        except (TwilioAPIError, httpx.TransportError) as e:
+            print(f"Twilio WhatsApp error: {e!r}")
+            return self._error_result(e)
         except Exception as e:
             print(f"Error sending Twilio WhatsApp message: {e}")
             print(f"Traceback: {traceback.format_exc()}")
@@ -95,7 +142,7 @@ class WhatsAppService:
     async def send_media_message(self, to_phone: str, message: str, media_url: str) -> Dict[str, Any]:
         """Send a WhatsApp message with media via Twilio"""
         try:
-            if not self.client:
+            if not self.configured:
                 return {
                     "success": False,
                     "error": "Twilio client not configured"
@@ -103,36 +150,18 @@ class WhatsAppService:
                 
             phone_number = self._format_phone_number(to_phone)
             
-            loop = asyncio.get_event_loop()
-            message_obj = await loop.run_in_executor(
-                self.executor,
-                lambda: self.client.messages.create(
-                    body=message,
-                    media_url=[media_url],
-                    from_=self.whatsapp_number,
-                    to=f"whatsapp:{phone_number}"
-                )
-            )
+            message_obj = await self._twilio_request("POST", "/Messages.json", {
+                "Body": message,
+                "MediaUrl": media_url,
+                "From": self.whatsapp_number,
+                "To": f"whatsapp:{phone_number}"
+            })
             
-            return {
-                "success": True,
-                "message_id": message_obj.sid,
-                "phone_number": phone_number,
-                "status": message_obj.status,
-                "response": {
-                    "sid": message_obj.sid,
-                    "status": message_obj.status,
-                    "to": message_obj.to,
-                    "from": message_obj.from_
-                }
-            }
+            return self._message_result(message_obj, phone_number)
                 
-        except TwilioException as e:
-            print(f"Twilio WhatsApp media error: {e}")
-            return {
-                "success": False,
-                "error": f"Twilio WhatsApp error: {e.msg if hasattr(e, 'msg') else str(e)}"
-            }
+        except (TwilioAPIError, httpx.TransportError) as e:
+            print(f"Twilio WhatsApp media error: {e!r}")
+            return self._error_result(e)
         except Exception as e:
             print(f"Error sending Twilio WhatsApp media message: {e}")
             return {
@@ -277,31 +306,27 @@ Thank you!"""
     async def test_connection(self) -> Dict[str, Any]:
         """Test Twilio WhatsApp connection"""
         try:
-            if not self.client:
+            if not self.configured:
                 return {
                     "success": False,
                     "error": "Twilio WhatsApp credentials not configured"
                 }
             
             # Test by getting account info
-            loop = asyncio.get_event_loop()
-            account = await loop.run_in_executor(
-                self.executor,
-                lambda: self.client.api.account.fetch()
-            )
+            account = await self._twilio_request("GET", ".json")
             
             return {
                 "success": True,
                 "message": "Twilio WhatsApp connection successful",
-                "account_sid": account.sid,
+                "account_sid": account.get("sid"),
                 "whatsapp_number": self.whatsapp_number,
-                "status": account.status
+                "status": account.get("status")
             }
                 
-        except TwilioException as e:
+        except TwilioAPIError as e:
             return {
                 "success": False,
-                "error": f"Twilio error: {e.msg if hasattr(e, 'msg') else str(e)}"
+                "error": f"Twilio error: {e.msg}"
             }
         except Exception as e:
             return {
@@ -312,37 +337,33 @@ Thank you!"""
     async def get_message_status(self, message_id: str) -> Dict[str, Any]:
         """Get the status of a sent message from Twilio"""
         try:
-            if not self.client:
+            if not self.configured:
                 return {
                     "success": False,
                     "error": "Twilio client not configured"
                 }
             
-            loop = asyncio.get_event_loop()
-            message = await loop.run_in_executor(
-                self.executor,
-                lambda: self.client.messages(message_id).fetch()
-            )
+            message = await self._twilio_request("GET", f"/Messages/{message_id}.json")
             
             return {
                 "success": True,
                 "message_id": message_id,
-                "status": message.status,
-                "to": message.to,
-                "from": message.from_,
-                "date_sent": str(message.date_sent) if message.date_sent else None,
+                "status": message.get("status"),
+                "to": message.get("to"),
+                "from": message.get("from"),
+                "date_sent": message.get("date_sent"),
                 "response": {
-                    "sid": message.sid,
-                    "status": message.status,
-                    "error_code": message.error_code,
-                    "error_message": message.error_message
+                    "sid": message.get("sid"),
+                    "status": message.get("status"),
+                    "error_code": message.get("error_code"),
+                    "error_message": message.get("error_message")
                 }
             }
                 
-        except TwilioException as e:
+        except TwilioAPIError as e:
             return {
                 "success": False,
-                "error": f"Twilio error: {e.msg if hasattr(e, 'msg') else str(e)}"
+                "error": f"Twilio error: {e.msg}"
             }
         except Exception as e:
             return {
@@ -536,8 +557,58 @@ This is an *initial/empirical prescription* based on clinical assessment.
 Thank you for visiting our clinic!"""
         
         return base_message
-    
-    def __del__(self):
-        """Cleanup thread pool executor"""
-        if hasattr(self, 'executor'):
-            self.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # Send throughput against the local fake Twilio server:
+    #   python whatsapp_service.py [--latency-ms 100] [--messages 200]
+    import argparse
+    import contextlib
+    import io
+    import time
+    from fake_twilio_server import start_fake_twilio_server
+    from connection_pool import close_connection_pools
+
+    parser = argparse.ArgumentParser(description="WhatsApp send throughput benchmark")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Fake Twilio response delay")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per concurrency level")
+    args = parser.parse_args()
+
+    async def run_level(service: WhatsAppService, concurrency: int, messages: int):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def send(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                result = await service.send_message(f"+9198{i:08d}", "benchmark")
+                latencies.append(time.perf_counter() - start)
+                return result["success"]
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = await asyncio.gather(*(send(i) for i in range(messages)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return messages / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)], sum(results)
+
+    async def benchmark():
+        server, state, base_url = await start_fake_twilio_server(latency_ms=args.latency_ms)
+        os.environ.update({
+            "TWILIO_API_BASE_URL": base_url, "TWILIO_ACCOUNT_SID": "ACfake",
+            "TWILIO_AUTH_TOKEN": "fake", "TWILIO_WHATSAPP_NUMBER": "whatsapp:+15550000000"
+        })
+        service = WhatsAppService()
+        await run_level(service, 10, 20)  # warm up the connection pool
+
+        print(f"Fake Twilio latency {args.latency_ms:g} ms, {args.messages} messages per level")
+        print(f"{'concurrency':>12}{'sends/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'ok':>6}")
+        for concurrency in (1, 10, 50):
+            rate, p50, p95, ok = await run_level(service, concurrency, args.messages)
+            print(f"{concurrency:>12}{rate:>10.1f}{p50 * 1000:>10.1f}{p95 * 1000:>10.1f}{ok:>6}")
+        print(f"📊 fake server: {state.stats()}")
+
+        server.close()
+        await close_connection_pools()
+
+    asyncio.run(benchmark())